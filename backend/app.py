@@ -7,16 +7,30 @@ import logging
 from contextlib import asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 
+from backend.auth import require_api_key
 from backend.config import settings
-from backend.db import cleanup_expired_sessions, init_db
+from backend.db import (
+    cleanup_expired_sessions_async,
+    cleanup_finished_jobs,
+    cleanup_old_spans,
+    gc_orphan_blobs_async,
+    init_db,
+    run_db,
+    shutdown_db,
+)
+from backend import executors, loop_monitor, metrics, tracing
 from backend.routers import agent as agent_router
+from backend.services.job_queue import jobs
+from backend.services.message_log import message_log
+from backend.services.retention import retention
+from backend.services.state_store import close_state_backend
 from backend.__version__ import __version__
 
 logger = logging.getLogger(__name__)
@@ -29,28 +43,78 @@ async def _session_cleanup_loop() -> None:
     while True:
         await asyncio.sleep(interval)
         try:
-            count = cleanup_expired_sessions(ttl)
+            count = await cleanup_expired_sessions_async(ttl)
             if count > 0:
                 logger.info("Session cleanup: removed %d expired session(s) (TTL=%ds)", count, ttl)
+            blobs = await gc_orphan_blobs_async()
+            if blobs > 0:
+                logger.info("Session cleanup: removed %d unreferenced blob(s)", blobs)
+            finished = await run_db(cleanup_finished_jobs, settings.job_ttl_seconds)
+            if finished > 0:
+                logger.info("Session cleanup: removed %d finished job(s)", finished)
+            spans = await run_db(cleanup_old_spans, settings.trace_ttl_seconds)
+            if spans > 0:
+                logger.info("Session cleanup: removed %d expired span(s)", spans)
+            uploads = await executors.io.run(agent_router._cleanup_old_uploads)
+            if uploads > 0:
+                logger.info("Session cleanup: removed %d expired upload(s)", uploads)
         except Exception:
             logger.exception("Session cleanup error")
 
 
+async def _retention_loop() -> None:
+    """后台按保留策略分批清理会话记录（取代每次创建会话时同步裁剪）。"""
+    interval = max(30, settings.retention_interval_seconds)
+    while True:
+        try:
+            result = await retention.run_once()
+            if result.get("conversations"):
+                logger.info(
+                    "Retention: removed %d conversation(s) / %d message(s), archived %d, freed %d page(s) in %.1f ms",
+                    result["conversations"],
+                    result["messages"],
+                    result["archived"],
+                    result["pages_freed"],
+                    result["duration_ms"],
+                )
+        except Exception:
+            logger.exception("Retention run error")
+        await asyncio.sleep(interval)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """启动时初始化 DB 与图片目录；后台运行会话清理任务。"""
+    """启动时初始化 DB 与图片目录；后台运行会话清理、会话记录保留任务与写后队列；退出时中断未完成的后台任务、关闭 I/O / CPU 执行器、落盘待写入并关闭 DB 线程池、连接池与共享状态后端连接。"""
     init_db()
+    interrupted = await run_db(jobs.recover)
+    if interrupted:
+        logger.info("Marked %d job(s) left by a previous process as interrupted", interrupted)
+    await message_log.start()
     Path(settings.images_output_dir_abs).mkdir(parents=True, exist_ok=True)
-    # P1-4: 启动后台清理任务
-    cleanup_task = asyncio.create_task(_session_cleanup_loop())
+    # P1-4: 启动后台清理任务；会话记录保留策略
+    tasks = [asyncio.create_task(_session_cleanup_loop()), asyncio.create_task(_retention_loop())]
+    if settings.loop_monitor_enabled:
+        tasks.append(asyncio.create_task(loop_monitor.monitor.run()))
+    if settings.metrics_enabled:
+        tasks.append(asyncio.create_task(metrics.run_background()))
     try:
         yield
     finally:
-        cleanup_task.cancel()
-        try:
-            await cleanup_task
-        except asyncio.CancelledError:
-            pass
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await jobs.shutdown()
+        executors.shutdown()
+        await message_log.drain()
+        await tracing.exporter.drain()
+        if settings.metrics_enabled:
+            metrics.flush(final=True)
+        shutdown_db()
+        close_state_backend()
 
 
 app = FastAPI(title="RS-Agent Backend", version=__version__, lifespan=lifespan)
@@ -71,6 +135,7 @@ async def http_exception_handler(_r: Request, exc: HTTPException) -> JSONRespons
     return JSONResponse(
         status_code=exc.status_code,
         content={"detail": _safe_detail(exc)},
+        headers=getattr(exc, "headers", None),
     )
 
 
@@ -99,6 +164,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["Content-Type", "Authorization", "Accept"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
@@ -106,6 +172,14 @@ app.add_middleware(
 app.mount("/api/kb-images", StaticFiles(directory=str(settings.images_output_dir_abs)), name="kb-images")
 
 
+@app.get("/metrics", dependencies=[Depends(require_api_key)], include_in_schema=False)
+async def prometheus_metrics() -> PlainTextResponse:
+    """Prometheus 文本格式指标（配置 RS_AGENT_METRICS_DIR 时合并全部 worker）。启用 API Key 时需要 Bearer。"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="metrics 未启用")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/health")
 async def health() -> dict:
     """健康检查，含 LLM 配置诊断（不暴露 API Key）。无需认证。"""
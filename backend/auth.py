@@ -4,6 +4,7 @@ If ``RS_AGENT_API_KEY`` is set, all protected endpoints require the header::
 
     Authorization: Bearer <RS_AGENT_API_KEY>
 
+Several keys may be configured comma-separated (e.g. one per caller, see ``RS_AGENT_KB_BUDGET_MS_BY_KEY``).
 If the env var is empty or unset, authentication is **disabled** (backward-compatible).
 """
 
@@ -11,7 +12,7 @@ from __future__ import annotations
 
 from typing import Optional
 
-from fastapi import Depends, HTTPException
+from fastapi import Depends, Header, HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 from backend.config import settings
@@ -30,14 +31,23 @@ async def require_api_key(
         @router.post("/agent", dependencies=[Depends(require_api_key)])
         async def agent_endpoint(...): ...
     """
-    configured_key = settings.api_key
-    if not configured_key:
+    configured_keys = {k.strip() for k in settings.api_key.split(",") if k.strip()}
+    if not configured_keys:
         # Auth not configured → allow all requests
         return
 
-    if credentials is None or credentials.credentials != configured_key:
+    if credentials is None or credentials.credentials not in configured_keys:
         raise HTTPException(
             status_code=401,
             detail="未授权：请在请求头中提供有效的 Authorization: Bearer <API_KEY>",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+
+async def require_profile_key(
+    x_profile_key: Optional[str] = Header(None, alias="X-Profile-Key"),
+) -> None:
+    """FastAPI dependency: 剖析相关操作需管理员密钥 ``X-Profile-Key``（``RS_AGENT_PROFILE_KEY`` 为空时一律拒绝）。"""
+    configured_key = settings.profile_key
+    if not configured_key or x_profile_key != configured_key:
+        raise HTTPException(status_code=403, detail="剖析需要有效的 X-Profile-Key")
@@ -51,8 +51,11 @@ class Settings:
         else:
             self.db_path = str(base / "data" / "rs_agent.db")
 
-        # 用户上传图片目录（用于以图搜图等），返回绝对路径
-        self.upload_dir = base / "data" / "uploads"
+        # 用户上传图片目录（用于以图搜图等），返回绝对路径。上传登记只记录该目录下的文件路径：
+        # 多台机器共用 redis 状态后端时，此目录须为各机器相同路径挂载的共享存储（如 NFS），否则其它机器解析到
+        # imageId 也打不开文件
+        upload_dir_env = os.environ.get("RS_AGENT_UPLOAD_DIR")
+        self.upload_dir = Path(upload_dir_env).expanduser().resolve() if upload_dir_env else base / "data" / "uploads"
         # KB 导出图片目录，用于静态服务；统一为绝对路径
         self.images_output_dir_abs = (
             Path(self.images_output_dir).resolve()
@@ -60,6 +63,40 @@ class Settings:
             else (base / self.images_output_dir).resolve()
         )
 
+        # ==== SQLite 连接池 ====
+        # 连接池大小，同时也是 DB 专用线程池的线程数（默认 4）
+        self.db_pool_size = int(os.environ.get("RS_AGENT_DB_POOL_SIZE", "4") or "4")
+        # 写锁等待超时（毫秒，默认 5000）
+        self.db_busy_timeout_ms = int(os.environ.get("RS_AGENT_DB_BUSY_TIMEOUT_MS", "5000") or "5000")
+        # WAL 模式下 NORMAL 只在检查点 fsync，断电最多丢最近提交、不会损坏库（可选 OFF/NORMAL/FULL/EXTRA）
+        db_sync = os.environ.get("RS_AGENT_DB_SYNCHRONOUS", "NORMAL").strip().upper()
+        self.db_synchronous = db_sync if db_sync in ("OFF", "NORMAL", "FULL", "EXTRA") else "NORMAL"
+        # 每个连接缓存的预编译语句数（sqlite3 cached_statements，默认 128）
+        self.db_statement_cache_size = int(os.environ.get("RS_AGENT_DB_STATEMENT_CACHE", "128") or "128")
+
+        # ==== 阻塞 / CPU 密集操作的执行器（移出事件循环）====
+        # I/O 线程池线程数（上传写盘、图片读取与 base64；默认 8）
+        self.io_executor_workers = int(os.environ.get("RS_AGENT_IO_EXECUTOR_WORKERS", "8") or "8")
+        # CPU 执行器：thread（默认）/ process（正则扫描、渲染、抽图在子进程中执行，绕开 GIL）
+        cpu_kind = (os.environ.get("RS_AGENT_CPU_EXECUTOR_KIND", "thread") or "thread").strip().lower()
+        self.cpu_executor_kind = cpu_kind if cpu_kind in ("thread", "process") else "thread"
+        # CPU 执行器工作线程 / 进程数（默认 min(4, CPU 核数)）
+        self.cpu_executor_workers = int(
+            os.environ.get("RS_AGENT_CPU_EXECUTOR_WORKERS", "") or str(min(4, os.cpu_count() or 1))
+        )
+        # 每个执行器在工作者之外最多排队的调用数，超出时调用方在事件循环上等待（默认 64）
+        self.executor_max_queue = int(os.environ.get("RS_AGENT_EXECUTOR_MAX_QUEUE", "64") or "64")
+
+        # ==== 写后消息日志（pipeline 会话/消息/trace 批量落盘）====
+        # 关闭后每次写入直接落盘（原行为）
+        self.db_write_behind = os.environ.get("RS_AGENT_DB_WRITE_BEHIND", "true").lower() in ("true", "1", "yes")
+        # 攒够多少条写入立即落盘（默认 100）
+        self.db_write_batch_size = int(os.environ.get("RS_AGENT_DB_WRITE_BATCH_SIZE", "100") or "100")
+        # 未攒够时最长等待多久落盘（毫秒，默认 50）
+        self.db_write_flush_ms = int(os.environ.get("RS_AGENT_DB_WRITE_FLUSH_MS", "50") or "50")
+        # 队列积压达到该值时生产者等待落盘（背压，默认 5000）
+        self.db_write_max_pending = int(os.environ.get("RS_AGENT_DB_WRITE_MAX_PENDING", "5000") or "5000")
+
         # ==== LLM（Qwen / OpenAI 兼容 API）配置 ====
         # API Key：优先级 LLM_API_KEY > DASHSCOPE_API_KEY > OPENAI_API_KEY
         self.llm_api_key = (
@@ -86,6 +123,37 @@ class Settings:
         # 重试最大等待秒数（默认 10）
         self.llm_retry_max_wait = float(os.environ.get("RS_AGENT_LLM_RETRY_MAX_WAIT", "10") or "10")
 
+        # ==== LLM 请求对冲（hedged requests）====
+        # 启用对冲的 stage 列表（逗号分隔，如 "intent,expand,confirmer"）；留空则不启用
+        self.llm_hedge_stages = frozenset(
+            s.strip()
+            for s in os.environ.get("RS_AGENT_LLM_HEDGE_STAGES", "").split(",")
+            if s.strip()
+        )
+        # 对冲阈值取最近耗时的分位数（默认 p95）
+        self.llm_hedge_percentile = float(os.environ.get("RS_AGENT_LLM_HEDGE_PERCENTILE", "95") or "95")
+        # 备份请求预算：不超过总调用数的比例（默认 5%）
+        self.llm_hedge_budget_ratio = float(os.environ.get("RS_AGENT_LLM_HEDGE_BUDGET_RATIO", "0.05") or "0.05")
+        # 每个 stage 至少积累多少次耗时样本后才开始对冲（默认 20）
+        self.llm_hedge_min_samples = int(os.environ.get("RS_AGENT_LLM_HEDGE_MIN_SAMPLES", "20") or "20")
+        # 每个 stage 保留的耗时样本窗口（默认 200）
+        self.llm_hedge_window = int(os.environ.get("RS_AGENT_LLM_HEDGE_WINDOW", "200") or "200")
+
+        # ==== LLM 结构化输出 ====
+        # collect / build_draft / confirmer 等 JSON 输出请求 response_format=json_object（模型不支持时自动退化）
+        self.llm_json_mode = os.environ.get("RS_AGENT_LLM_JSON_MODE", "true").lower() in ("true", "1", "yes")
+
+        # ==== 本地意图分类器（字符 n-gram NB/LR，scripts/train_intent_classifier.py 训练产出）====
+        # 权重文件（.npz）；不存在时不启用，规则无法判定时直接走 LLM
+        intent_clf_env = os.environ.get("RS_AGENT_INTENT_CLF_PATH")
+        self.intent_clf_path = (
+            str(Path(intent_clf_env).expanduser()) if intent_clf_env else str(base / "data" / "intent_clf.npz")
+        )
+        # 分类器置信度（所选类别概率）达到该值时不再调用 LLM（默认 0.85）
+        self.intent_clf_threshold = float(os.environ.get("RS_AGENT_INTENT_CLF_THRESHOLD", "0.85") or "0.85")
+        # 高置信度请求中抽样在后台再问 LLM 的比例，仅用于统计一致率（默认 0，不额外调用）
+        self.intent_clf_shadow_rate = float(os.environ.get("RS_AGENT_INTENT_CLF_SHADOW_RATE", "0") or "0")
+
         # ==== KB_QUERY 方案 B（LLM 多 query 检索增强 + 综合输出）====
         self.kb_query_llm_enabled = os.environ.get("RS_AGENT_KB_QUERY_LLM_ENABLED", "true").lower() in (
             "true",
@@ -95,6 +163,59 @@ class Settings:
         self.kb_query_max_subqueries = int(os.environ.get("RS_AGENT_KB_QUERY_MAX_SUBQUERIES", "4") or "4")
         self.kb_query_max_merged_chars = int(os.environ.get("RS_AGENT_KB_QUERY_MAX_MERGED_CHARS", "12000") or "12000")
 
+        # ==== KB_QUERY 延迟预算（按剩余预算跳过扩展 / 减少子问题 / 不做综合）====
+        # 默认预算（毫秒，默认 0 = 不限）；请求体 budgetMs 与按 API Key 的预算可再收紧
+        self.kb_budget_ms = float(os.environ.get("RS_AGENT_KB_BUDGET_MS", "0") or "0")
+        # 按 API Key 的预算：key=毫秒，逗号分隔（如 widget-key=5000）；该 Key 的请求以此取代默认预算
+        self.kb_budget_ms_by_key = {
+            key.strip(): float(ms)
+            for key, sep, ms in (
+                item.partition("=") for item in os.environ.get("RS_AGENT_KB_BUDGET_MS_BY_KEY", "").split(",")
+            )
+            if sep and key.strip() and ms.strip()
+        }
+        # 为 pipeline 其余部分（落库、响应）预留的毫秒数（默认 200）
+        self.kb_budget_reserve_ms = float(os.environ.get("RS_AGENT_KB_BUDGET_RESERVE_MS", "200") or "200")
+
+        # ==== KB_QUERY 模式（请求体 mode：fast / balanced / thorough，见 services.kb_modes）====
+        # 请求未指定 mode 时的默认模式（balanced 即上面方案 B 的配置）
+        self.kb_query_default_mode = (os.environ.get("RS_AGENT_KB_QUERY_DEFAULT_MODE", "balanced") or "balanced").strip().lower()
+        # fast：只用规则 / 本地分类器判定意图，检索子问题数（默认 1，不扩展），不做 LLM 综合
+        self.kb_fast_max_subqueries = int(os.environ.get("RS_AGENT_KB_FAST_MAX_SUBQUERIES", "1") or "1")
+        # fast 可直接返回的已缓存答案：有效期（秒，默认 600，0 为关闭缓存）与条数上限（默认 256）
+        self.kb_fast_cache_ttl_seconds = float(os.environ.get("RS_AGENT_KB_FAST_CACHE_TTL_SECONDS", "600") or "600")
+        self.kb_fast_cache_size = int(os.environ.get("RS_AGENT_KB_FAST_CACHE_SIZE", "256") or "256")
+        # thorough：检索子问题数（默认 8）与重排后保留的命中片段数（默认 12）
+        self.kb_thorough_max_subqueries = int(os.environ.get("RS_AGENT_KB_THOROUGH_MAX_SUBQUERIES", "8") or "8")
+        self.kb_thorough_rerank_top_k = int(os.environ.get("RS_AGENT_KB_THOROUGH_RERANK_TOP_K", "12") or "12")
+
+        # ==== KB_QUERY 渐进检索（覆盖度够了或后续子问题多为重复命中时不再检索）====
+        self.kb_early_exit_enabled = os.environ.get("RS_AGENT_KB_EARLY_EXIT_ENABLED", "true").lower() in (
+            "true",
+            "1",
+            "yes",
+        )
+        # 覆盖度（0~1）达到该值即停止（默认 0.8）
+        self.kb_early_exit_coverage = float(os.environ.get("RS_AGENT_KB_EARLY_EXIT_COVERAGE", "0.8") or "0.8")
+        # 高置信命中的距离上限（默认 0.3）与覆盖度中命中数一项达满所需的高置信命中数（默认 3）
+        self.kb_early_exit_max_distance = float(os.environ.get("RS_AGENT_KB_EARLY_EXIT_MAX_DISTANCE", "0.3") or "0.3")
+        self.kb_early_exit_min_hits = int(os.environ.get("RS_AGENT_KB_EARLY_EXIT_MIN_HITS", "3") or "3")
+        # 某个后续子问题的命中中新片段占比低于该值（多为重复）即停止（默认 0.2）
+        self.kb_early_exit_min_new_ratio = float(os.environ.get("RS_AGENT_KB_EARLY_EXIT_MIN_NEW_RATIO", "0.2") or "0.2")
+
+        # ==== BUILD_DRAFT 分段并发模式 ====
+        # 开启后 business_requirement / system_current / system_changes 三个 section 并发各调一次 LLM，
+        # 每次只携带该 section 相关的 KB 片段（仅 system_current 携带候选图片）；默认关闭，沿用单次大调用
+        self.draft_parallel_sections = os.environ.get("RS_AGENT_DRAFT_PARALLEL_SECTIONS", "false").lower() in (
+            "true",
+            "1",
+            "yes",
+        )
+        # 分段模式下各 section 所用 KB 片段的最大字符数（system_current 的片段含表格与图片段，同样受此上限）
+        self.draft_section_kb_max_chars = int(
+            os.environ.get("RS_AGENT_DRAFT_SECTION_KB_MAX_CHARS", "6000") or "6000"
+        )
+
         # ==== 会话超时与清理（P1-4）====
         # sessions 表中超过 TTL 的记录将被后台定时清理（秒，默认 7200 = 2h）
         self.session_ttl_seconds = int(os.environ.get("RS_AGENT_SESSION_TTL_SECONDS", "7200") or "7200")
@@ -103,8 +224,126 @@ class Settings:
             os.environ.get("RS_AGENT_SESSION_CLEANUP_INTERVAL", "300") or "300"
         )
 
+        # ==== 会话记录保留策略（后台任务，按数量 / 时长 / 状态清理 conversations）====
+        # 会话记录总数上限，超出时删除最旧的（默认 1000，0 为不限）
+        self.retention_max_conversations = int(os.environ.get("RS_AGENT_RETENTION_MAX_CONVERSATIONS", "1000") or "1000")
+        # 最后更新早于该天数的会话记录被删除（默认 90，0 为不限）
+        self.retention_max_age_days = float(os.environ.get("RS_AGENT_RETENTION_MAX_AGE_DAYS", "90") or "90")
+        # 只清理这些状态的会话（逗号分隔，默认 done,expired；进行中的 active 会话不会被清理）
+        self.retention_statuses = [
+            s.strip() for s in (os.environ.get("RS_AGENT_RETENTION_STATUSES", "done,expired") or "").split(",") if s.strip()
+        ]
+        # 检查间隔（秒，默认 600）与每批删除的会话数（默认 200）
+        self.retention_interval_seconds = int(os.environ.get("RS_AGENT_RETENTION_INTERVAL", "600") or "600")
+        self.retention_batch_size = int(os.environ.get("RS_AGENT_RETENTION_BATCH_SIZE", "200") or "200")
+        # 归档：none（直接删除，默认）/ table（压缩后存入 conversation_archive 表）/ file（追加到 gzip JSONL 文件）
+        archive = (os.environ.get("RS_AGENT_RETENTION_ARCHIVE", "none") or "none").strip().lower()
+        self.retention_archive = archive if archive in ("none", "table", "file") else "none"
+        archive_dir_env = os.environ.get("RS_AGENT_RETENTION_ARCHIVE_DIR", "").strip()
+        self.retention_archive_dir = (
+            Path(archive_dir_env).expanduser() if archive_dir_env else base / "data" / "archive"
+        )
+        # 每轮清理后 incremental_vacuum 归还的最大页数（默认 0 = 全部空闲页）
+        self.retention_vacuum_pages = int(os.environ.get("RS_AGENT_RETENTION_VACUUM_PAGES", "0") or "0")
+
+        # ==== 会话缓存（进程内 LRU，按 sessions.version 校验）====
+        # 缓存的已解析会话数上限（默认 128，0 为关闭）
+        self.session_cache_size = int(os.environ.get("RS_AGENT_SESSION_CACHE_SIZE", "128") or "128")
+
+        # ==== 会话并发控制 ====
+        # 保存会话时按 sessions.version 做 compare-and-swap：读取后被其它请求保存过则冲突（接口返回 409），
+        # 关闭后恢复后写者整体覆盖（原行为）
+        self.session_cas = os.environ.get("RS_AGENT_SESSION_CAS", "true").lower() in ("true", "1", "yes")
+        # 同一会话的请求在进程内排队，等待上一条处理完成的最长秒数（超时返回 409，默认 30）
+        self.session_lock_timeout_seconds = float(os.environ.get("RS_AGENT_SESSION_LOCK_TIMEOUT", "30") or "30")
+
+        # ==== 请求截止时间与取消（超时 / 客户端断开后停止 KB 子进程、LLM 调用与文生图）====
+        # 每个请求（含后台任务）的截止时间（秒，默认 300，0 为不限），超时返回 504
+        self.request_deadline_seconds = float(os.environ.get("RS_AGENT_REQUEST_DEADLINE_SECONDS", "300") or "300")
+        # 检测客户端是否已断开的轮询间隔（毫秒，默认 500）
+        self.disconnect_poll_ms = float(os.environ.get("RS_AGENT_DISCONNECT_POLL_MS", "500") or "500")
+
+        # ==== 后台任务模式（长 ORCH_FLOW 轮次，事件持久化，SSE 断线续传）====
+        # 同时执行的后台任务数上限，超出的任务排队（默认 4）
+        self.job_max_concurrency = int(os.environ.get("RS_AGENT_JOB_MAX_CONCURRENCY", "4") or "4")
+        # 结束超过该秒数的任务及其事件被后台清理（默认 86400 = 1 天，0 为不清理）
+        self.job_ttl_seconds = int(os.environ.get("RS_AGENT_JOB_TTL_SECONDS", "86400") or "86400")
+        # 跟进其它 worker 上运行的任务时轮询事件表的间隔（毫秒，默认 500）
+        self.job_poll_ms = int(os.environ.get("RS_AGENT_JOB_POLL_MS", "500") or "500")
+
+        # ==== 链路追踪（span，单调时钟计时）====
+        # 结束的 trace 导出到：table（SQLite spans 表，默认）/ jsonl（按天写入 RS_AGENT_TRACE_DIR）/ none（仅保留内存中最近的）
+        trace_export = (os.environ.get("RS_AGENT_TRACE_EXPORT", "table") or "table").strip().lower()
+        self.trace_export = trace_export if trace_export in ("table", "jsonl", "none") else "table"
+        trace_dir_env = os.environ.get("RS_AGENT_TRACE_DIR", "").strip()
+        self.trace_dir = Path(trace_dir_env).expanduser() if trace_dir_env else base / "data" / "traces"
+        # 进程内保留最近多少个 trace 供 /api/traces 查询（默认 100）
+        self.trace_recent = int(os.environ.get("RS_AGENT_TRACE_RECENT", "100") or "100")
+        # 单个 trace 最多记录的 span 数，超出的丢弃并计数（默认 2000）
+        self.trace_max_spans = int(os.environ.get("RS_AGENT_TRACE_MAX_SPANS", "2000") or "2000")
+        # spans 表中超过该秒数的记录被后台清理（默认 604800 = 7 天，0 为不清理）
+        self.trace_ttl_seconds = int(os.environ.get("RS_AGENT_TRACE_TTL_SECONDS", "604800") or "604800")
+
+        # ==== Prometheus 指标（GET /metrics）====
+        self.metrics_enabled = os.environ.get("RS_AGENT_METRICS_ENABLED", "true").lower() in ("true", "1", "yes")
+        # 多 worker 部署时设置：各进程定期把指标写入该目录，/metrics 合并全部进程（每次部署时清空；未设置则只输出本进程）
+        metrics_dir_env = os.environ.get("RS_AGENT_METRICS_DIR", "").strip()
+        self.metrics_dir = Path(metrics_dir_env).expanduser() if metrics_dir_env else None
+        # 写入多进程目录的间隔（秒，默认 5）
+        self.metrics_flush_seconds = float(os.environ.get("RS_AGENT_METRICS_FLUSH_SECONDS", "5") or "5")
+
+        # ==== 事件循环监控（延迟 + 阻塞调用定位，GET /api/diagnostics/loop）====
+        self.loop_monitor_enabled = os.environ.get("RS_AGENT_LOOP_MONITOR_ENABLED", "true").lower() in ("true", "1", "yes")
+        # 心跳间隔（毫秒，默认 20；也是阻塞检测的精度）
+        self.loop_monitor_interval_ms = float(os.environ.get("RS_AGENT_LOOP_MONITOR_INTERVAL_MS", "20") or "20")
+        # 心跳迟到超过该毫秒数即视为阻塞并抓取事件循环线程调用栈（默认 100）
+        self.loop_block_threshold_ms = float(os.environ.get("RS_AGENT_LOOP_BLOCK_THRESHOLD_MS", "100") or "100")
+        # 测试中 loop_monitor.fail_on_block() 的默认阈值（毫秒，默认 100）
+        self.loop_block_fail_ms = float(os.environ.get("RS_AGENT_LOOP_BLOCK_FAIL_MS", "100") or "100")
+
+        # ==== 按需请求剖析（X-Profile: cprofile|sample，需 X-Profile-Key）====
+        # 管理员密钥，留空则不允许剖析
+        self.profile_key = os.environ.get("RS_AGENT_PROFILE_KEY", "").strip()
+        profile_dir_env = os.environ.get("RS_AGENT_PROFILE_DIR", "").strip()
+        self.profile_dir = Path(profile_dir_env).expanduser() if profile_dir_env else base / "data" / "profiles"
+        # 保留最近多少个剖析结果（默认 20）
+        self.profile_keep = int(os.environ.get("RS_AGENT_PROFILE_KEEP", "20") or "20")
+        # sample 模式的调用栈采样间隔（毫秒，默认 5）
+        self.profile_sample_interval_ms = float(os.environ.get("RS_AGENT_PROFILE_SAMPLE_INTERVAL_MS", "5") or "5")
+        # tracemalloc 分配差异输出条数（默认 20，0 为不启用 tracemalloc）与记录的栈深度
+        self.profile_tracemalloc_top = int(os.environ.get("RS_AGENT_PROFILE_TRACEMALLOC_TOP", "20") or "20")
+        self.profile_tracemalloc_frames = int(os.environ.get("RS_AGENT_PROFILE_TRACEMALLOC_FRAMES", "1") or "1")
+
+        # ==== 多 worker 共享状态（上传登记 / 会话缓存共享层 / 限流计数）====
+        # memory（进程内，默认，仅适用单 worker）/ sqlite（本机共享文件）/ redis（RESP 协议，可跨机器；
+        # 跨机器时上传目录 RS_AGENT_UPLOAD_DIR 须为共享存储）
+        state_backend = (os.environ.get("RS_AGENT_STATE_BACKEND", "memory") or "memory").strip().lower()
+        self.state_backend = state_backend if state_backend in ("memory", "sqlite", "redis") else "memory"
+        state_sqlite_env = os.environ.get("RS_AGENT_STATE_SQLITE_PATH", "").strip()
+        self.state_sqlite_path = (
+            Path(state_sqlite_env).expanduser() if state_sqlite_env else base / "data" / "rs_agent_state.db"
+        )
+        self.state_redis_url = os.environ.get("RS_AGENT_STATE_REDIS_URL", "redis://127.0.0.1:6379/0").strip()
+        self.state_key_prefix = os.environ.get("RS_AGENT_STATE_KEY_PREFIX", "rs-agent:")
+        # 共享会话缓存条目的 TTL（秒，默认 600）
+        self.state_session_ttl_seconds = int(os.environ.get("RS_AGENT_STATE_SESSION_TTL", "600") or "600")
+        # /api/agent 与 /api/agent/stream 每个 API Key（未启用认证时按客户端 IP）每分钟请求上限（默认 0 = 不限）
+        self.rate_limit_per_minute = int(os.environ.get("RS_AGENT_RATE_LIMIT_PER_MINUTE", "0") or "0")
+
+        # ==== 会话大字段 blob 存储（内容寻址 + 压缩）====
+        # 不短于该字符数的大字段（knowledge_markdown）单独存 blob，session_data 只存引用（默认 4096）
+        self.blob_min_chars = int(os.environ.get("RS_AGENT_BLOB_MIN_CHARS", "4096") or "4096")
+        # 压缩算法：zlib（默认）或 zstd（需安装 zstandard，未安装时回退 zlib）
+        self.blob_codec = (os.environ.get("RS_AGENT_BLOB_CODEC", "zlib") or "zlib").strip().lower()
+
+        # ==== 会话增量日志（JSON patch + 定期快照）====
+        # 关闭后每次整体重写 session_data 且不记日志（原行为）
+        self.session_journal = os.environ.get("RS_AGENT_SESSION_JOURNAL", "true").lower() in ("true", "1", "yes")
+        # 距上次快照累计多少条增量后整体写一次快照（加载时最多重放这么多条，默认 16）
+        self.session_journal_compact_every = int(os.environ.get("RS_AGENT_SESSION_JOURNAL_COMPACT_EVERY", "16") or "16")
+
         # ==== API 认证 ====
-        # 若设置了 RS_AGENT_API_KEY，则所有 /api/* 端点需要 Authorization: Bearer <key>
+        # 若设置了 RS_AGENT_API_KEY，则所有 /api/* 端点需要 Authorization: Bearer <key>；可用逗号分隔多个 Key
         # 留空或未设置则不启用认证（向后兼容）
         self.api_key = os.environ.get("RS_AGENT_API_KEY", "").strip()
 
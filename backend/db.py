@@ -1,31 +1,241 @@
-"""SQLite persistence for RS-Agent conversations and messages."""
+"""SQLite persistence for RS-Agent conversations and messages.
+
+连接池与异步接口：
+
+- 连接按 ``settings.db_path`` 放入一个小型连接池复用（``RS_AGENT_DB_POOL_SIZE``），每个连接打开时设置
+  WAL 日志模式、``synchronous``（默认 NORMAL）与 ``busy_timeout``，并开启 sqlite3 的预编译语句缓存
+  （``cached_statements``），不再每次调用都重新建连、解析 SQL；
+- 同步函数保持原签名，供脚本、同步路由与后台任务使用；
+- 事件循环中的调用方（AgentPipeline、orchestrator_controller）使用 ``*_async`` 版本，
+  SQL 在专用线程池（与连接池同大小）中执行，磁盘 IO 与 fsync 不再阻塞事件循环。
+"""
 
 from __future__ import annotations
 
+import asyncio
+import json
+import logging
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
 
+from backend import metrics, tracing
 from backend.config import settings
 
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+# ---------------------------------------------------------------------------
+# Connection pool
+# ---------------------------------------------------------------------------
+
+class _ConnectionPool:
+    """固定上限的 SQLite 连接池：空闲连接后进先出复用，全部占用时阻塞等待归还。"""
+
+    def __init__(self, path: str, size: int) -> None:
+        self.path = path
+        self.size = max(1, size)
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self.stats = {"opened": 0, "reused": 0, "waited": 0, "discarded": 0, "timeouts": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            cached_statements=max(0, settings.db_statement_cache_size),
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={settings.db_synchronous}")
+        conn.execute(f"PRAGMA busy_timeout={max(0, settings.db_busy_timeout_ms)}")
+        return conn
+
+    def _try_open(self) -> Optional[sqlite3.Connection]:
+        """未达上限时新开一个连接，否则返回 None。"""
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        self.stats["opened"] += 1
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """取一个连接；池已占满时最多等待 busy_timeout（至少 1 秒），超时抛 ``sqlite3.OperationalError``。"""
+        try:
+            conn = self._idle.get_nowait()
+            self.stats["reused"] += 1
+            return conn
+        except queue.Empty:
+            pass
+        conn = self._try_open()
+        if conn is not None:
+            return conn
+        self.stats["waited"] += 1
+        timeout_s = max(1.0, settings.db_busy_timeout_ms / 1000)
+        try:
+            return self._idle.get(timeout=timeout_s)
+        except queue.Empty:
+            pass
+        # 等待期间可能有连接因出错被丢弃而腾出名额
+        conn = self._try_open()
+        if conn is not None:
+            return conn
+        self.stats["timeouts"] += 1
+        raise sqlite3.OperationalError(
+            f"timed out after {timeout_s:.1f}s waiting for a connection from the SQLite pool "
+            f"(size {self.size}, all in use; a connection may have leaked or the pool is undersized)"
+        )
+
+    def release(self, conn: sqlite3.Connection, broken: bool = False) -> None:
+        if broken:
+            self.stats["discarded"] += 1
+            with self._lock:
+                self._created -= 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return
+        self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "size": self.size,
+            "open": self._created,
+            "idle": self._idle.qsize(),
+            **self.stats,
+        }
+
+
+_POOL: Optional[_ConnectionPool] = None
+_POOL_LOCK = threading.Lock()
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+
+
+def _get_pool() -> _ConnectionPool:
+    """按当前 ``settings.db_path`` 返回连接池；路径变化（如测试切换临时库）时重建。"""
+    global _POOL
+    pool = _POOL
+    if pool is not None and pool.path == settings.db_path:
+        return pool
+    with _POOL_LOCK:
+        if _POOL is None or _POOL.path != settings.db_path:
+            if _POOL is not None:
+                _POOL.close()
+            _POOL = _ConnectionPool(settings.db_path, settings.db_pool_size)
+        return _POOL
+
 
 @contextmanager
 def get_conn() -> Iterable[sqlite3.Connection]:
-    conn = sqlite3.connect(settings.db_path)
+    """从连接池借出一个连接；正常退出时提交，异常时回滚后归还。"""
+    pool = _get_pool()
+    conn = pool.acquire()
     try:
-        conn.row_factory = sqlite3.Row
         yield conn
         conn.commit()
-    finally:
-        conn.close()
+    except BaseException:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            pool.release(conn, broken=True)
+            raise
+        pool.release(conn)
+        raise
+    else:
+        pool.release(conn)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        with _POOL_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = ThreadPoolExecutor(
+                    max_workers=max(1, settings.db_pool_size), thread_name_prefix="rs-agent-db"
+                )
+    return _EXECUTOR
+
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """在专用 DB 线程池中执行同步的数据库函数，事件循环只等待结果。
+
+    执行耗时与在线程池中排队的时间记入 ``backend.metrics``；有进行中的 trace 时另记为一个 ``db.<函数名>`` span
+    （``wait_ms`` 为排队时间）。
+    """
+    loop = asyncio.get_running_loop()
+    name = getattr(fn, "__name__", "call")
+    sp = tracing.start_span(f"db.{name}", "DB") if tracing.current_trace() is not None else None
+    submitted = time.perf_counter_ns()
+
+    def _timed() -> T:
+        started = time.perf_counter_ns()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            wait_ns = started - submitted
+            metrics.observe_db(name, wait_ns / 1e9, (time.perf_counter_ns() - started) / 1e9)
+            if sp is not None:
+                sp.set(wait_ms=round(wait_ns / 1e6, 3))
+
+    if sp is None:
+        return await loop.run_in_executor(_get_executor(), _timed)
+    with tracing.activate(sp):
+        return await loop.run_in_executor(_get_executor(), _timed)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """连接池诊断信息（打开/空闲连接数、复用与等待次数）。"""
+    return _get_pool().describe()
+
+
+def shutdown_db() -> None:
+    """关闭 DB 线程池与连接池（应用退出时调用；之后再次使用会按需重建）。"""
+    global _EXECUTOR, _POOL
+    with _POOL_LOCK:
+        executor, _EXECUTOR = _EXECUTOR, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.close()
 
 
 def init_db() -> None:
     """Create tables if they do not exist."""
     db_file = Path(settings.db_path)
     db_file.parent.mkdir(parents=True, exist_ok=True)
+    if not db_file.exists() or db_file.stat().st_size == 0:
+        _create_db_file(str(db_file))
     with get_conn() as conn:
+        _check_incremental_vacuum(conn)
         cur = conn.cursor()
         cur.execute(
             """
@@ -63,43 +273,272 @@ def init_db() -> None:
             )
             """
         )
+        _migrate(conn)
 
 
-def create_conversation(conv_id: str, intent: str, status: str = "active") -> None:
-    with get_conn() as conn:
-        conn.execute(
+# 结构迁移：(目标 user_version, SQL 语句...)，按 PRAGMA user_version 顺序执行，已执行过的跳过
+_MIGRATIONS: List[Tuple[int, Tuple[str, ...]]] = [
+    # 会话版本号：每次保存 +1，多 worker 下用于校验进程内会话缓存是否过期
+    (1, ("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0",)),
+    # 大字段（knowledge_markdown 等）按内容哈希存一次、压缩；session_blobs 记录会话引用，供 GC
+    (
+        2,
+        (
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
             """
-            INSERT OR IGNORE INTO conversations (
-                id,
-                intent,
-                status,
-                created_at,
-                updated_at
+            CREATE TABLE IF NOT EXISTS session_blobs (
+                session_id TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (session_id, hash)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_session_blobs_hash ON session_blobs(hash)",
+        ),
+    ),
+    # 会话增量日志：每次保存记一条 JSON patch（seq = 保存后的 version）；sessions.session_data 为
+    # snapshot_version 时的快照，加载时重放 seq > snapshot_version 的增量
+    (
+        3,
+        (
+            "ALTER TABLE sessions ADD COLUMN snapshot_version INTEGER NOT NULL DEFAULT 0",
+            """
+            CREATE TABLE IF NOT EXISTS session_journal (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                patch TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (session_id, seq)
             )
-            VALUES (
-                ?,
-                ?,
-                ?,
-                datetime('now', 'localtime'),
-                datetime('now', 'localtime')
+            """,
+        ),
+    ),
+    # 会话列表：索引 + 反规范化的首条用户消息与消息数（由触发器在插入消息时维护），回填已有数据
+    (
+        4,
+        (
+            "CREATE INDEX IF NOT EXISTS idx_conversations_created ON conversations(created_at, id)",
+            "CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at)",
+            "ALTER TABLE conversations ADD COLUMN first_user_text TEXT",
+            "ALTER TABLE conversations ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0",
+            """
+            UPDATE conversations SET
+                message_count = (SELECT COUNT(*) FROM messages m WHERE m.conversation_id = conversations.id),
+                first_user_text = (
+                    SELECT m.content FROM messages m
+                    WHERE m.conversation_id = conversations.id AND m.role = 'user'
+                    ORDER BY m.id ASC LIMIT 1
+                )
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_messages_conversation_summary
+            AFTER INSERT ON messages
+            BEGIN
+                UPDATE conversations SET
+                    message_count = message_count + 1,
+                    first_user_text = CASE
+                        WHEN first_user_text IS NULL AND NEW.role = 'user' THEN NEW.content
+                        ELSE first_user_text
+                    END
+                WHERE id = NEW.conversation_id;
+            END
+            """,
+        ),
+    ),
+    # 保留策略归档：被清理的会话连同消息压缩后存入冷表
+    (
+        5,
+        (
+            """
+            CREATE TABLE IF NOT EXISTS conversation_archive (
+                id TEXT PRIMARY KEY,
+                intent TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at TIMESTAMP,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                codec TEXT NOT NULL,
+                data BLOB NOT NULL
             )
             """,
-            (conv_id, intent, status),
+        ),
+    ),
+    # 后台任务模式：任务状态与只追加的事件日志（SSE 断线后按 Last-Event-ID 重放）
+    (
+        6,
+        (
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                session_id TEXT,
+                status TEXT NOT NULL,
+                request TEXT NOT NULL,
+                owner TEXT,
+                error TEXT,
+                last_seq INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+                updated_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_jobs_status_updated ON jobs(status, updated_at)",
+            """
+            CREATE TABLE IF NOT EXISTS job_events (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+                PRIMARY KEY (job_id, seq)
+            )
+            """,
+        ),
+    ),
+    # 链路追踪：结束的 trace 按 span 一行导出（started_at 为 trace 开始时间，根 span 的 parent_id 为 NULL）
+    (
+        7,
+        (
+            """
+            CREATE TABLE IF NOT EXISTS spans (
+                trace_id TEXT NOT NULL,
+                span_id TEXT NOT NULL,
+                parent_id TEXT,
+                name TEXT NOT NULL,
+                phase TEXT,
+                kind TEXT NOT NULL,
+                start_us INTEGER NOT NULL,
+                duration_us INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                task TEXT,
+                attrs TEXT,
+                started_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (trace_id, span_id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_spans_started ON spans(started_at)",
+        ),
+    ),
+]
+
+
+def _create_db_file(path: str) -> None:
+    """新建库文件：auto_vacuum=INCREMENTAL 须在切换 WAL、建表之前设置才生效。"""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+    finally:
+        conn.close()
+
+
+def _check_incremental_vacuum(conn: sqlite3.Connection) -> None:
+    """旧库未开启 auto_vacuum=INCREMENTAL 时只记日志：转换需整库 VACUUM（独占锁，耗时随库大小增长），不在启动时执行。"""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        logger.warning(
+            "%s is not in incremental auto_vacuum mode; retention cannot return freed pages to the OS. "
+            "Run `python scripts/convert_incremental_vacuum.py` during a maintenance window to convert it.",
+            settings.db_path,
         )
-    # 每次创建新会话后，清理只保留最近 10 条记录
-    trim_old_conversations(max_count=10)
+
+
+def convert_incremental_vacuum() -> Dict[str, Any]:
+    """把库转换为 auto_vacuum=INCREMENTAL（整库 VACUUM，期间持有独占锁）；已是该模式时不做任何事。"""
+    with get_conn() as conn:
+        before = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+        if before == 2:
+            return {
+                "converted": False,
+                "auto_vacuum": before,
+                "page_count_before": pages_before,
+                "page_count": pages_before,
+                "seconds": 0.0,
+            }
+        conn.commit()
+        t0 = time.perf_counter()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        elapsed = time.perf_counter() - t0
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        pages_after = conn.execute("PRAGMA page_count").fetchone()[0]
+    logger.info("Converted %s to incremental auto_vacuum in %.1fs", settings.db_path, elapsed)
+    return {
+        "converted": True,
+        "auto_vacuum": mode,
+        "page_count_before": pages_before,
+        "page_count": pages_after,
+        "seconds": round(elapsed, 2),
+    }
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """逐步执行结构迁移：每步在 ``BEGIN IMMEDIATE`` 事务中执行并更新 user_version。
+
+    取得写锁后重读 user_version：多个 worker 同时启动时只有一个执行迁移，其余跳过；中途崩溃则整步回滚，
+    下次启动重新执行该步（不会留下已加的列导致 "duplicate column name"）。
+    """
+    conn.commit()
+    for version, statements in _MIGRATIONS:
+        if version <= conn.execute("PRAGMA user_version").fetchone()[0]:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= conn.execute("PRAGMA user_version").fetchone()[0]:
+                conn.rollback()
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+_SQL_INSERT_CONVERSATION = """
+    INSERT OR IGNORE INTO conversations (
+        id,
+        intent,
+        status,
+        created_at,
+        updated_at
+    )
+    VALUES (
+        ?,
+        ?,
+        ?,
+        datetime('now', 'localtime'),
+        datetime('now', 'localtime')
+    )
+"""
+
+_SQL_UPDATE_CONVERSATION_STATUS = """
+    UPDATE conversations
+    SET status = ?, updated_at = datetime('now', 'localtime')
+    WHERE id = ?
+"""
+
+_SQL_INSERT_MESSAGE = """
+    INSERT INTO messages (conversation_id, role, payload_type, content, created_at)
+    VALUES (?, ?, ?, ?, datetime('now', 'localtime'))
+"""
+
+
+def create_conversation(conv_id: str, intent: str, status: str = "active") -> None:
+    with get_conn() as conn:
+        conn.execute(_SQL_INSERT_CONVERSATION, (conv_id, intent, status))
 
 
 def update_conversation_status(conv_id: str, status: str) -> None:
     with get_conn() as conn:
-        conn.execute(
-            """
-            UPDATE conversations
-            SET status = ?, updated_at = datetime('now', 'localtime')
-            WHERE id = ?
-            """,
-            (status, conv_id),
-        )
+        conn.execute(_SQL_UPDATE_CONVERSATION_STATUS, (status, conv_id))
 
 
 def add_message(
@@ -109,42 +548,76 @@ def add_message(
     content: str,
 ) -> None:
     with get_conn() as conn:
-        conn.execute(
-            """
-            INSERT INTO messages (conversation_id, role, payload_type, content, created_at)
-            VALUES (?, ?, ?, ?, datetime('now', 'localtime'))
-            """,
-            (conv_id, role, payload_type, content),
-        )
+        conn.execute(_SQL_INSERT_MESSAGE, (conv_id, role, payload_type, content))
 
 
-def list_conversations(limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+def write_batch(ops: Sequence[Tuple[str, Tuple[Any, ...]]]) -> None:
+    """在同一个事务中按顺序执行一批写操作（供写后队列批量落盘）。
+
+    ``ops`` 为 ``(kind, args)``：``conversation`` (conv_id, intent, status)、
+    ``status`` (conv_id, status)、``message`` (conv_id, role, payload_type, content)。
+    message 的 content 不是 str 时在此处（DB 线程中）序列化为 JSON。
+    """
     with get_conn() as conn:
-        cur = conn.execute(
-            """
-            SELECT
-                c.id,
-                c.intent,
-                c.status,
-                c.created_at,
-                c.updated_at,
-                (
-                    SELECT m.content
-                    FROM messages m
-                    WHERE m.conversation_id = c.id AND m.role = 'user'
-                    ORDER BY m.id ASC
-                    LIMIT 1
-                ) AS first_user_text
-            FROM conversations c
-            ORDER BY c.created_at DESC
-            LIMIT ? OFFSET ?
-            """,
-            (limit, offset),
-        )
-        rows = cur.fetchall()
+        for kind, args in ops:
+            if kind == "message":
+                conv_id, role, payload_type, content = args
+                if not isinstance(content, str):
+                    content = json.dumps(content, ensure_ascii=False)
+                conn.execute(_SQL_INSERT_MESSAGE, (conv_id, role, payload_type, content))
+            elif kind == "conversation":
+                conn.execute(_SQL_INSERT_CONVERSATION, args)
+            elif kind == "status":
+                conv_id, status = args
+                conn.execute(_SQL_UPDATE_CONVERSATION_STATUS, (status, conv_id))
+            else:
+                raise ValueError(f"unknown write op: {kind}")
+
+
+def list_conversations(
+    limit: int = 20,
+    offset: int = 0,
+    after: Optional[Tuple[str, str]] = None,
+) -> List[Dict[str, Any]]:
+    """按创建时间倒序列出会话（含首条用户消息与消息数）。
+
+    ``after`` 为上一页最后一条的 (created_at, id)：按 keyset 定位下一页（走 idx_conversations_created，
+    与页码无关），此时忽略 ``offset``；不传时沿用 LIMIT/OFFSET。
+    """
+    sql = """
+        SELECT id, intent, status, created_at, updated_at, first_user_text, message_count
+        FROM conversations
+    """
+    params: Tuple[Any, ...]
+    if after is not None:
+        # 行值比较（SQLite >= 3.15）可直接作为索引上的范围扫描
+        sql += " WHERE (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?"
+        params = (after[0], after[1], limit)
+    else:
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?"
+        params = (limit, offset)
+    with get_conn() as conn:
+        rows = conn.execute(sql, params).fetchall()
     return [dict(r) for r in rows]
 
 
+def list_intent_samples(limit: Optional[int] = None) -> List[Tuple[str, str]]:
+    """返回 (首条用户消息, 会话意图) 列表，供离线训练本地意图分类器。"""
+    sql = """
+        SELECT first_user_text, intent
+        FROM conversations
+        WHERE first_user_text IS NOT NULL
+        ORDER BY created_at DESC, id DESC
+    """
+    params: Tuple[Any, ...] = ()
+    if limit is not None:
+        sql += " LIMIT ?"
+        params = (limit,)
+    with get_conn() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [(r["first_user_text"], r["intent"]) for r in rows if r["first_user_text"]]
+
+
 def get_conversation(conv_id: str) -> Optional[Dict[str, Any]]:
     with get_conn() as conn:
         cur = conn.execute(
@@ -172,72 +645,360 @@ def get_conversation(conv_id: str) -> Optional[Dict[str, Any]]:
         return conv
 
 
-def trim_old_conversations(max_count: int = 10) -> None:
-    """保留最近 max_count 条会话，删除更早的会话及其消息。"""
-    if max_count <= 0:
-        return
+# ---------------------------------------------------------------------------
+# Retention（由 services/retention.py 后台任务调用）
+# ---------------------------------------------------------------------------
+
+def _status_filter(statuses: Sequence[str]) -> Tuple[str, Tuple[str, ...]]:
+    if not statuses:
+        return "1 = 1", ()
+    return f"status IN ({', '.join('?' * len(statuses))})", tuple(statuses)
+
+
+def retention_candidates(
+    limit: int,
+    statuses: Sequence[str] = (),
+    older_than: Optional[str] = None,
+    max_count: int = 0,
+) -> List[str]:
+    """按保留策略选出至多 ``limit`` 个待清理会话（最旧的优先）。
+
+    仅考虑状态在 ``statuses`` 中的会话（空表示全部）：最后更新早于 ``older_than``（本地时间字符串）的，
+    以及会话总数超过 ``max_count``（0 表示不限）时最旧的超出部分。
+    """
+    where, params = _status_filter(statuses)
     with get_conn() as conn:
-        cur = conn.execute(
-            """
-            SELECT id
-            FROM conversations
-            WHERE id NOT IN (
-                SELECT id
-                FROM conversations
-                ORDER BY created_at DESC
-                LIMIT ?
+        ids: List[str] = []
+        if older_than:
+            ids = [
+                r["id"]
+                for r in conn.execute(
+                    f"SELECT id FROM conversations WHERE {where} AND updated_at < ? ORDER BY created_at, id LIMIT ?",
+                    (*params, older_than, limit),
+                )
+            ]
+        if max_count > 0 and len(ids) < limit:
+            total = conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+            excess = total - len(ids) - max_count
+            wanted = min(excess, limit - len(ids))
+            if wanted > 0:
+                picked = set(ids)
+                for r in conn.execute(
+                    f"SELECT id FROM conversations WHERE {where} ORDER BY created_at, id LIMIT ?",
+                    (*params, len(ids) + wanted),
+                ):
+                    if r["id"] not in picked:
+                        ids.append(r["id"])
+                        wanted -= 1
+                        if wanted == 0:
+                            break
+        return ids
+
+
+def export_conversations(ids: Sequence[str]) -> List[Dict[str, Any]]:
+    """读取若干会话及其全部消息（归档用）。"""
+    if not ids:
+        return []
+    marks = ", ".join("?" * len(ids))
+    with get_conn() as conn:
+        convs = {
+            r["id"]: {**dict(r), "messages": []}
+            for r in conn.execute(
+                f"SELECT id, intent, status, created_at, updated_at FROM conversations WHERE id IN ({marks})",
+                tuple(ids),
             )
+        }
+        for r in conn.execute(
+            f"""
+            SELECT conversation_id, role, payload_type, content, created_at FROM messages
+            WHERE conversation_id IN ({marks}) ORDER BY id
             """,
-            (max_count,),
-        )
-        old_ids = [row["id"] for row in cur.fetchall()]
-        if not old_ids:
-            return
-        conn.executemany(
-            "DELETE FROM messages WHERE conversation_id = ?",
-            [(cid,) for cid in old_ids],
-        )
-        conn.executemany(
-            "DELETE FROM conversations WHERE id = ?",
-            [(cid,) for cid in old_ids],
-        )
+            tuple(ids),
+        ):
+            conv = convs.get(r["conversation_id"])
+            if conv is not None:
+                conv["messages"].append({k: r[k] for k in ("role", "payload_type", "content", "created_at")})
+    return list(convs.values())
+
+
+def delete_conversations(
+    ids: Sequence[str],
+    archive_rows: Sequence[Tuple[str, str, str, str, str, bytes]] = (),
+) -> Tuple[int, int]:
+    """在一个事务中（可选地先写入归档行 (id, intent, status, created_at, codec, data)）删除会话及其消息。
+
+    返回 (删除的会话数, 删除的消息数)。
+    """
+    if not ids:
+        return 0, 0
+    marks = ", ".join("?" * len(ids))
+    with get_conn() as conn:
+        if archive_rows:
+            conn.executemany(
+                "INSERT OR REPLACE INTO conversation_archive (id, intent, status, created_at, archived_at, codec, data) "
+                "VALUES (?, ?, ?, ?, datetime('now', 'localtime'), ?, ?)",
+                list(archive_rows),
+            )
+        messages = conn.execute(f"DELETE FROM messages WHERE conversation_id IN ({marks})", tuple(ids)).rowcount
+        conversations = conn.execute(f"DELETE FROM conversations WHERE id IN ({marks})", tuple(ids)).rowcount
+    return conversations, messages
+
+
+def get_archived_conversation(conv_id: str) -> Optional[Tuple[str, bytes]]:
+    """读取冷表中的归档 (codec, data)。"""
+    with get_conn() as conn:
+        row = conn.execute("SELECT codec, data FROM conversation_archive WHERE id = ?", (conv_id,)).fetchone()
+    return (row["codec"], bytes(row["data"])) if row else None
+
+
+def incremental_vacuum(max_pages: int = 0) -> Dict[str, int]:
+    """归还空闲页（``PRAGMA incremental_vacuum``，0 表示全部）；返回归还前后的空闲页数与页大小。"""
+    with get_conn() as conn:
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode == 2 and before:
+            # executescript 会把语句执行完（execute 对无结果列的 PRAGMA 只 step 一次，只归还一页）
+            conn.executescript(f"PRAGMA incremental_vacuum({max(0, int(max_pages))});")
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return {"freelist_before": before, "freelist_after": after, "page_size": page_size, "auto_vacuum": mode}
 
 
 # ---------------------------------------------------------------------------
 # Sessions (P0-2: Orchestrator session persistence)
 # ---------------------------------------------------------------------------
 
-def save_session(session_id: str, state: str, session_data: str) -> None:
-    """Insert or update an orchestrator session (upsert)."""
+class SessionConflictError(RuntimeError):
+    """compare-and-swap 失败：会话在读取之后已被其它请求（通常是另一个 worker）保存过。"""
+
+    def __init__(self, session_id: str, expected: int, actual: Optional[int]) -> None:
+        super().__init__(f"session {session_id} changed concurrently (expected version {expected}, found {actual})")
+        self.session_id = session_id
+        self.expected = expected
+        self.actual = actual
+
+
+class MissingBlobError(LookupError):
+    """save_session 引用的 blob 在库中不存在（如已被 GC），调用方需连同内容重新保存。"""
+
+    def __init__(self, hashes: Sequence[str]) -> None:
+        super().__init__(f"missing blobs: {', '.join(hashes)}")
+        self.hashes = list(hashes)
+
+
+def _store_session_blobs(
+    conn: sqlite3.Connection,
+    session_id: str,
+    blobs: Sequence[Tuple[str, str, int, bytes]],
+    blob_refs: Optional[Sequence[str]],
+) -> None:
+    if blobs:
+        conn.executemany(
+            "INSERT OR IGNORE INTO blobs (hash, codec, size, data) VALUES (?, ?, ?, ?)",
+            list(blobs),
+        )
+    if blob_refs is None:
+        return
+    conn.execute("DELETE FROM session_blobs WHERE session_id = ?", (session_id,))
+    if not blob_refs:
+        return
+    conn.executemany(
+        "INSERT OR IGNORE INTO session_blobs (session_id, hash) VALUES (?, ?)",
+        [(session_id, h) for h in blob_refs],
+    )
+    missing = [
+        row["hash"]
+        for row in conn.execute(
+            """
+            SELECT sb.hash FROM session_blobs sb
+            LEFT JOIN blobs b ON b.hash = sb.hash
+            WHERE sb.session_id = ? AND b.hash IS NULL
+            """,
+            (session_id,),
+        )
+    ]
+    if missing:
+        raise MissingBlobError(missing)
+
+
+def _append_journal(conn: sqlite3.Connection, session_id: str, seq: int, state: str, patch: str) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO session_journal (session_id, seq, state, patch, created_at) "
+        "VALUES (?, ?, ?, ?, datetime('now', 'localtime'))",
+        (session_id, seq, state, patch),
+    )
+
+
+def save_session(
+    session_id: str,
+    state: str,
+    session_data: str,
+    blobs: Sequence[Tuple[str, str, int, bytes]] = (),
+    blob_refs: Optional[Sequence[str]] = None,
+    patch: Optional[str] = None,
+    base_version: Optional[int] = None,
+    journal: bool = True,
+    expected_version: Optional[int] = None,
+) -> int:
+    """Insert or update an orchestrator session (upsert).  Returns the new version (1 for a new session).
+
+    整体写入快照（snapshot_version = 新版本），并在 session_journal 记一条增量：库中版本等于
+    ``base_version`` 时记 ``patch``（相对上一版本的 JSON patch），否则（新会话、并发写入、升级前的旧会话）
+    记整体替换。``journal=False`` 时不记增量。
+
+    ``blobs`` 为需要写入的 (hash, codec, size, data)，已存在的 hash 直接跳过；``blob_refs`` 为该会话当前引用的
+    全部 hash（None 表示不改动引用）。引用的 blob 不在库中时整个事务回滚并抛出 :class:`MissingBlobError`。
+
+    给出 ``expected_version`` 时按版本号 compare-and-swap：库中版本不等于它时不做任何写入并抛出
+    :class:`SessionConflictError`（会话已被删除时与以往一样重新写入）。
+    """
     with get_conn() as conn:
-        conn.execute(
+        current = conn.execute(
+            "SELECT version, snapshot_version FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if expected_version is not None and current is not None:
+            # 条件 UPDATE 作为事务中的第一条写入：版本校验与写入原子完成
+            cur = conn.execute(
+                """
+                UPDATE sessions SET state = ?, session_data = ?, version = version + 1,
+                    snapshot_version = version + 1, updated_at = datetime('now', 'localtime')
+                WHERE id = ? AND version = ?
+                """,
+                (state, session_data, session_id, expected_version),
+            )
+            if cur.rowcount != 1:
+                actual = conn.execute("SELECT version FROM sessions WHERE id = ?", (session_id,)).fetchone()
+                raise SessionConflictError(session_id, expected_version, actual["version"] if actual else None)
+            _store_session_blobs(conn, session_id, blobs, blob_refs)
+        else:
+            _store_session_blobs(conn, session_id, blobs, blob_refs)
+            conn.execute(
+                """
+                INSERT INTO sessions (id, state, session_data, version, snapshot_version, created_at, updated_at)
+                VALUES (?, ?, ?, 1, 1, datetime('now', 'localtime'), datetime('now', 'localtime'))
+                ON CONFLICT(id) DO UPDATE SET
+                    state = excluded.state,
+                    session_data = excluded.session_data,
+                    version = sessions.version + 1,
+                    snapshot_version = sessions.version + 1,
+                    updated_at = datetime('now', 'localtime')
+                """,
+                (session_id, state, session_data),
+            )
+        version = int(conn.execute("SELECT version FROM sessions WHERE id = ?", (session_id,)).fetchone()["version"])
+        if journal:
+            journaled = current is not None and current["snapshot_version"] > 0
+            if patch is None or not journaled or current["version"] != base_version:
+                patch = '[{"op": "replace", "path": "", "value": ' + session_data + "}]"
+            _append_journal(conn, session_id, version, state, patch)
+    return version
+
+
+def append_session_patch(
+    session_id: str,
+    base_version: int,
+    state: str,
+    patch: str,
+    blobs: Sequence[Tuple[str, str, int, bytes]] = (),
+    blob_refs: Optional[Sequence[str]] = None,
+) -> Optional[int]:
+    """只追加一条增量（不重写 session_data）。库中版本不等于 ``base_version``、会话不存在或尚无快照时
+    不做任何写入并返回 None，调用方改用 :func:`save_session` 整体保存。"""
+    with get_conn() as conn:
+        cur = conn.execute(
             """
-            INSERT INTO sessions (id, state, session_data, created_at, updated_at)
-            VALUES (?, ?, ?, datetime('now', 'localtime'), datetime('now', 'localtime'))
-            ON CONFLICT(id) DO UPDATE SET
-                state = excluded.state,
-                session_data = excluded.session_data,
-                updated_at = datetime('now', 'localtime')
+            UPDATE sessions SET state = ?, version = version + 1, updated_at = datetime('now', 'localtime')
+            WHERE id = ? AND version = ? AND snapshot_version > 0
             """,
-            (session_id, state, session_data),
+            (state, session_id, base_version),
         )
+        if cur.rowcount != 1:
+            return None
+        _store_session_blobs(conn, session_id, blobs, blob_refs)
+        _append_journal(conn, session_id, base_version + 1, state, patch)
+    return base_version + 1
 
 
 def load_session(session_id: str) -> Optional[Dict[str, Any]]:
-    """Load an orchestrator session by ID.  Returns dict with id/state/session_data or None."""
+    """Load an orchestrator session by ID.
+
+    Returns dict with id/state/session_data/version/snapshot_version and ``patches`` (增量 JSON patch 文本，
+    按 seq 升序，需在快照上依次重放) or None.
+    """
     with get_conn() as conn:
-        cur = conn.execute(
-            "SELECT id, state, session_data, created_at, updated_at FROM sessions WHERE id = ?",
+        row = conn.execute(
+            "SELECT id, state, session_data, version, snapshot_version, created_at, updated_at FROM sessions WHERE id = ?",
             (session_id,),
-        )
-        row = cur.fetchone()
-    return dict(row) if row else None
+        ).fetchone()
+        if not row:
+            return None
+        patches = [
+            r["patch"]
+            for r in conn.execute(
+                "SELECT patch FROM session_journal WHERE session_id = ? AND seq > ? AND seq <= ? ORDER BY seq",
+                (session_id, row["snapshot_version"], row["version"]),
+            )
+        ]
+    return {**dict(row), "patches": patches}
+
+
+def list_session_journal(session_id: str) -> List[Dict[str, Any]]:
+    """某会话的全部增量（seq / state / patch / created_at），按 seq 升序。"""
+    with get_conn() as conn:
+        rows = conn.execute(
+            "SELECT seq, state, patch, created_at FROM session_journal WHERE session_id = ? ORDER BY seq",
+            (session_id,),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def journal_table_stats() -> Dict[str, int]:
+    """增量日志的条目数与 patch 总字节数。"""
+    with get_conn() as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) AS n, COALESCE(SUM(LENGTH(patch)), 0) AS bytes FROM session_journal"
+        ).fetchone()
+    return {"entries": int(row["n"]), "bytes": int(row["bytes"])}
+
+
+def get_session_version(session_id: str) -> Optional[int]:
+    """只读版本号（不取 session_data），用于校验会话缓存；会话不存在时返回 None。"""
+    with get_conn() as conn:
+        row = conn.execute("SELECT version FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    return int(row["version"]) if row else None
 
 
 def delete_session(session_id: str) -> None:
-    """Delete an orchestrator session."""
+    """Delete an orchestrator session with its journal and blob references (blobs themselves are left to GC)."""
     with get_conn() as conn:
         conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        conn.execute("DELETE FROM session_journal WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM session_blobs WHERE session_id = ?", (session_id,))
+
+
+def get_blob(blob_hash: str) -> Optional[Tuple[str, bytes]]:
+    """按内容哈希读取 blob，返回 (codec, data) 或 None。"""
+    with get_conn() as conn:
+        row = conn.execute("SELECT codec, data FROM blobs WHERE hash = ?", (blob_hash,)).fetchone()
+    return (row["codec"], bytes(row["data"])) if row else None
+
+
+def gc_orphan_blobs() -> int:
+    """删除没有任何会话引用的 blob，返回删除数量。"""
+    with get_conn() as conn:
+        cur = conn.execute(
+            "DELETE FROM blobs WHERE NOT EXISTS (SELECT 1 FROM session_blobs sb WHERE sb.hash = blobs.hash)"
+        )
+        return cur.rowcount
+
+
+def blob_table_stats() -> Dict[str, int]:
+    """blob 表的条目数、原始总字节数与压缩后总字节数。"""
+    with get_conn() as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS raw, COALESCE(SUM(LENGTH(data)), 0) AS stored FROM blobs"
+        ).fetchone()
+    return {"count": int(row["n"]), "raw_bytes": int(row["raw"]), "stored_bytes": int(row["stored"])}
 
 
 def cleanup_expired_sessions(ttl_seconds: int) -> int:
@@ -263,11 +1024,19 @@ def cleanup_expired_sessions(ttl_seconds: int) -> int:
         if not expired_ids:
             return 0
 
-        # Delete expired sessions
+        # Delete expired sessions (with their journal and blob references)
         conn.executemany(
             "DELETE FROM sessions WHERE id = ?",
             [(sid,) for sid in expired_ids],
         )
+        conn.executemany(
+            "DELETE FROM session_journal WHERE session_id = ?",
+            [(sid,) for sid in expired_ids],
+        )
+        conn.executemany(
+            "DELETE FROM session_blobs WHERE session_id = ?",
+            [(sid,) for sid in expired_ids],
+        )
 
         # Archive related active conversations → mark as 'expired'
         conn.executemany(
@@ -280,3 +1049,241 @@ def cleanup_expired_sessions(ttl_seconds: int) -> int:
 
     return len(expired_ids)
 
+
+# ---------------------------------------------------------------------------
+# 后台任务（jobs / job_events）
+# ---------------------------------------------------------------------------
+
+_JOB_TERMINAL = ("done", "error", "interrupted")
+
+
+def create_job(job_id: str, session_id: Optional[str], request: str, owner: str) -> None:
+    """登记一个排队中的任务；``owner`` 为执行它的进程（``host:pid``）。"""
+    with get_conn() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, session_id, status, request, owner) VALUES (?, ?, 'queued', ?, ?)",
+            (job_id, session_id, request, owner),
+        )
+
+
+def set_job_status(job_id: str, status: str, error: Optional[str] = None) -> None:
+    with get_conn() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = datetime('now', 'localtime') WHERE id = ?",
+            (status, error, job_id),
+        )
+
+
+def append_job_event(job_id: str, seq: int, event_type: str, data: str) -> None:
+    """追加一条事件（seq 由调用方按任务递增分配）。"""
+    with get_conn() as conn:
+        conn.execute(
+            "INSERT INTO job_events (job_id, seq, type, data) VALUES (?, ?, ?, ?)",
+            (job_id, seq, event_type, data),
+        )
+        conn.execute(
+            "UPDATE jobs SET last_seq = ?, updated_at = datetime('now', 'localtime') WHERE id = ?",
+            (seq, job_id),
+        )
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with get_conn() as conn:
+        row = conn.execute(
+            "SELECT id, session_id, status, error, last_seq, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def list_job_events(job_id: str, after_seq: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """返回 seq > ``after_seq`` 的事件（升序），data 为 JSON 文本。"""
+    sql = "SELECT seq, type, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq"
+    params: Tuple[Any, ...] = (job_id, after_seq)
+    if limit is not None:
+        sql += " LIMIT ?"
+        params += (limit,)
+    with get_conn() as conn:
+        return [dict(r) for r in conn.execute(sql, params)]
+
+
+def get_job_result(job_id: str) -> Optional[Dict[str, Any]]:
+    """任务最后一条 final / error 事件（seq、type、data 文本）；尚未产生时返回 None。"""
+    with get_conn() as conn:
+        row = conn.execute(
+            """
+            SELECT seq, type, data FROM job_events
+            WHERE job_id = ? AND type IN ('final', 'error') ORDER BY seq DESC LIMIT 1
+            """,
+            (job_id,),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def list_unfinished_jobs() -> List[Tuple[str, str]]:
+    """仍为 queued / running 的任务 (id, owner)。"""
+    with get_conn() as conn:
+        return [
+            (r["id"], r["owner"] or "")
+            for r in conn.execute("SELECT id, owner FROM jobs WHERE status IN ('queued', 'running')")
+        ]
+
+
+def cleanup_finished_jobs(ttl_seconds: int) -> int:
+    """删除结束超过 ``ttl_seconds`` 的任务及其事件，返回删除的任务数。"""
+    if ttl_seconds <= 0:
+        return 0
+    placeholders = ", ".join("?" for _ in _JOB_TERMINAL)
+    with get_conn() as conn:
+        ids = [
+            r["id"]
+            for r in conn.execute(
+                f"""
+                SELECT id FROM jobs
+                WHERE status IN ({placeholders}) AND updated_at < datetime('now', 'localtime', ? || ' seconds')
+                """,
+                (*_JOB_TERMINAL, str(-ttl_seconds)),
+            )
+        ]
+        conn.executemany("DELETE FROM job_events WHERE job_id = ?", [(i,) for i in ids])
+        conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in ids])
+    return len(ids)
+
+
+# ---------------------------------------------------------------------------
+# 链路追踪（spans）
+# ---------------------------------------------------------------------------
+
+_SPAN_COLUMNS = "span_id, parent_id, name, phase, kind, start_us, duration_us, status, task, attrs"
+
+
+def insert_trace(trace: Dict[str, Any]) -> None:
+    """写入一个结束的 trace（``tracing.Trace.to_dict`` 格式），同一事务内批量插入全部 span。"""
+    attrs_extra = {"dropped_spans": trace["dropped"]} if trace.get("dropped") else {}
+    rows = [
+        (
+            trace["trace_id"], s["span_id"], s["parent_id"], s["name"], s["phase"], s["kind"],
+            s["start_us"], s["duration_us"], s["status"], s["task"],
+            json.dumps({**s["attrs"], **(attrs_extra if s["parent_id"] is None else {})}, ensure_ascii=False),
+            trace["started_at"],
+        )
+        for s in trace["spans"]
+    ]
+    with get_conn() as conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO spans (trace_id, {_SPAN_COLUMNS}, started_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+def load_trace(trace_id: str) -> Optional[Dict[str, Any]]:
+    """按 id 读取 trace，结构与 ``tracing.Trace.to_dict`` 一致；不存在时返回 None。"""
+    with get_conn() as conn:
+        rows = conn.execute(
+            f"SELECT {_SPAN_COLUMNS}, started_at FROM spans WHERE trace_id = ? ORDER BY start_us",
+            (trace_id,),
+        ).fetchall()
+    if not rows:
+        return None
+    spans = []
+    for r in rows:
+        item = dict(r)
+        item["attrs"] = json.loads(item["attrs"] or "{}")
+        spans.append(item)
+    root = next((s for s in spans if s["parent_id"] is None), spans[0])
+    return {
+        "trace_id": trace_id,
+        "name": root["name"],
+        "started_at": rows[0]["started_at"],
+        "duration_ms": root["duration_us"] // 1000,
+        "status": root["status"],
+        "attrs": {k: v for k, v in root["attrs"].items() if k != "dropped_spans"},
+        "dropped": int(root["attrs"].get("dropped_spans", 0)),
+        "spans": [{k: v for k, v in s.items() if k != "started_at"} for s in spans],
+    }
+
+
+def list_traces(limit: int = 20) -> List[Dict[str, Any]]:
+    """最近的 trace 摘要（按开始时间倒序），来自各根 span。"""
+    with get_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT r.trace_id, r.name, r.started_at, r.duration_us, r.status, r.attrs,
+                   (SELECT COUNT(*) FROM spans s WHERE s.trace_id = r.trace_id) AS spans
+            FROM spans r
+            WHERE r.parent_id IS NULL
+            ORDER BY r.started_at DESC
+            LIMIT ?
+            """,
+            (limit,),
+        ).fetchall()
+    return [
+        {
+            "trace_id": r["trace_id"],
+            "name": r["name"],
+            "started_at": r["started_at"],
+            "duration_ms": r["duration_us"] // 1000,
+            "status": r["status"],
+            "attrs": json.loads(r["attrs"] or "{}"),
+            "spans": r["spans"],
+        }
+        for r in rows
+    ]
+
+
+def cleanup_old_spans(ttl_seconds: int) -> int:
+    """删除开始超过 ``ttl_seconds`` 的 trace 的全部 span，返回删除的行数。"""
+    if ttl_seconds <= 0:
+        return 0
+    with get_conn() as conn:
+        cur = conn.execute(
+            "DELETE FROM spans WHERE started_at < datetime('now', 'localtime', ? || ' seconds')",
+            (str(-ttl_seconds),),
+        )
+    return cur.rowcount
+
+
+# ---------------------------------------------------------------------------
+# Async API（供事件循环中的调用方使用，SQL 在 DB 线程池中执行）
+# ---------------------------------------------------------------------------
+
+async def create_conversation_async(conv_id: str, intent: str, status: str = "active") -> None:
+    await run_db(create_conversation, conv_id, intent, status)
+
+
+async def update_conversation_status_async(conv_id: str, status: str) -> None:
+    await run_db(update_conversation_status, conv_id, status)
+
+
+async def add_message_async(conv_id: str, role: str, payload_type: str, content: str) -> None:
+    await run_db(add_message, conv_id, role, payload_type, content)
+
+
+async def get_conversation_async(conv_id: str) -> Optional[Dict[str, Any]]:
+    return await run_db(get_conversation, conv_id)
+
+
+async def list_conversations_async(
+    limit: int = 20, offset: int = 0, after: Optional[Tuple[str, str]] = None
+) -> List[Dict[str, Any]]:
+    return await run_db(list_conversations, limit, offset, after)
+
+
+async def save_session_async(session_id: str, state: str, session_data: str) -> int:
+    return await run_db(save_session, session_id, state, session_data)
+
+
+async def gc_orphan_blobs_async() -> int:
+    return await run_db(gc_orphan_blobs)
+
+
+async def load_session_async(session_id: str) -> Optional[Dict[str, Any]]:
+    return await run_db(load_session, session_id)
+
+
+async def get_session_version_async(session_id: str) -> Optional[int]:
+    return await run_db(get_session_version, session_id)
+
+
+async def cleanup_expired_sessions_async(ttl_seconds: int) -> int:
+    return await run_db(cleanup_expired_sessions, ttl_seconds)
@@ -0,0 +1,139 @@
+"""托管执行器：把阻塞 I/O 与 CPU 密集操作移出事件循环。
+
+async 处理函数里的同步操作（PyMuPDF 抽图、图片读取 + base64、KB 文本上的正则扫描、草稿 / 终稿 Markdown
+渲染、上传文件写盘）每次都会卡住所有并发的 SSE 流。这里提供两个按配置定尺寸的执行器：
+
+- :data:`io`：线程池（``RS_AGENT_IO_EXECUTOR_WORKERS``），文件读写等阻塞 I/O；
+- :data:`cpu`：线程池或进程池（``RS_AGENT_CPU_EXECUTOR_KIND``，``RS_AGENT_CPU_EXECUTOR_WORKERS``），
+  正则扫描、渲染、抽图。进程池需要函数与参数可 pickle，子进程中的 span 不会进入当前 trace。
+
+``await io.run(fn, *args)``：每个执行器同时提交的调用数不超过 ``workers + RS_AGENT_EXECUTOR_MAX_QUEUE``，
+超出时调用方在事件循环上等待（背压），不会在线程池内无限排队。排队时间与执行时间计入 ``backend.metrics``；
+线程池中执行时沿用调用方的 contextvars，函数内的 span 仍挂在当前 trace 上。DB 调用另有专用线程池
+（``db.run_db``，与连接池同尺寸）。应用退出时 :func:`shutdown` 关闭全部执行器，之后再用会按需重建。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import multiprocessing
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from backend import metrics
+from backend.config import settings
+
+T = TypeVar("T")
+
+
+def _call_timed(fn: Callable[..., T], args: tuple, kwargs: dict) -> Tuple[T, int]:
+    """在工作线程 / 子进程中执行，连同开始时刻一起返回（Linux 下 perf_counter 跨进程可比）。"""
+    started = time.perf_counter_ns()
+    return fn(*args, **kwargs), started
+
+
+class ManagedExecutor:
+    """按需创建的线程池 / 进程池，带提交上限与统计。"""
+
+    def __init__(self, name: str, workers: Callable[[], int], kind: Callable[[], str] = lambda: "thread") -> None:
+        self.name = name
+        self._workers_fn = workers
+        self._kind_fn = kind
+        self._lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.Executor] = None
+        self._kind = "thread"
+        self._workers = 0
+        self._slots: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+        self._in_flight = 0
+        self._stats = {"submitted": 0, "completed": 0, "errors": 0, "backpressure_waits": 0, "max_in_flight": 0}
+
+    def _get(self) -> concurrent.futures.Executor:
+        executor = self._executor
+        if executor is not None:
+            return executor
+        with self._lock:
+            if self._executor is None:
+                self._workers = max(1, int(self._workers_fn()))
+                self._kind = "process" if self._kind_fn() == "process" else "thread"
+                if self._kind == "process":
+                    self._executor = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self._workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                else:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self._workers, thread_name_prefix=f"rs-agent-{self.name}"
+                    )
+            return self._executor
+
+    def _slot(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots[0] is not loop:
+            self._slots = (loop, asyncio.Semaphore(self._workers + max(0, settings.executor_max_queue)))
+        return self._slots[1]
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """在执行器中执行同步函数 ``fn``，事件循环只等待结果。"""
+        executor = self._get()
+        slot = self._slot()
+        if slot.locked():
+            self._stats["backpressure_waits"] += 1
+        name = getattr(fn, "__name__", "call")
+        async with slot:
+            self._in_flight += 1
+            self._stats["submitted"] += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._in_flight)
+            if settings.metrics_enabled:
+                metrics.EXECUTOR_IN_FLIGHT.inc(self.name)
+            submitted = time.perf_counter_ns()
+            if self._kind == "process":
+                call = functools.partial(_call_timed, fn, args, kwargs)
+            else:
+                call = functools.partial(_call_timed, contextvars.copy_context().run, (fn, *args), kwargs)
+            try:
+                result, started = await asyncio.get_running_loop().run_in_executor(executor, call)
+            except BaseException:
+                self._stats["errors"] += 1
+                raise
+            finally:
+                self._in_flight -= 1
+                if settings.metrics_enabled:
+                    metrics.EXECUTOR_IN_FLIGHT.dec(self.name)
+            self._stats["completed"] += 1
+            ended = time.perf_counter_ns()
+            metrics.observe_executor(self.name, name, max(0, started - submitted) / 1e9, max(0, ended - started) / 1e9)
+            return result
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._slots = None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self._kind if self._executor is not None else self._kind_fn(),
+            "workers": self._workers if self._executor is not None else max(1, int(self._workers_fn())),
+            "max_queue": settings.executor_max_queue,
+            "started": self._executor is not None,
+            "in_flight": self._in_flight,
+            **self._stats,
+        }
+
+
+io = ManagedExecutor("io", lambda: settings.io_executor_workers)
+cpu = ManagedExecutor("cpu", lambda: settings.cpu_executor_workers, lambda: settings.cpu_executor_kind)
+
+
+def stats() -> Dict[str, Any]:
+    return {"io": io.stats(), "cpu": cpu.stats()}
+
+
+def shutdown(wait: bool = True) -> None:
+    """关闭全部执行器（应用退出时调用；之后再次使用会按需重建）。"""
+    io.shutdown(wait)
+    cpu.shutdown(wait)
@@ -0,0 +1,248 @@
+"""事件循环延迟监控与阻塞调用定位。
+
+async 处理函数里仍有同步操作（SQLite 调用、PyMuPDF 抽图、``Path.write_bytes``、图片 base64 编码、
+``render_final`` 等），每一次都会卡住所有并发的 SSE 流。:class:`LoopMonitor` 由两部分组成：
+
+- 事件循环上的心跳协程：每 ``RS_AGENT_LOOP_MONITOR_INTERVAL_MS`` sleep 一次，实际唤醒与预期的差值即
+  事件循环延迟（计入 ``rs_agent_event_loop_lag_seconds``）；
+- 看门狗线程：发现心跳迟到超过 ``RS_AGENT_LOOP_BLOCK_THRESHOLD_MS`` 时，事件循环**仍卡在**阻塞代码里，
+  此时用 ``sys._current_frames()`` 抓取事件循环线程的调用栈与当前任务名。
+
+心跳恢复后按实际阻塞时长记一次阻塞：以调用栈中最内层的本项目代码行为调用点聚合（次数、总 / 最长耗时、
+最近一次的调用栈），经 ``GET /api/diagnostics/loop`` 与 ``rs_agent_event_loop_blocks_total{site}`` 输出。
+检测精度约为一个心跳间隔。
+
+测试中用 :func:`fail_on_block` 包住被测代码：期间事件循环被阻塞超过阈值即抛 :class:`LoopBlockedError`。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from backend import metrics
+from backend.config import settings
+
+_ROOT = Path(__file__).resolve().parent.parent
+_SKIP_DIRS = ("site-packages", ".venv", "dist-packages")
+_STACK_DEPTH = 12
+_MAX_SITES = 100
+_LAG_WINDOW = 1000
+
+
+class LoopBlockedError(AssertionError):
+    """:func:`fail_on_block` 期间事件循环被阻塞超过阈值。"""
+
+
+def _relpath(filename: str) -> Optional[str]:
+    """本项目内的源文件返回相对路径，第三方 / 标准库返回 None。"""
+    try:
+        rel = Path(filename).resolve().relative_to(_ROOT)
+    except ValueError:
+        return None
+    if any(part in _SKIP_DIRS for part in rel.parts):
+        return None
+    return rel.as_posix()
+
+
+def _describe_stack(frame) -> Tuple[str, List[str]]:
+    """(调用点, 调用栈)：调用点取最内层的本项目代码行，调用栈为最内层的若干帧（外到内）。"""
+    site: Optional[str] = None
+    leaf: Optional[str] = None
+    stack: List[str] = []
+    this_file = Path(__file__).resolve().as_posix()
+    while frame is not None:
+        code = frame.f_code
+        rel = _relpath(code.co_filename)
+        where = f"{rel or code.co_filename}:{frame.f_lineno} in {code.co_name}"
+        if leaf is None:
+            leaf = where
+        if site is None and rel is not None and Path(code.co_filename).resolve().as_posix() != this_file:
+            site = where
+        if len(stack) < _STACK_DEPTH:
+            stack.append(where)
+        frame = frame.f_back
+    stack.reverse()
+    return site or leaf or "unknown", stack
+
+
+class LoopMonitor:
+    """``run()`` 作为后台任务运行在被监控的事件循环上；``stats()`` 可在任意线程调用。"""
+
+    def __init__(self, interval_ms: Optional[float] = None, threshold_ms: Optional[float] = None) -> None:
+        self._interval_ms = interval_ms
+        self._threshold_ms = threshold_ms
+        self._configure()
+        self._lock = threading.Lock()
+        self._beat = 0.0
+        self._loop_thread: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 看门狗抓到的 (心跳时刻, 调用点, 调用栈, 任务名)
+        self._captured: Optional[Tuple[float, str, List[str], Optional[str]]] = None
+        self._lags: Deque[float] = deque(maxlen=_LAG_WINDOW)
+        self._window_max = 0.0
+        self._sites: Dict[str, Dict[str, Any]] = {}
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=20)
+        self.blocks = 0
+        self.uncaptured = 0
+        self.running = False
+
+    def _configure(self) -> None:
+        """未显式指定的间隔 / 阈值取当前配置（全局实例在 import 时创建，启动时再读一次）。"""
+        interval_ms = self._interval_ms if self._interval_ms is not None else settings.loop_monitor_interval_ms
+        threshold_ms = self._threshold_ms if self._threshold_ms is not None else settings.loop_block_threshold_ms
+        self.interval = max(1.0, interval_ms) / 1000
+        self.threshold = max(1.0, threshold_ms) / 1000
+
+    # -- 事件循环侧 -------------------------------------------------------------------
+
+    async def run(self) -> None:
+        self._configure()
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.perf_counter()
+        stop = threading.Event()
+        watchdog = threading.Thread(target=self._watch, args=(stop,), name="rs-agent-loop-watchdog", daemon=True)
+        watchdog.start()
+        self.running = True
+        try:
+            while True:
+                expected = time.perf_counter() + self.interval
+                await asyncio.sleep(self.interval)
+                self._on_beat(time.perf_counter(), expected)
+        finally:
+            self.running = False
+            stop.set()
+            watchdog.join(timeout=1.0)
+
+    def _on_beat(self, now: float, expected: float) -> None:
+        lag = max(0.0, now - expected)
+        prev_beat, self._beat = self._beat, now
+        with self._lock:
+            self._lags.append(lag)
+            self._window_max = max(self._window_max, lag)
+        if settings.metrics_enabled:
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+        if lag < self.threshold:
+            return
+        captured = self._captured
+        if captured is not None and captured[0] == prev_beat:
+            _, site, stack, task = captured
+        else:
+            site, stack, task = "unknown", [], None
+        self._record_block(lag, site, stack, task)
+
+    def _record_block(self, lag: float, site: str, stack: List[str], task: Optional[str]) -> None:
+        ms = round(lag * 1000, 2)
+        with self._lock:
+            self.blocks += 1
+            if site == "unknown":
+                self.uncaptured += 1
+            if site not in self._sites and len(self._sites) >= _MAX_SITES:
+                site = "other"
+            entry = self._sites.setdefault(site, {"site": site, "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] = round(entry["total_ms"] + ms, 2)
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["last_task"] = task
+            entry["last_stack"] = stack
+            entry["last_at"] = time.time()
+            self._recent.append({"site": site, "ms": ms, "task": task, "at": entry["last_at"]})
+        if settings.metrics_enabled:
+            metrics.LOOP_BLOCKS.inc(site)
+            metrics.LOOP_BLOCK_SECONDS.observe(lag)
+
+    # -- 看门狗线程 --------------------------------------------------------------------
+
+    def _watch(self, stop: threading.Event) -> None:
+        poll = max(0.002, min(self.interval, self.threshold / 4))
+        while not stop.wait(poll):
+            beat = self._beat
+            late = time.perf_counter() - (beat + self.interval)
+            if late < self.threshold or (self._captured is not None and self._captured[0] == beat):
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            site, stack = _describe_stack(frame)
+            del frame
+            task = None
+            try:
+                current = asyncio.current_task(self._loop)
+                task = current.get_name() if current is not None else None
+            except RuntimeError:
+                pass
+            self._captured = (beat, site, stack, task)
+
+    # -- 读取 --------------------------------------------------------------------------
+
+    def take_window_max(self) -> float:
+        """自上次调用以来的最大延迟（秒），供指标按刷新周期输出。"""
+        with self._lock:
+            value, self._window_max = self._window_max, 0.0
+        return value
+
+    def sites(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return sorted((dict(e) for e in self._sites.values()), key=lambda e: e["total_ms"], reverse=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lags = sorted(self._lags)
+            recent = list(self._recent)
+
+        def pct(p: float) -> Optional[float]:
+            if not lags:
+                return None
+            return round(lags[min(len(lags) - 1, int(p * len(lags)))] * 1000, 2)
+
+        return {
+            "running": self.running,
+            "interval_ms": round(self.interval * 1000, 2),
+            "threshold_ms": round(self.threshold * 1000, 2),
+            "lag_ms": {"p50": pct(0.50), "p99": pct(0.99), "max": round(lags[-1] * 1000, 2) if lags else None, "samples": len(lags)},
+            "blocks": self.blocks,
+            "uncaptured": self.uncaptured,
+            "sites": self.sites(),
+            "recent": recent,
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._lags.clear()
+            self._window_max = 0.0
+            self._sites.clear()
+            self._recent.clear()
+            self.blocks = 0
+            self.uncaptured = 0
+
+
+monitor = LoopMonitor()
+
+
+@asynccontextmanager
+async def fail_on_block(max_ms: Optional[float] = None) -> AsyncIterator[LoopMonitor]:
+    """测试用：期间事件循环被阻塞超过 ``max_ms``（默认 ``RS_AGENT_LOOP_BLOCK_FAIL_MS``）即抛 :class:`LoopBlockedError`。"""
+    threshold = max_ms if max_ms is not None else settings.loop_block_fail_ms
+    guard = LoopMonitor(interval_ms=max(1.0, min(5.0, threshold / 4)), threshold_ms=threshold)
+    task = asyncio.ensure_future(guard.run())
+    await asyncio.sleep(0)
+    try:
+        yield guard
+        # 让心跳在被测代码结束后至少再醒一次，以记录结尾处的阻塞
+        await asyncio.sleep(guard.interval * 2)
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    if guard.blocks:
+        worst = ", ".join(f"{s['site']} ({s['max_ms']} ms)" for s in guard.sites()[:5])
+        raise LoopBlockedError(f"事件循环被阻塞 {guard.blocks} 次（阈值 {threshold} ms）：{worst}")
@@ -0,0 +1,468 @@
+"""Prometheus 文本格式指标（仅标准库）：``GET /metrics``。
+
+此前唯一的耗时数据是 ``messages`` 表里 ``payload_type=TRACE`` 的 JSON，无法被采集。这里提供最小的
+Counter / Gauge / Histogram（带标签），记录一次只是一次字典查找、一次二分与几次加法；数据来源：
+
+- pipeline 各阶段（INTENT / KB / COLLECT / BUILD_DRAFT / CONFIRM / DEFEND / EDITOR）与整轮耗时、
+  LLM 调用耗时与 token、KB 子进程次数与耗时：监听 :mod:`backend.tracing` 的 span 结束事件，不再额外埋点；
+- DB 调用耗时与线程池排队时间：``db.run_db``；移出事件循环的阻塞 / CPU 操作：``backend.executors``；
+- 会话缓存命中 / 未命中：采集时读取 ``session_cache`` 计数，另按合并后的计数给出命中率；
+- 事件循环延迟与阻塞次数（按调用点）：由 :mod:`backend.loop_monitor` 的心跳与看门狗记录；
+- 被取消的请求（按原因）与因此停止的工作（按类型）：:mod:`backend.request_scope`；KB_QUERY 延迟预算决策：
+  :mod:`backend.services.kb_budget`；KB_QUERY 按模式与答案缓存结果的次数：:mod:`backend.services.kb_modes`；
+  渐进检索跳过的子问题数（按原因）：:mod:`backend.services.kb_query_enhanced`；
+- 进行中的 SSE 流数。
+
+多 worker：设置 ``RS_AGENT_METRICS_DIR`` 后，各进程每 ``RS_AGENT_METRICS_FLUSH_SECONDS`` 把自己的指标写入
+``<dir>/metrics-<host>-<pid>.json``（先写临时文件再原子替换），``/metrics`` 由任一 worker 合并目录下全部文件：
+计数器与直方图求和（已退出进程的累计值保留），gauge 按其模式求和或取最大值且只计存活进程。
+目录应在每次部署 / 重启整个服务时清空。未设置时只输出本进程指标。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import json
+import logging
+import os
+import socket
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from backend import tracing
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+PIPELINE_PHASES = ("INTENT", "KB", "COLLECT", "BUILD_DRAFT", "CONFIRM", "DEFEND", "EDITOR")
+
+_LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[_LabelValues, Any] = {}
+
+    def _key(self, labelvalues: Sequence[Any]) -> _LabelValues:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labelvalues!r}")
+        return tuple(str(v) for v in labelvalues)
+
+    def snapshot(self) -> Dict[_LabelValues, Any]:
+        with self._lock:
+            return {k: (list(v) if isinstance(v, list) else v) for k, v in self._values.items()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues: Any, amount: float = 1.0) -> None:
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, *labelvalues: Any) -> None:
+        """由采集函数直接写入累计值（数据源本身已在计数时使用）。"""
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), mode: str = "sum") -> None:
+        super().__init__(name, documentation, labelnames)
+        self.mode = mode  # 多 worker 合并方式：sum / max
+
+    def set(self, value: float, *labelvalues: Any) -> None:
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, *labelvalues: Any, amount: float = 1.0) -> None:
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, *labelvalues: Any, amount: float = 1.0) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues: Any) -> None:
+        key = self._key(labelvalues)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # 各桶（非累计）计数 + 溢出桶，之后是 sum、count
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            entry[idx] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._derived: List[Callable[[Dict[str, Dict[str, Any]]], Iterable[str]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), mode: str = "sum") -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, mode))  # type: ignore[return-value]
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))  # type: ignore[return-value]
+
+    def add_collector(self, fn: Callable[[], None]) -> None:
+        """采集前调用，用于把其它模块的计数同步到指标中。"""
+        self._collectors.append(fn)
+
+    def add_derived(self, fn: Callable[[Dict[str, Dict[str, Any]]], Iterable[str]]) -> None:
+        """渲染时基于合并后的数据额外输出的行（如命中率）。"""
+        self._derived.append(fn)
+
+    def collect(self) -> None:
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception:
+                logger.exception("Metrics collector failed")
+
+    def dump(self, include_gauges: bool = True) -> Dict[str, Dict[str, Any]]:
+        """本进程指标的可 JSON 序列化快照：``{name: {kind, help, labels, mode, buckets, samples}}``。"""
+        self.collect()
+        out: Dict[str, Dict[str, Any]] = {}
+        for m in self._metrics.values():
+            if m.kind == "gauge" and not include_gauges:
+                continue
+            out[m.name] = {
+                "kind": m.kind,
+                "help": m.documentation,
+                "labels": list(m.labelnames),
+                "mode": getattr(m, "mode", None),
+                "buckets": list(getattr(m, "buckets", ())),
+                "samples": [[list(k), v] for k, v in m.snapshot().items()],
+            }
+        return out
+
+    def reset(self) -> None:
+        for m in self._metrics.values():
+            m.clear()
+
+    def render(self, dumps: Sequence[Dict[str, Dict[str, Any]]]) -> str:
+        merged = merge(dumps)
+        lines: List[str] = []
+        for name, m in merged.items():
+            lines.append(f"# HELP {name} {m['help']}")
+            lines.append(f"# TYPE {name} {m['kind']}")
+            labels = m["labels"]
+            for key, value in sorted(m["samples"].items()):
+                if m["kind"] != "histogram":
+                    lines.append(f"{name}{_format_labels(labels, key)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip([*m["buckets"], float("inf")], value[:-2]):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{name}_bucket{_format_labels(labels, key, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels, key)} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels, key)} {value[-1]}")
+        for fn in self._derived:
+            lines.extend(fn(merged))
+        return "\n".join(lines) + "\n"
+
+
+def merge(dumps: Sequence[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """合并多个进程的快照：counter / histogram 求和，gauge 按 mode 求和或取最大。"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for dump in dumps:
+        for name, m in dump.items():
+            target = merged.setdefault(name, {**{k: v for k, v in m.items() if k != "samples"}, "samples": {}})
+            samples = target["samples"]
+            for key, value in m["samples"]:
+                key = tuple(key)
+                if key not in samples:
+                    samples[key] = list(value) if isinstance(value, list) else value
+                elif m["kind"] == "histogram":
+                    samples[key] = [a + b for a, b in zip(samples[key], value)]
+                elif m["kind"] == "gauge" and m.get("mode") == "max":
+                    samples[key] = max(samples[key], value)
+                else:
+                    samples[key] = samples[key] + value
+    return merged
+
+
+registry = Registry()
+
+PHASE_SECONDS = registry.histogram(
+    "rs_agent_phase_duration_seconds", "Pipeline phase latency (seconds).", ("phase",)
+)
+PIPELINE_SECONDS = registry.histogram(
+    "rs_agent_pipeline_duration_seconds", "Whole pipeline turn latency including streaming (seconds).", ("status",)
+)
+LLM_SECONDS = registry.histogram(
+    "rs_agent_llm_request_duration_seconds", "LLM chat call latency incl. retries and hedging (seconds).",
+    ("stage", "model", "status"),
+)
+LLM_TOKENS = registry.counter(
+    "rs_agent_llm_tokens_total", "LLM tokens reported by the API.", ("stage", "model", "kind")
+)
+LLM_HEDGES = registry.counter("rs_agent_llm_hedges_total", "Backup LLM requests issued by hedging.", ("stage",))
+KB_SECONDS = registry.histogram(
+    "rs_agent_kb_subprocess_duration_seconds", "KB script (run_all_sources.py) subprocess latency (seconds).",
+    ("status",),
+)
+DB_SECONDS = registry.histogram(
+    "rs_agent_db_call_duration_seconds", "DB call execution time in the DB thread pool (seconds).", ("fn",),
+    buckets=FAST_BUCKETS,
+)
+DB_WAIT_SECONDS = registry.histogram(
+    "rs_agent_db_pool_wait_seconds", "Time DB calls waited for a DB thread (seconds).", buckets=FAST_BUCKETS
+)
+CACHE_REQUESTS = registry.counter(
+    "rs_agent_cache_requests_total", "Cache lookups by result.", ("cache", "result")
+)
+LOOP_LAG_SECONDS = registry.histogram(
+    "rs_agent_event_loop_lag_seconds", "Event loop scheduling lag (seconds).", buckets=FAST_BUCKETS
+)
+LOOP_LAG_MAX = registry.gauge(
+    "rs_agent_event_loop_lag_max_seconds", "Largest event loop lag since the previous flush (seconds).", mode="max"
+)
+LOOP_BLOCK_SECONDS = registry.histogram(
+    "rs_agent_event_loop_block_seconds", "Duration of event loop blocks above the threshold (seconds).", buckets=LATENCY_BUCKETS
+)
+LOOP_BLOCKS = registry.counter(
+    "rs_agent_event_loop_blocks_total", "Event loop blocks above the threshold by call site.", ("site",)
+)
+EXECUTOR_SECONDS = registry.histogram(
+    "rs_agent_executor_call_duration_seconds", "Offloaded call execution time by executor (seconds).", ("pool", "fn"),
+    buckets=FAST_BUCKETS,
+)
+EXECUTOR_WAIT_SECONDS = registry.histogram(
+    "rs_agent_executor_queue_wait_seconds", "Time offloaded calls waited for a worker (seconds).", ("pool",),
+    buckets=FAST_BUCKETS,
+)
+EXECUTOR_IN_FLIGHT = registry.gauge(
+    "rs_agent_executor_in_flight", "Offloaded calls queued or running by executor.", ("pool",)
+)
+REQUESTS_CANCELLED = registry.counter(
+    "rs_agent_requests_cancelled_total", "Requests cancelled before completion by reason.", ("reason",)
+)
+CANCELLED_WORK = registry.counter(
+    "rs_agent_cancelled_work_total", "In-flight work stopped or skipped by request cancellation / deadline.", ("kind",)
+)
+KB_BUDGET_DECISIONS = registry.counter(
+    "rs_agent_kb_budget_decisions_total", "KB_QUERY latency budget decisions (skipped / cut-short steps).", ("decision",)
+)
+KB_QUERIES = registry.counter(
+    "rs_agent_kb_queries_total", "KB_QUERY requests by mode and answer-cache outcome.", ("mode", "cache")
+)
+KB_SUBQUERIES_SKIPPED = registry.counter(
+    "rs_agent_kb_subqueries_skipped_total", "KB_QUERY sub-queries skipped by progressive retrieval.", ("reason",)
+)
+SSE_IN_FLIGHT = registry.gauge("rs_agent_sse_streams_in_flight", "SSE responses currently streaming.")
+
+
+# ---------------------------------------------------------------------------
+# Sources
+# ---------------------------------------------------------------------------
+
+def _on_span(sp: tracing.Span) -> None:
+    if not settings.metrics_enabled:
+        return
+    name = sp.name
+    if name == "llm._chat":
+        stage, model = sp.attrs.get("stage", "default"), sp.attrs.get("model", "")
+        LLM_SECONDS.observe(sp.duration_ns / 1e9, stage, model, sp.status)
+        for kind in ("prompt", "completion"):
+            tokens = sp.attrs.get(f"{kind}_tokens")
+            if isinstance(tokens, int):
+                LLM_TOKENS.inc(stage, model, kind, amount=tokens)
+    elif name == "kb.subprocess":
+        ok = sp.status == "ok" and sp.attrs.get("returncode") == 0
+        KB_SECONDS.observe(sp.duration_ns / 1e9, "ok" if ok else "error")
+    elif name == "llm.hedge":
+        LLM_HEDGES.inc(sp.attrs.get("stage", "default"))
+    elif sp.trace is not None and sp.trace.root is not None and sp.kind == "span":
+        if sp is sp.trace.root:
+            PIPELINE_SECONDS.observe(sp.duration_ns / 1e9, sp.status)
+        elif sp.parent_id == sp.trace.root.span_id and sp.phase in PIPELINE_PHASES:
+            PHASE_SECONDS.observe(sp.duration_ns / 1e9, sp.phase)
+
+
+def observe_db(fn_name: str, wait_s: float, run_s: float) -> None:
+    if not settings.metrics_enabled:
+        return
+    DB_SECONDS.observe(run_s, fn_name)
+    DB_WAIT_SECONDS.observe(wait_s)
+
+
+def observe_executor(pool: str, fn_name: str, wait_s: float, run_s: float) -> None:
+    if not settings.metrics_enabled:
+        return
+    EXECUTOR_SECONDS.observe(run_s, pool, fn_name)
+    EXECUTOR_WAIT_SECONDS.observe(wait_s, pool)
+
+
+def _collect_caches() -> None:
+    from backend.services.session_cache import session_cache
+
+    st = session_cache.stats()
+    for result, key in (("hit", "hits"), ("miss", "misses"), ("stale", "stale"),
+                        ("shared_hit", "shared_hits"), ("shared_miss", "shared_misses")):
+        CACHE_REQUESTS.set_total(st.get(key, 0), "session", result)
+
+
+def _cache_hit_ratio(merged: Dict[str, Dict[str, Any]]) -> Iterable[str]:
+    samples = merged.get(CACHE_REQUESTS.name, {}).get("samples", {})
+    totals: Dict[str, List[float]] = {}
+    for (cache, result), value in samples.items():
+        t = totals.setdefault(cache, [0.0, 0.0])
+        t[1] += value
+        if result in ("hit", "shared_hit"):
+            t[0] += value
+    if not totals:
+        return []
+    name = "rs_agent_cache_hit_ratio"
+    lines = [f"# HELP {name} Cache hit ratio across all workers since start.", f"# TYPE {name} gauge"]
+    for cache, (hits, lookups) in sorted(totals.items()):
+        lines.append(f'{name}{{cache="{_escape(cache)}"}} {_format_value(round(hits / lookups, 4) if lookups else 0.0)}')
+    return lines
+
+
+tracing.add_listener(_on_span)
+registry.add_collector(_collect_caches)
+registry.add_derived(_cache_hit_ratio)
+
+
+# ---------------------------------------------------------------------------
+# Multi-worker files & background task
+# ---------------------------------------------------------------------------
+
+def _process_file(directory: Path) -> Path:
+    return directory / f"metrics-{socket.gethostname()}-{os.getpid()}.json"
+
+
+def _pid_alive(host: str, pid: int) -> bool:
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def flush(final: bool = False) -> Optional[Path]:
+    """把本进程指标写入多进程目录（未配置目录时不做任何事）。``final`` 时不写 gauge（进程即将退出）。"""
+    directory = settings.metrics_dir
+    if directory is None:
+        return None
+    directory.mkdir(parents=True, exist_ok=True)
+    path = _process_file(directory)
+    payload = {"host": socket.gethostname(), "pid": os.getpid(), "metrics": registry.dump(include_gauges=not final)}
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(payload, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp, path)
+    return path
+
+
+def _read_all(directory: Path) -> List[Dict[str, Dict[str, Any]]]:
+    dumps: List[Dict[str, Dict[str, Any]]] = []
+    own = _process_file(directory)
+    for path in sorted(directory.glob("metrics-*.json")):
+        if path == own:
+            continue
+        try:
+            payload = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        metrics = payload.get("metrics") or {}
+        if not _pid_alive(str(payload.get("host", "")), int(payload.get("pid", 0))):
+            metrics = {k: v for k, v in metrics.items() if v.get("kind") != "gauge"}
+        dumps.append(metrics)
+    return dumps
+
+
+def render() -> str:
+    """``/metrics`` 响应体：本进程实时指标 + 多进程目录中其它 worker 最近一次写入的指标。"""
+    dumps = [registry.dump()]
+    directory = settings.metrics_dir
+    if directory is not None and directory.is_dir():
+        dumps.extend(_read_all(directory))
+    return registry.render(dumps)
+
+
+async def run_background() -> None:
+    """定期输出事件循环最大延迟并写多进程文件（lifespan 中作为后台任务运行）。"""
+    from backend import executors
+    from backend.loop_monitor import monitor
+
+    flush_every = max(1.0, float(settings.metrics_flush_seconds))
+    while True:
+        await asyncio.sleep(flush_every)
+        LOOP_LAG_MAX.set(monitor.take_window_max())
+        if settings.metrics_dir is not None:
+            try:
+                await executors.io.run(flush)
+            except Exception:
+                logger.exception("Failed to write metrics file")
@@ -0,0 +1,495 @@
+"""按需对单次 ``/api/agent`` 请求做性能剖析（管理员授权）。
+
+线上某个请求慢时，span 只能告诉我们慢在哪个阶段，看不出时间花在事件循环里的哪段 Python 代码
+（正则扫描、JSON 编码……）还是在等 I/O。请求带上 ``X-Profile: cprofile|sample``（或查询参数
+``?profile=``）及 ``X-Profile-Key``（须等于 ``RS_AGENT_PROFILE_KEY``）时，这次请求在 :class:`Profile`
+中执行：
+
+- ``cprofile``：确定性剖析（``cProfile``），可下载 ``.pstats``（``python -m pstats`` / snakeviz 打开）；
+  speedscope 视图按「每个函数的自身耗时挂在其耗时最多的调用链上」近似还原；
+- ``sample``：后台线程按 ``RS_AGENT_PROFILE_SAMPLE_INTERVAL_MS`` 采样事件循环线程的调用栈，开销低，
+  可下载 speedscope JSON（停在 ``select`` 上的样本即事件循环在等 I/O）；
+- 两种模式都记录剖析期间创建的 asyncio 任务：墙钟耗时、在事件循环上实际执行的时间与单步最长耗时
+  （单步很长说明阻塞了事件循环），以及 ``tracemalloc`` 前后快照的分配差异 top-N。
+
+结果以 ID 保存在 ``RS_AGENT_PROFILE_DIR``（只保留最近 ``RS_AGENT_PROFILE_KEEP`` 个），经
+``GET /api/profiles/{id}``、``/pstats``、``/speedscope`` 下载。``cProfile``、任务工厂与 ``tracemalloc``
+都是进程级的：同一时刻只允许一个剖析，期间并发的其它请求也会被计入。未请求剖析时不安装任何钩子。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import collections.abc
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple, TypeVar
+
+from backend import executors
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+MODES = ("cprofile", "sample")
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_TASKS_MAX = 200
+_STACK_MAX_DEPTH = 128
+_SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+# 当前进行中的剖析（同一时刻只允许一个）
+_active: Optional["Profile"] = None
+_active_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """已有剖析在进行。"""
+
+
+def busy() -> bool:
+    return _active is not None
+
+
+def valid_id(profile_id: str) -> bool:
+    return bool(_ID_RE.match(profile_id or ""))
+
+
+def _profile_dir() -> Path:
+    return Path(settings.profile_dir)
+
+
+def _frame_key(code) -> Tuple[str, str, int]:
+    return code.co_name, code.co_filename, code.co_firstlineno
+
+
+class _TimedCoro(collections.abc.Coroutine):
+    """包装任务的协程：统计每一步 ``send`` / ``throw`` 在事件循环上的执行时间。"""
+
+    __slots__ = ("_coro", "name", "created_ns", "ended_ns", "busy_ns", "max_step_ns", "steps", "status")
+
+    def __init__(self, coro) -> None:
+        self._coro = coro
+        self.name = getattr(coro, "__qualname__", None) or type(coro).__name__
+        self.created_ns = time.perf_counter_ns()
+        self.ended_ns: Optional[int] = None
+        self.busy_ns = 0
+        self.max_step_ns = 0
+        self.steps = 0
+        self.status = "running"
+
+    def _step(self, fn, *args):
+        t0 = time.perf_counter_ns()
+        try:
+            return fn(*args)
+        except StopIteration:
+            self.status = "ok"
+            self.ended_ns = time.perf_counter_ns()
+            raise
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            self.ended_ns = time.perf_counter_ns()
+            raise
+        except BaseException:
+            self.status = "error"
+            self.ended_ns = time.perf_counter_ns()
+            raise
+        finally:
+            dt = time.perf_counter_ns() - t0
+            self.busy_ns += dt
+            self.steps += 1
+            if dt > self.max_step_ns:
+                self.max_step_ns = dt
+
+    def send(self, value):
+        return self._step(self._coro.send, value)
+
+    def throw(self, *args):
+        return self._step(self._coro.throw, *args)
+
+    def close(self):
+        return self._coro.close()
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    def __getattr__(self, name: str) -> Any:
+        # cr_frame / cr_await 等供 Task.get_stack() 与 repr 使用
+        return getattr(self._coro, name)
+
+    def to_dict(self, origin_ns: int) -> Dict[str, Any]:
+        end = self.ended_ns if self.ended_ns is not None else time.perf_counter_ns()
+        return {
+            "name": self.name,
+            "status": self.status,
+            "start_ms": round((self.created_ns - origin_ns) / 1e6, 3),
+            "wall_ms": round((end - self.created_ns) / 1e6, 3),
+            "busy_ms": round(self.busy_ns / 1e6, 3),
+            "max_step_ms": round(self.max_step_ns / 1e6, 3),
+            "steps": self.steps,
+        }
+
+
+class _StackSampler(threading.Thread):
+    """定时采样指定线程（事件循环线程）的调用栈，相同调用栈合并计数。"""
+
+    def __init__(self, thread_id: int, interval_s: float) -> None:
+        super().__init__(name="rs-agent-profiler", daemon=True)
+        self._thread_id = thread_id
+        self._interval_s = interval_s
+        self._stop_event = threading.Event()
+        self.frames: Dict[Tuple[str, str, int], int] = {}
+        self.stacks: Dict[Tuple[int, ...], float] = {}
+        self.samples = 0
+
+    def run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop_event.wait(self._interval_s):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self._thread_id)
+            weight_ms, last = (now - last) * 1000, now
+            if frame is None:
+                continue
+            stack: List[int] = []
+            while frame is not None and len(stack) < _STACK_MAX_DEPTH:
+                key = _frame_key(frame.f_code)
+                stack.append(self.frames.setdefault(key, len(self.frames)))
+                frame = frame.f_back
+            del frame
+            stack.reverse()
+            key_stack = tuple(stack)
+            self.stacks[key_stack] = self.stacks.get(key_stack, 0.0) + weight_ms
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join(timeout=1.0)
+
+
+class Profile:
+    """一次请求的剖析。``async with`` 进入时开始、退出时停止并在线程池中写出结果；
+    要剖析的协程经 :meth:`run` / :meth:`iterate` 执行，以便作为任务统计其执行时间。
+
+    进入时若已有其它剖析（并发请求抢先），本次不剖析，只保存一条 ``status: skipped`` 的记录。
+    """
+
+    def __init__(self, mode: str, label: str = "") -> None:
+        if mode not in MODES:
+            raise ValueError(f"unknown profile mode: {mode}")
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.label = label
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self._wall = datetime.now()
+        self._start_ns = 0
+        self._end_ns = 0
+        self._profiler: Optional[cProfile.Profile] = None
+        self._sampler: Optional[_StackSampler] = None
+        self._tasks: List[_TimedCoro] = []
+        self._tasks_dropped = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._prev_factory = None
+        self._own_tracemalloc = False
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._snapshot_end: Optional[tracemalloc.Snapshot] = None
+
+    # -- 生命周期 -----------------------------------------------------------------
+
+    async def __aenter__(self) -> "Profile":
+        global _active
+        with _active_lock:
+            if _active is not None:
+                self.status = "skipped"
+                self.error = "已有剖析在进行"
+                return self
+            _active = self
+        self.status = "running"
+        self._wall = datetime.now()
+        self._loop = asyncio.get_running_loop()
+        self._prev_factory = self._loop.get_task_factory()
+        self._loop.set_task_factory(self._task_factory)
+        if settings.profile_tracemalloc_top > 0:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(settings.profile_tracemalloc_frames)
+                self._own_tracemalloc = True
+            self._snapshot = tracemalloc.take_snapshot()
+        self._start_ns = time.perf_counter_ns()
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = _StackSampler(threading.get_ident(), max(settings.profile_sample_interval_ms, 1) / 1000)
+            self._sampler.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        global _active
+        if self.status == "running":
+            self._stop(exc)
+            with _active_lock:
+                _active = None
+        try:
+            await executors.io.run(self.save)
+        except Exception:  # noqa: BLE001
+            logger.warning("保存剖析结果失败 id=%s", self.id, exc_info=True)
+
+    def _stop(self, exc: Optional[BaseException]) -> None:
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        self._end_ns = time.perf_counter_ns()
+        if self._loop is not None:
+            self._loop.set_task_factory(self._prev_factory)
+        if self._snapshot is not None:
+            self._snapshot_end = tracemalloc.take_snapshot()
+            if self._own_tracemalloc:
+                tracemalloc.stop()
+        if isinstance(exc, (asyncio.CancelledError, GeneratorExit)):
+            self.status = "cancelled"
+        elif exc is not None:
+            self.status, self.error = "error", f"{type(exc).__name__}: {exc}"[:300]
+        else:
+            self.status = "ok"
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if asyncio.iscoroutine(coro) and not isinstance(coro, _TimedCoro):
+            if len(self._tasks) < _TASKS_MAX:
+                coro = _TimedCoro(coro)
+                self._tasks.append(coro)
+            else:
+                self._tasks_dropped += 1
+        if self._prev_factory is not None:
+            return self._prev_factory(loop, coro, **kwargs)
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    # -- 执行被剖析的协程 ---------------------------------------------------------------
+
+    async def run(self, coro: Awaitable[T]) -> T:
+        """作为任务执行 ``coro``（经任务工厂计时），返回其结果。"""
+        return await asyncio.ensure_future(coro)
+
+    async def iterate(self, agen: AsyncIterator[T]) -> AsyncIterator[T]:
+        """在一个任务中驱动异步生成器（保持其 contextvars 在同一上下文），逐个转发产出的事件。"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        done = object()
+
+        async def pump() -> None:
+            try:
+                async for item in agen:
+                    await queue.put(item)
+            finally:
+                await queue.put(done)
+
+        task = asyncio.ensure_future(pump())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                yield item
+            await task  # 传出生成器内的异常
+        finally:
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):  # noqa: BLE001
+                    pass
+
+    # -- 结果 -------------------------------------------------------------------------
+
+    def summary(self) -> Dict[str, Any]:
+        duration_ns = max(self._end_ns - self._start_ns, 0)
+        tasks = [t.to_dict(self._start_ns) for t in self._tasks]
+        by_name: Dict[str, Dict[str, Any]] = {}
+        for t in tasks:
+            agg = by_name.setdefault(t["name"], {"name": t["name"], "count": 0, "wall_ms": 0.0, "busy_ms": 0.0, "max_step_ms": 0.0})
+            agg["count"] += 1
+            agg["wall_ms"] = round(agg["wall_ms"] + t["wall_ms"], 3)
+            agg["busy_ms"] = round(agg["busy_ms"] + t["busy_ms"], 3)
+            agg["max_step_ms"] = max(agg["max_step_ms"], t["max_step_ms"])
+        loop_busy_ms = round(sum(t["busy_ms"] for t in tasks), 3)
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "label": self.label,
+            "status": self.status,
+            "error": self.error,
+            "started_at": self._wall.isoformat(sep=" ", timespec="milliseconds"),
+            "duration_ms": round(duration_ns / 1e6, 3),
+            "loop": {
+                "busy_ms": loop_busy_ms,
+                # 剖析期间事件循环未执行任何任务步骤的时间，近似为等待 I/O（含线程池中的 DB / 子进程等待）
+                "idle_ms": round(max(duration_ns / 1e6 - loop_busy_ms, 0.0), 3),
+            },
+            "tasks": sorted(by_name.values(), key=lambda a: a["busy_ms"], reverse=True),
+            "task_list": sorted(tasks, key=lambda t: t["start_ms"]),
+            "tasks_dropped": self._tasks_dropped,
+            "samples": self._sampler.samples if self._sampler is not None else None,
+            "tracemalloc": self._tracemalloc_top(),
+            "downloads": {
+                "pstats": self._profiler is not None,
+                "speedscope": self._profiler is not None or self._sampler is not None,
+            },
+        }
+
+    def _tracemalloc_top(self) -> Optional[List[Dict[str, Any]]]:
+        if self._snapshot is None or self._snapshot_end is None:
+            return None
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ]
+        diff = self._snapshot_end.filter_traces(filters).compare_to(self._snapshot.filter_traces(filters), "lineno")
+        return [
+            {
+                "location": str(stat.traceback[0]) if stat.traceback else "?",
+                "size_diff_kb": round(stat.size_diff / 1024, 2),
+                "count_diff": stat.count_diff,
+                "size_kb": round(stat.size / 1024, 2),
+            }
+            for stat in diff[: settings.profile_tracemalloc_top]
+        ]
+
+    def speedscope(self) -> Optional[Dict[str, Any]]:
+        name = f"rs-agent {self.label or self.mode} {self.id}"
+        if self._sampler is not None:
+            frames = sorted(self._sampler.frames.items(), key=lambda kv: kv[1])
+            stacks = list(self._sampler.stacks.items())
+            return _speedscope_doc(name, [k for k, _ in frames], [list(s) for s, _ in stacks], [w for _, w in stacks])
+        if self._profiler is not None:
+            return _pstats_to_speedscope(pstats.Stats(self._profiler), name)
+        return None
+
+    def save(self) -> None:
+        """写出 ``<id>.json``（摘要）、``<id>.pstats``、``<id>.speedscope.json``，并清理超出保留数的旧结果。"""
+        out = _profile_dir()
+        out.mkdir(parents=True, exist_ok=True)
+        if self._profiler is not None:
+            self._profiler.dump_stats(str(out / f"{self.id}.pstats"))
+        doc = self.speedscope()
+        if doc is not None:
+            (out / f"{self.id}.speedscope.json").write_text(json.dumps(doc), encoding="utf-8")
+        tmp = out / f"{self.id}.json.tmp"
+        tmp.write_text(json.dumps(self.summary(), ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, out / f"{self.id}.json")
+        _prune(out, settings.profile_keep)
+
+
+def _speedscope_doc(
+    name: str,
+    frames: List[Tuple[str, str, int]],
+    samples: List[List[int]],
+    weights: List[float],
+) -> Dict[str, Any]:
+    return {
+        "$schema": _SPEEDSCOPE_SCHEMA,
+        "name": name,
+        "exporter": "rs-agent",
+        "activeProfileIndex": 0,
+        "shared": {"frames": [{"name": fn, "file": file, "line": line} for fn, file, line in frames]},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": round(sum(weights), 3),
+            "samples": samples,
+            "weights": [round(w, 3) for w in weights],
+        }],
+    }
+
+
+def _pstats_to_speedscope(stats: pstats.Stats, name: str) -> Dict[str, Any]:
+    """pstats 只有「调用者 → 被调用者」的聚合，没有完整调用栈：每个函数的自身耗时挂在沿耗时最多的
+    调用者一路向上得到的调用链上（与 gprof2dot 类似的近似）。"""
+    raw = stats.stats  # type: ignore[attr-defined]
+    index: Dict[Tuple[str, int, str], int] = {}
+
+    def frame_id(func: Tuple[str, int, str]) -> int:
+        return index.setdefault(func, len(index))
+
+    samples: List[List[int]] = []
+    weights: List[float] = []
+    for func, (_cc, _nc, tt, _ct, _callers) in raw.items():
+        if tt <= 0:
+            continue
+        chain = [func]
+        seen = {func}
+        current = func
+        while len(chain) < _STACK_MAX_DEPTH:
+            callers = raw.get(current, (0, 0, 0, 0, {}))[4]
+            parent = max(callers, key=lambda c: callers[c][3], default=None)
+            if parent is None or parent in seen:
+                break
+            chain.append(parent)
+            seen.add(parent)
+            current = parent
+        samples.append([frame_id(f) for f in reversed(chain)])
+        weights.append(tt * 1000)
+    frames = [(fn, file, line) for (file, line, fn), _ in sorted(index.items(), key=lambda kv: kv[1])]
+    return _speedscope_doc(name, frames, samples, weights)
+
+
+def _prune(out: Path, keep: int) -> None:
+    if keep <= 0:
+        return
+    summaries = sorted(out.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    summaries = [p for p in summaries if valid_id(p.name.split(".")[0]) and p.name.count(".") == 1]
+    for old in summaries[keep:]:
+        pid = old.name.split(".")[0]
+        for path in (old, out / f"{pid}.pstats", out / f"{pid}.speedscope.json"):
+            path.unlink(missing_ok=True)
+
+
+# ---------------------------------------------------------------------------
+# 读取已保存的结果
+# ---------------------------------------------------------------------------
+
+def result_path(profile_id: str, kind: str) -> Optional[Path]:
+    """``kind``：summary / pstats / speedscope；ID 非法或文件不存在返回 None。"""
+    if not valid_id(profile_id):
+        return None
+    suffix = {"summary": ".json", "pstats": ".pstats", "speedscope": ".speedscope.json"}[kind]
+    path = _profile_dir() / f"{profile_id}{suffix}"
+    return path if path.is_file() else None
+
+
+def load_summary(profile_id: str) -> Optional[Dict[str, Any]]:
+    path = result_path(profile_id, "summary")
+    if path is None:
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def list_profiles(limit: int = 20) -> List[Dict[str, Any]]:
+    out = _profile_dir()
+    if not out.is_dir():
+        return []
+    items: List[Dict[str, Any]] = []
+    paths = sorted(out.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in paths:
+        if len(items) >= limit:
+            break
+        if path.name.count(".") != 1 or not valid_id(path.stem):
+            continue
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        items.append({k: data.get(k) for k in ("id", "mode", "label", "status", "started_at", "duration_ms")})
+    return items
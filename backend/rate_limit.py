@@ -0,0 +1,61 @@
+"""Per-client rate limiting for the agent endpoints.
+
+If ``RS_AGENT_RATE_LIMIT_PER_MINUTE`` is > 0, ``/api/agent`` and ``/api/agent/stream`` accept at most
+that many requests per client per minute (fixed one-minute window) and answer ``429`` beyond it.
+The client is the bearer API key when one is sent, otherwise the remote address.
+
+Counters live in the shared state backend (``RS_AGENT_STATE_BACKEND``), so the limit holds across
+uvicorn workers when the backend is ``sqlite`` or ``redis``; with ``memory`` each worker counts on its own.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import time
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials
+
+from backend.auth import _bearer_scheme
+from backend.config import settings
+from backend.services import state_store
+
+logger = logging.getLogger(__name__)
+
+_WINDOW_SECONDS = 60
+
+
+def _client_key(request: Request, credentials: Optional[HTTPAuthorizationCredentials]) -> str:
+    if credentials is not None and credentials.credentials:
+        # 只保存摘要，不把 API Key 明文写进共享存储
+        return "key:" + hashlib.sha256(credentials.credentials.encode("utf-8")).hexdigest()[:16]
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+async def enforce_rate_limit(
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer_scheme),
+) -> None:
+    """FastAPI dependency: count this request and reject it with 429 once the window is full."""
+    limit = settings.rate_limit_per_minute
+    if limit <= 0:
+        return
+    now = time.time()
+    window = int(now // _WINDOW_SECONDS)
+    key = f"{_client_key(request, credentials)}:{window}"
+    backend = state_store.get_state_backend()
+    try:
+        count = await state_store.run_state(backend.incr, "ratelimit", key, 1, _WINDOW_SECONDS * 2)
+    except Exception as exc:
+        # 共享后端不可用时放行（fail-open），不因限流组件故障拒绝业务请求
+        logger.warning("rate limit backend unavailable: %s", exc)
+        return
+    if count > limit:
+        retry_after = max(1, int((window + 1) * _WINDOW_SECONDS - now))
+        raise HTTPException(
+            status_code=429,
+            detail="请求过于频繁，请稍后再试",
+            headers={"Retry-After": str(retry_after)},
+        )
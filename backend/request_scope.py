@@ -0,0 +1,244 @@
+"""请求级截止时间与取消范围（经 contextvar 传递给各服务）。
+
+用户在 ``/api/agent/stream`` 过程中关闭页面后，pipeline 原先会一直跑完：KB 子进程继续检索、LLM 调用连同
+重试继续、文生图等满 90 秒。uvicorn 的 ASGI spec ≥ 2.4 下 Starlette 不再监听断开，只有下一次写出事件时
+才发现连接已关闭。:class:`RequestScope` 为一次请求提供：
+
+- 截止时间（``RS_AGENT_REQUEST_DEADLINE_SECONDS``）：到期即取消 pipeline 任务，调用方得到
+  :class:`DeadlineExceeded`（接口返回 504）；
+- 取消：pipeline 在独立任务中执行，SSE 生成器每 ``RS_AGENT_DISCONNECT_POLL_MS`` 检查一次客户端是否断开，
+  断开或消费方提前离开时取消该任务。
+
+另可带一个软性的延迟预算（``budget_s``）：到期不取消，只供 KB_QUERY 等路径按剩余预算降级
+（:func:`budget_remaining`，见 ``services.kb_budget``）。
+
+任务内（含其派生的子任务）经 :func:`current` 可取到所属范围。各服务据此收紧自身超时（:func:`cap`）、
+在取消时释放资源并用 :func:`note` 记下省下的工作：``query_kb`` 杀掉 KB 子进程、``_http_post`` 中止请求并
+跳过剩余重试、``generate_flowchart_image`` 停止等待。范围结束时若被取消，按原因汇总省下的资源写日志并计入
+``rs_agent_requests_cancelled_total{reason}`` 与 ``rs_agent_cancelled_work_total{kind}``。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import time
+from collections import Counter
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from backend import metrics
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEADLINE = "deadline"
+DISCONNECTED = "client_disconnected"
+SHUTDOWN = "shutdown"
+
+_current: contextvars.ContextVar[Optional["RequestScope"]] = contextvars.ContextVar("rs_agent_request_scope", default=None)
+_DONE = object()
+
+
+class RequestCancelled(Exception):
+    """请求在完成前被取消（客户端断开、服务关闭等）。"""
+
+    def __init__(self, reason: str, message: Optional[str] = None) -> None:
+        super().__init__(message or f"请求已取消（{reason}）")
+        self.reason = reason
+
+
+class DeadlineExceeded(RequestCancelled):
+    """请求超过截止时间。"""
+
+
+class RequestScope:
+    """一次请求的截止时间与取消状态。``run()`` / ``iterate()`` 各只能调用一次。"""
+
+    def __init__(self, timeout_s: Optional[float] = None, label: str = "", budget_s: Optional[float] = None) -> None:
+        self.label = label
+        self.timeout_s = timeout_s if timeout_s and timeout_s > 0 else None
+        self.budget_s = budget_s if budget_s and budget_s > 0 else None
+        self.started = time.monotonic()
+        self.deadline = self.started + self.timeout_s if self.timeout_s is not None else None
+        self.reason: Optional[str] = None
+        self.saved: List[Dict[str, Any]] = []
+        self._task: Optional["asyncio.Task[Any]"] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._watcher: Optional["asyncio.Task[None]"] = None
+
+    # -- 状态 --------------------------------------------------------------------------
+
+    def remaining(self) -> Optional[float]:
+        """距截止时间的秒数（不小于 0）；没有截止时间时为 None。"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def budget_remaining(self) -> Optional[float]:
+        """延迟预算剩余秒数（可为负，表示已超出）；没有预算时为 None。"""
+        if self.budget_s is None:
+            return None
+        return self.started + self.budget_s - time.monotonic()
+
+    def cancel(self, reason: str) -> None:
+        """以 ``reason`` 取消本次请求（只记录第一个原因）。"""
+        if self.reason is None:
+            self.reason = reason
+        task = self._task
+        if task is not None and not task.done():
+            task.cancel()
+
+    def summary(self) -> Dict[str, Any]:
+        kinds = Counter(item["kind"] for item in self.saved)
+        return {
+            "reason": self.reason,
+            "elapsed_ms": round((time.monotonic() - self.started) * 1000, 1),
+            "work": dict(kinds),
+            "retries_skipped": sum(int(item.get("retries_skipped") or 0) for item in self.saved),
+            "wait_saved_s": round(sum(float(item.get("wait_saved_s") or 0.0) for item in self.saved), 1),
+        }
+
+    # -- 执行 --------------------------------------------------------------------------
+
+    def _start(self, aw: Awaitable[T], is_disconnected: Optional[Callable[[], Awaitable[bool]]]) -> "asyncio.Task[T]":
+        if self._task is not None:
+            raise RuntimeError("RequestScope 只能执行一次")
+
+        # 任务创建时复制当前上下文：在设置了本范围的副本中创建，任务及其子任务都能取到本范围
+        ctx = contextvars.copy_context()
+        ctx.run(_current.set, self)
+        task = ctx.run(asyncio.ensure_future, aw)
+        self._task = task
+        task.add_done_callback(self._on_done)
+        remaining = self.remaining()
+        if remaining is not None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_at(loop.time() + remaining, self.cancel, DEADLINE)
+        if is_disconnected is not None:
+            self._watcher = asyncio.ensure_future(self._watch(is_disconnected))
+        return task
+
+    async def _watch(self, is_disconnected: Callable[[], Awaitable[bool]]) -> None:
+        interval = max(0.01, settings.disconnect_poll_ms / 1000)
+        task = self._task
+        while task is not None and not task.done():
+            if await is_disconnected():
+                self.cancel(DISCONNECTED)
+                return
+            await asyncio.sleep(interval)
+
+    def _on_done(self, task: "asyncio.Task[Any]") -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._watcher is not None and not self._watcher.done():
+            self._watcher.cancel()
+        if self.reason is None and not self.saved:
+            return
+        summary = self.summary()
+        logger.info(
+            "请求 %s 提前结束的工作（取消原因 %s，已运行 %.1fs）：省下 %s，跳过重试 %d 次，释放等待 %.1fs",
+            self.label or "-", summary["reason"] or "-", summary["elapsed_ms"] / 1000,
+            ", ".join(f"{k} x{n}" for k, n in summary["work"].items()) or "无进行中的工作",
+            summary["retries_skipped"], summary["wait_saved_s"],
+        )
+        if settings.metrics_enabled:
+            if self.reason is not None:
+                metrics.REQUESTS_CANCELLED.inc(self.reason)
+            for kind, n in summary["work"].items():
+                metrics.CANCELLED_WORK.inc(kind, amount=n)
+
+    def _result(self, task: "asyncio.Task[T]") -> T:
+        if task.cancelled():
+            if self.reason == DEADLINE:
+                raise DeadlineExceeded(DEADLINE, f"请求超过截止时间（{self.timeout_s:g} 秒）")
+            if self.reason is not None:
+                raise RequestCancelled(self.reason)
+            raise asyncio.CancelledError()
+        return task.result()
+
+    async def run(
+        self,
+        aw: Awaitable[T],
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        abandon_reason: str = DISCONNECTED,
+    ) -> T:
+        """在本范围内作为独立任务执行 ``aw``；调用方被取消时以 ``abandon_reason`` 取消该任务。"""
+        task = self._start(aw, is_disconnected)
+        try:
+            await asyncio.wait({task})
+        finally:
+            if not task.done():
+                self.cancel(abandon_reason)
+        return self._result(task)
+
+    async def iterate(
+        self,
+        agen: AsyncIterator[T],
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        abandon_reason: str = DISCONNECTED,
+    ) -> AsyncIterator[T]:
+        """在本范围内的一个任务中驱动异步生成器，逐个转发其事件；消费方提前离开时取消该任务。"""
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def pump() -> None:
+            async for item in agen:
+                queue.put_nowait(item)
+
+        task = self._start(pump(), is_disconnected)
+        task.add_done_callback(lambda _t: queue.put_nowait(_DONE))
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            if not task.done():
+                self.cancel(abandon_reason)
+                # 等任务完成清理（杀子进程等）；若调用方再次被取消则交由任务自行结束
+                await asyncio.wait({task})
+        self._result(task)
+
+
+# ---------------------------------------------------------------------------
+# 服务侧接口：读取当前任务所属的范围
+# ---------------------------------------------------------------------------
+
+def current() -> Optional[RequestScope]:
+    return _current.get()
+
+
+def remaining() -> Optional[float]:
+    scope = _current.get()
+    return scope.remaining() if scope is not None else None
+
+
+def cap(timeout_s: float) -> float:
+    """把服务自身的超时收紧到不超过请求剩余时间。"""
+    left = remaining()
+    return timeout_s if left is None else max(0.001, min(timeout_s, left))
+
+
+def budget_remaining() -> Optional[float]:
+    scope = _current.get()
+    return scope.budget_remaining() if scope is not None else None
+
+
+def is_cancelled() -> bool:
+    scope = _current.get()
+    return scope is not None and scope.reason is not None
+
+
+def reason() -> Optional[str]:
+    scope = _current.get()
+    return scope.reason if scope is not None else None
+
+
+def note(kind: str, **info: Any) -> None:
+    """记下因取消 / 截止时间而省下的工作（``retries_skipped``、``wait_saved_s`` 计入汇总）。"""
+    scope = _current.get()
+    if scope is not None:
+        scope.saved.append({"kind": kind, **info})
@@ -6,59 +6,168 @@ All business logic lives in :mod:`backend.services.agent_pipeline`.
 
 from __future__ import annotations
 
+import base64
+import binascii
 import json
 import os
 import time
 import uuid
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from pydantic import BaseModel, Field
 
 from backend.__version__ import __version__
-from backend.auth import require_api_key
+from backend.auth import _bearer_scheme, require_api_key, require_profile_key
 from backend.config import settings
-from backend.db import get_conversation, list_conversations
+from backend.db import (
+    blob_table_stats,
+    get_conversation_async,
+    get_job_result,
+    get_session_version_async,
+    journal_table_stats,
+    list_conversations_async,
+    list_job_events,
+    list_traces,
+    pool_stats,
+    run_db,
+)
+from backend import executors, loop_monitor, metrics, profiling, request_scope, tracing
+from backend.rate_limit import enforce_rate_limit
+from backend.services import blob_store, kb_modes, session_journal, state_store
 from backend.services.agent_pipeline import AgentPipeline, PipelineError
+from backend.services.intent_classifier import agreement, get_classifier
 from backend.services.intent_router import Intent
+from backend.services.job_queue import jobs
+from backend.services.llm_hedging import hedger
+from backend.services.llm_service import json_parse_stats
+from backend.services.message_log import message_log
+from backend.services.retention import retention
+from backend.services.session_cache import session_cache
+from backend.services.session_locks import session_locks
 
 # ---------------------------------------------------------------------------
 # Upload store (stays in router – protocol/IO concern)
 # ---------------------------------------------------------------------------
 
-_UPLOAD_STORE: Dict[str, tuple[str, float]] = {}
 UPLOAD_MAX_AGE_SECONDS = 3600  # 1 小时
+# imageId -> (本地路径, 上传时间)；存于共享状态后端，多 worker 下任一 worker 都能解析，条目随 TTL 过期
+_UPLOAD_STORE = state_store.StateMapping("uploads", ttl=UPLOAD_MAX_AGE_SECONDS)
 
 
-def _cleanup_old_uploads() -> None:
-    """删除超过 UPLOAD_MAX_AGE_SECONDS 的上传条目及对应磁盘文件。"""
-    now = time.time()
-    to_remove = [
-        uid for uid, (_, created) in _UPLOAD_STORE.items()
-        if now - created > UPLOAD_MAX_AGE_SECONDS
-    ]
-    for uid in to_remove:
-        path_str = _UPLOAD_STORE[uid][0]
+def _cleanup_old_uploads() -> int:
+    """删除上传目录中超过 UPLOAD_MAX_AGE_SECONDS 的文件（由后台清理任务定期调用），返回删除的文件数。
+
+    登记条目由状态后端按 TTL 过期，这里只顺带移除仍存在的条目；不扫描整个命名空间，其它 worker
+    同时删除同一条目也不会出错。
+    """
+    cutoff = time.time() - UPLOAD_MAX_AGE_SECONDS
+    removed = 0
+    try:
+        entries = list(settings.upload_dir.iterdir())
+    except FileNotFoundError:
+        return 0
+    for path in entries:
         try:
-            Path(path_str).unlink(missing_ok=True)
+            if not path.is_file() or path.stat().st_mtime > cutoff:
+                continue
+            path.unlink(missing_ok=True)
         except OSError:
-            pass
-        del _UPLOAD_STORE[uid]
+            continue
+        removed += 1
+        _UPLOAD_STORE.pop(path.stem, None)
+    return removed
 
 
 def _resolve_image_paths(image_ids: Optional[List[str]]) -> List[str]:
-    """将上传返回的 imageIds 解析为本地路径，供 pipeline 使用。"""
-    if not image_ids:
-        return []
-    _cleanup_old_uploads()
-    return [_UPLOAD_STORE[i][0] for i in image_ids if i in _UPLOAD_STORE]
+    """将上传返回的 imageIds 解析为本地路径，供 pipeline 使用（已过期或不存在的 id 忽略）。"""
+    paths: List[str] = []
+    for image_id in image_ids or []:
+        entry = _UPLOAD_STORE.get(image_id)
+        if entry is not None:
+            paths.append(entry[0])
+    return paths
+
+
+def _encode_cursor(row: dict) -> str:
+    """会话列表的 keyset 游标：上一页最后一条的 (created_at, id)，base64url 编码。"""
+    raw = json.dumps([row["created_at"], row["id"]], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        created_at, conv_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="cursor 无效")
+    return str(created_at), str(conv_id)
 
 
-def _sse(event: str, data: dict) -> str:
+def _sse(event: str, data: dict, event_id: Optional[str] = None) -> str:
     """Encode one Server-Sent Events message."""
-    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _parse_last_event_id(value: str) -> tuple[str, int]:
+    """后台任务事件的 SSE id 为 ``<jobId>:<seq>``。"""
+    job_id, sep, seq = value.strip().rpartition(":")
+    if not sep or not job_id or not seq.isdigit():
+        raise HTTPException(status_code=400, detail="Last-Event-ID 无效")
+    return job_id, int(seq)
+
+
+async def _job_stream(job_id: str, after_seq: int):
+    """后台任务的 SSE：先发一条 job 事件（不带 id），再按序输出（重放）其事件。"""
+    yield _sse("job", {"jobId": job_id})
+    async for event in jobs.events(job_id, after_seq):
+        yield _sse(event["type"], event["data"], event_id=f"{job_id}:{event['seq']}")
+
+
+async def _count_in_flight(gen):
+    metrics.SSE_IN_FLIGHT.inc()
+    try:
+        async for chunk in gen:
+            yield chunk
+    finally:
+        metrics.SSE_IN_FLIGHT.dec()
+
+
+def _sse_response(gen, headers: Optional[dict] = None) -> StreamingResponse:
+    return StreamingResponse(
+        _count_in_flight(gen),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **(headers or {})},
+    )
+
+
+async def _requested_profile(
+    request: Request,
+    x_profile: Optional[str] = Header(None, alias="X-Profile"),
+    profile: Optional[str] = Query(None),
+    x_profile_key: Optional[str] = Header(None, alias="X-Profile-Key"),
+) -> Optional[profiling.Profile]:
+    """请求头 ``X-Profile`` 或查询参数 ``profile`` 要求剖析本次请求时返回 :class:`profiling.Profile`，否则 None。"""
+    mode = (x_profile or profile or "").strip().lower()
+    if not mode:
+        return None
+    await require_profile_key(x_profile_key)
+    if mode not in profiling.MODES:
+        raise HTTPException(status_code=400, detail=f"profile 取值应为 {' / '.join(profiling.MODES)}")
+    if profiling.busy():
+        raise HTTPException(status_code=409, detail="已有剖析在进行，请稍后重试")
+    return profiling.Profile(mode, label=request.url.path)
+
+
+def _latency_budget_s(budget_ms: Optional[int], credentials: Optional[HTTPAuthorizationCredentials]) -> Optional[float]:
+    """本次请求的延迟预算（秒）：该 API Key 的预算或默认预算，请求体 ``budgetMs`` 只能再收紧。"""
+    key = credentials.credentials if credentials is not None else None
+    configured = settings.kb_budget_ms_by_key.get(key, settings.kb_budget_ms) if key else settings.kb_budget_ms
+    candidates = [ms for ms in (configured, budget_ms) if ms and ms > 0]
+    return min(candidates) / 1000 if candidates else None
 
 
 # ---------------------------------------------------------------------------
@@ -72,6 +181,13 @@ class AgentRequest(BaseModel):
     sessionId: Optional[str] = None
     text: str
     imageIds: Optional[List[str]] = None
+    # 作为后台任务执行：与连接解耦，事件持久化，可断线续传 / 轮询
+    background: bool = False
+    # KB_QUERY 延迟预算（毫秒）：超出前跳过扩展 / 减少子问题 / 不做综合，见 services.kb_budget
+    budgetMs: Optional[int] = Field(None, ge=1)
+    # KB_QUERY 模式：fast（规则意图、单次检索、不综合、可用缓存）/ balanced / thorough（更多子问题 + 重排），
+    # 未指定时取 RS_AGENT_KB_QUERY_DEFAULT_MODE，见 services.kb_modes
+    mode: Optional[Literal["fast", "balanced", "thorough"]] = None
 
 
 class AgentResponse(BaseModel):
@@ -88,6 +204,7 @@ class ConversationSummary(BaseModel):
     created_at: str
     updated_at: str
     first_user_text: Optional[str] = None
+    message_count: int = 0
 
 
 class ConversationDetail(BaseModel):
@@ -108,36 +225,133 @@ def get_version() -> dict:
     return {"version": __version__}
 
 
+@router.get("/diagnostics/llm")
+def get_llm_diagnostics() -> dict:
+    """LLM 调用诊断：各 stage 调用数、对冲次数与备份请求胜出率；JSON 解析修复/补问统计。"""
+    return {"hedge": hedger.stats(), "json": json_parse_stats()}
+
+
+@router.get("/diagnostics/intent")
+def get_intent_diagnostics() -> dict:
+    """本地意图分类器诊断：是否加载、阈值、打分耗时，以及与 LLM 判定按置信度分桶的一致率。"""
+    clf = get_classifier()
+    return {
+        "classifier": clf.describe() if clf is not None else None,
+        "threshold": settings.intent_clf_threshold,
+        "agreement": agreement.stats(),
+    }
+
+
+@router.get("/diagnostics/loop")
+def get_loop_diagnostics() -> dict:
+    """事件循环诊断：心跳延迟分位数、超过阈值的阻塞次数，以及按调用点聚合的阻塞（次数、总 / 最长耗时、最近一次的调用栈与任务名）；I/O 与 CPU 执行器的提交数、在途数与背压等待次数。"""
+    return {**loop_monitor.monitor.stats(), "executors": executors.stats()}
+
+
+@router.get("/diagnostics/db")
+def get_db_diagnostics() -> dict:
+    """SQLite 诊断：连接池（打开/空闲连接数、复用与等待次数）、写后队列（深度、批大小、落盘耗时）、会话缓存与 KB 答案缓存命中率、blob 存储（写入量、表大小）、会话增量日志与保留任务（耗时、删除行数、归还页数）、共享状态后端、会话锁排队情况、后台任务、trace 导出。"""
+    return {
+        "pool": pool_stats(),
+        "write_behind": message_log.stats(),
+        "session_cache": session_cache.stats(),
+        "kb_answer_cache": kb_modes.answer_cache.stats(),
+        "blobs": {**blob_store.stats(), **blob_table_stats()},
+        "journal": {**session_journal.stats(), **journal_table_stats()},
+        "retention": retention.stats(),
+        "state": {"backend": settings.state_backend, "uploads": len(_UPLOAD_STORE)},
+        "session_locks": session_locks.stats(),
+        "jobs": jobs.stats(),
+        "tracing": tracing.exporter.stats(),
+    }
+
+
+@router.get("/traces")
+async def get_traces(limit: int = Query(20, ge=1, le=200)) -> list[dict]:
+    """最近的 pipeline trace 摘要（导出到 spans 表时跨 worker 查询，否则为本进程内存中的）。"""
+    if settings.trace_export == "table":
+        return await run_db(list_traces, limit)
+    return tracing.exporter.recent(limit)
+
+
+async def _load_trace(trace_id: str) -> dict:
+    data = await run_db(tracing.exporter.get, trace_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="trace 不存在或已过期")
+    return data
+
+
+@router.get("/traces/{trace_id}")
+async def get_trace(trace_id: str) -> dict:
+    """单个 trace 的全部 span（start_us 相对 trace 开始，parent_id 表示嵌套关系）。"""
+    return await _load_trace(trace_id)
+
+
+@router.get("/traces/{trace_id}/chrome")
+async def get_trace_chrome(trace_id: str) -> JSONResponse:
+    """Chrome Trace Event 格式，可直接导入 chrome://tracing、Perfetto 或 speedscope 查看火焰图。"""
+    data = await _load_trace(trace_id)
+    return JSONResponse(
+        tracing.to_chrome_trace(data),
+        headers={"Content-Disposition": f'attachment; filename="trace-{trace_id}.json"'},
+    )
+
+
 @router.get("/conversations", response_model=list[ConversationSummary])
-def get_conversations(limit: int = 20, offset: int = 0) -> list[ConversationSummary]:
-    rows = list_conversations(limit=limit, offset=offset)
+async def get_conversations(
+    response: Response,
+    limit: int = 20,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+) -> list[ConversationSummary]:
+    """会话列表（新到旧）。响应体仍为数组；还有下一页时响应头 ``X-Next-Cursor`` 给出游标，
+    下次请求带上 ``cursor`` 即按 keyset 翻页（忽略 offset）；不带 cursor 时沿用 limit/offset。"""
+    await message_log.barrier()
+    after = _decode_cursor(cursor) if cursor else None
+    rows = await list_conversations_async(limit=limit, offset=offset, after=after)
+    if limit > 0 and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1])
     return [ConversationSummary(**r) for r in rows]
 
 
 @router.get("/conversations/{conv_id}", response_model=ConversationDetail)
-def get_conversation_detail(conv_id: str) -> ConversationDetail:
-    conv = get_conversation(conv_id)
+async def get_conversation_detail(conv_id: str) -> ConversationDetail:
+    await message_log.barrier(conv_id)
+    conv = await get_conversation_async(conv_id)
     if not conv:
         raise HTTPException(status_code=404, detail="conversation 不存在")
     return ConversationDetail(**conv)
 
 
+@router.get("/conversations/{conv_id}/drafts")
+async def get_draft_history(conv_id: str) -> dict:
+    """Orchestrator 会话的草稿历史：由增量日志重放出 draft_struct 每次变化后的版本（旧到新）。"""
+    drafts = await session_journal.draft_history_async(conv_id)
+    if not drafts and await get_session_version_async(conv_id) is None:
+        raise HTTPException(status_code=404, detail="session 不存在")
+    return {"sessionId": conv_id, "drafts": drafts}
+
+
+def _save_upload(content: bytes, ext: str) -> str:
+    """写盘并登记一张上传图片，返回 imageId（在 I/O 执行器中运行）。"""
+    settings.upload_dir.mkdir(parents=True, exist_ok=True)
+    uid = str(uuid.uuid4())
+    path = settings.upload_dir / f"{uid}{ext}"
+    path.write_bytes(content)
+    _UPLOAD_STORE[uid] = (str(path.resolve()), time.time())
+    return uid
+
+
 @router.post("/upload")
-def upload_images(files: List[UploadFile] = File(...)) -> dict:
+async def upload_images(files: List[UploadFile] = File(...)) -> dict:
     """上传图片，返回 imageIds，供 /api/agent 请求体中的 imageIds 使用。"""
-    settings.upload_dir.mkdir(parents=True, exist_ok=True)
     ids: List[str] = []
     for f in files:
         if not f.content_type or not f.content_type.startswith("image/"):
             continue
         ext = os.path.splitext(f.filename or "")[1] or ".png"
-        uid = str(uuid.uuid4())
-        path = settings.upload_dir / f"{uid}{ext}"
-        content = f.file.read()
-        path.write_bytes(content)
-        _UPLOAD_STORE[uid] = (str(path.resolve()), time.time())
-        ids.append(uid)
-    _cleanup_old_uploads()
+        content = await f.read()
+        ids.append(await executors.io.run(_save_upload, content, ext))
     return {"imageIds": ids}
 
 
@@ -145,37 +359,188 @@ def upload_images(files: List[UploadFile] = File(...)) -> dict:
 # Agent endpoints – delegate to AgentPipeline
 # ---------------------------------------------------------------------------
 
-@router.post("/agent/stream")
-async def agent_stream_endpoint(req: AgentRequest):
-    """流式版本：以 SSE 输出 trace + final 事件。"""
+@router.post("/agent/stream", dependencies=[Depends(enforce_rate_limit)])
+async def agent_stream_endpoint(
+    req: AgentRequest,
+    request: Request,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    prof: Optional[profiling.Profile] = Depends(_requested_profile),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer_scheme),
+):
+    """流式版本：以 SSE 输出 trace + final 事件。
+
+    ``background: true`` 时作为后台任务执行，事件带 ``id: <jobId>:<seq>``；连接断开后带请求头
+    ``Last-Event-ID`` 重新请求即从断点重放（此时忽略请求体，不会重复提交）。
+
+    管理员带 ``X-Profile`` 与 ``X-Profile-Key`` 时剖析本次请求，响应头 ``X-Profile-Id`` 给出结果 ID。
+
+    pipeline 在 :class:`request_scope.RequestScope` 中执行：客户端断开即取消（停止 KB 子进程、LLM 调用与文生图），
+    超过 ``RS_AGENT_REQUEST_DEADLINE_SECONDS`` 输出 504 error 事件。KB_QUERY 按延迟预算（``budgetMs`` /
+    按 API Key / 默认）降级，决策见 final 事件的 ``kbRuns``；检索深度由 ``mode`` 选择。
+    """
+    if last_event_id:
+        job_id, after_seq = _parse_last_event_id(last_event_id)
+        if await jobs.get(job_id) is None:
+            raise HTTPException(status_code=404, detail="job 不存在或已过期")
+        return _sse_response(_job_stream(job_id, after_seq))
+
     text = (req.text or "").strip()
     if not text:
         raise HTTPException(status_code=400, detail="text 不能为空")
 
-    async def gen():
-        image_paths = _resolve_image_paths(req.imageIds)
-        pipeline = AgentPipeline()
-        async for event in pipeline.process(text, req.sessionId, image_paths or None):
-            yield _sse(event["type"], event["data"])
-
-    return StreamingResponse(
-        gen(),
-        media_type="text/event-stream",
-        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
-    )
-
+    if req.background:
+        if prof is not None:
+            raise HTTPException(status_code=400, detail="后台任务不支持剖析")
+        image_paths = await state_store.run_state(_resolve_image_paths, req.imageIds)
+        job_id = await jobs.submit(text, req.sessionId, image_paths or None, mode=req.mode)
+        return _sse_response(_job_stream(job_id, 0))
 
-@router.post("/agent", response_model=AgentResponse)
-async def agent_endpoint(req: AgentRequest) -> AgentResponse:
-    """非流式版本：直接返回 JSON 结果。"""
+    async def gen():
+        image_paths = await state_store.run_state(_resolve_image_paths, req.imageIds)
+        scope = request_scope.RequestScope(
+            settings.request_deadline_seconds, label=request.url.path, budget_s=_latency_budget_s(req.budgetMs, credentials)
+        )
+        events = AgentPipeline(req.mode).process(text, req.sessionId, image_paths or None)
+        try:
+            if prof is None:
+                async for event in scope.iterate(events, request.is_disconnected):
+                    yield _sse(event["type"], event["data"])
+                return
+            async with prof:
+                async for event in scope.iterate(prof.iterate(events), request.is_disconnected):
+                    yield _sse(event["type"], event["data"])
+        except request_scope.DeadlineExceeded as exc:
+            yield _sse("error", {"message": str(exc), "status_code": 504})
+        except request_scope.RequestCancelled:
+            return
+
+    return _sse_response(gen(), headers={"X-Profile-Id": prof.id} if prof is not None else None)
+
+
+@router.post("/agent", response_model=AgentResponse, dependencies=[Depends(enforce_rate_limit)])
+async def agent_endpoint(
+    req: AgentRequest,
+    request: Request,
+    response: Response,
+    prof: Optional[profiling.Profile] = Depends(_requested_profile),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer_scheme),
+) -> AgentResponse:
+    """非流式版本：直接返回 JSON 结果；``background: true`` 时返回 202 与 jobId，结果经 ``GET /api/jobs/{jobId}`` 轮询。
+    剖析方式同流式版本，结果 ID 见响应头 ``X-Profile-Id``；截止时间、断开取消与延迟预算同流式版本（超时返回 504）。"""
     text = (req.text or "").strip()
     if not text:
         raise HTTPException(status_code=400, detail="text 不能为空")
 
-    image_paths = _resolve_image_paths(req.imageIds)
+    image_paths = await state_store.run_state(_resolve_image_paths, req.imageIds)
+    if req.background:
+        if prof is not None:
+            raise HTTPException(status_code=400, detail="后台任务不支持剖析")
+        job_id = await jobs.submit(text, req.sessionId, image_paths or None, mode=req.mode)
+        return JSONResponse(status_code=202, content={"jobId": job_id, "status": "queued"})
+    headers = {"X-Profile-Id": prof.id} if prof is not None else None
+    scope = request_scope.RequestScope(
+        settings.request_deadline_seconds, label=request.url.path, budget_s=_latency_budget_s(req.budgetMs, credentials)
+    )
     try:
-        result = await AgentPipeline().run(text, req.sessionId, image_paths or None)
+        pipeline = AgentPipeline(req.mode).run(text, req.sessionId, image_paths or None)
+        if prof is None:
+            result = await scope.run(pipeline, request.is_disconnected)
+        else:
+            async with prof:
+                result = await prof.run(scope.run(pipeline, request.is_disconnected))
     except PipelineError as exc:
-        raise HTTPException(status_code=exc.status_code, detail=str(exc)) from exc
+        raise HTTPException(status_code=exc.status_code, detail=str(exc), headers=headers) from exc
+    except request_scope.DeadlineExceeded as exc:
+        raise HTTPException(status_code=504, detail=str(exc), headers=headers) from exc
+    except request_scope.RequestCancelled as exc:
+        # 客户端已断开，响应不会被读取
+        raise HTTPException(status_code=499, detail=str(exc), headers=headers) from exc
+    if headers:
+        response.headers.update(headers)
 
     return AgentResponse(**result)
+
+
+# ---------------------------------------------------------------------------
+# Background jobs – polling & resumable event stream
+# ---------------------------------------------------------------------------
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, after: int = Query(0, ge=0)) -> dict:
+    """轮询后台任务：状态、seq > after 的事件，以及任务结束后的结果（最后一条 final / error 事件）。"""
+    job = await jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job 不存在或已过期")
+    events = await run_db(list_job_events, job_id, after)
+    result = await run_db(get_job_result, job_id) if job["status"] in ("done", "error", "interrupted") else None
+    return {
+        "jobId": job_id,
+        "sessionId": job["session_id"],
+        "status": job["status"],
+        "error": job["error"],
+        "lastSeq": job["last_seq"],
+        "events": [{"seq": e["seq"], "type": e["type"], "data": json.loads(e["data"])} for e in events],
+        "result": {"type": result["type"], "data": json.loads(result["data"])} if result else None,
+    }
+
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_job_events(
+    job_id: str,
+    after: int = Query(0, ge=0),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """后台任务事件的 SSE（可直接用 EventSource，断线自动重连时浏览器会带上 Last-Event-ID）。"""
+    if last_event_id:
+        header_job, after = _parse_last_event_id(last_event_id)
+        if header_job != job_id:
+            raise HTTPException(status_code=400, detail="Last-Event-ID 与 jobId 不匹配")
+    if await jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="job 不存在或已过期")
+    return _sse_response(_job_stream(job_id, after))
+
+
+# ---------------------------------------------------------------------------
+# Request profiles – admin only
+# ---------------------------------------------------------------------------
+
+@router.get("/profiles", dependencies=[Depends(require_profile_key)])
+async def get_profiles(limit: int = Query(20, ge=1, le=200)) -> list[dict]:
+    """本进程保存的最近剖析结果摘要（新到旧）。"""
+    return await executors.io.run(profiling.list_profiles, limit)
+
+
+@router.get("/profiles/{profile_id}", dependencies=[Depends(require_profile_key)])
+async def get_profile(profile_id: str) -> dict:
+    """剖析摘要：asyncio 任务耗时（墙钟 / 事件循环上执行 / 单步最长）、事件循环空闲时间、tracemalloc 分配差异 top-N。"""
+    data = await executors.io.run(profiling.load_summary, profile_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="profile 不存在或已清理")
+    return data
+
+
+def _profile_file(profile_id: str, kind: str) -> Path:
+    path = profiling.result_path(profile_id, kind)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"profile 不存在、已清理或该模式无 {kind} 结果")
+    return path
+
+
+@router.get("/profiles/{profile_id}/pstats", dependencies=[Depends(require_profile_key)])
+def get_profile_pstats(profile_id: str) -> FileResponse:
+    """cProfile 结果（``python -m pstats`` / snakeviz 打开；仅 cprofile 模式）。"""
+    return FileResponse(
+        _profile_file(profile_id, "pstats"),
+        media_type="application/octet-stream",
+        filename=f"profile-{profile_id}.pstats",
+    )
+
+
+@router.get("/profiles/{profile_id}/speedscope", dependencies=[Depends(require_profile_key)])
+def get_profile_speedscope(profile_id: str) -> FileResponse:
+    """speedscope JSON（https://www.speedscope.app 打开）。"""
+    return FileResponse(
+        _profile_file(profile_id, "speedscope"),
+        media_type="application/json",
+        filename=f"profile-{profile_id}.speedscope.json",
+    )
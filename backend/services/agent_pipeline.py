@@ -19,27 +19,26 @@ Usage (non-streaming)::
 
 from __future__ import annotations
 
-import json
+import asyncio
 import os
-import time
 import uuid
 from datetime import datetime
 from typing import AsyncGenerator, Dict, List, Optional
 from urllib.parse import urlparse
 
+from backend import executors, request_scope, tracing
 from backend.config import settings
-from backend.db import (
-    add_message,
-    create_conversation,
-    update_conversation_status,
-)
+from backend.db import SessionConflictError
 from backend.services.confirmer_service import get_display as confirmer_get_display
 from backend.services.confirmer_service import parse_feedback as confirmer_parse_feedback
 from backend.services.defender_service import check_draft
 from backend.services.editor_service import render_final
-from backend.services.intent_router import Intent, detect_intent, detect_intent_hybrid
+from backend.services.intent_router import Intent, detect_intent, detect_intent_local, detect_intent_with_expansion
+from backend.services import kb_modes
 from backend.services.kb_query_enhanced import enhanced_kb_query
+from backend.services.message_log import message_log
 from backend.services import orchestrator_controller as orch
+from backend.services.session_locks import SessionBusyError, session_locks
 from backend.services.trading_kb_service import KBQueryError
 
 
@@ -67,14 +66,20 @@ PipelineEvent = Dict[str, object]
 # Internal helpers (moved from routers/agent.py)
 # ---------------------------------------------------------------------------
 
-def _trace_step(phase: str, title: str, detail: str | None = None, level: str = "info") -> dict:
-    return {
-        "ts": datetime.now().isoformat(timespec="seconds"),
-        "phase": phase,
+def _trace_step(sp: tracing.Span, title: str, detail: str | None = None, level: str = "info") -> dict:
+    """由 span 派生一条 trace 步骤：瞬时事件取其时间，计时 span 取结束时间并带 ``duration_ms``。"""
+    step = {
+        "ts": datetime.fromtimestamp(sp.wall if sp.kind == "event" else sp.end_wall).isoformat(timespec="milliseconds"),
+        "phase": sp.phase,
         "title": title,
         "detail": detail or "",
         "level": level,
+        "trace_id": sp.trace.trace_id if sp.trace is not None else None,
+        "span_id": sp.span_id or None,
     }
+    if sp.kind == "span":
+        step["duration_ms"] = sp.duration_ms
+    return step
 
 
 def _short_url(url: str) -> str:
@@ -117,10 +122,13 @@ def kb_image_paths_to_urls(paths: List[str]) -> List[str]:
 class AgentPipeline:
     """Encapsulates all business logic for the ``/api/agent`` endpoints.
 
-    A new instance should be created **per-request**.
+    A new instance should be created **per-request**. ``mode`` selects the KB_QUERY tier
+    (fast / balanced / thorough, see ``services.kb_modes``); it also decides whether a new
+    conversation's intent may be routed by LLM.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, mode: Optional[str] = None) -> None:
+        self._mode = kb_modes.resolve(mode)
         self._trace_steps: List[dict] = []
         self._llm_chat_short = (
             _short_url(f"{settings.llm_base_url.rstrip('/')}/chat/completions")
@@ -132,16 +140,25 @@ class AgentPipeline:
     # -- helpers --------------------------------------------------------
 
     def _emit(self, phase: str, title: str, detail: str | None = None, level: str = "info") -> PipelineEvent:
-        step = _trace_step(phase, title, detail, level)
+        sp = tracing.event(title, phase, detail=detail, level=level if level != "info" else None)
+        step = _trace_step(sp, title, detail, level)
         self._trace_steps.append(step)
         return {"type": "trace", "data": step}
 
-    def _save_trace(self, conv_id: str) -> None:
-        add_message(
+    def _emit_span(self, sp: tracing.Span, label: str = "完成", level: str = "info", **kvs: object) -> PipelineEvent:
+        """一个结束的 span 对应的 trace 步骤（``<span 名> · <label>``），结果属性同时记到 span 上。"""
+        sp.set(**{k: v for k, v in kvs.items() if not isinstance(v, str) or v.strip()})
+        step = _trace_step(sp, f"{sp.name} · {label}", _kv_detail(**kvs, duration_ms=sp.duration_ms), level)
+        self._trace_steps.append(step)
+        return {"type": "trace", "data": step}
+
+    async def _save_trace(self, conv_id: str) -> None:
+        # 传入快照，JSON 序列化推迟到写后队列落盘时在 DB 线程中完成
+        await message_log.add_message(
             conv_id,
             role="assistant",
             payload_type="TRACE",
-            content=json.dumps(self._trace_steps, ensure_ascii=False),
+            content=list(self._trace_steps),
         )
 
     def _llm_configured(self) -> bool:
@@ -166,6 +183,32 @@ class AgentPipeline:
         image_paths: Optional[List[str]] = None,
     ) -> AsyncGenerator[PipelineEvent, None]:
         """Async generator yielding pipeline events (trace / final / error)."""
+        # 每个请求一个会话 identity map：同一会话在本请求内只加载一次；每个请求一个 trace
+        with orch.session_scope(), tracing.trace(
+            "agent.pipeline", phase="PIPELINE", session_id=session_id, images=len(image_paths or [])
+        ) as tr:
+            try:
+                async for event in self._process(text, session_id, image_paths):
+                    data = event.get("data")
+                    if event["type"] == "final" and isinstance(data, dict):
+                        tr.root.set(payload_type=data.get("payloadType"), intent=data.get("intent"))
+                    elif event["type"] == "error" and tr.root is not None:
+                        tr.root.status = "error"
+                        if isinstance(data, dict):
+                            tr.root.set(error=data.get("message"), status_code=data.get("status_code"))
+                    yield event
+            except asyncio.CancelledError:
+                # 客户端断开 / 超过截止时间（backend.request_scope）：原因记到 trace 上
+                if tr.root is not None and request_scope.reason():
+                    tr.root.set(cancel_reason=request_scope.reason())
+                raise
+
+    async def _process(
+        self,
+        text: str,
+        session_id: Optional[str],
+        image_paths: Optional[List[str]],
+    ) -> AsyncGenerator[PipelineEvent, None]:
         conv_id_for_trace: Optional[str] = None
 
         try:
@@ -180,49 +223,54 @@ class AgentPipeline:
                     yield event
                 return
 
-            # Existing session: load and advance
-            yield self._emit(
-                "INTENT",
-                "services.orchestrator_controller.get_session · 加载会话",
-                _kv_detail(session_id=session_id),
-            )
-            sess = orch.get_session(session_id)
-            if not sess:
-                yield {"type": "error", "data": {"message": "session 不存在或已过期", "status_code": 404}}
-                return
-            conv_id_for_trace = sess.session_id
-            yield self._emit(
-                "INTENT",
-                "services.orchestrator_controller · 会话状态",
-                _kv_detail(state=sess.state),
-            )
-
-            if sess.state in ("WAITING_ANSWERS", "COLLECT"):
-                async for event in self._handle_answer(sess, text):
-                    yield event
-            elif sess.state in ("DRAFT_READY", "CONFIRMING"):
-                async for event in self._handle_confirm(sess, text):
-                    yield event
-            elif sess.state == "DEFENDING":
-                async for event in self._handle_defend(sess, text):
-                    yield event
-            else:
-                yield self._emit("INTENT", "services.orchestrator_controller · 会话已完成", level="warn")
-                self._save_trace(sess.session_id)
-                add_message(sess.session_id, role="assistant", payload_type="INFO",
-                            content="会话已完成，更多能力将在后续版本中提供。")
-                yield {"type": "final", "data": {
-                    "sessionId": sess.session_id,
-                    "intent": Intent.ORCH_FLOW.value,
-                    "payloadType": "INFO",
-                    "content": {"message": "会话已完成，更多能力将在后续版本中提供。"},
-                }}
-
+            # Existing session: load and advance. 同一会话的请求在进程内排队，上一轮保存后再加载最新版本
+            async with session_locks.hold(session_id, timeout=settings.session_lock_timeout_seconds):
+                yield self._emit(
+                    "INTENT",
+                    "services.orchestrator_controller.get_session · 加载会话",
+                    _kv_detail(session_id=session_id),
+                )
+                sess = await orch.get_session(session_id)
+                if not sess:
+                    yield {"type": "error", "data": {"message": "session 不存在或已过期", "status_code": 404}}
+                    return
+                conv_id_for_trace = sess.session_id
+                yield self._emit(
+                    "INTENT",
+                    "services.orchestrator_controller · 会话状态",
+                    _kv_detail(state=sess.state),
+                )
+
+                if sess.state in ("WAITING_ANSWERS", "COLLECT"):
+                    async for event in self._handle_answer(sess, text):
+                        yield event
+                elif sess.state in ("DRAFT_READY", "CONFIRMING"):
+                    async for event in self._handle_confirm(sess, text):
+                        yield event
+                elif sess.state == "DEFENDING":
+                    async for event in self._handle_defend(sess, text):
+                        yield event
+                else:
+                    yield self._emit("INTENT", "services.orchestrator_controller · 会话已完成", level="warn")
+                    await self._save_trace(sess.session_id)
+                    await message_log.add_message(sess.session_id, role="assistant", payload_type="INFO",
+                                                  content="会话已完成，更多能力将在后续版本中提供。")
+                    yield {"type": "final", "data": {
+                        "sessionId": sess.session_id,
+                        "intent": Intent.ORCH_FLOW.value,
+                        "payloadType": "INFO",
+                        "content": {"message": "会话已完成，更多能力将在后续版本中提供。"},
+                    }}
+
+        except SessionBusyError:
+            yield {"type": "error", "data": {"message": "该会话正在处理上一条请求，请稍后重试", "status_code": 409}}
+        except SessionConflictError:
+            yield {"type": "error", "data": {"message": "会话已被其它请求更新，请刷新后重新发送", "status_code": 409}}
         except Exception as e:
             yield {"type": "error", "data": {"message": str(e), "status_code": 500}}
             try:
                 if conv_id_for_trace:
-                    self._save_trace(conv_id_for_trace)
+                    await self._save_trace(conv_id_for_trace)
             except Exception:
                 pass
 
@@ -237,14 +285,19 @@ class AgentPipeline:
         Raises :class:`PipelineError` on error events.
         """
         result: Optional[dict] = None
-        async for event in self.process(text, session_id, image_paths):
-            if event["type"] == "final":
-                result = event["data"]
-            elif event["type"] == "error":
-                data = event.get("data") or {}
-                msg = data.get("message", "Pipeline error") if isinstance(data, dict) else str(data)
-                status = data.get("status_code", 500) if isinstance(data, dict) else 500
-                raise PipelineError(str(msg), status_code=int(status))
+        events = self.process(text, session_id, image_paths)
+        try:
+            async for event in events:
+                if event["type"] == "final":
+                    result = event["data"]
+                elif event["type"] == "error":
+                    data = event.get("data") or {}
+                    msg = data.get("message", "Pipeline error") if isinstance(data, dict) else str(data)
+                    status = data.get("status_code", 500) if isinstance(data, dict) else 500
+                    raise PipelineError(str(msg), status_code=int(status))
+        finally:
+            # 立即关闭生成器，释放其持有的会话锁
+            await events.aclose()
         if result is None:
             raise PipelineError("Pipeline produced no final event")
         return result
@@ -256,16 +309,26 @@ class AgentPipeline:
         text: str,
         image_paths: Optional[List[str]],
     ) -> AsyncGenerator[PipelineEvent, None]:
-        t_intent = time.time()
-        intent, intent_method = await detect_intent_hybrid(text)
-        yield self._emit(
-            "INTENT",
-            "services.intent_router.detect_intent_hybrid · 完成",
-            _kv_detail(intent=intent.value, method=intent_method, duration_ms=int((time.time() - t_intent) * 1000)),
+        expanded_queries: Optional[List[str]] = None
+        if self._mode.local_intent:
+            # fast 模式：不为意图付一次 LLM 往返
+            with tracing.span("services.intent_router.detect_intent_local", "INTENT") as sp:
+                intent, intent_method = detect_intent_local(text)
+        else:
+            with tracing.span("services.intent_router.detect_intent_with_expansion", "INTENT") as sp:
+                intent, intent_method, expanded_queries = await detect_intent_with_expansion(
+                    text, max_queries=self._mode.max_subqueries
+                )
+        yield self._emit_span(
+            sp,
+            intent=intent.value,
+            method=intent_method,
+            mode=self._mode.name,
+            fused_queries=(len(expanded_queries) if expanded_queries is not None else None),
         )
 
         if intent is Intent.KB_QUERY:
-            async for event in self._handle_kb_query(text, image_paths, intent):
+            async for event in self._handle_kb_query(text, image_paths, intent, expanded_queries):
                 yield event
         else:
             async for event in self._handle_new_orch(text, intent):
@@ -276,6 +339,7 @@ class AgentPipeline:
         text: str,
         image_paths: Optional[List[str]],
         intent: Intent,
+        expanded_queries: Optional[List[str]] = None,
     ) -> AsyncGenerator[PipelineEvent, None]:
         yield self._emit(
             "KB",
@@ -283,13 +347,17 @@ class AgentPipeline:
             _kv_detail(
                 target="internal",
                 has_query_image=bool(image_paths),
+                mode=self._mode.name,
                 llm_enabled=bool(getattr(settings, "kb_query_llm_enabled", True)),
-                max_subqueries=getattr(settings, "kb_query_max_subqueries", 4),
+                max_subqueries=self._mode.max_subqueries,
+                reuse_fused_queries=expanded_queries is not None,
             ),
         )
-        t_kb = time.time()
         try:
-            result = await enhanced_kb_query(text, image_paths or None)
+            with tracing.span("services.kb_query_enhanced.enhanced_kb_query", "KB") as sp:
+                result = await enhanced_kb_query(
+                    text, image_paths or None, expanded_queries=expanded_queries, mode=self._mode.name
+                )
         except KBQueryError as exc:
             yield {"type": "error", "data": {"message": str(exc), "status_code": 500}}
             return
@@ -300,23 +368,20 @@ class AgentPipeline:
         used_llm = bool(result.get("used_llm"))
         image_urls = kb_image_paths_to_urls(list(result.get("image_paths") or []))
 
-        yield self._emit(
-            "KB",
-            "services.kb_query_enhanced.enhanced_kb_query · 完成",
-            _kv_detail(
-                images=len(image_urls),
-                used_llm=used_llm,
-                subqueries=(len(sub_queries) if isinstance(sub_queries, list) else 0),
-                duration_ms=int((time.time() - t_kb) * 1000),
-            ),
+        yield self._emit_span(
+            sp,
+            images=len(image_urls),
+            used_llm=used_llm,
+            cached=bool(result.get("cached")),
+            subqueries=(len(sub_queries) if isinstance(sub_queries, list) else 0),
         )
 
         conv_id = uuid.uuid4().hex
-        create_conversation(conv_id, intent=intent.value, status="done")
-        add_message(conv_id, role="user", payload_type="USER_QUERY", content=text)
-        self._save_trace(conv_id)
-        add_message(conv_id, role="assistant", payload_type="KB_ANSWER",
-                    content=final_markdown or "[空结果]")
+        await message_log.create_conversation(conv_id, intent=intent.value, status="done")
+        await message_log.add_message(conv_id, role="user", payload_type="USER_QUERY", content=text)
+        await self._save_trace(conv_id)
+        await message_log.add_message(conv_id, role="assistant", payload_type="KB_ANSWER",
+                                      content=final_markdown or "[空结果]")
 
         content = {
             "markdown": final_markdown,
@@ -325,6 +390,8 @@ class AgentPipeline:
             "subQueries": sub_queries,
             "rawMarkdown": raw_markdown,
             "kbRuns": result.get("kb_runs") or [],
+            "mode": result.get("mode") or self._mode.name,
+            "cached": bool(result.get("cached")),
         }
         yield {"type": "final", "data": {
             "sessionId": None,
@@ -335,7 +402,7 @@ class AgentPipeline:
 
     async def _handle_new_orch(self, text: str, intent: Intent) -> AsyncGenerator[PipelineEvent, None]:
         yield self._emit("COLLECT", "services.orchestrator_controller.create_session · 创建会话")
-        sess = orch.create_session(user_request=text)
+        sess = await orch.create_session(user_request=text)
         lh = self._llm_hint()
         yield self._emit(
             "COLLECT",
@@ -348,20 +415,16 @@ class AgentPipeline:
                 llm_model=(settings.llm_model if self._llm_configured() else ""),
             ),
         )
-        t_collect = time.time()
-        questions = await orch.get_open_questions(sess)
-        yield self._emit(
-            "COLLECT",
-            "services.orchestrator_controller.get_open_questions · 完成",
-            _kv_detail(questions=len(questions), duration_ms=int((time.time() - t_collect) * 1000)),
-        )
+        with tracing.span("services.orchestrator_controller.get_open_questions", "COLLECT") as sp:
+            questions = await orch.get_open_questions(sess)
+        yield self._emit_span(sp, questions=len(questions))
 
-        create_conversation(sess.session_id, intent=intent.value, status="active")
-        add_message(sess.session_id, role="user", payload_type="USER_REQUEST", content=text)
-        self._save_trace(sess.session_id)
+        await message_log.create_conversation(sess.session_id, intent=intent.value, status="active")
+        await message_log.add_message(sess.session_id, role="user", payload_type="USER_REQUEST", content=text)
+        await self._save_trace(sess.session_id)
         if questions:
             joined = "\n".join(f"{i+1}. {q}" for i, q in enumerate(questions))
-            add_message(sess.session_id, role="assistant", payload_type="OPEN_QUESTIONS", content=joined)
+            await message_log.add_message(sess.session_id, role="assistant", payload_type="OPEN_QUESTIONS", content=joined)
 
         yield {"type": "final", "data": {
             "sessionId": sess.session_id,
@@ -387,17 +450,13 @@ class AgentPipeline:
                 image_gen_model=(getattr(settings, "image_gen_model", "") if (ih and "http:POST" in ih) else ""),
             ),
         )
-        add_message(sess.session_id, role="user", payload_type="USER_ANSWER", content=text)
-        t_build = time.time()
-        sess, _ = await orch.answer_questions(sess.session_id, text)
-        display_result = confirmer_get_display(sess.draft_struct)
-        yield self._emit(
-            "BUILD_DRAFT",
-            "services.orchestrator_controller.answer_questions · 完成",
-            _kv_detail(duration_ms=int((time.time() - t_build) * 1000)),
-        )
-        self._save_trace(sess.session_id)
-        add_message(sess.session_id, role="assistant", payload_type="DRAFT", content=display_result.display_content)
+        await message_log.add_message(sess.session_id, role="user", payload_type="USER_ANSWER", content=text)
+        with tracing.span("services.orchestrator_controller.answer_questions", "BUILD_DRAFT") as sp:
+            sess, _ = await orch.answer_questions(sess.session_id, text)
+            display_result = await executors.cpu.run(confirmer_get_display, sess.draft_struct)
+        yield self._emit_span(sp)
+        await self._save_trace(sess.session_id)
+        await message_log.add_message(sess.session_id, role="assistant", payload_type="DRAFT", content=display_result.display_content)
 
         yield {"type": "final", "data": {
             "sessionId": sess.session_id,
@@ -422,19 +481,15 @@ class AgentPipeline:
                 llm_model=(settings.llm_model if self._llm_configured() else ""),
             ),
         )
-        add_message(sess.session_id, role="user", payload_type="USER_FEEDBACK", content=text)
-        t_confirm = time.time()
-        parse_result = await confirmer_parse_feedback(sess.draft_struct, text)
-        yield self._emit(
-            "CONFIRM",
-            "services.confirmer_service.parse_feedback · 完成",
-            _kv_detail(status=parse_result.status, duration_ms=int((time.time() - t_confirm) * 1000)),
-        )
+        await message_log.add_message(sess.session_id, role="user", payload_type="USER_FEEDBACK", content=text)
+        with tracing.span("services.confirmer_service.parse_feedback", "CONFIRM") as sp:
+            parse_result = await confirmer_parse_feedback(sess.draft_struct, text)
+        yield self._emit_span(sp, status=parse_result.status)
 
         if parse_result.status == "needs_clarification" and parse_result.clarification_question:
-            self._save_trace(sess.session_id)
-            add_message(sess.session_id, role="assistant", payload_type="OPEN_QUESTIONS",
-                        content=parse_result.clarification_question)
+            await self._save_trace(sess.session_id)
+            await message_log.add_message(sess.session_id, role="assistant", payload_type="OPEN_QUESTIONS",
+                                          content=parse_result.clarification_question)
             yield {"type": "final", "data": {
                 "sessionId": sess.session_id,
                 "intent": Intent.ORCH_FLOW.value,
@@ -448,17 +503,13 @@ class AgentPipeline:
             sess = await orch.redo_full(sess.session_id)
             # 重新走 COLLECT → open_questions
             yield self._emit("COLLECT", "services.orchestrator_controller.get_open_questions · 重做开始")
-            t_redo = time.time()
-            questions = await orch.get_open_questions(sess)
-            yield self._emit(
-                "COLLECT",
-                "services.orchestrator_controller.get_open_questions · 重做完成",
-                _kv_detail(questions=len(questions), duration_ms=int((time.time() - t_redo) * 1000)),
-            )
-            self._save_trace(sess.session_id)
+            with tracing.span("services.orchestrator_controller.get_open_questions", "COLLECT", redo=True) as sp:
+                questions = await orch.get_open_questions(sess)
+            yield self._emit_span(sp, "重做完成", questions=len(questions))
+            await self._save_trace(sess.session_id)
             if questions:
                 joined = "\n".join(f"{i+1}. {q}" for i, q in enumerate(questions))
-                add_message(sess.session_id, role="assistant", payload_type="OPEN_QUESTIONS", content=joined)
+                await message_log.add_message(sess.session_id, role="assistant", payload_type="OPEN_QUESTIONS", content=joined)
             yield {"type": "final", "data": {
                 "sessionId": sess.session_id,
                 "intent": Intent.ORCH_FLOW.value,
@@ -482,8 +533,8 @@ class AgentPipeline:
             )
             sess = await orch.redo_partial(sess.session_id, scope)
             msg = f"已清空「{scope_label}」部分，请补充说明后重新生成该部分（回复您的补充信息）。"
-            self._save_trace(sess.session_id)
-            add_message(sess.session_id, role="assistant", payload_type="INFO", content=msg)
+            await self._save_trace(sess.session_id)
+            await message_log.add_message(sess.session_id, role="assistant", payload_type="INFO", content=msg)
             yield {"type": "final", "data": {
                 "sessionId": sess.session_id,
                 "intent": Intent.ORCH_FLOW.value,
@@ -498,7 +549,7 @@ class AgentPipeline:
                 if isinstance(val, str):
                     br[key] = val
         sess.state = "DEFENDING"
-        orch.persist_session(sess)
+        await orch.persist_session(sess)
 
         async for event in self._defend_and_maybe_finalize(sess):
             yield event
@@ -509,27 +560,23 @@ class AgentPipeline:
             "services.orchestrator_controller.apply_defend_answers · 应用补充说明",
             _kv_detail(target="internal"),
         )
-        add_message(sess.session_id, role="user", payload_type="USER_DEFEND", content=text)
-        sess = orch.apply_defend_answers(sess.session_id, text)
+        await message_log.add_message(sess.session_id, role="user", payload_type="USER_DEFEND", content=text)
+        sess = await orch.apply_defend_answers(sess.session_id, text)
         async for event in self._defend_and_maybe_finalize(sess):
             yield event
 
     async def _defend_and_maybe_finalize(self, sess: orch.OrchestratorSession) -> AsyncGenerator[PipelineEvent, None]:
         yield self._emit("DEFEND", "services.defender_service.check_draft · 开始")
-        t_defend = time.time()
-        result = check_draft(sess.draft_struct)
-        yield self._emit(
-            "DEFEND",
-            "services.defender_service.check_draft · 完成",
-            _kv_detail(is_complete=result.is_complete, duration_ms=int((time.time() - t_defend) * 1000)),
-        )
+        with tracing.span("services.defender_service.check_draft", "DEFEND") as sp:
+            result = check_draft(sess.draft_struct)
+        yield self._emit_span(sp, is_complete=result.is_complete)
 
         if not result.is_complete and result.questions:
             sess.last_defend_questions = result.questions
-            orch.persist_session(sess)
+            await orch.persist_session(sess)
             joined = "\n".join(f"{i+1}. {q}" for i, q in enumerate(result.questions))
-            self._save_trace(sess.session_id)
-            add_message(sess.session_id, role="assistant", payload_type="OPEN_QUESTIONS", content=joined)
+            await self._save_trace(sess.session_id)
+            await message_log.add_message(sess.session_id, role="assistant", payload_type="OPEN_QUESTIONS", content=joined)
             yield self._emit(
                 "DEFEND",
                 "services.defender_service.check_draft · 待补充信息",
@@ -545,18 +592,14 @@ class AgentPipeline:
             return
 
         yield self._emit("EDITOR", "services.editor_service.render_final · 开始")
-        t_edit = time.time()
-        final_md = render_final(sess.draft_struct)
-        yield self._emit(
-            "EDITOR",
-            "services.editor_service.render_final · 完成",
-            _kv_detail(duration_ms=int((time.time() - t_edit) * 1000)),
-        )
-        self._save_trace(sess.session_id)
-        add_message(sess.session_id, role="assistant", payload_type="FINAL_DOC", content=final_md)
-        update_conversation_status(sess.session_id, status="done")
+        with tracing.span("services.editor_service.render_final", "EDITOR") as sp:
+            final_md = await executors.cpu.run(render_final, sess.draft_struct)
+        yield self._emit_span(sp)
+        await self._save_trace(sess.session_id)
+        await message_log.add_message(sess.session_id, role="assistant", payload_type="FINAL_DOC", content=final_md)
+        await message_log.update_conversation_status(sess.session_id, status="done")
         sess.state = "DONE"
-        orch.persist_session(sess)
+        await orch.persist_session(sess)
 
         yield {"type": "final", "data": {
             "sessionId": sess.session_id,
@@ -0,0 +1,193 @@
+"""会话大字段的内容寻址 blob 存储。
+
+``OrchestratorSession.knowledge_markdown``（多 MB 的 KB 文本，且每轮追加）原先内联在 session_data JSON 中，
+每次 ``_persist`` 都整体重新序列化、重新写入，即使只改了 state。这里：
+
+- 不短于 ``RS_AGENT_BLOB_MIN_CHARS`` 个字符的字段按 sha256 存入 ``blobs`` 表一次（zlib；装了 ``zstandard`` 时可选 zstd），
+  session_data 中只保留引用 ``{"$blob": "<sha256>"}``；内容不变时后续保存不再写 blob，只写约 1KB 的会话 JSON；
+- :class:`BlobField` 作为 dataclass 字段描述符：从库中加载的会话只持有引用，首次访问字段时才读取并解压；
+- blob 不可变，解压后的文本按哈希做进程内 LRU 缓存；
+- ``session_blobs`` 记录会话引用，:func:`gc` 删除无人引用的 blob（由后台会话清理任务定期调用）。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from backend import db
+from backend.config import settings
+
+try:
+    import zstandard as _zstd
+except ImportError:  # pragma: no cover - zstandard 为可选依赖
+    _zstd = None
+
+_BLOB_KEY = "$blob"
+_TEXT_CACHE_SIZE = 16
+
+
+class BlobRef(NamedTuple):
+    """尚未加载的 blob 引用。"""
+
+    digest: str
+
+
+def digest_of(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress(text: str) -> Tuple[str, bytes]:
+    raw = text.encode("utf-8")
+    if settings.blob_codec == "zstd" and _zstd is not None:
+        return "zstd", _zstd.ZstdCompressor(level=3).compress(raw)
+    return "zlib", zlib.compress(raw, 6)
+
+
+def decompress(codec: str, data: bytes) -> str:
+    if codec == "zstd":
+        if _zstd is None:
+            raise RuntimeError("blob is zstd-compressed but the zstandard package is not installed")
+        return _zstd.ZstdDecompressor().decompress(data).decode("utf-8")
+    if codec == "zlib":
+        return zlib.decompress(data).decode("utf-8")
+    raise ValueError(f"unknown blob codec: {codec}")
+
+
+_LOCK = threading.Lock()
+_TEXT_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_STATS: Dict[str, int] = {
+    "loads": 0,
+    "cache_hits": 0,
+    "blobs_written": 0,
+    "blob_bytes_written": 0,
+    "persists": 0,
+    "session_bytes_written": 0,
+}
+
+
+def _count(**deltas: int) -> None:
+    with _LOCK:
+        for key, value in deltas.items():
+            _STATS[key] += value
+
+
+def load_text(digest: str) -> str:
+    """按哈希读取并解压 blob（进程内 LRU 缓存）；blob 不存在时抛出 LookupError。"""
+    with _LOCK:
+        text = _TEXT_CACHE.get(digest)
+        if text is not None:
+            _TEXT_CACHE.move_to_end(digest)
+            _STATS["cache_hits"] += 1
+            return text
+    row = db.get_blob(digest)
+    if row is None:
+        raise LookupError(f"blob {digest} not found")
+    text = decompress(*row)
+    with _LOCK:
+        _STATS["loads"] += 1
+        _TEXT_CACHE[digest] = text
+        while len(_TEXT_CACHE) > _TEXT_CACHE_SIZE:
+            _TEXT_CACHE.popitem(last=False)
+    return text
+
+
+class BlobField:
+    """dataclass 字段描述符：值为内联 str，或从库中加载时的 :class:`BlobRef`（首次读取时才加载）。
+
+    另记录 (文本对象, 哈希, 是否已落库)：文本未被重新赋值时，保存既不重新计算哈希也不重写 blob。
+    """
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = name
+        self._value = f"_blob_{name}"
+        self._memo = f"_blob_{name}_memo"
+
+    def __get__(self, obj: Any, owner: Optional[type] = None) -> Any:
+        if obj is None:
+            return ""  # dataclass 默认值
+        value = obj.__dict__.get(self._value, "")
+        if isinstance(value, BlobRef):
+            text = load_text(value.digest)
+            obj.__dict__[self._value] = text
+            obj.__dict__[self._memo] = (text, value.digest, True)
+            return text
+        return value
+
+    def __set__(self, obj: Any, value: Any) -> None:
+        obj.__dict__[self._value] = value
+
+    # -- persistence helpers --------------------------------------------
+
+    def is_loaded(self, obj: Any) -> bool:
+        return not isinstance(obj.__dict__.get(self._value, ""), BlobRef)
+
+    def encode(self, obj: Any) -> Tuple[Any, Optional[str], Optional[str]]:
+        """返回 (session_data 中的取值, 引用的哈希或 None, 内存中的文本或 None)；未加载的引用保持不加载。"""
+        value = obj.__dict__.get(self._value, "")
+        if isinstance(value, BlobRef):
+            return {_BLOB_KEY: value.digest}, value.digest, None
+        text = value or ""
+        if len(text) < settings.blob_min_chars:
+            return text, None, None
+        memo = obj.__dict__.get(self._memo)
+        if memo is None or memo[0] is not text:
+            memo = (text, digest_of(text), False)
+            obj.__dict__[self._memo] = memo
+        return {_BLOB_KEY: memo[1]}, memo[1], text
+
+    def needs_write(self, obj: Any) -> bool:
+        memo = obj.__dict__.get(self._memo)
+        return memo is None or not memo[2]
+
+    def mark_stored(self, obj: Any, digest: str) -> None:
+        memo = obj.__dict__.get(self._memo)
+        if memo is not None and memo[1] == digest:
+            obj.__dict__[self._memo] = (memo[0], digest, True)
+
+
+def decode_value(value: Any) -> Any:
+    """session_data 中的取值 → 内联 str 或 :class:`BlobRef`（兼容旧的内联格式）。"""
+    if isinstance(value, dict) and isinstance(value.get(_BLOB_KEY), str):
+        return BlobRef(value[_BLOB_KEY])
+    return value
+
+
+def encode_rows(texts: Dict[str, str]) -> List[Tuple[str, str, int, bytes]]:
+    """{哈希: 文本} → ``db.save_session`` 所需的 (hash, codec, size, data) 行（在 DB 线程中压缩）。"""
+    rows = []
+    for digest, text in texts.items():
+        codec, data = compress(text)
+        rows.append((digest, codec, len(text.encode("utf-8")), data))
+    return rows
+
+
+def record_write(session_bytes: int, rows: List[Tuple[str, str, int, bytes]]) -> None:
+    """记录一次会话保存写入的会话 JSON 字节数与 blob 行。"""
+    _count(
+        persists=1,
+        session_bytes_written=session_bytes,
+        blobs_written=len(rows),
+        blob_bytes_written=sum(len(r[3]) for r in rows),
+    )
+
+
+def gc() -> int:
+    """删除无人引用的 blob，返回删除数量。"""
+    return db.gc_orphan_blobs()
+
+
+def stats() -> Dict[str, Any]:
+    with _LOCK:
+        counters = dict(_STATS)
+        cached = len(_TEXT_CACHE)
+    persists = counters["persists"]
+    return {
+        **counters,
+        "codec": "zstd" if (settings.blob_codec == "zstd" and _zstd is not None) else "zlib",
+        "avg_session_bytes": round(counters["session_bytes_written"] / persists, 1) if persists else 0.0,
+        "text_cache": cached,
+    }
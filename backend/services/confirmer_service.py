@@ -6,11 +6,26 @@ from dataclasses import dataclass, field
 from typing import Any, Dict, Optional
 
 from backend.services.llm_service import llm_confirmer_parse
+from backend.utils.keyword_matcher import KeywordMatcher
 from backend.utils.text import sanitize_draft_text
 
 
 DEFAULT_PROMPT = "请确认以上内容是否无误，确认后将继续做完整性检查并生成最终文档。"
 
+# LLM 不可用时的关键词回退：用户回复只扫描一遍，得到全部类别命中
+_FEEDBACK_MATCHER = KeywordMatcher(
+    {
+        "redo_full": ("整体重做", "全部重做", "重新生成", "从头再来"),
+        "redo_partial": ("只改业务需求", "只改系统现状", "只改系统改动点", "只改业务", "只改现状", "只改改动点"),
+        "redo": ("重做",),
+        "part": ("一块", "部分", "一段"),
+        "scope_business": ("业务",),
+        "scope_current": ("现状",),
+        "confirm": ("确认", "没问题", "OK", "ok", "好", "可以", "无异议", "通过"),
+        "negative": ("不", "有问", "错", "改"),
+    }
+)
+
 
 @dataclass
 class ConfirmerDisplayResult:
@@ -206,8 +221,9 @@ async def parse_feedback(draft_output: dict, user_message: str) -> ConfirmerPars
         logging.getLogger(__name__).warning("LLM llm_confirmer_parse 调用失败，已回退到关键词规则: %s", e)
 
     # === 回退逻辑（原实现） ===
+    cats = _FEEDBACK_MATCHER.categories(msg)
     # request_redo_full
-    if any(k in msg for k in ("整体重做", "全部重做", "重新生成", "从头再来")):
+    if "redo_full" in cats:
         return ConfirmerParseResult(
             status="request_redo_full",
             user_message=user_message or "",
@@ -215,14 +231,17 @@ async def parse_feedback(draft_output: dict, user_message: str) -> ConfirmerPars
         )
 
     # request_redo_partial
-    if any(k in msg for k in ("只改业务需求", "只改系统现状", "只改系统改动点", "只改业务", "只改现状", "只改改动点")):
-        scope = "business_requirement" if "业务" in msg else ("system_current" if "现状" in msg else "system_changes")
+    if "redo_partial" in cats:
+        scope = (
+            "business_requirement" if "scope_business" in cats
+            else ("system_current" if "scope_current" in cats else "system_changes")
+        )
         return ConfirmerParseResult(
             status="request_redo_partial",
             user_message=user_message or "",
             redo_scope=scope,
         )
-    if "重做" in msg and ("一块" in msg or "部分" in msg or "一段" in msg):
+    if "redo" in cats and "part" in cats:
         return ConfirmerParseResult(
             status="request_redo_partial",
             user_message=user_message or "",
@@ -230,11 +249,11 @@ async def parse_feedback(draft_output: dict, user_message: str) -> ConfirmerPars
         )
 
     # confirmed
-    if not msg or any(k in msg for k in ("确认", "没问题", "OK", "ok", "好", "可以", "无异议", "通过")):
+    if not msg or "confirm" in cats:
         return ConfirmerParseResult(status="confirmed", user_message=user_message or "")
 
     # needs_clarification: 很短且像否定
-    if len(msg) <= 4 and any(k in msg for k in ("不", "有问", "错", "改")):
+    if len(msg) <= 4 and "negative" in cats:
         return ConfirmerParseResult(
             status="needs_clarification",
             user_message=user_message or "",
@@ -1,24 +1,31 @@
 """LLM 文生图服务：调用 DashScope 万相生成流程图 PNG，保存到静态目录并返回可访问 URL。
 
 P0-3: uses ``httpx.AsyncClient`` for non-blocking HTTP.
+生成与下载的超时不超过请求剩余时间（``backend.request_scope``）；请求已被取消时不再发起，取消时立即停止等待。
 """
 
 from __future__ import annotations
 
+import asyncio
 import logging
 import re
+import time
 import uuid
 from pathlib import Path
 from typing import Optional
 
 import httpx
 
+from backend import request_scope
 from backend.config import settings
 
 logger = logging.getLogger(__name__)
 
 # 文生图 prompt 最大长度（万相限制约 2100 字符）
 PROMPT_MAX_LEN = 2000
+# 生成请求与下载图片的超时（秒）
+GENERATE_TIMEOUT = 90.0
+DOWNLOAD_TIMEOUT = 30.0
 
 
 def _strip_mermaid_from_description(description: str) -> str:
@@ -35,7 +42,7 @@ async def generate_flowchart_image(flow_description: str) -> Optional[str]:
 
     若未配置 API、请求失败或保存失败则返回 None。
     """
-    if not getattr(settings, "image_gen_enabled", True):
+    if not getattr(settings, "image_gen_enabled", True) or request_scope.is_cancelled():
         return None
     if not settings.llm_api_key:
         logger.warning("文生图未配置 API Key，跳过流程图生成")
@@ -67,11 +74,19 @@ async def generate_flowchart_image(flow_description: str) -> Optional[str]:
         "Authorization": f"Bearer {settings.llm_api_key}",
         "Content-Type": "application/json",
     }
+    started = time.monotonic()
     try:
-        async with httpx.AsyncClient(timeout=httpx.Timeout(90.0)) as client:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(request_scope.cap(GENERATE_TIMEOUT))) as client:
             resp = await client.post(url, headers=headers, json=payload)
         resp.raise_for_status()
         data = resp.json()
+    except asyncio.CancelledError:
+        request_scope.note(
+            "image_gen",
+            ran_ms=round((time.monotonic() - started) * 1000, 1),
+            wait_saved_s=round(max(0.0, GENERATE_TIMEOUT - (time.monotonic() - started)), 1),
+        )
+        raise
     except Exception as e:
         logger.warning("文生图请求失败: %s", e)
         return None
@@ -96,7 +111,7 @@ async def generate_flowchart_image(flow_description: str) -> Optional[str]:
     name = f"flowchart_{uuid.uuid4().hex[:12]}.png"
     out_path = out_dir / name
     try:
-        async with httpx.AsyncClient(timeout=httpx.Timeout(30.0)) as client:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(request_scope.cap(DOWNLOAD_TIMEOUT))) as client:
             r = await client.get(image_url_remote)
         r.raise_for_status()
         out_path.write_bytes(r.content)
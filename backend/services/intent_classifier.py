@@ -0,0 +1,304 @@
+"""本地轻量意图分类器：字符 n-gram 特征 + 朴素贝叶斯 / 逻辑回归（二分类线性模型）。
+
+用途：规则无法强判定时先用本地模型打分，置信度达到阈值（RS_AGENT_INTENT_CLF_THRESHOLD）直接返回，
+只有低置信度时才调用 LLM 分类，省去大部分意图兜底的 LLM 往返。
+
+- 特征：归一化文本的字符 1~3-gram，经 crc32 哈希到固定维度（默认 2^15），取二值（出现即 1）；
+- 模型：线性打分 ``bias + Σ w[idx]``，正类为 KB_QUERY，sigmoid 后得到概率；
+  朴素贝叶斯的对数似然比与逻辑回归的权重形式一致，推理代码共用；
+- 权重以 ``.npz`` 保存（float32），由 ``scripts/train_intent_classifier.py`` 离线从
+  conversations / messages 历史训练产出；文件不存在或未安装 numpy 时分类器不启用。
+
+与 LLM 的一致率按置信度分桶统计（:class:`AgreementTracker`），用于调节阈值，见 ``GET /api/diagnostics/intent``。
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+import random
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from backend.config import settings
+from backend.services.intent_router import Intent
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy 为可选依赖
+    np = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIM = 1 << 15
+DEFAULT_NGRAM_RANGE = (1, 3)
+
+
+# ---------------------------------------------------------------------------
+# Features
+# ---------------------------------------------------------------------------
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def feature_indices(text: str, dim: int = DEFAULT_DIM, ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE) -> List[int]:
+    """返回文本字符 n-gram 的哈希下标（去重，二值特征）。"""
+    s = _normalize(text)
+    lo, hi = ngram_range
+    idx = set()
+    for n in range(lo, hi + 1):
+        for i in range(len(s) - n + 1):
+            idx.add(zlib.crc32(s[i:i + n].encode("utf-8")) % dim)
+    return sorted(idx)
+
+
+def _sigmoid(z: float) -> float:
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+
+# ---------------------------------------------------------------------------
+# Model
+# ---------------------------------------------------------------------------
+
+class IntentClassifier:
+    """哈希字符 n-gram 上的二分类线性模型（正类 KB_QUERY）。"""
+
+    def __init__(
+        self,
+        weights: "np.ndarray",
+        bias: float,
+        ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE,
+        kind: str = "nb",
+        trained_samples: int = 0,
+    ) -> None:
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+        self.kind = kind
+        self.trained_samples = int(trained_samples)
+
+    @property
+    def dim(self) -> int:
+        return int(self.weights.shape[0])
+
+    def prob_kb(self, text: str) -> float:
+        idx = feature_indices(text, self.dim, self.ngram_range)
+        z = self.bias + (float(self.weights[idx].sum()) if idx else 0.0)
+        return _sigmoid(z)
+
+    def predict(self, text: str) -> Tuple[Intent, float]:
+        """返回 (intent, confidence)，confidence 为所选类别的概率（0.5~1.0）。"""
+        p = self.prob_kb(text)
+        return (Intent.KB_QUERY, p) if p >= 0.5 else (Intent.ORCH_FLOW, 1.0 - p)
+
+    # -- persistence -----------------------------------------------------
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                weights=self.weights,
+                bias=np.float32(self.bias),
+                ngram_range=np.asarray(self.ngram_range, dtype=np.int32),
+                kind=np.asarray(self.kind),
+                trained_samples=np.int64(self.trained_samples),
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "IntentClassifier":
+        with np.load(Path(path), allow_pickle=False) as data:
+            return cls(
+                weights=data["weights"],
+                bias=float(data["bias"]),
+                ngram_range=tuple(int(x) for x in data["ngram_range"]),  # type: ignore[arg-type]
+                kind=str(data["kind"]),
+                trained_samples=int(data["trained_samples"]),
+            )
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "dim": self.dim,
+            "ngram_range": list(self.ngram_range),
+            "trained_samples": self.trained_samples,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Training (offline, used by scripts/train_intent_classifier.py)
+# ---------------------------------------------------------------------------
+
+def _labels(intents: Sequence[str]) -> List[int]:
+    return [1 if str(x) == Intent.KB_QUERY.value else 0 for x in intents]
+
+
+def train_naive_bayes(
+    texts: Sequence[str],
+    intents: Sequence[str],
+    dim: int = DEFAULT_DIM,
+    ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE,
+    alpha: float = 1.0,
+) -> IntentClassifier:
+    """多项式朴素贝叶斯（二值特征 + 拉普拉斯平滑），权重为两类对数似然比。"""
+    y = _labels(intents)
+    counts = np.zeros((2, dim), dtype=np.float64)
+    for text, label in zip(texts, y):
+        counts[label, feature_indices(text, dim, ngram_range)] += 1.0
+    smoothed = counts + alpha
+    log_lik = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+    n_pos = sum(y)
+    n_neg = len(y) - n_pos
+    bias = math.log((n_pos + 1.0) / (n_neg + 1.0))
+    return IntentClassifier(log_lik[1] - log_lik[0], bias, ngram_range, kind="nb", trained_samples=len(y))
+
+
+def train_logistic_regression(
+    texts: Sequence[str],
+    intents: Sequence[str],
+    dim: int = DEFAULT_DIM,
+    ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE,
+    epochs: int = 20,
+    lr: float = 0.2,
+    l2: float = 1e-4,
+    seed: int = 0,
+) -> IntentClassifier:
+    """稀疏 SGD 逻辑回归（只更新样本出现的特征）。"""
+    y = _labels(intents)
+    feats = [feature_indices(t, dim, ngram_range) for t in texts]
+    w = np.zeros(dim, dtype=np.float64)
+    b = 0.0
+    order = list(range(len(y)))
+    rng = random.Random(seed)
+    for _ in range(max(1, epochs)):
+        rng.shuffle(order)
+        for i in order:
+            idx = feats[i]
+            g = _sigmoid(b + float(w[idx].sum())) - y[i]
+            w[idx] -= lr * (g + l2 * w[idx])
+            b -= lr * g
+    return IntentClassifier(w, b, ngram_range, kind="lr", trained_samples=len(y))
+
+
+# ---------------------------------------------------------------------------
+# Classifier / LLM agreement
+# ---------------------------------------------------------------------------
+
+class AgreementTracker:
+    """按分类器置信度分桶（0.5~1.0，步长 0.05）统计与 LLM 判定的一致率。"""
+
+    _STEP = 0.05
+
+    def __init__(self) -> None:
+        self._buckets: Dict[float, List[int]] = {}
+        self._score_calls = 0
+        self._score_seconds = 0.0
+        self._decided_locally = 0
+
+    def _bucket(self, confidence: float) -> float:
+        lower = math.floor(max(0.5, min(confidence, 0.9999)) / self._STEP) * self._STEP
+        return round(lower, 2)
+
+    def record(self, clf_intent: Intent, confidence: float, llm_intent: Intent) -> None:
+        b = self._buckets.setdefault(self._bucket(confidence), [0, 0])
+        b[0] += 1
+        if clf_intent == llm_intent:
+            b[1] += 1
+
+    def record_score(self, seconds: float, decided_locally: bool) -> None:
+        self._score_calls += 1
+        self._score_seconds += seconds
+        if decided_locally:
+            self._decided_locally += 1
+
+    def suggested_threshold(self, target: float = 0.95, min_samples: int = 20) -> Optional[float]:
+        """返回最低的桶下界，使其以上所有桶合计一致率 ≥ target；样本不足返回 None。"""
+        total = agree = 0
+        best: Optional[float] = None
+        for lower in sorted(self._buckets, reverse=True):
+            n, a = self._buckets[lower]
+            total += n
+            agree += a
+            if total >= min_samples and agree / total >= target:
+                best = lower
+            elif total >= min_samples:
+                break
+        return best
+
+    def stats(self) -> Dict[str, Any]:
+        buckets = {
+            f"{lower:.2f}": {"n": n, "agree": a, "rate": round(a / n, 4) if n else None}
+            for lower, (n, a) in sorted(self._buckets.items())
+        }
+        n_all = sum(v[0] for v in self._buckets.values())
+        a_all = sum(v[1] for v in self._buckets.values())
+        return {
+            "scored": self._score_calls,
+            "decided_locally": self._decided_locally,
+            "avg_score_ms": round(self._score_seconds * 1000 / self._score_calls, 3) if self._score_calls else None,
+            "compared_with_llm": n_all,
+            "agreement_rate": round(a_all / n_all, 4) if n_all else None,
+            "buckets": buckets,
+            "suggested_threshold": self.suggested_threshold(),
+        }
+
+    def reset(self) -> None:
+        self._buckets.clear()
+        self._score_calls = 0
+        self._score_seconds = 0.0
+        self._decided_locally = 0
+
+
+agreement = AgreementTracker()
+
+
+# ---------------------------------------------------------------------------
+# Loading
+# ---------------------------------------------------------------------------
+
+_cached: Optional[Tuple[str, float, IntentClassifier]] = None
+_warned = False
+
+
+def get_classifier() -> Optional[IntentClassifier]:
+    """加载（并按文件 mtime 缓存）本地分类器；未训练、未安装 numpy 或加载失败时返回 None。"""
+    global _cached, _warned
+    path = getattr(settings, "intent_clf_path", None)
+    if not path or np is None:
+        return None
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if _cached is not None and _cached[0] == str(path) and _cached[1] == mtime:
+        return _cached[2]
+    try:
+        clf = IntentClassifier.load(Path(path))
+    except Exception as e:
+        if not _warned:
+            logger.warning("本地意图分类器加载失败（%s），将直接使用 LLM 兜底: %s", path, e)
+            _warned = True
+        return None
+    _cached = (str(path), mtime, clf)
+    logger.info("已加载本地意图分类器 %s: %s", path, clf.describe())
+    return clf
+
+
+def classify(text: str) -> Optional[Tuple[Intent, float]]:
+    """用本地分类器打分；不可用时返回 None。"""
+    clf = get_classifier()
+    if clf is None:
+        return None
+    t0 = time.perf_counter()
+    result = clf.predict(text)
+    threshold = float(getattr(settings, "intent_clf_threshold", 0.85))
+    agreement.record_score(time.perf_counter() - t0, decided_locally=result[1] >= threshold)
+    return result
@@ -4,15 +4,22 @@ P1-1: 混合意图路由 — 关键词规则（快速路径） + LLM 意图分
 
 路由策略：
 1. 强关键词命中 → 直接返回（KB_QUERY 或 ORCH_FLOW）；
-2. 关键词未命中 / 模糊 → 调用 LLM 分类（若 LLM 不可用则回退 ORCH_FLOW）。
+2. 本地分类器（intent_classifier，字符 n-gram 线性模型）置信度 ≥ 阈值 → 直接返回；
+3. 否则调用 LLM 分类（若 LLM 不可用则回退规则结果 / ORCH_FLOW），并记录分类器与 LLM 的一致率。
+   若 KB_QUERY 检索增强已启用，LLM 兜底使用融合调用（意图 + 检索 query 扩展一次返回），
+   KB_QUERY 路径可直接复用扩展结果，省去一次串行 LLM 往返。
 """
 
 from __future__ import annotations
 
+import asyncio
 import logging
-import re
+import random
 from enum import Enum
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
+
+from backend.config import settings
+from backend.utils.keyword_matcher import KeywordMatcher
 
 logger = logging.getLogger(__name__)
 
@@ -37,12 +44,9 @@ _KB_STRONG_KEYWORDS = (
 )
 
 # 弱 KB_QUERY 模式：疑问句 + 交易/规则相关词 → 倾向 KB_QUERY
-_KB_QUESTION_PATTERNS = [
-    re.compile(r"(?:什么|怎么|如何|哪些|几|多少|是否|有没有|能否).*(?:规则|流程|逻辑|配置|现状|机制|策略|方案)"),
-    re.compile(r"(?:规则|流程|逻辑|配置|现状|机制|策略|方案).*(?:是什么|有哪些|怎么样|如何)"),
-    re.compile(r"(?:定投|调仓|赎回|申购|追加|份额|基金|组合|持仓|下单|拆单).*(?:规则|流程|逻辑|怎么|是什么|有哪些)"),
-    re.compile(r"(?:规则|流程|逻辑).*(?:定投|调仓|赎回|申购|追加|份额|基金|组合|持仓|下单|拆单)"),
-]
+_QUESTION_WORDS = ("什么", "怎么", "如何", "哪些", "几", "多少", "是否", "有没有", "能否")
+_TOPIC_WORDS = ("规则", "流程", "逻辑", "配置", "现状", "机制", "策略", "方案")
+_BUSINESS_WORDS = ("定投", "调仓", "赎回", "申购", "追加", "份额", "基金", "组合", "持仓", "下单", "拆单")
 
 # 强 ORCH_FLOW 关键词：命中即走 ORCH_FLOW
 _ORCH_STRONG_KEYWORDS = (
@@ -53,9 +57,32 @@ _ORCH_STRONG_KEYWORDS = (
 )
 
 # 弱 ORCH_FLOW 模式：包含改动/新增/优化等动作词 → 倾向 ORCH_FLOW
-_ORCH_ACTION_PATTERNS = [
-    re.compile(r"(?:新增|增加|添加|修改|调整|优化|去掉|移除|删除|隐藏|改为|改成|替换|升级|重构|上线|需要)"),
-]
+_ORCH_ACTION_KEYWORDS = (
+    "新增", "增加", "添加", "修改", "调整", "优化", "去掉", "移除", "删除", "隐藏", "改为", "改成", "替换", "升级", "重构", "上线", "需要",
+)
+
+# 所有规则关键词共用一个匹配器，用户输入只扫描一遍
+_INTENT_MATCHER = KeywordMatcher(
+    {
+        "kb_strong": _KB_STRONG_KEYWORDS,
+        "orch_strong": _ORCH_STRONG_KEYWORDS,
+        "orch_action": _ORCH_ACTION_KEYWORDS,
+        "question": _QUESTION_WORDS,
+        "topic": _TOPIC_WORDS,
+        "topic_question": ("是什么", "有哪些", "怎么样", "如何"),
+        "business": _BUSINESS_WORDS,
+        "business_question": ("规则", "流程", "逻辑", "怎么", "是什么", "有哪些"),
+        "rule": ("规则", "流程", "逻辑"),
+    }
+)
+
+# 弱 KB_QUERY 模式：同一行内 A 类词之后出现 B 类词（即正则 ``A.*B``），每条命中计 1 分
+_KB_QUESTION_PATTERNS = (
+    ("question", "topic"),
+    ("topic", "topic_question"),
+    ("business", "business_question"),
+    ("rule", "business"),
+)
 
 
 def _rule_based_detect(text: str) -> Tuple[Optional[Intent], float]:
@@ -70,17 +97,34 @@ def _rule_based_detect(text: str) -> Tuple[Optional[Intent], float]:
     if not normalized:
         return Intent.ORCH_FLOW, 1.0
 
+    # 一次扫描：记录每类词在各行中最早的结束位置与最晚的起始位置，A 类最早结束 ≤ B 类最晚起始即 ``A.*B`` 成立
+    found: Set[str] = set()
+    matched_patterns: Set[Tuple[str, str]] = set()
+    for line in normalized.split("\n"):
+        first_end: Dict[str, int] = {}
+        last_start: Dict[str, int] = {}
+        for start, end, cats in _INTENT_MATCHER.iter_hits(line):
+            for c in cats:
+                if end < first_end.get(c, end + 1):
+                    first_end[c] = end
+                if start > last_start.get(c, -1):
+                    last_start[c] = start
+        found.update(first_end)
+        for first, then in _KB_QUESTION_PATTERNS:
+            if first in first_end and then in last_start and first_end[first] <= last_start[then]:
+                matched_patterns.add((first, then))
+
     # 1. 强关键词：KB_QUERY
-    if any(k in normalized for k in _KB_STRONG_KEYWORDS):
+    if "kb_strong" in found:
         return Intent.KB_QUERY, 1.0
 
     # 2. 强关键词：ORCH_FLOW
-    if any(k in normalized for k in _ORCH_STRONG_KEYWORDS):
+    if "orch_strong" in found:
         return Intent.ORCH_FLOW, 1.0
 
     # 3. 弱模式匹配
-    kb_score = sum(1 for p in _KB_QUESTION_PATTERNS if p.search(normalized))
-    orch_score = sum(1 for p in _ORCH_ACTION_PATTERNS if p.search(normalized))
+    kb_score = len(matched_patterns)
+    orch_score = 1 if "orch_action" in found else 0
 
     if kb_score > 0 and orch_score == 0:
         return Intent.KB_QUERY, 0.7
@@ -104,22 +148,128 @@ async def detect_intent_hybrid(text: str) -> Tuple[Intent, str]:
     """混合意图路由（P1-1）：规则 + LLM 兜底。
 
     Returns:
-        (intent, method): method 为 "rule" 或 "llm" 或 "llm_fallback"，用于 trace 展示。
+        (intent, method): method 为 "rule" / "classifier" / "llm" / "llm_fallback"，用于 trace 展示。
+    """
+    intent, method, _ = await _detect(text, fuse_expansion=False)
+    return intent, method
+
+
+def detect_intent_local(text: str) -> Tuple[Intent, str]:
+    """不调用 LLM 的意图路由（KB_QUERY fast 模式）：规则命中即返回，否则取本地分类器的判定（不看阈值），
+    两者都无法判定时同 :func:`detect_intent` 回退 ORCH_FLOW。
+
+    Returns:
+        (intent, method): method 为 "rule" / "classifier" / "rule_default"。
+    """
+    intent, _ = _rule_based_detect(text)
+    if intent is not None:
+        return intent, "rule"
+    clf_result = _local_classify(text)
+    if clf_result is not None:
+        return clf_result[0], "classifier"
+    return Intent.ORCH_FLOW, "rule_default"
+
+
+async def detect_intent_with_expansion(
+    text: str, max_queries: Optional[int] = None
+) -> Tuple[Intent, str, Optional[List[str]]]:
+    """混合意图路由 + KB 检索 query 扩展（首轮融合调用）。
+
+    规则无法判定且需要 LLM 兜底时，若 KB_QUERY 检索增强已启用，则用一次
+    ``llm_classify_and_expand`` 同时拿到意图与扩展后的子问题（至多 ``max_queries`` 条，默认
+    ``RS_AGENT_KB_QUERY_MAX_SUBQUERIES``）。
+
+    Returns:
+        (intent, method, expanded_queries)：method 额外可能为 "llm_fused"；
+        expanded_queries 仅在融合调用判定为 KB_QUERY 时非 None，可直接传给 ``enhanced_kb_query``。
     """
+    return await _detect(text, fuse_expansion=_expansion_enabled(), max_queries=max_queries)
+
+
+def _expansion_enabled() -> bool:
+    return bool(
+        getattr(settings, "kb_query_llm_enabled", True)
+        and getattr(settings, "llm_api_key", "")
+        and getattr(settings, "llm_base_url", "")
+    )
+
+
+# 影子比对任务的引用，避免被垃圾回收
+_shadow_tasks: Set["asyncio.Task[None]"] = set()
+
+
+def _local_classify(text: str) -> Optional[Tuple[Intent, float]]:
+    try:
+        from backend.services.intent_classifier import classify
+        return classify(text)
+    except Exception as e:
+        logger.warning("本地意图分类器打分失败，跳过: %s", e)
+        return None
+
+
+def _record_agreement(clf_result: Optional[Tuple[Intent, float]], llm_intent: Intent) -> None:
+    if clf_result is None:
+        return
+    from backend.services.intent_classifier import agreement
+    agreement.record(clf_result[0], clf_result[1], llm_intent)
+
+
+def _maybe_shadow_compare(text: str, clf_result: Tuple[Intent, float]) -> None:
+    """按 RS_AGENT_INTENT_CLF_SHADOW_RATE 抽样，在后台再问一次 LLM，只用于统计高置信度区间的一致率。"""
+    rate = float(getattr(settings, "intent_clf_shadow_rate", 0.0))
+    if rate <= 0 or random.random() >= rate:
+        return
+
+    async def _compare() -> None:
+        try:
+            from backend.services.llm_service import llm_classify_intent
+            llm_intent = await llm_classify_intent(text)
+            if llm_intent is not None:
+                _record_agreement(clf_result, Intent(llm_intent))
+        except Exception as e:
+            logger.debug("意图影子比对失败: %s", e)
+
+    task = asyncio.get_running_loop().create_task(_compare())
+    _shadow_tasks.add(task)
+    task.add_done_callback(_shadow_tasks.discard)
+
+
+async def _detect(
+    text: str, fuse_expansion: bool, max_queries: Optional[int] = None
+) -> Tuple[Intent, str, Optional[List[str]]]:
     intent, confidence = _rule_based_detect(text)
 
     # 强命中 → 直接返回
     if intent is not None and confidence >= 0.9:
-        return intent, "rule"
+        return intent, "rule", None
+
+    # 本地分类器置信度足够 → 直接返回，不调用 LLM
+    clf_result = _local_classify(text)
+    if clf_result is not None and clf_result[1] >= float(getattr(settings, "intent_clf_threshold", 0.85)):
+        _maybe_shadow_compare(text, clf_result)
+        return clf_result[0], "classifier", None
 
-    # 弱命中或无法确定 → 尝试 LLM 分类
+    # 弱命中或无法确定 → 尝试 LLM 分类（可融合 KB query 扩展）
     try:
-        from backend.services.llm_service import llm_classify_intent
-        llm_intent = await llm_classify_intent(text)
-        if llm_intent is not None:
-            return llm_intent, "llm"
+        if fuse_expansion:
+            from backend.services.llm_service import llm_classify_and_expand
+            llm_intent, queries = await llm_classify_and_expand(
+                text, max_queries=max_queries or getattr(settings, "kb_query_max_subqueries", 4)
+            )
+            if llm_intent is not None:
+                resolved = Intent(llm_intent)
+                _record_agreement(clf_result, resolved)
+                expanded = queries if (resolved is Intent.KB_QUERY and queries) else None
+                return resolved, "llm_fused", expanded
+        else:
+            from backend.services.llm_service import llm_classify_intent
+            llm_intent = await llm_classify_intent(text)
+            if llm_intent is not None:
+                resolved = Intent(llm_intent)
+                _record_agreement(clf_result, resolved)
+                return resolved, "llm", None
     except Exception as e:
         logger.warning("LLM 意图分类失败，回退到规则版: %s", e)
 
     # LLM 不可用 → 使用规则结果或默认 ORCH_FLOW
-    return (intent if intent is not None else Intent.ORCH_FLOW), "llm_fallback"
+    return (intent if intent is not None else Intent.ORCH_FLOW), "llm_fallback", None
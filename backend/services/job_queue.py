@@ -0,0 +1,208 @@
+"""后台任务模式：长时间的 ORCH_FLOW 轮次与 HTTP 连接解耦，事件持久化以便断线续传。
+
+``answer_questions`` 一轮要做两次 KB 检索、抽图、多模态 LLM 调用（可选文生图），耗时 30~120 秒；
+原先全部绑定在一个 HTTP 请求上，连接断开或代理超时即前功尽弃。请求体 ``background: true`` 时：
+
+- 任务写入 SQLite ``jobs`` 表，在进程内队列中执行（并发上限 ``RS_AGENT_JOB_MAX_CONCURRENCY``），与客户端连接无关；
+- pipeline 产生的每个 trace / final / error 事件按序号追加到 ``job_events``（只追加），再通知在线订阅者；
+- 订阅者（SSE）可随时断开，之后带 ``Last-Event-ID: <jobId>:<seq>`` 重连即从断点重放；也可轮询
+  ``GET /api/jobs/{jobId}``。任务在其它 worker 上运行时按 ``RS_AGENT_JOB_POLL_MS`` 轮询事件表跟进；
+- 进程退出时未完成的任务标记为 ``interrupted``；启动时把本机上已退出进程遗留的任务同样标记；
+- 与交互请求相同受 ``RS_AGENT_REQUEST_DEADLINE_SECONDS`` 约束，超时记为 ``error``（504）；订阅者断开不影响任务。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from backend import db, request_scope
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+_TERMINAL = ("done", "error", "interrupted")
+
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _LiveJob:
+    """本进程内运行中任务的序号分配与事件通知。"""
+
+    __slots__ = ("seq", "changed", "finished")
+
+    def __init__(self) -> None:
+        self.seq = 0
+        self.changed = asyncio.Event()
+        self.finished = False
+
+    def notify(self) -> None:
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class JobManager:
+    def __init__(self) -> None:
+        self._live: Dict[str, _LiveJob] = {}
+        self._tasks: Dict[str, "asyncio.Task[None]"] = {}
+        self._semaphore: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+        self._stats = {"submitted": 0, "done": 0, "error": 0, "interrupted": 0, "resumes": 0, "events": 0}
+
+    def _slot(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore[0] is not loop:
+            self._semaphore = (loop, asyncio.Semaphore(max(1, settings.job_max_concurrency)))
+        return self._semaphore[1]
+
+    # -- submit / run ---------------------------------------------------------
+
+    async def submit(
+        self,
+        text: str,
+        session_id: Optional[str],
+        image_paths: Optional[List[str]] = None,
+        mode: Optional[str] = None,
+    ) -> str:
+        """登记任务并在后台开始执行，返回 jobId。``mode`` 为 KB_QUERY 模式（见 ``services.kb_modes``）。"""
+        job_id = str(uuid.uuid4())
+        request = json.dumps(
+            {"text": text, "sessionId": session_id, "imagePaths": image_paths or [], "mode": mode}, ensure_ascii=False
+        )
+        await db.run_db(db.create_job, job_id, session_id, request, _owner())
+        self._live[job_id] = _LiveJob()
+        self._stats["submitted"] += 1
+        task = asyncio.create_task(self._run(job_id, text, session_id, image_paths, mode))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _t, jid=job_id: self._tasks.pop(jid, None))
+        return job_id
+
+    async def _append(self, job_id: str, live: _LiveJob, event_type: str, data: Any) -> None:
+        live.seq += 1
+        await db.run_db(db.append_job_event, job_id, live.seq, event_type, json.dumps(data, ensure_ascii=False))
+        self._stats["events"] += 1
+        live.notify()
+
+    async def _run(
+        self,
+        job_id: str,
+        text: str,
+        session_id: Optional[str],
+        image_paths: Optional[List[str]],
+        mode: Optional[str] = None,
+    ) -> None:
+        # 延迟导入：pipeline 依赖 LLM / KB 等服务模块
+        from backend.services.agent_pipeline import AgentPipeline
+
+        live = self._live[job_id]
+        status, error = "done", None
+        try:
+            async with self._slot():
+                await db.run_db(db.set_job_status, job_id, "running")
+                scope = request_scope.RequestScope(settings.request_deadline_seconds, label=f"job:{job_id}")
+                events = AgentPipeline(mode).process(text, session_id, image_paths or None)
+                async for event in scope.iterate(events, abandon_reason=request_scope.SHUTDOWN):
+                    await self._append(job_id, live, str(event["type"]), event["data"])
+                    if event["type"] == "error":
+                        data = event["data"]
+                        status = "error"
+                        error = str(data.get("message", "")) if isinstance(data, dict) else str(data)
+        except request_scope.DeadlineExceeded as exc:
+            status, error = "error", str(exc)
+            try:
+                await self._append(job_id, live, "error", {"message": error, "status_code": 504})
+            except Exception:
+                pass
+        except asyncio.CancelledError:
+            status, error = "interrupted", "服务关闭，任务已中断"
+        except Exception as exc:
+            logger.exception("Job %s failed", job_id)
+            status, error = "error", str(exc)
+            try:
+                await self._append(job_id, live, "error", {"message": error, "status_code": 500})
+            except Exception:
+                pass
+        finally:
+            try:
+                await db.run_db(db.set_job_status, job_id, status, error)
+            except Exception:
+                logger.exception("Failed to record status of job %s", job_id)
+            self._stats[status] += 1
+            live.finished = True
+            live.notify()
+            self._live.pop(job_id, None)
+
+    # -- read -----------------------------------------------------------------
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await db.run_db(db.get_job, job_id)
+
+    async def events(self, job_id: str, after_seq: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        """从 ``after_seq`` 之后开始产出事件 ``{"seq", "type", "data"}``，直到任务结束。"""
+        if after_seq > 0:
+            self._stats["resumes"] += 1
+        while True:
+            live = self._live.get(job_id)
+            # 先取通知对象与完成标记，再读事件表，避免漏掉两者之间追加的事件
+            waiter = live.changed if live is not None else None
+            finished = live is not None and live.finished
+            for row in await db.run_db(db.list_job_events, job_id, after_seq):
+                after_seq = row["seq"]
+                yield {"seq": row["seq"], "type": row["type"], "data": json.loads(row["data"])}
+            if live is not None:
+                if finished:
+                    return
+                await waiter.wait()
+                continue
+            job = await db.run_db(db.get_job, job_id)
+            if job is None or (job["status"] in _TERMINAL and job["last_seq"] <= after_seq):
+                return
+            # 任务在其它 worker 上运行：轮询事件表
+            await asyncio.sleep(max(10, settings.job_poll_ms) / 1000)
+
+    # -- lifecycle ------------------------------------------------------------
+
+    def recover(self) -> int:
+        """启动时调用（DB 线程）：本机已退出进程遗留的 queued / running 任务标记为 interrupted。"""
+        host = socket.gethostname()
+        count = 0
+        for job_id, owner in db.list_unfinished_jobs():
+            owner_host, _, pid = owner.rpartition(":")
+            if owner and (owner_host != host or (pid.isdigit() and _pid_alive(int(pid)) and int(pid) != os.getpid())):
+                continue  # 其它机器上的任务，或本机仍在运行的其它 worker
+            db.set_job_status(job_id, "interrupted", "服务重启，任务已中断")
+            count += 1
+        return count
+
+    async def shutdown(self) -> None:
+        """取消本进程内未完成的任务（状态记为 interrupted）。"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": len(self._live), "max_concurrency": settings.job_max_concurrency, **self._stats}
+
+
+jobs = JobManager()
@@ -14,6 +14,8 @@ from dataclasses import dataclass
 from pathlib import Path
 from typing import Iterable, List, Optional, Tuple
 
+from backend import tracing
+
 
 TABLE_SECTION_MARKER = "=== 表格聚合视图"
 IMAGE_SECTION_MARKER = "=== 图片 (images) ==="
@@ -174,6 +176,13 @@ def extract_best_images(
 
     Returns absolute file paths saved under out_dir. On failure returns [].
     """
+    with tracing.span("kb_artifacts.extract_best_images", max_images=max_images) as sp:
+        saved = _extract_best_images(refs, out_dir, max_images)
+        sp.set(saved=len(saved))
+    return saved
+
+
+def _extract_best_images(refs: Iterable[ImageRef], out_dir: str | Path, max_images: int) -> List[str]:
     out = Path(out_dir).resolve()
     out.mkdir(parents=True, exist_ok=True)
     saved: List[str] = []
@@ -196,12 +205,14 @@ def extract_best_images(
         raw: Optional[bytes] = None
         ext = "png"
         suffix = src.suffix.lower()
-        if suffix == ".pdf":
-            raw, ext = _extract_best_pdf_image_bytes(src, page_no)
-        elif suffix == ".docx":
-            raw, ext = _extract_docx_image_bytes(src, page_no)
-        else:
+        if suffix not in (".pdf", ".docx"):
             continue
+        with tracing.span("kb_artifacts.extract_image", source=src.name, page=page_no) as sp:
+            if suffix == ".pdf":
+                raw, ext = _extract_best_pdf_image_bytes(src, page_no)
+            else:
+                raw, ext = _extract_docx_image_bytes(src, page_no)
+            sp.set(bytes=len(raw or b""))
 
         if not raw:
             continue
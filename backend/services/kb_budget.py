@@ -0,0 +1,111 @@
+"""KB_QUERY 延迟预算：按各阶段的历史耗时估计，剩余预算不够时降级。
+
+嵌入式小部件等调用方要求固定时间内（如 5 秒）给出答案，宁可答案粗一些。请求带延迟预算时
+（请求体 ``budgetMs``、``RS_AGENT_KB_BUDGET_MS_BY_KEY`` 或 ``RS_AGENT_KB_BUDGET_MS``，经
+``backend.request_scope`` 传递），``enhanced_kb_query`` 在每一步之前用 :class:`KBBudget` 判断：
+
+- LLM 扩展：剩余预算放不下「扩展 + 一次检索」时跳过，只检索原问题；执行时以「剩余 - 一次检索」为超时；
+- 子问题检索：放不下下一次检索时不再检索后面的子问题；每次检索以剩余预算为超时（超时即杀掉子进程）；
+- LLM 综合：放不下时直接返回合并后的 KB 原文；执行时以剩余预算为超时，超时同样回退原文。
+
+各阶段耗时估计取最近 ``_WINDOW`` 次成功执行的 p90，样本不足时用保守的先验值。剩余预算另扣除
+``RS_AGENT_KB_BUDGET_RESERVE_MS``（落库与响应）。每个决策以 ``{"stage": "budget", "decision": ...}``
+记入 ``kb_runs``，并计入 ``rs_agent_kb_budget_decisions_total{decision}``。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import threading
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, List, Optional, TypeVar
+
+from backend import metrics, request_scope, tracing
+from backend.config import settings
+
+T = TypeVar("T")
+
+# 样本不足时的耗时先验（毫秒）
+_PRIORS_MS = {"expand": 1500.0, "retrieve": 2500.0, "synthesize": 5000.0}
+_WINDOW = 100
+_MIN_SAMPLES = 5
+_PERCENTILE = 90.0
+
+
+class StageLatency:
+    """按阶段记录最近的耗时，估计值取 p90。进程内单例使用。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, stage: str, ms: Optional[float]) -> None:
+        if ms is None:
+            return
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=_WINDOW)).append(float(ms))
+
+    def estimate(self, stage: str) -> float:
+        with self._lock:
+            buf = sorted(self._samples.get(stage) or ())
+        if len(buf) < _MIN_SAMPLES:
+            return _PRIORS_MS.get(stage, 1000.0)
+        return buf[max(0, math.ceil(_PERCENTILE / 100 * len(buf)) - 1)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = sorted(set(self._samples) | set(_PRIORS_MS))
+            counts = {s: len(self._samples.get(s) or ()) for s in stages}
+        return {s: {"samples": counts[s], "estimate_ms": round(self.estimate(s), 1)} for s in stages}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+latency = StageLatency()
+
+
+class KBBudget:
+    """一次 ``enhanced_kb_query`` 的预算视图；决策追加到 ``runs``（即 ``kb_runs``）。"""
+
+    def __init__(self, runs: List[dict]) -> None:
+        self._runs = runs
+        self.active = request_scope.budget_remaining() is not None
+        scope = request_scope.current()
+        if self.active and scope is not None:
+            self.decide("start", budget_ms=round((scope.budget_s or 0) * 1000, 1))
+
+    def remaining_ms(self) -> Optional[float]:
+        """扣除预留后的剩余预算（毫秒，可为负）；没有预算时为 None。"""
+        left = request_scope.budget_remaining()
+        if left is None:
+            return None
+        return left * 1000 - max(0.0, settings.kb_budget_reserve_ms)
+
+    def fits(self, *stages: str) -> bool:
+        """剩余预算是否放得下依次执行 ``stages``（按估计耗时）；没有预算时总为 True。"""
+        left = self.remaining_ms()
+        return left is None or left >= sum(latency.estimate(s) for s in stages)
+
+    def timeout_s(self, *reserve_stages: str) -> Optional[float]:
+        """本步骤的超时：剩余预算减去之后还要留给 ``reserve_stages`` 的估计耗时。"""
+        left = self.remaining_ms()
+        if left is None:
+            return None
+        return max(0.001, (left - sum(latency.estimate(s) for s in reserve_stages)) / 1000)
+
+    def decide(self, decision: str, **info: Any) -> None:
+        left = self.remaining_ms()
+        entry = {"stage": "budget", "decision": decision, "remaining_ms": None if left is None else round(left, 1), **info}
+        self._runs.append(entry)
+        tracing.event("kb_query.budget", decision=decision, remaining_ms=entry["remaining_ms"])
+        if settings.metrics_enabled:
+            metrics.KB_BUDGET_DECISIONS.inc(decision)
+
+    async def bounded(self, aw: Awaitable[T], timeout_s: Optional[float]) -> T:
+        """按超时执行（None 为不限）；超时抛 ``asyncio.TimeoutError``，被等待的操作随之取消。"""
+        if timeout_s is None:
+            return await aw
+        return await asyncio.wait_for(aw, timeout_s)
@@ -0,0 +1,151 @@
+"""KB 检索结果中的命中片段：解析、跨子问题去重与重排、渐进检索的覆盖度。
+
+``run_all_sources.py`` 输出的 markdown 由若干命中块与附加段组成：命中块以
+``--- source=<文件> distance=<向量距离>`` 起头（距离越小越相关），附加段以 ``=== <标题>`` 起头
+（表格聚合视图、图片列表等）。多个子问题的检索结果常有重复命中，thorough 模式据此合并、重排后只保留
+最相关的片段；渐进检索按 :class:`CoverageTracker` 的覆盖度与新片段占比决定是否还需检索后续子问题。
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+_HIT_HEADER = re.compile(r"^---\s*source=(\S*)(?:.*?\bdistance=([0-9]*\.?[0-9]+))?")
+
+# 重排打分：向量距离换算的相关度与问题字符二元组覆盖率的加权；同一片段被多个子问题命中时略加分
+_W_DISTANCE = 0.6
+_W_LEXICAL = 0.4
+_REPEAT_BONUS = 0.05
+_MAX_REPEAT_BONUS = 0.15
+
+
+@dataclass
+class KBHit:
+    header: str
+    source: str
+    distance: Optional[float]
+    text: str
+    repeats: int = 1
+
+    @property
+    def key(self) -> str:
+        """去重用的片段标识：正文折叠空白后的文本。"""
+        return " ".join(self.text.split())
+
+
+def split_blocks(markdown: str) -> Tuple[List[KBHit], List[str]]:
+    """把一次检索的 markdown 拆成命中块与其余段落（附加段、首个命中块之前的文字）。"""
+    hits: List[KBHit] = []
+    extras: List[str] = []
+    header: Optional[str] = None
+    lines: List[str] = []
+
+    def flush() -> None:
+        body = "\n".join(lines).strip()
+        if header is not None and header.startswith("---"):
+            m = _HIT_HEADER.match(header)
+            if body:
+                hits.append(KBHit(header, m.group(1) if m else "", float(m.group(2)) if m and m.group(2) else None, body))
+        elif header is not None or body:
+            extras.append("\n".join([header, body]).strip() if header is not None else body)
+
+    for line in (markdown or "").splitlines():
+        stripped = line.strip()
+        if _HIT_HEADER.match(stripped) or stripped.startswith("==="):
+            flush()
+            header, lines = stripped, []
+        else:
+            lines.append(line)
+    flush()
+    return hits, extras
+
+
+def parse_hits(markdown: str) -> List[KBHit]:
+    return split_blocks(markdown)[0]
+
+
+def _bigrams(text: str) -> Set[str]:
+    s = "".join(text.split()).lower()
+    return {s[i:i + 2] for i in range(len(s) - 1)}
+
+
+def score(hit: KBHit, query_bigrams: Set[str]) -> float:
+    relevance = 1.0 / (1.0 + hit.distance) if hit.distance is not None else 0.5
+    lexical = len(query_bigrams & _bigrams(hit.text)) / len(query_bigrams) if query_bigrams else 0.0
+    bonus = min(_MAX_REPEAT_BONUS, _REPEAT_BONUS * (hit.repeats - 1))
+    return _W_DISTANCE * relevance + _W_LEXICAL * lexical + bonus
+
+
+def rerank_markdown(query: str, results: List[Tuple[str, str]], top_k: int) -> Tuple[str, Dict[str, object]]:
+    """合并各子问题的检索结果：命中片段去重后按 :func:`score` 重排，保留前 ``top_k`` 条，附加段去重后附在末尾。
+
+    返回 (markdown, stats)；没有解析出命中块时 markdown 为空串，调用方应回退到原样合并。
+    """
+    merged: Dict[str, KBHit] = {}
+    extras: List[str] = []
+    total = 0
+    for _q, md in results:
+        hits, rest = split_blocks(md)
+        total += len(hits)
+        for hit in hits:
+            seen = merged.get(hit.key)
+            if seen is None:
+                merged[hit.key] = hit
+                continue
+            seen.repeats += 1
+            if hit.distance is not None and (seen.distance is None or hit.distance < seen.distance):
+                seen.header, seen.distance = hit.header, hit.distance
+        extras.extend(x for x in rest if x not in extras)
+
+    stats: Dict[str, object] = {"hits": total, "unique": len(merged), "kept": 0}
+    if not merged:
+        return "", stats
+    qb = _bigrams(query)
+    ranked = sorted(merged.values(), key=lambda h: score(h, qb), reverse=True)[: max(1, top_k)]
+    stats["kept"] = len(ranked)
+    stats["top_score"] = round(score(ranked[0], qb), 3)
+    parts = [f"{hit.header}\n{hit.text}" for hit in ranked] + extras
+    return "\n\n".join(parts).strip(), stats
+
+
+class CoverageTracker:
+    """渐进检索的覆盖度：每批检索结果按命中距离与新片段占比打分，``enhanced_kb_query`` 据此提前结束。
+
+    覆盖度 = 0.5 × min(1, 高置信命中数 / ``min_hits``) + 0.5 × 高置信命中覆盖的问题字符二元组占比，
+    高置信命中指距离不超过 ``max_distance`` 的去重片段；没有距离的片段不计入。
+    """
+
+    def __init__(self, query: str, max_distance: float, min_hits: int) -> None:
+        self._query_bigrams = _bigrams(query)
+        self._max_distance = max_distance
+        self._min_hits = max(1, min_hits)
+        self._seen: Set[str] = set()
+        self._covered: Set[str] = set()
+        self._confident = 0
+
+    def coverage(self) -> float:
+        hit_score = min(1.0, self._confident / self._min_hits)
+        qb = self._query_bigrams
+        term_score = len(self._covered) / len(qb) if qb else 1.0
+        return 0.5 * hit_score + 0.5 * term_score
+
+    def add(self, markdown: str) -> Dict[str, object]:
+        """计入一批检索结果，返回 ``hits`` / ``new_hits`` / ``new_ratio``（无命中块时为 None）/ ``coverage``。"""
+        hits = parse_hits(markdown)
+        new = 0
+        for hit in hits:
+            if hit.key in self._seen:
+                continue
+            self._seen.add(hit.key)
+            new += 1
+            if hit.distance is not None and hit.distance <= self._max_distance:
+                self._confident += 1
+                self._covered |= self._query_bigrams & _bigrams(hit.text)
+        return {
+            "hits": len(hits),
+            "new_hits": new,
+            "new_ratio": round(new / len(hits), 3) if hits else None,
+            "coverage": round(self.coverage(), 3),
+        }
@@ -0,0 +1,131 @@
+"""KB_QUERY 模式：按请求选择检索深度（请求体 ``mode``，默认 ``RS_AGENT_KB_QUERY_DEFAULT_MODE``）。
+
+- ``fast``：意图只用规则 / 本地分类器判定（不调 LLM），单次检索、不扩展、不做 LLM 综合；同一问题在
+  ``RS_AGENT_KB_FAST_CACHE_TTL_SECONDS`` 内答过时直接返回缓存的答案（任一模式的结果都会写入缓存）；
+- ``balanced``：原有方案 B（LLM 扩展 → 至多 ``RS_AGENT_KB_QUERY_MAX_SUBQUERIES`` 次检索 → LLM 综合）；
+- ``thorough``：至多 ``RS_AGENT_KB_THOROUGH_MAX_SUBQUERIES`` 次检索，命中片段去重重排后保留前
+  ``RS_AGENT_KB_THOROUGH_RERANK_TOP_K`` 条（``services.kb_hits``）再综合。
+
+答案缓存在进程内；带查询图片的请求不读写缓存。
+"""
+
+from __future__ import annotations
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from backend.config import settings
+
+FAST = "fast"
+BALANCED = "balanced"
+THOROUGH = "thorough"
+MODES = (FAST, BALANCED, THOROUGH)
+
+
+@dataclass(frozen=True)
+class KBMode:
+    name: str
+    max_subqueries: int
+    synthesize: bool
+    rerank_top_k: int = 0
+    local_intent: bool = False
+    use_cache: bool = False
+
+    @property
+    def expand(self) -> bool:
+        return self.max_subqueries > 1
+
+
+def resolve(mode: Optional[str] = None) -> KBMode:
+    """取模式配置；未指定或取值无效时用默认模式（默认模式也无效时为 balanced）。"""
+    name = (mode or settings.kb_query_default_mode or BALANCED).strip().lower()
+    if name not in MODES:
+        name = BALANCED
+    if name == FAST:
+        return KBMode(
+            FAST,
+            max(1, settings.kb_fast_max_subqueries),
+            synthesize=False,
+            local_intent=True,
+            use_cache=settings.kb_fast_cache_ttl_seconds > 0,
+        )
+    if name == THOROUGH:
+        return KBMode(
+            THOROUGH,
+            max(1, settings.kb_thorough_max_subqueries),
+            synthesize=True,
+            rerank_top_k=max(0, settings.kb_thorough_rerank_top_k),
+        )
+    return KBMode(BALANCED, max(1, int(getattr(settings, "kb_query_max_subqueries", 4))), synthesize=True)
+
+
+class AnswerCache:
+    """按规范化问题缓存 ``enhanced_kb_query`` 的结果（有界 LRU + TTL），供 fast 模式直接返回。
+
+    新结果覆盖旧结果，但有效期内已有 LLM 综合的答案不被未综合的答案覆盖。
+    """
+
+    def __init__(self) -> None:
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+
+    def get(self, query: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """返回 (缓存时长秒, 结果副本)；未命中或已过期时为 None。"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(query)
+            if entry is not None and now - entry[0] > settings.kb_fast_cache_ttl_seconds:
+                del self._entries[query]
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(query)
+            self._stats["hits"] += 1
+            stored_at, result = entry
+        return now - stored_at, copy.deepcopy(result)
+
+    def put(self, query: str, result: Dict[str, Any]) -> None:
+        maxsize = settings.kb_fast_cache_size
+        if maxsize <= 0 or settings.kb_fast_cache_ttl_seconds <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            current = self._entries.get(query)
+            if (
+                current is not None
+                and current[1].get("used_llm")
+                and not result.get("used_llm")
+                and now - current[0] <= settings.kb_fast_cache_ttl_seconds
+            ):
+                return
+            self._entries[query] = (now, copy.deepcopy(result))
+            self._entries.move_to_end(query)
+            self._stats["puts"] += 1
+            while len(self._entries) > maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats = {k: 0 for k in self._stats}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "size": len(self._entries),
+                "capacity": settings.kb_fast_cache_size,
+                "ttl_seconds": settings.kb_fast_cache_ttl_seconds,
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+answer_cache = AnswerCache()
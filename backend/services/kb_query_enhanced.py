@@ -1,15 +1,24 @@
 """Enhanced KB_QUERY flow (方案 B): LLM expands queries -> multi KB retrieval -> LLM synthesis.
 
 This module is designed to be reusable later by ORCH_FLOW (shared retrieve function).
+With a request latency budget (see ``services.kb_budget``) each step may be skipped or cut short;
+every such decision is recorded in ``kb_runs``. The request ``mode`` (``services.kb_modes``) picks the depth:
+fast = single retrieval without synthesis (cached answers allowed), balanced = the flow above,
+thorough = more sub-queries with reranked hits. Retrieval is progressive: after each sub-query the
+hits are scored (``kb_hits.CoverageTracker``) and the remaining sub-queries are skipped once coverage
+reaches ``RS_AGENT_KB_EARLY_EXIT_COVERAGE`` or a sub-query returns mostly duplicates.
 """
 
 from __future__ import annotations
 
+import asyncio
 import logging
-import time
 from typing import Dict, List, Optional, Tuple
 
+from backend import executors, metrics, tracing
 from backend.config import settings
+from backend.services import kb_hits, kb_modes
+from backend.services.kb_budget import KBBudget, latency
 from backend.services.trading_kb_service import KBQueryError, query_kb
 from backend.services.llm_service import llm_expand_kb_queries, llm_kb_synthesize
 
@@ -34,6 +43,17 @@ def _dedup_keep_order(items: List[str]) -> List[str]:
     return out
 
 
+def _early_exit_reason(scored: Dict[str, object], index: int) -> Optional[str]:
+    """渐进检索：本批之后是否不再检索其余子问题（没有可解析的命中块时不判断）。"""
+    if not scored["hits"]:
+        return None
+    if float(scored["coverage"]) >= settings.kb_early_exit_coverage:  # type: ignore[arg-type]
+        return "coverage"
+    if index > 0 and float(scored["new_ratio"]) < settings.kb_early_exit_min_new_ratio:  # type: ignore[arg-type]
+        return "duplicates"
+    return None
+
+
 def _merge_kb_markdown(results: List[Tuple[str, str]]) -> str:
     """Merge per-query KB markdown into one markdown, with lightweight separators."""
     if len(results) == 1:
@@ -54,9 +74,15 @@ def _merge_kb_markdown(results: List[Tuple[str, str]]) -> str:
 async def enhanced_kb_query(
     user_query: str,
     image_paths: Optional[List[str]] = None,
+    expanded_queries: Optional[List[str]] = None,
+    mode: Optional[str] = None,
 ) -> Dict[str, object]:
     """Run enhanced KB query and return a structured result.
 
+    ``expanded_queries``: sub-queries already produced by the fused first-turn call
+    (``detect_intent_with_expansion``); when given, the LLM expansion round-trip is skipped.
+    ``mode``: fast / balanced / thorough (default ``RS_AGENT_KB_QUERY_DEFAULT_MODE``).
+
     Returns:
       {
         "final_markdown": str,          # final answer (LLM synthesized when enabled)
@@ -65,8 +91,11 @@ async def enhanced_kb_query(
         "used_llm": bool,               # whether synthesis succeeded
         "kb_runs": List[dict],          # per sub-query stats
         "image_paths": List[str],       # merged image paths from KB
+        "mode": str,                    # resolved mode
+        "cached": bool,                 # fast mode: answer served from the answer cache
       }
     """
+    kb_mode = kb_modes.resolve(mode)
     q0 = _normalize_query(user_query)
     if not q0:
         return {
@@ -76,23 +105,67 @@ async def enhanced_kb_query(
             "used_llm": False,
             "kb_runs": [],
             "image_paths": [],
+            "mode": kb_mode.name,
+            "cached": False,
         }
 
+    # 0) fast 模式：同一问题近期答过则直接返回（带查询图片的请求不走缓存）
+    cache_state = "off"
+    if kb_mode.use_cache and not image_paths:
+        hit = kb_modes.answer_cache.get(q0)
+        cache_state = "miss" if hit is None else "hit"
+        if hit is not None:
+            age_s, cached = hit
+            cached["kb_runs"] = [
+                {"stage": "cache", "hit": True, "source_mode": cached.get("mode"), "age_s": round(age_s, 1)}
+            ]
+            cached.update(mode=kb_mode.name, cached=True)
+            tracing.event("kb_query.cache_hit", source_mode=cached["kb_runs"][0]["source_mode"])
+            if settings.metrics_enabled:
+                metrics.KB_QUERIES.inc(kb_mode.name, cache_state)
+            return cached
+    if settings.metrics_enabled:
+        metrics.KB_QUERIES.inc(kb_mode.name, cache_state)
+
     # 1) Expand multi queries via LLM (if configured and enabled)
     sub_queries: List[str] = [q0]
     kb_runs: List[dict] = []
-    t_expand = time.time()
-    try:
-        if getattr(settings, "kb_query_llm_enabled", True) and settings.llm_api_key and settings.llm_base_url:
-            expanded = await llm_expand_kb_queries(q0, max_queries=getattr(settings, "kb_query_max_subqueries", 4))
-            expanded = [_normalize_query(x) for x in expanded]
-            sub_queries = _dedup_keep_order([q0, *expanded])[: max(1, int(getattr(settings, "kb_query_max_subqueries", 4)))]
-    except Exception as e:
-        logger.warning("KB_QUERY expand queries failed, fallback to single query: %s", e)
+    budget = KBBudget(kb_runs)
+    max_sub = kb_mode.max_subqueries
+    fused = expanded_queries is not None
+    with tracing.span("kb_query.expand_queries", fused=fused, mode=kb_mode.name) as sp:
+        try:
+            if fused:
+                expanded = [_normalize_query(x) for x in expanded_queries or []]
+                sub_queries = _dedup_keep_order([q0, *expanded])[:max_sub]
+            elif (
+                kb_mode.expand
+                and getattr(settings, "kb_query_llm_enabled", True)
+                and settings.llm_api_key
+                and settings.llm_base_url
+            ):
+                if not budget.fits("expand", "retrieve"):
+                    budget.decide("skip_expand", estimate_ms=round(latency.estimate("expand"), 1))
+                else:
+                    expanded = await budget.bounded(
+                        llm_expand_kb_queries(q0, max_queries=max_sub),
+                        budget.timeout_s("retrieve"),
+                    )
+                    latency.record("expand", sp.duration_ms)
+                    expanded = [_normalize_query(x) for x in expanded]
+                    sub_queries = _dedup_keep_order([q0, *expanded])[:max_sub]
+        except asyncio.TimeoutError:
+            budget.decide("expand_timeout")
+            sp.set(fallback="budget")
+        except Exception as e:
+            logger.warning("KB_QUERY expand queries failed, fallback to single query: %s", e)
+            sp.set(fallback=str(e))
+        sp.set(queries=len(sub_queries))
     kb_runs.append(
         {
             "stage": "expand_queries",
-            "duration_ms": int((time.time() - t_expand) * 1000),
+            "fused": fused,
+            "duration_ms": sp.duration_ms,
             "queries": list(sub_queries),
         }
     )
@@ -102,11 +175,29 @@ async def enhanced_kb_query(
     per_query_results: List[Tuple[str, str]] = []
     merged_images: List[str] = []
     had_success = False
+    tracker = (
+        kb_hits.CoverageTracker(q0, settings.kb_early_exit_max_distance, settings.kb_early_exit_min_hits)
+        if settings.kb_early_exit_enabled and len(sub_queries) > 1
+        else None
+    )
     for i, sq in enumerate(sub_queries):
-        t_kb = time.time()
+        # 第一个子问题总要检索；之后的放不下一次检索就不再发起
+        if i > 0 and not budget.fits("retrieve"):
+            budget.decide("drop_subqueries", dropped=sub_queries[i:], estimate_ms=round(latency.estimate("retrieve"), 1))
+            break
         try:
-            md, imgs = await query_kb(sq, image_paths if (i == 0 and image_paths) else None)
+            with tracing.span("kb_query.retrieve", index=i, query=sq) as sp:
+                md, imgs = await budget.bounded(
+                    query_kb(sq, image_paths if (i == 0 and image_paths) else None), budget.timeout_s()
+                )
             had_success = True
+            latency.record("retrieve", sp.duration_ms)
+        except asyncio.TimeoutError:
+            kb_runs.append(
+                {"stage": "kb_retrieve", "query": sq, "ok": False, "error": "budget timeout", "duration_ms": sp.duration_ms}
+            )
+            budget.decide("retrieve_timeout", dropped=sub_queries[i + 1:])
+            break
         except KBQueryError as exc:
             kb_runs.append(
                 {
@@ -114,12 +205,13 @@ async def enhanced_kb_query(
                     "query": sq,
                     "ok": False,
                     "error": str(exc),
-                    "duration_ms": int((time.time() - t_kb) * 1000),
+                    "duration_ms": sp.duration_ms,
                 }
             )
             continue
 
         md_norm = (md or "").strip()
+        sp.set(chars=len(md_norm), images=len(imgs or []), duplicate=bool(md_norm) and md_norm in seen_md)
         if md_norm and md_norm not in seen_md:
             seen_md.add(md_norm)
             per_query_results.append((sq, md_norm))
@@ -127,54 +219,104 @@ async def enhanced_kb_query(
         if imgs:
             merged_images.extend([p for p in imgs if isinstance(p, str) and p.strip()])
 
-        kb_runs.append(
-            {
-                "stage": "kb_retrieve",
-                "query": sq,
-                "ok": True,
-                "chars": len(md_norm),
-                "images": len(imgs or []),
-                "duration_ms": int((time.time() - t_kb) * 1000),
-            }
-        )
+        run = {
+            "stage": "kb_retrieve",
+            "query": sq,
+            "ok": True,
+            "chars": len(md_norm),
+            "images": len(imgs or []),
+            "duration_ms": sp.duration_ms,
+        }
+        reason = None
+        if tracker is not None:
+            # 单批打分开销很小且要更新 tracker 自身的状态，直接在事件循环上执行（进程池中只会改到副本）
+            scored = tracker.add(md_norm)
+            run.update(scored)
+            reason = _early_exit_reason(scored, i)
+        kb_runs.append(run)
+
+        if reason is not None and i + 1 < len(sub_queries):
+            skipped = sub_queries[i + 1:]
+            kb_runs.append(
+                {
+                    "stage": "early_exit",
+                    "reason": reason,
+                    "coverage": run["coverage"],
+                    "new_ratio": run["new_ratio"],
+                    "skipped": skipped,
+                }
+            )
+            tracing.event("kb_query.early_exit", reason=reason, skipped=len(skipped), coverage=run["coverage"])
+            if settings.metrics_enabled:
+                metrics.KB_SUBQUERIES_SKIPPED.inc(reason, amount=len(skipped))
+            break
 
     if not had_success:
         # Keep behavior: surface KB errors to caller by raising (so router returns 500).
+        if budget.active and kb_runs and kb_runs[-1].get("decision") == "retrieve_timeout":
+            raise KBQueryError("KB 查询失败：延迟预算内未能完成检索。")
         raise KBQueryError("KB 查询失败：所有检索子问题均未成功返回结果。")
 
     merged_images = _dedup_keep_order(merged_images)
-    raw_markdown = _merge_kb_markdown(per_query_results)
+    raw_markdown = ""
+    if kb_mode.rerank_top_k > 0 and per_query_results:
+        # thorough：各子问题的命中片段去重后重排，只保留最相关的若干条；解析不出命中块时原样合并
+        with tracing.span("kb_query.rerank", results=len(per_query_results)) as sp:
+            raw_markdown, stats = await executors.cpu.run(
+                kb_hits.rerank_markdown, q0, per_query_results, kb_mode.rerank_top_k
+            )
+            sp.set(**stats)
+        kb_runs.append({"stage": "rerank", **stats, "duration_ms": sp.duration_ms})
+    if not raw_markdown:
+        raw_markdown = _merge_kb_markdown(per_query_results)
     if not raw_markdown:
         raw_markdown = "[空结果]"
 
     # 3) LLM synthesis (strictly based on raw_markdown). If fails, fallback to raw_markdown.
     used_llm = False
     final_markdown = raw_markdown
-    t_syn = time.time()
-    try:
-        if getattr(settings, "kb_query_llm_enabled", True) and settings.llm_api_key and settings.llm_base_url:
-            limit = int(getattr(settings, "kb_query_max_merged_chars", 12000))
-            kb_for_llm = raw_markdown if len(raw_markdown) <= limit else (raw_markdown[:limit] + "\n\n（已截断：KB 合并结果过长）")
-            final_markdown = (await llm_kb_synthesize(q0, kb_for_llm)).strip() or raw_markdown
-            used_llm = True
-    except Exception as e:
-        logger.warning("KB_QUERY synthesis failed, fallback to raw markdown: %s", e)
-        final_markdown = raw_markdown
-        used_llm = False
+    with tracing.span("kb_query.synthesize", merged_chars=len(raw_markdown)) as sp:
+        try:
+            if not kb_mode.synthesize:
+                sp.set(skipped="mode")
+            elif getattr(settings, "kb_query_llm_enabled", True) and settings.llm_api_key and settings.llm_base_url:
+                if not budget.fits("synthesize"):
+                    budget.decide("skip_synthesize", estimate_ms=round(latency.estimate("synthesize"), 1))
+                else:
+                    limit = int(getattr(settings, "kb_query_max_merged_chars", 12000))
+                    kb_for_llm = raw_markdown if len(raw_markdown) <= limit else (raw_markdown[:limit] + "\n\n（已截断：KB 合并结果过长）")
+                    answer = await budget.bounded(llm_kb_synthesize(q0, kb_for_llm), budget.timeout_s())
+                    latency.record("synthesize", sp.duration_ms)
+                    final_markdown = answer.strip() or raw_markdown
+                    used_llm = True
+        except asyncio.TimeoutError:
+            budget.decide("synthesize_timeout")
+            sp.set(fallback="budget")
+        except Exception as e:
+            logger.warning("KB_QUERY synthesis failed, fallback to raw markdown: %s", e)
+            sp.set(fallback=str(e))
+            final_markdown = raw_markdown
+            used_llm = False
+        sp.set(used_llm=used_llm)
     kb_runs.append(
         {
             "stage": "synthesize",
             "used_llm": used_llm,
-            "duration_ms": int((time.time() - t_syn) * 1000),
+            "duration_ms": sp.duration_ms,
         }
     )
 
-    return {
+    result = {
         "final_markdown": final_markdown,
         "raw_markdown": raw_markdown,
         "sub_queries": list(sub_queries),
         "used_llm": used_llm,
         "kb_runs": kb_runs,
         "image_paths": merged_images,
+        "mode": kb_mode.name,
+        "cached": False,
     }
+    if not image_paths:
+        kb_modes.answer_cache.put(q0, result)
+    return result
 
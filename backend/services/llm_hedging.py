@@ -0,0 +1,168 @@
+"""Hedged LLM requests：对慢请求发送一份相同的备份请求，取先返回者，降低 _chat 尾延迟。
+
+策略：
+1. 按 stage 记录最近 N 次调用耗时，阈值取其分位数（默认 p95）；
+2. 首个请求超过阈值仍未返回 → 发出一份完全相同的备份请求，二者谁先成功用谁，另一个取消；
+3. 备份请求数受预算约束（默认不超过总调用数的 5%），避免放大上游负载；
+4. 仅对 ``RS_AGENT_LLM_HEDGE_STAGES`` 中列出的 stage 启用（intent / expand / confirmer 等低成本调用）。
+
+统计数据（各 stage 调用数、对冲数、备份胜出率等）通过 :func:`HedgeController.stats` 暴露给诊断接口。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from backend import tracing
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _consume_result(task: "asyncio.Future[Any]") -> None:
+    """被取消/落败的请求：读取结果，避免 "Task exception was never retrieved" 警告。"""
+    if not task.cancelled():
+        task.exception()
+
+
+class HedgeController:
+    """按 stage 学习延迟分位数并在超时后发出备份请求。进程内单例使用。"""
+
+    def __init__(self) -> None:
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._calls = 0
+        self._hedges = 0
+
+    # -- configuration ---------------------------------------------------
+
+    def enabled(self, stage: str) -> bool:
+        return stage in getattr(settings, "llm_hedge_stages", frozenset())
+
+    # -- latency tracking ------------------------------------------------
+
+    def record(self, stage: str, seconds: float) -> None:
+        window = max(10, int(getattr(settings, "llm_hedge_window", 200)))
+        buf = self._latencies.get(stage)
+        if buf is None or buf.maxlen != window:
+            buf = deque(buf or (), maxlen=window)
+            self._latencies[stage] = buf
+        buf.append(seconds)
+
+    def threshold(self, stage: str) -> Optional[float]:
+        """返回该 stage 的对冲阈值（秒）；样本不足时返回 None（不对冲）。"""
+        buf = self._latencies.get(stage)
+        if not buf or len(buf) < max(1, int(getattr(settings, "llm_hedge_min_samples", 20))):
+            return None
+        pct = min(99.9, max(50.0, float(getattr(settings, "llm_hedge_percentile", 95.0))))
+        ordered = sorted(buf)
+        idx = max(0, math.ceil(pct / 100.0 * len(ordered)) - 1)
+        return ordered[idx]
+
+    def _stage_stats(self, stage: str) -> Dict[str, int]:
+        st = self._stats.get(stage)
+        if st is None:
+            st = {"calls": 0, "hedged": 0, "hedge_wins": 0, "primary_wins": 0, "budget_denied": 0}
+            self._stats[stage] = st
+        return st
+
+    def _try_acquire_budget(self) -> bool:
+        ratio = max(0.0, float(getattr(settings, "llm_hedge_budget_ratio", 0.05)))
+        if self._hedges + 1 > ratio * self._calls:
+            return False
+        self._hedges += 1
+        return True
+
+    # -- main entry ------------------------------------------------------
+
+    async def run(self, stage: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """执行 ``factory()``；若该 stage 启用对冲且超过阈值未返回，则发出备份请求。
+
+        ``factory`` 每次调用必须返回一个新的、等价的 awaitable（同一请求的独立副本）。
+        """
+        self._calls += 1
+        st = self._stage_stats(stage)
+        st["calls"] += 1
+        t0 = time.monotonic()
+        delay = self.threshold(stage) if self.enabled(stage) else None
+        if delay is None:
+            result = await factory()
+            self.record(stage, time.monotonic() - t0)
+            return result
+
+        primary = asyncio.ensure_future(factory())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                if not self._try_acquire_budget():
+                    st["budget_denied"] += 1
+                    result = await primary
+                    self.record(stage, time.monotonic() - t0)
+                    return result
+                st["hedged"] += 1
+                logger.info("LLM hedge: stage=%s 超过阈值 %.2fs 未返回，发出备份请求", stage, delay)
+                tracing.event("llm.hedge", stage=stage, delay_ms=int(delay * 1000))
+                backup = asyncio.ensure_future(factory())
+                tasks.add(backup)
+            winner = await self._first_success(tasks)
+            if len(tasks) > 1:
+                st["hedge_wins" if winner is not primary else "primary_wins"] += 1
+            self.record(stage, time.monotonic() - t0)
+            return winner.result()
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+                t.add_done_callback(_consume_result)
+
+    @staticmethod
+    async def _first_success(tasks: "set[asyncio.Future[Any]]") -> "asyncio.Future[Any]":
+        """等待第一个成功完成的请求；全部失败时抛出最先失败的异常。"""
+        pending = set(tasks)
+        first_failed: Optional[asyncio.Future[Any]] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    return t
+                if first_failed is None:
+                    first_failed = t
+        assert first_failed is not None
+        raise first_failed.exception()  # type: ignore[misc]
+
+    # -- reporting -------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        stages: Dict[str, Any] = {}
+        for stage, st in self._stats.items():
+            threshold = self.threshold(stage)
+            stages[stage] = {
+                **st,
+                "enabled": self.enabled(stage),
+                "hedge_win_rate": round(st["hedge_wins"] / st["hedged"], 4) if st["hedged"] else None,
+                "threshold_ms": int(threshold * 1000) if threshold is not None else None,
+                "samples": len(self._latencies.get(stage) or ()),
+            }
+        return {
+            "total_calls": self._calls,
+            "total_hedges": self._hedges,
+            "budget_ratio": float(getattr(settings, "llm_hedge_budget_ratio", 0.05)),
+            "stages": stages,
+        }
+
+    def reset(self) -> None:
+        self._latencies.clear()
+        self._stats.clear()
+        self._calls = 0
+        self._hedges = 0
+
+
+hedger = HedgeController()
@@ -4,34 +4,47 @@
 
 P1-3: prompt 全部抽取到 backend/prompts/*.yaml，代码只做加载与变量替换。
 P1-5: HTTP 调用带 tenacity 指数退避重试。
-
-封装五个高层能力：
+请求级截止时间（``backend.request_scope``）收紧每次尝试的超时；剩余时间不够等待下一次重试时直接放弃，
+请求被取消时中止进行中的 HTTP 调用。
+每次 _chat 调用带 stage 标识，按 stage 可选启用请求对冲（见 llm_hedging）。
+结构化输出（collect / build_draft / confirmer）走 _chat_json：请求 JSON 模式（response_format），
+本地宽松修复解析（backend.utils.json_repair），仅对仍缺失的字段做一次定向补问。
+
+封装以下高层能力：
+- llm_classify_intent:   意图路由 LLM 兜底，判断 KB_QUERY / ORCH_FLOW
+- llm_classify_and_expand: 首轮融合调用，一次返回意图 + KB_QUERY 检索 query 扩展
 - llm_expand_kb_queries: KB_QUERY 方案 B，扩展多条检索 query
 - llm_kb_synthesize:     KB_QUERY，基于 KB 检索结果综合回答
 - llm_collect:           COLLECT 阶段，产生结构化需求 + open_questions
 - llm_build_draft_sections: BUILD_DRAFT 阶段，生成 system_current / system_changes 段落
+- llm_build_draft_section:  BUILD_DRAFT 分段模式，按 section 单独生成（可并发）
 - llm_confirmer_parse:   Confirmer 阶段，解析用户反馈为 5 种 status
 """
 
 from __future__ import annotations
 
+import asyncio
 import base64
 import json
 import logging
+import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import httpx
 from tenacity import (
     retry,
-    retry_if_exception_type,
+    retry_if_exception,
     stop_after_attempt,
     wait_exponential,
     before_sleep_log,
 )
 
+from backend import executors, request_scope, tracing
 from backend.config import settings
 from backend.prompts import load_prompt
+from backend.services.llm_hedging import hedger
+from backend.utils.json_repair import missing_keys, repair_json_object
 
 logger = logging.getLogger(__name__)
 
@@ -40,11 +53,30 @@ logger = logging.getLogger(__name__)
 # ---------------------------------------------------------------------------
 
 
+def _is_retryable(exc: BaseException) -> bool:
+    """仅对网络错误、超时、5xx 与 408/429 重试；其余 4xx 是请求本身的问题，重试无意义。"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        code = exc.response.status_code
+        return code >= 500 or code in (408, 429)
+    return isinstance(exc, (httpx.TransportError, TimeoutError))
+
+
+def _past_deadline(retry_state) -> bool:
+    """请求剩余时间不够等到下一次重试时停止重试（tenacity 先算等待时间再判断是否停止）。"""
+    left = request_scope.remaining()
+    if left is None or left > getattr(retry_state, "upcoming_sleep", 0.0):
+        return False
+    skipped = max(0, settings.llm_max_retries - retry_state.attempt_number)
+    logger.warning("请求剩余 %.1fs，不足以等待 LLM 重试，放弃剩余 %d 次重试", left, skipped)
+    request_scope.note("llm_retry", retries_skipped=skipped)
+    return True
+
+
 def _build_retry_decorator():
     """Return a tenacity retry decorator based on current settings."""
     return retry(
-        retry=retry_if_exception_type((httpx.HTTPStatusError, httpx.TransportError, TimeoutError)),
-        stop=stop_after_attempt(max(1, settings.llm_max_retries)),
+        retry=retry_if_exception(_is_retryable),
+        stop=stop_after_attempt(max(1, settings.llm_max_retries)) | _past_deadline,
         wait=wait_exponential(
             min=max(0.1, settings.llm_retry_min_wait),
             max=max(1, settings.llm_retry_max_wait),
@@ -55,23 +87,73 @@ def _build_retry_decorator():
 
 
 async def _http_post(url: str, headers: dict, payload: dict) -> dict:
-    """Execute the HTTP POST with tenacity retry (exponential backoff)."""
+    """Execute the HTTP POST with tenacity retry (exponential backoff).
+
+    每次尝试记为一个 ``llm.http_attempt`` span（序号、状态码），重试间的退避等待落在父 span 中。
+    单次超时 120 秒，但不超过请求剩余时间；请求被取消时连同剩余重试一起放弃。
+    """
     _retry = _build_retry_decorator()
+    attempts = 0
+    timeout_s = 120.0
+    attempt_started = time.monotonic()
 
     @_retry
     async def _do():
-        async with httpx.AsyncClient(timeout=httpx.Timeout(120.0)) as client:
-            resp = await client.post(url, headers=headers, json=payload)
-        resp.raise_for_status()
-        return resp.json()
-
-    return await _do()
-
-
-async def _chat(messages: List[Dict[str, Any]], temperature: float = 0.2, max_tokens: int = 2048) -> str:
+        nonlocal attempts, attempt_started
+        attempts += 1
+        attempt_started = time.monotonic()
+        with tracing.span("llm.http_attempt", attempt=attempts) as sp:
+            async with httpx.AsyncClient(timeout=httpx.Timeout(request_scope.cap(timeout_s))) as client:
+                resp = await client.post(url, headers=headers, json=payload)
+            sp.set(status_code=resp.status_code)
+            resp.raise_for_status()
+            return resp.json()
+
+    with tracing.span("llm.http_post") as sp:
+        try:
+            return await _do()
+        except asyncio.CancelledError:
+            # 对冲落败的备份请求也会被取消，只有请求本身被取消时才计为省下的工作
+            if request_scope.is_cancelled():
+                request_scope.note(
+                    "llm_request",
+                    attempt=attempts,
+                    retries_skipped=max(0, settings.llm_max_retries - attempts),
+                    wait_saved_s=round(max(0.0, timeout_s - (time.monotonic() - attempt_started)), 1),
+                )
+            raise
+        finally:
+            sp.set(attempts=attempts)
+
+
+# 拒绝 response_format 参数（HTTP 400）的模型，进程内记住后不再发送
+_JSON_MODE_UNSUPPORTED: set[str] = set()
+
+
+def _rejects_json_mode(exc: httpx.HTTPStatusError) -> bool:
+    """400 的错误信息是否指向 response_format；上下文超长、消息格式错误等其它 400 不算。"""
+    if exc.response.status_code != 400:
+        return False
+    try:
+        body = exc.response.text.lower()
+    except httpx.ResponseNotRead:
+        return False
+    return "response_format" in body or "json_object" in body
+
+
+async def _chat(
+    messages: List[Dict[str, Any]],
+    temperature: float = 0.2,
+    max_tokens: int = 2048,
+    stage: str = "default",
+    json_mode: bool = False,
+) -> str:
     """通过 httpx.AsyncClient 调用 Chat Completions，返回单条 content。
 
     P1-5: 失败时自动重试（指数退避），由 RS_AGENT_LLM_MAX_RETRIES 等配置控制。
+    stage 用于按阶段统计耗时；在 RS_AGENT_LLM_HEDGE_STAGES 中的 stage 会启用请求对冲。
+    json_mode=True 时请求 ``response_format={"type": "json_object"}``；模型不支持（400 且错误信息提到 response_format / json_object）则去掉该参数重发一次，
+    其它 400 照常抛出。
     """
     if not settings.llm_api_key:
         raise RuntimeError(
@@ -92,7 +174,27 @@ async def _chat(messages: List[Dict[str, Any]], temperature: float = 0.2, max_to
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
-    data = await _http_post(url, headers, payload)
+    use_json_mode = (
+        json_mode
+        and getattr(settings, "llm_json_mode", True)
+        and settings.llm_model not in _JSON_MODE_UNSUPPORTED
+    )
+    if use_json_mode:
+        payload["response_format"] = {"type": "json_object"}
+    with tracing.span("llm._chat", "LLM", stage=stage, model=settings.llm_model, json_mode=use_json_mode) as sp:
+        try:
+            data = await hedger.run(stage, lambda: _http_post(url, headers, payload))
+        except httpx.HTTPStatusError as exc:
+            if not use_json_mode or not _rejects_json_mode(exc):
+                raise
+            logger.warning("模型 %s 不支持 JSON 模式（response_format），已去掉后重试", settings.llm_model)
+            _JSON_MODE_UNSUPPORTED.add(settings.llm_model)
+            payload.pop("response_format", None)
+            sp.set(json_mode=False)
+            data = await hedger.run(stage, lambda: _http_post(url, headers, payload))
+        usage = data.get("usage") if isinstance(data, dict) else None
+        if isinstance(usage, dict):
+            sp.set(prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
     content = data.get("choices", [{}])[0].get("message", {}).get("content")
     if content is None:
         raise RuntimeError(f"LLM API 返回格式异常: {data}")
@@ -103,6 +205,107 @@ async def _chat(messages: List[Dict[str, Any]], temperature: float = 0.2, max_to
     return str(content)
 
 
+# ---------------------------------------------------------------------------
+# Structured JSON output: JSON mode + local repair + targeted re-ask
+# ---------------------------------------------------------------------------
+
+# 各 stage 的 JSON 解析统计：clean=直接解析成功，salvaged=经本地修复后成功，
+# reasked=发起了缺失字段补问，failed=最终无法得到对象
+_JSON_STATS: Dict[str, Dict[str, int]] = {}
+
+
+def _json_stat(stage: str, key: str) -> None:
+    st = _JSON_STATS.setdefault(
+        stage, {"responses": 0, "clean": 0, "salvaged": 0, "reasked": 0, "reask_filled": 0, "failed": 0}
+    )
+    st[key] += 1
+
+
+def json_parse_stats() -> Dict[str, Any]:
+    """返回各 stage 的 JSON 解析统计与抢救率（salvaged / responses）。"""
+    out: Dict[str, Any] = {}
+    for stage, st in _JSON_STATS.items():
+        n = st["responses"]
+        out[stage] = {
+            **st,
+            "salvage_rate": round(st["salvaged"] / n, 4) if n else None,
+            "failure_rate": round(st["failed"] / n, 4) if n else None,
+        }
+    return out
+
+
+def _text_only(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """补问时去掉多模态图片，只保留文字部分，避免重复上传图片。"""
+    out: List[Dict[str, Any]] = []
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, list):
+            content = "".join(
+                p.get("text", "") for p in content if isinstance(p, dict) and p.get("type") == "text"
+            )
+        out.append({**m, "content": content})
+    return out
+
+
+def _unwrap(obj: Dict[str, Any], key: Optional[str]) -> Dict[str, Any]:
+    if key and isinstance(obj.get(key), dict):
+        return obj[key]
+    return obj
+
+
+async def _chat_json(
+    messages: List[Dict[str, Any]],
+    stage: str,
+    required: Tuple[str, ...] = (),
+    unwrap: Optional[str] = None,
+    temperature: float = 0.2,
+    max_tokens: int = 2048,
+) -> Dict[str, Any]:
+    """调用 LLM 并解析为 JSON 对象。
+
+    1. 请求 JSON 模式（provider 支持时）；
+    2. 本地宽松修复解析（去代码块、注释、尾随逗号，提取最大平衡对象）；
+    3. 按 stage 必填字段校验，仍缺失的字段单独补问一次并合并。
+
+    ``unwrap``：若返回对象中该键是 dict，则取其内容（兼容模型是否包一层 section 键）。
+    完全无法解析时抛出 ValueError，由调用方回退到规则版。
+    """
+    raw = await _chat(messages, temperature=temperature, max_tokens=max_tokens, stage=stage, json_mode=True)
+    _json_stat(stage, "responses")
+    obj, salvaged = repair_json_object(raw)
+    if obj is None:
+        _json_stat(stage, "failed")
+        raise ValueError(f"LLM 返回无法解析为 JSON（stage={stage}）")
+    _json_stat(stage, "salvaged" if salvaged else "clean")
+    if salvaged:
+        logger.info("LLM JSON 输出经本地修复后解析成功（stage=%s）", stage)
+    obj = _unwrap(obj, unwrap)
+
+    missing = missing_keys(obj, required)
+    if not missing:
+        return obj
+    _json_stat(stage, "reasked")
+    tpl = load_prompt("json_reask")
+    reask_messages = _text_only(messages) + [
+        {"role": "assistant", "content": raw},
+        {"role": "user", "content": tpl.user(missing_fields="、".join(missing))},
+    ]
+    try:
+        raw2 = await _chat(reask_messages, temperature=temperature, max_tokens=max_tokens, stage=stage, json_mode=True)
+    except Exception as e:
+        logger.warning("LLM JSON 缺失字段补问失败（stage=%s, missing=%s）: %s", stage, missing, e)
+        return obj
+    extra, _ = repair_json_object(raw2)
+    if extra is not None:
+        extra = _unwrap(extra, unwrap)
+        for key in missing:
+            if extra.get(key) is not None:
+                obj[key] = extra[key]
+        if not missing_keys(obj, required):
+            _json_stat(stage, "reask_filled")
+    return obj
+
+
 # ---------------------------------------------------------------------------
 # Public LLM functions (P1-3: prompts loaded from YAML templates)
 # ---------------------------------------------------------------------------
@@ -122,21 +325,67 @@ async def llm_classify_intent(user_text: str) -> Optional[str]:
         {"role": "system", "content": tpl.system()},
         {"role": "user", "content": tpl.user(user_text=text)},
     ]
-    raw = await _chat(messages, temperature=0.0, max_tokens=128)
-    try:
-        data = json.loads(raw)
-        intent = data.get("intent", "").strip().upper()
+    raw = await _chat(messages, temperature=0.0, max_tokens=128, stage="intent", json_mode=True)
+    data, _ = repair_json_object(raw)
+    if data is not None:
+        intent = str(data.get("intent") or "").strip().upper()
         if intent in ("KB_QUERY", "ORCH_FLOW"):
             return intent
-    except Exception:
-        # 尝试从纯文本中提取
-        if "KB_QUERY" in raw.upper():
-            return "KB_QUERY"
-        if "ORCH_FLOW" in raw.upper():
-            return "ORCH_FLOW"
+        return None
+    # 尝试从纯文本中提取
+    if "KB_QUERY" in raw.upper():
+        return "KB_QUERY"
+    if "ORCH_FLOW" in raw.upper():
+        return "ORCH_FLOW"
     return None
 
 
+def _clean_queries(qs: Any, max_q: int) -> List[str]:
+    out: List[str] = []
+    if isinstance(qs, list):
+        for x in qs:
+            if isinstance(x, str):
+                s = x.strip()
+                if s:
+                    out.append(s)
+    return out[:max_q]
+
+
+async def llm_classify_and_expand(user_text: str, max_queries: int = 4) -> Tuple[Optional[str], List[str]]:
+    """首轮融合调用：一次请求同时完成意图分类与（KB_QUERY 时的）检索 query 扩展。
+
+    省去规则无法判定时「llm_classify_intent → llm_expand_kb_queries」两次串行往返。
+
+    Returns:
+        (intent, queries)：intent 为 "KB_QUERY" / "ORCH_FLOW" 或 None（无法判断）；
+        queries 仅在 intent 为 KB_QUERY 时可能非空。
+    """
+    text = (user_text or "").strip()
+    if not text:
+        return None, []
+    max_q = max(1, int(max_queries or 1))
+    tpl = load_prompt("intent_expand")
+    messages: List[Dict[str, Any]] = [
+        {"role": "system", "content": tpl.system()},
+        {"role": "user", "content": tpl.user(user_text=text, max_queries=max_q)},
+    ]
+    raw = await _chat(messages, temperature=0.0, max_tokens=512, stage="intent", json_mode=True)
+    data, _ = repair_json_object(raw)
+    if data is None:
+        upper = raw.upper()
+        if "KB_QUERY" in upper:
+            return "KB_QUERY", []
+        if "ORCH_FLOW" in upper:
+            return "ORCH_FLOW", []
+        return None, []
+    intent = str(data.get("intent") or "").strip().upper()
+    if intent not in ("KB_QUERY", "ORCH_FLOW"):
+        return None, []
+    if intent != "KB_QUERY":
+        return intent, []
+    return intent, _clean_queries(data.get("queries"), max_q)
+
+
 async def llm_expand_kb_queries(user_query: str, max_queries: int = 4) -> List[str]:
     """KB_QUERY 方案 B：将用户问题扩展为多条检索 query（不输出答案）。"""
     uq = (user_query or "").strip()
@@ -148,20 +397,10 @@ async def llm_expand_kb_queries(user_query: str, max_queries: int = 4) -> List[s
         {"role": "system", "content": tpl.system()},
         {"role": "user", "content": tpl.user(user_query=uq, max_queries=max_q)},
     ]
-    raw = await _chat(messages, temperature=0.2, max_tokens=512)
-    try:
-        data = json.loads(raw)
-        qs = data.get("queries")
-        if isinstance(qs, list):
-            out: List[str] = []
-            for x in qs:
-                if isinstance(x, str):
-                    s = x.strip()
-                    if s:
-                        out.append(s)
-            return out[:max_q]
-    except Exception:
-        pass
+    raw = await _chat(messages, temperature=0.2, max_tokens=512, stage="expand", json_mode=True)
+    data, _ = repair_json_object(raw)
+    if data is not None and isinstance(data.get("queries"), list):
+        return _clean_queries(data["queries"], max_q)
     # 兜底：尽力从纯文本中按行解析
     lines = [ln.strip("- ").strip() for ln in str(raw).splitlines() if ln.strip()]
     return [ln for ln in lines if ln][:max_q]
@@ -176,7 +415,10 @@ async def llm_kb_synthesize(user_query: str, kb_markdown_merged: str) -> str:
         {"role": "system", "content": tpl.system()},
         {"role": "user", "content": tpl.user(user_query=uq, kb_markdown=kb)},
     ]
-    return await _chat(messages, temperature=0.2, max_tokens=2048)
+    return await _chat(messages, temperature=0.2, max_tokens=2048, stage="synthesize")
+
+
+_COLLECT_REQUIRED = ("demand_source", "product_statement", "open_questions")
 
 
 async def llm_collect(user_request: str, kb_markdown: str) -> Dict[str, Any]:
@@ -186,8 +428,7 @@ async def llm_collect(user_request: str, kb_markdown: str) -> Dict[str, Any]:
         {"role": "system", "content": tpl.system()},
         {"role": "user", "content": tpl.user(user_request=user_request, kb_markdown=kb_markdown)},
     ]
-    raw = await _chat(messages)
-    data = json.loads(raw)
+    data = await _chat_json(messages, stage="collect", required=_COLLECT_REQUIRED)
     demand_source = data.get("demand_source") or user_request
     product_statement = data.get("product_statement") or ""
     open_questions = data.get("open_questions") or ["请确认或补充上述需求，回复后继续。"]
@@ -212,6 +453,39 @@ def _image_path_to_data_url(path: str) -> Optional[str]:
     return f"data:{mime};base64,{b64}"
 
 
+def _build_user_content(text_content: str, image_paths: Optional[List[str]]) -> Any:
+    """构建 user message：无图时纯文本，有图时多模态（先文字，再按顺序每张图）。"""
+    if not image_paths:
+        return text_content.strip()
+    content_parts: List[Dict[str, Any]] = [{"type": "text", "text": text_content.strip()}]
+    for path in image_paths:
+        data_url = _image_path_to_data_url(path)
+        if data_url:
+            content_parts.append({
+                "type": "image_url",
+                "image_url": {"url": data_url},
+            })
+    return content_parts
+
+
+async def _build_user_content_async(text_content: str, image_paths: Optional[List[str]]) -> Any:
+    """同 :func:`_build_user_content`；有图时读文件与 base64 编码在 I/O 执行器中进行，不阻塞事件循环。"""
+    if not image_paths:
+        return _build_user_content(text_content, None)
+    return await executors.io.run(_build_user_content, text_content, image_paths)
+
+
+# 草稿三个 section；分段模式下每个 section 对应 backend/prompts/build_draft_<section>.yaml
+DRAFT_SECTIONS = ("business_requirement", "system_current", "system_changes")
+
+# 分段模式下各 section 内部的必填字段（用于缺失字段补问）
+_DRAFT_SECTION_REQUIRED: Dict[str, Tuple[str, ...]] = {
+    "business_requirement": ("demand_source", "product_statement"),
+    "system_current": ("business_rules", "frontend_current", "backend_current", "notification_current"),
+    "system_changes": ("change_overview", "frontend_changes", "backend_changes", "notification_changes"),
+}
+
+
 async def llm_build_draft_sections(
     user_request: str,
     user_answer: str,
@@ -232,25 +506,51 @@ async def llm_build_draft_sections(
         text_content += "\n" + tpl.get("image_instruction")
     text_content += "\n" + tpl.get("output_schema")
 
-    # 构建 user message：无图时纯文本，有图时多模态（先文字，再按顺序每张图）
-    user_content: Any = text_content.strip()
+    messages: List[Dict[str, Any]] = [
+        {"role": "system", "content": tpl.system()},
+        {"role": "user", "content": await _build_user_content_async(text_content, candidate_image_paths)},
+    ]
+    return await _chat_json(messages, stage="build_draft", required=DRAFT_SECTIONS)
+
+
+async def llm_build_draft_section(
+    section: str,
+    user_request: str,
+    user_answer: str,
+    requirement_structured: Dict[str, Any],
+    kb_markdown: str,
+    candidate_image_paths: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """BUILD_DRAFT 分段模式：只生成一个 section，返回该 section 的 dict。
+
+    与 llm_build_draft_sections 共享同一 draft_struct schema，供调用方并发发起三次调用后合并。
+    仅 system_current 需要选图，其余 section 调用方不应传入 candidate_image_paths。
+    """
+    if section not in DRAFT_SECTIONS:
+        raise ValueError(f"unknown draft section: {section}")
+    tpl = load_prompt(f"build_draft_{section}")
+    req_json = json.dumps(requirement_structured, ensure_ascii=False)
+    text_content = tpl.user(
+        user_request=user_request,
+        user_answer=user_answer,
+        requirement_structured_json=req_json,
+        kb_markdown=kb_markdown,
+    )
     if candidate_image_paths:
-        content_parts: List[Dict[str, Any]] = [{"type": "text", "text": text_content.strip()}]
-        for i, path in enumerate(candidate_image_paths):
-            data_url = _image_path_to_data_url(path)
-            if data_url:
-                content_parts.append({
-                    "type": "image_url",
-                    "image_url": {"url": data_url},
-                })
-        user_content = content_parts
+        text_content += "\n" + tpl.get("image_instruction")
+    text_content += "\n" + tpl.get("output_schema")
+
     messages: List[Dict[str, Any]] = [
         {"role": "system", "content": tpl.system()},
-        {"role": "user", "content": user_content},
+        {"role": "user", "content": await _build_user_content_async(text_content, candidate_image_paths)},
     ]
-    raw = await _chat(messages)
-    sections = json.loads(raw)
-    return sections
+    # unwrap 兼容模型直接返回 section 内容（未包一层 section 键）的情况
+    return await _chat_json(
+        messages,
+        stage="draft_section",
+        required=_DRAFT_SECTION_REQUIRED[section],
+        unwrap=section,
+    )
 
 
 async def llm_confirmer_parse(draft_output: Dict[str, Any], user_message: str) -> Dict[str, Any]:
@@ -261,5 +561,4 @@ async def llm_confirmer_parse(draft_output: Dict[str, Any], user_message: str) -
         {"role": "system", "content": tpl.system()},
         {"role": "user", "content": tpl.user(draft_json=draft_json, user_message=user_message)},
     ]
-    raw = await _chat(messages)
-    return json.loads(raw)
+    return await _chat_json(messages, stage="confirmer", required=("status",))
@@ -0,0 +1,203 @@
+"""写后（write-behind）消息日志：pipeline 的会话/消息/trace 写入先入内存队列，由后台任务批量落盘。
+
+原先 AgentPipeline 每次 ``add_message`` / ``_save_trace`` 都是一次独立的连接、事务与 fsync，
+trace 每次保存都在请求路径上整体重新 JSON 序列化。这里：
+
+1. 写操作按到达顺序追加到队列（请求路径上只做一次 append，不等待 IO）；
+2. 后台任务在「攒够 ``RS_AGENT_DB_WRITE_BATCH_SIZE`` 条」或「最早一条已等待 ``RS_AGENT_DB_WRITE_FLUSH_MS``」时，
+   把一批写入放在同一个事务里执行（``db.write_batch``，在 DB 线程池中），trace 的 JSON 序列化也在此时完成；
+3. 读己之写：读取某会话前调用 :meth:`MessageLog.barrier`，立即触发落盘并等到该会话此前入队的写入全部提交；
+   队列单消费者、按序提交，同一会话内的写入顺序与入队顺序一致；
+4. 应用退出时（lifespan）:meth:`MessageLog.drain` 落盘全部待写入后再停止；
+5. 队列深度、批大小、落盘耗时（p50/p95/max）通过 :meth:`MessageLog.stats` 暴露给 ``/api/diagnostics/db``。
+
+``RS_AGENT_DB_WRITE_BEHIND=false`` 时退化为直接写（``db.*_async``），行为与之前一致。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from backend import db
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+# (seq, conv_id, kind, args)
+_Op = Tuple[int, str, str, Tuple[Any, ...]]
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+class MessageLog:
+    """单消费者写后队列。进程内单例使用；后台任务在首次写入或 :meth:`start` 时于当前事件循环启动。"""
+
+    def __init__(self) -> None:
+        self._ops: Deque[_Op] = deque()
+        self._seq = 0
+        self._committed = 0
+        self._pending_by_conv: Dict[str, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._committed_cond: Optional[asyncio.Condition] = None
+        self._flush_now = False
+        self._stopping = False
+        self._latencies: Deque[float] = deque(maxlen=500)
+        self._stats: Dict[str, int] = {"enqueued": 0, "written": 0, "batches": 0, "dropped": 0, "max_depth": 0}
+        self._last_batch = 0
+
+    # -- lifecycle -------------------------------------------------------
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        # 首次使用或事件循环已更换（如测试中多次 asyncio.run）：在当前循环上重建；未落盘的写入仍在队列中
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._committed_cond = asyncio.Condition()
+        self._task = loop.create_task(self._run())
+        if self._ops:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        self._ensure_started()
+
+    async def drain(self) -> None:
+        """落盘全部待写入并停止后台任务（不取消进行中的批次）。"""
+        if self._task is None and not self._ops:
+            return
+        self._ensure_started()
+        self._stopping = True
+        self._wakeup.set()  # type: ignore[union-attr]
+        try:
+            await self._task  # type: ignore[misc]
+        finally:
+            self._stopping = False
+            self._task = None
+
+    # -- producers -------------------------------------------------------
+
+    async def create_conversation(self, conv_id: str, intent: str, status: str = "active") -> None:
+        await self._put(conv_id, "conversation", (conv_id, intent, status))
+
+    async def update_conversation_status(self, conv_id: str, status: str) -> None:
+        await self._put(conv_id, "status", (conv_id, status))
+
+    async def add_message(self, conv_id: str, role: str, payload_type: str, content: Any) -> None:
+        """content 可以是 str，或可 JSON 序列化的对象（在落盘时于 DB 线程中序列化）。"""
+        await self._put(conv_id, "message", (conv_id, role, payload_type, content))
+
+    async def _put(self, conv_id: str, kind: str, args: Tuple[Any, ...]) -> None:
+        if not settings.db_write_behind:
+            await db.run_db(db.write_batch, [(kind, args)])
+            return
+        self._ensure_started()
+        self._seq += 1
+        self._ops.append((self._seq, conv_id, kind, args))
+        self._pending_by_conv[conv_id] = self._seq
+        self._stats["enqueued"] += 1
+        depth = len(self._ops)
+        if depth > self._stats["max_depth"]:
+            self._stats["max_depth"] = depth
+        if depth == 1 or depth >= max(1, settings.db_write_batch_size):
+            # 队列由空变非空时唤醒后台任务开始计时；攒够一批时立即落盘
+            self._wakeup.set()  # type: ignore[union-attr]
+        if depth >= max(1, settings.db_write_max_pending):
+            # 背压：落盘跟不上时让生产者等待当前积压提交完成
+            await self.barrier()
+
+    # -- consumers -------------------------------------------------------
+
+    async def barrier(self, conv_id: Optional[str] = None) -> None:
+        """等待 conv_id（None 表示全部会话）此前入队的写入全部提交；有待写入时立即触发落盘。"""
+        target = self._seq if conv_id is None else self._pending_by_conv.get(conv_id, 0)
+        if target <= self._committed:
+            return
+        self._ensure_started()
+        self._flush_now = True
+        self._wakeup.set()  # type: ignore[union-attr]
+        cond = self._committed_cond
+        async with cond:  # type: ignore[union-attr]
+            await cond.wait_for(lambda: self._committed >= target)  # type: ignore[union-attr]
+
+    async def _run(self) -> None:
+        wakeup = self._wakeup
+        while True:
+            if not self._ops:
+                if self._stopping:
+                    return
+                wakeup.clear()  # type: ignore[union-attr]
+                await wakeup.wait()  # type: ignore[union-attr]
+                continue
+            # 攒批：未达批大小且无人等待时，最多再等一个 flush 间隔
+            if len(self._ops) < settings.db_write_batch_size and not (self._flush_now or self._stopping):
+                wakeup.clear()  # type: ignore[union-attr]
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=max(0, settings.db_write_flush_ms) / 1000)  # type: ignore[union-attr]
+                except asyncio.TimeoutError:
+                    pass
+            self._flush_now = False
+            while self._ops:
+                await self._flush_batch(max(1, settings.db_write_batch_size))
+
+    async def _flush_batch(self, limit: int) -> None:
+        batch = [self._ops.popleft() for _ in range(min(limit, len(self._ops)))]
+        if not batch:
+            return
+        t0 = time.perf_counter()
+        dropped = 0
+        try:
+            await db.run_db(db.write_batch, [(kind, args) for _seq, _conv, kind, args in batch])
+        except Exception:
+            logger.exception("Write-behind batch of %d failed; retrying ops individually", len(batch))
+            for _seq, conv_id, kind, args in batch:
+                try:
+                    await db.run_db(db.write_batch, [(kind, args)])
+                except Exception:
+                    dropped += 1
+                    logger.exception("Dropping write-behind op %s for conversation %s", kind, conv_id)
+        self._latencies.append(time.perf_counter() - t0)
+        self._stats["written"] += len(batch) - dropped
+        self._stats["dropped"] += dropped
+        self._stats["batches"] += 1
+        self._last_batch = len(batch)
+        self._committed = batch[-1][0]
+        for _seq, conv_id, _kind, _args in batch:
+            if self._pending_by_conv.get(conv_id, 0) <= self._committed:
+                self._pending_by_conv.pop(conv_id, None)
+        cond = self._committed_cond
+        if cond is not None:
+            async with cond:
+                cond.notify_all()
+
+    # -- metrics ---------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        lat = sorted(self._latencies)
+        batches = self._stats["batches"]
+        return {
+            "enabled": settings.db_write_behind,
+            "depth": len(self._ops),
+            **self._stats,
+            "avg_batch": round(self._stats["written"] / batches, 2) if batches else 0.0,
+            "last_batch": self._last_batch,
+            "flush_ms": {
+                "p50": round(_percentile(lat, 50) * 1000, 2),
+                "p95": round(_percentile(lat, 95) * 1000, 2),
+                "max": round(lat[-1] * 1000, 2) if lat else 0.0,
+            },
+        }
+
+
+message_log = MessageLog()
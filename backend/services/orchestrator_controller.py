@@ -5,12 +5,15 @@
 - 一轮 open_questions；
 - 用户回答后，生成与 demand_analysis_doc_v1 结构对齐的简化草稿。
 
-P0-2：会话通过 ``db.save_session`` / ``db.load_session`` 持久化到 SQLite；
-重启后可按 sessionId 恢复未完成的 Orchestrator 流程。
+P0-2：会话通过 ``db.save_session`` / ``db.load_session`` 持久化到 SQLite（增量日志见 ``session_journal``）；
+重启后可按 sessionId 恢复未完成的 Orchestrator 流程。会话读写均为协程，
+经 ``db.*_async`` 在 DB 线程池中执行，不阻塞事件循环。
 """
 
 from __future__ import annotations
 
+import asyncio
+import copy
 import json
 import logging
 import os
@@ -18,16 +21,28 @@ import re
 import uuid
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
+from backend import executors
 from backend.config import settings
-from backend.db import save_session as _db_save, load_session as _db_load
+from backend.db import SessionConflictError, get_session_version_async as _db_version, run_db as _run_db
+from backend.services import blob_store, session_journal, state_store
+from backend.services.session_journal import load_async as _db_load
+from backend.services.session_cache import scoped_get, scoped_put, session_cache, session_scope
 from backend.services.trading_kb_service import query_kb
-from backend.services.llm_service import llm_build_draft_sections, llm_collect
+from backend.services.llm_service import (
+    DRAFT_SECTIONS,
+    llm_build_draft_section,
+    llm_build_draft_sections,
+    llm_collect,
+)
 from backend.services.kb_artifacts import (
+    IMAGE_SECTION_MARKER,
     extract_best_images,
     extract_image_refs,
+    extract_table_aggregate_markdown,
 )
+from backend.utils.keyword_matcher import KeywordMatcher
 
 logger = logging.getLogger(__name__)
 
@@ -41,39 +56,76 @@ class OrchestratorSession:
     state: str  # "COLLECT" | "WAITING_ANSWERS" | "DRAFT_READY" | "CONFIRMING" | "DEFENDING" | "DONE"
     open_questions: List[str] = field(default_factory=list)
     user_answers: List[str] = field(default_factory=list)
-    knowledge_markdown: str = ""
+    knowledge_markdown: str = blob_store.BlobField()  # type: ignore[assignment]  # 大文本：blob 引用，首次访问时加载
     kb_image_urls: List[str] = field(default_factory=list)  # 知识库导出的图片，前端 URL 如 /api/kb-images/检索图_1.png
     draft_struct: dict = field(default_factory=dict)
     last_defend_questions: List[str] = field(default_factory=list)  # DEFEND 轮追问的问题，用于写入 clarification_log
     requirement_structured: dict = field(default_factory=dict)  # P4: 结构化需求，COLLECT/用户回复后更新
+    # 上次落库的 (version, 会话 JSON, 距快照增量条数)，保存时据此只写增量
+    _journal_base: Optional[session_journal.JournalBase] = field(default=None, init=False, repr=False, compare=False)
 
     # -- serialisation ---------------------------------------------------
 
-    def to_dict(self) -> dict:
-        """Serialise to a JSON-safe dict for DB persistence."""
+    def _plain_dict(self) -> dict:
         return {
             "session_id": self.session_id,
             "user_request": self.user_request,
             "state": self.state,
             "open_questions": list(self.open_questions),
             "user_answers": list(self.user_answers),
-            "knowledge_markdown": self.knowledge_markdown,
             "kb_image_urls": list(self.kb_image_urls),
             "draft_struct": self.draft_struct,
             "last_defend_questions": list(self.last_defend_questions),
             "requirement_structured": self.requirement_structured,
         }
 
+    def to_dict(self) -> dict:
+        """Serialise to a JSON-safe dict with every field inline (loads blob fields)."""
+        data = self._plain_dict()
+        for name in _BLOB_FIELDS:
+            data[name] = getattr(self, name)
+        return data
+
+    def to_record(self) -> Tuple[dict, List[str], Dict[str, str], Dict[str, str]]:
+        """Serialise for DB persistence: large fields become content-addressed blob refs.
+
+        Returns ``(record, refs, pending, available)``: referenced hashes, ``{hash: text}`` still to be
+        written, and ``{hash: text}`` for every loaded blob field.  Unloaded fields stay unloaded.
+        """
+        data = self._plain_dict()
+        refs: List[str] = []
+        pending: Dict[str, str] = {}
+        available: Dict[str, str] = {}
+        for name in _BLOB_FIELDS:
+            blob_field: blob_store.BlobField = type(self).__dict__[name]
+            data[name], digest, text = blob_field.encode(self)
+            if digest is None:
+                continue
+            refs.append(digest)
+            if text is not None:
+                available[digest] = text
+                if blob_field.needs_write(self):
+                    pending[digest] = text
+        return data, refs, pending, available
+
+    def mark_blobs_stored(self, refs: List[str]) -> None:
+        for name in _BLOB_FIELDS:
+            for digest in refs:
+                type(self).__dict__[name].mark_stored(self, digest)
+
+    def blobs_loaded(self) -> bool:
+        return all(type(self).__dict__[name].is_loaded(self) for name in _BLOB_FIELDS)
+
     @classmethod
     def from_dict(cls, data: dict) -> "OrchestratorSession":
-        """Reconstruct from a dict (loaded from DB JSON)."""
+        """Reconstruct from a dict (loaded from DB JSON); blob refs are resolved lazily."""
         return cls(
             session_id=data["session_id"],
             user_request=data.get("user_request", ""),
             state=data.get("state", "COLLECT"),
             open_questions=list(data.get("open_questions") or []),
             user_answers=list(data.get("user_answers") or []),
-            knowledge_markdown=data.get("knowledge_markdown", ""),
+            knowledge_markdown=blob_store.decode_value(data.get("knowledge_markdown", "")),
             kb_image_urls=list(data.get("kb_image_urls") or []),
             draft_struct=data.get("draft_struct") or {},
             last_defend_questions=list(data.get("last_defend_questions") or []),
@@ -81,29 +133,54 @@ class OrchestratorSession:
         )
 
 
+# 以 blob 引用持久化、按需加载的大字段
+_BLOB_FIELDS = ("knowledge_markdown",)
+
+
 # ---------------------------------------------------------------------------
 # Persistence helpers (P0-2)
 # ---------------------------------------------------------------------------
 
-def _persist(sess: OrchestratorSession) -> None:
-    """Save session to SQLite."""
-    _db_save(
-        session_id=sess.session_id,
-        state=sess.state,
-        session_data=json.dumps(sess.to_dict(), ensure_ascii=False),
-    )
+async def _persist(sess: OrchestratorSession) -> None:
+    """Save session to SQLite (write-through) and refresh the session cache with the new version.
+
+    Large fields go to the blob table only when their content changed, and only a JSON-patch delta
+    against the last persisted version is written (see :mod:`session_journal`); encoding, diffing and
+    compression run on the DB executor.  Raises :class:`SessionConflictError` when the session was saved
+    by another request since it was loaded (version compare-and-swap).
+    """
+    record, refs, pending, available = sess.to_record()
+    try:
+        sess._journal_base = await _run_db(
+            session_journal.save_record,
+            sess.session_id,
+            sess.state,
+            record,
+            refs,
+            pending,
+            available,
+            sess._journal_base,
+        )
+    except SessionConflictError:
+        # 其它 worker 已保存过更新的版本：丢弃本地缓存，下次请求重新加载
+        session_cache.invalidate(sess.session_id, stale=True)
+        raise
+    sess.mark_blobs_stored(refs)
+    session_cache.put(sess.session_id, sess._journal_base[0], copy.deepcopy(sess))
+    await state_store.run_state(session_cache.put_shared, sess.session_id, sess._journal_base)
+    scoped_put(sess.session_id, sess)
 
 
-def persist_session(sess: OrchestratorSession) -> None:
+async def persist_session(sess: OrchestratorSession) -> None:
     """Public API: persist a session after external mutations (e.g. in AgentPipeline)."""
-    _persist(sess)
+    await _persist(sess)
 
 
 # ---------------------------------------------------------------------------
 # Session CRUD
 # ---------------------------------------------------------------------------
 
-def create_session(user_request: str) -> OrchestratorSession:
+async def create_session(user_request: str) -> OrchestratorSession:
     """Create a new orchestrator session in COLLECT state and persist it."""
     session_id = str(uuid.uuid4())
     sess = OrchestratorSession(
@@ -111,21 +188,54 @@ def create_session(user_request: str) -> OrchestratorSession:
         user_request=user_request,
         state="COLLECT",
     )
-    _persist(sess)
+    await _persist(sess)
     return sess
 
 
-def get_session(session_id: str) -> Optional[OrchestratorSession]:
-    """Load session from DB.  Returns None if not found."""
-    row = _db_load(session_id)
-    if not row:
-        return None
+async def get_session(session_id: str) -> Optional[OrchestratorSession]:
+    """Load a session.  Returns None if not found.
+
+    同一请求（:func:`session_scope`）内返回同一对象；跨请求先查 LRU 缓存，再查跨 worker 的共享层，
+    DB 版本号一致时直接用缓存，否则加载快照并重放其后的增量（在 DB 线程中完成）。
+    """
+    sess = scoped_get(session_id)
+    if sess is not None:
+        return sess
+    cached = session_cache.get(session_id)
+    if cached is not None:
+        if await _db_version(session_id) == cached[0]:
+            session_cache.record_hit()
+            sess = copy.deepcopy(cached[1])
+            scoped_put(session_id, sess)
+            return sess
+        session_cache.invalidate(session_id, stale=True)
+    shared = await state_store.run_state(session_cache.get_shared, session_id)
+    if shared is not None and await _db_version(session_id) == shared[0]:
+        session_cache.record_hit(shared=True)
+        sess = OrchestratorSession.from_dict(json.loads(shared[1]))
+        sess._journal_base = shared
+        session_cache.put(session_id, shared[0], copy.deepcopy(sess))
+        scoped_put(session_id, sess)
+        return sess
     try:
-        data = json.loads(row["session_data"])
-        return OrchestratorSession.from_dict(data)
-    except (json.JSONDecodeError, KeyError) as exc:
+        row = await _db_load(session_id)
+        if not row:
+            return None
+        sess = OrchestratorSession.from_dict(row["record"])
+    except (ValueError, KeyError, IndexError, TypeError) as exc:
         logger.warning("Failed to deserialise session %s: %s", session_id, exc)
         return None
+    sess._journal_base = (int(row["version"]), row["base"], len(row["patches"]))
+    session_cache.put(session_id, int(row["version"]), copy.deepcopy(sess))
+    await state_store.run_state(session_cache.put_shared, session_id, sess._journal_base)
+    scoped_put(session_id, sess)
+    return sess
+
+
+async def _load_blobs(sess: OrchestratorSession) -> None:
+    """在 DB 线程中预先加载 blob 字段，避免随后的首次属性访问在事件循环中读库。"""
+    if not sess.blobs_loaded():
+        await _run_db(sess.to_dict)
 
 
 def _extract_kb_mentions(kb_text: str, max_mentions: int = 5) -> List[str]:
@@ -134,7 +244,6 @@ def _extract_kb_mentions(kb_text: str, max_mentions: int = 5) -> List[str]:
         return []
     seen: set[str] = set()
     out: List[str] = []
-    keywords = ("页面", "流程", "调仓", "定投", "确认", "方案", "明细", "入口", "弹框", "浮层", "比例", "金额", "规则", "追加", "申购", "赎回")
 
     def _is_meta_line(line: str) -> bool:
         s = line.strip()
@@ -148,20 +257,40 @@ def _extract_kb_mentions(kb_text: str, max_mentions: int = 5) -> List[str]:
             out.append(p)
             if len(out) >= max_mentions:
                 return out
-    # 2) 取非元数据、含关键词的短行
-    for line in kb_text.splitlines():
-        line = line.strip()
+    # 2) 取非元数据、含关键词的短行（与 system_current 推导共用同一次关键词扫描）
+    line_cats = _KB_LINE_MATCHER.line_categories(kb_text)
+    for raw_line, cats in line_cats:
+        if "mention" not in cats:
+            continue
+        line = raw_line.strip()
         if _is_meta_line(line) or len(line) < 4 or len(line) > 55:
             continue
-        if any(k in line for k in keywords) and line not in seen:
+        if line not in seen:
             seen.add(line)
             out.append(line[:48] + "…" if len(line) > 48 else line)
             if len(out) >= max_mentions:
                 return out
-    # 3) 从正文中截取含关键概念的片段
+    # 3) 从正文中截取含关键概念的片段：锚点前至多 25 字、后至多 15 字，不跨行
+    #    （与正则 ``[^\n]{0,25}(?:锚点)[^\n]{0,15}`` 的 finditer 结果一致：前缀贪婪取到窗口内最后一个锚点）
     if len(out) < max_mentions:
-        for m in re.finditer(r"[^\n]{0,25}(?:确认调仓|调仓明细|定投|追加资金|调仓方式|前端|页面|流程)[^\n]{0,15}", kb_text):
-            p = m.group(0).strip()
+        anchors = [(a, b) for a, b, cats in _KB_LINE_MATCHER.iter_hits(kb_text) if "mention_anchor" in cats]
+        pos = 0
+        i = 0
+        while i < len(anchors):
+            first = anchors[i][0]
+            if first < pos:
+                i += 1
+                continue
+            line_start = kb_text.rfind("\n", 0, first) + 1
+            line_end = kb_text.find("\n", first)
+            if line_end < 0:
+                line_end = len(kb_text)
+            begin = max(pos, first - 25, line_start)
+            while i + 1 < len(anchors) and anchors[i + 1][0] <= begin + 25 and anchors[i + 1][0] < line_end:
+                i += 1
+            pos = min(anchors[i][1] + 15, line_end)
+            i += 1
+            p = kb_text[begin:pos].strip()
             if p and p not in seen and 4 <= len(p) <= 45:
                 seen.add(p)
                 out.append(p)
@@ -197,6 +326,14 @@ def _derive_open_questions(user_request: str, knowledge_markdown: str) -> List[s
     return ["请确认或补充上述需求，回复后继续。"]
 
 
+def _best_kb_images(kb_text: str, images_dir: Any) -> List[str]:
+    """解析 KB 文本中的 path/page 引用并从源文档抽取候选图（正则扫描 + PyMuPDF，在 CPU 执行器中运行）。"""
+    refs = extract_image_refs(kb_text)
+    if not refs:
+        return []
+    return extract_best_images(refs, images_dir, max_images=8)
+
+
 async def _ensure_collect(sess: OrchestratorSession) -> None:
     """Run a minimal COLLECT step: 调一次 KB，生成 open_questions，并落 requirement_structured（P0/P4）。
 
@@ -209,11 +346,10 @@ async def _ensure_collect(sess: OrchestratorSession) -> None:
 
     # 更可靠的候选图：从 KB markdown 的 path/page 引用中抽取 PDF 页最大图（更像流程图），
     # 若提取失败则回退到 KB 脚本已导出的图片路径
-    refs = extract_image_refs(kb_text)
-    best_paths = extract_best_images(
-        refs,
+    best_paths = await executors.cpu.run(
+        _best_kb_images,
+        kb_text,
         getattr(settings, "images_output_dir_abs", None) or settings.images_output_dir,
-        max_images=8,
     )
     image_paths = best_paths or (exported_paths or [])
     sess.kb_image_urls = [f"/api/kb-images/{os.path.basename(p)}" for p in image_paths]
@@ -228,14 +364,14 @@ async def _ensure_collect(sess: OrchestratorSession) -> None:
     except Exception as e:
         # 回退：仍使用规则版 open_questions 与最简 requirement_structured
         logger.warning("LLM llm_collect 调用失败，已回退到规则版: %s", e)
-        sess.open_questions = _derive_open_questions(sess.user_request, kb_text)
+        sess.open_questions = await executors.cpu.run(_derive_open_questions, sess.user_request, kb_text)
         sess.requirement_structured = {
             "demand_source": sess.user_request,
             "product_statement": "",
             "open_questions": list(sess.open_questions),
         }
     sess.state = "WAITING_ANSWERS"
-    _persist(sess)
+    await _persist(sess)
 
 
 async def get_open_questions(sess: OrchestratorSession) -> List[str]:
@@ -244,6 +380,36 @@ async def get_open_questions(sess: OrchestratorSession) -> List[str]:
     return list(sess.open_questions)
 
 
+# KB 行分类关键词：规则版 system_current 推导与分段模式的 KB 切片共用
+_FRONTEND_KEYWORDS = ("页面", "前端", "展示", "交互", "浮层", "弹框", "调仓明细", "确认调仓", "持仓", "占比")
+_BACKEND_KEYWORDS = ("接口", "拆单", "流程", "订单", "垫资", "申购", "赎回", "后端", "中台")
+_NOTIFICATION_KEYWORDS = ("通知", "消息", "模板", "触发", "到账")
+# 追问生成时提取 KB 关键提及所用的关键词 / 片段锚点
+_MENTION_KEYWORDS = ("页面", "流程", "调仓", "定投", "确认", "方案", "明细", "入口", "弹框", "浮层", "比例", "金额", "规则", "追加", "申购", "赎回")
+_MENTION_ANCHORS = ("确认调仓", "调仓明细", "定投", "追加资金", "调仓方式", "前端", "页面", "流程")
+
+# KB 文本的所有行级关键词类别共用一个匹配器：一次扫描、结果按文本缓存，多个调用方复用
+_KB_LINE_MATCHER = KeywordMatcher(
+    {
+        "frontend": _FRONTEND_KEYWORDS,
+        "backend": _BACKEND_KEYWORDS,
+        "notification": _NOTIFICATION_KEYWORDS,
+        "mention": _MENTION_KEYWORDS,
+        "mention_anchor": _MENTION_ANCHORS,
+    }
+)
+
+# 规则版 system_changes：用户需求与回复中的改动范围关键词
+_CHANGE_MATCHER = KeywordMatcher(
+    {
+        "frontend": ("前端", "页面", "展示", "隐藏", "去掉", "文案", "弹框", "调仓明细", "确认调仓"),
+        "no_backend": ("不改后端", "不改后端逻辑", "无后端", "后端无", "仅前端"),
+        "backend": ("后端", "接口", "拆单", "流程", "逻辑"),
+        "notification": ("通知", "消息", "推送"),
+    }
+)
+
+
 def _derive_system_current_from_kb(kb_text: str) -> tuple[str, str, str]:
     """从 KB 文本推导 system_current 的 frontend/backend/notification 描述。"""
     if not (kb_text or "").strip():
@@ -252,16 +418,18 @@ def _derive_system_current_from_kb(kb_text: str) -> tuple[str, str, str]:
             "（知识库暂无命中，待补充后端现状）",
             "（知识库暂无命中，待补充通知现状）",
         )
-    lines = [ln.strip() for ln in kb_text.splitlines() if ln.strip()]
     frontend_parts: List[str] = []
     backend_parts: List[str] = []
     notification_parts: List[str] = []
-    for ln in lines:
-        if any(k in ln for k in ("页面", "前端", "展示", "交互", "浮层", "弹框", "调仓明细", "确认调仓", "持仓", "占比")):
+    for raw_line, cats in _KB_LINE_MATCHER.line_categories(kb_text):
+        if not cats:
+            continue
+        ln = raw_line.strip()
+        if "frontend" in cats:
             frontend_parts.append(ln)
-        elif any(k in ln for k in ("接口", "拆单", "流程", "订单", "垫资", "申购", "赎回", "后端", "中台")):
+        elif "backend" in cats:
             backend_parts.append(ln)
-        elif any(k in ln for k in ("通知", "消息", "模板", "触发", "到账")):
+        elif "notification" in cats:
             notification_parts.append(ln)
     fe = " ".join(frontend_parts[:8]) if frontend_parts else "（知识库中与前端/页面相关描述较少，可结合上方业务规则补充）"
     be = " ".join(backend_parts[:8]) if backend_parts else "（知识库中与后端/流程相关描述较少，可结合上方业务规则补充）"
@@ -278,8 +446,7 @@ def _derive_system_current_from_kb(kb_text: str) -> tuple[str, str, str]:
 def _derive_system_changes_from_user(user_request: str, answer_text: str) -> tuple[str, str, str, str]:
     """从用户需求与回复推导 system_changes 各字段。"""
     combined = f"{user_request or ''} {answer_text or ''}".strip()
-    req_lower = (user_request or "").lower()
-    ans_lower = (answer_text or "").lower()
+    change_cats = _CHANGE_MATCHER.categories(combined)
 
     # 改动总览
     overview = f"根据需求「{user_request}」与用户补充：{answer_text}。" if combined else "（待基于需求与知识库进一步梳理改动总览）"
@@ -287,7 +454,7 @@ def _derive_system_changes_from_user(user_request: str, answer_text: str) -> tup
         overview = overview[:397] + "..."
 
     # 前端改动：需求/回复中常涉及页面、展示、隐藏、去掉等
-    if any(k in combined for k in ("前端", "页面", "展示", "隐藏", "去掉", "文案", "弹框", "调仓明细", "确认调仓")):
+    if "frontend" in change_cats:
         frontend_desc = f"根据需求与用户补充：{answer_text or user_request}。涉及前端展示或交互调整。"
     else:
         frontend_desc = "（若仅后端或配置改动则可为无；否则请结合需求补充）"
@@ -295,9 +462,9 @@ def _derive_system_changes_from_user(user_request: str, answer_text: str) -> tup
         frontend_desc = frontend_desc[:347] + "..."
 
     # 后端改动：用户明确说不改后端则填无
-    if any(k in combined for k in ("不改后端", "不改后端逻辑", "无后端", "后端无", "仅前端")):
+    if "no_backend" in change_cats:
         backend_desc = "无。不修改后端接口与逻辑。"
-    elif any(k in combined for k in ("后端", "接口", "拆单", "流程", "逻辑")):
+    elif "backend" in change_cats:
         backend_desc = f"根据需求与用户补充待进一步确认：{answer_text or user_request}。"
     else:
         backend_desc = "（若需求仅涉及前端展示则填无）"
@@ -305,7 +472,7 @@ def _derive_system_changes_from_user(user_request: str, answer_text: str) -> tup
         backend_desc = backend_desc[:347] + "..."
 
     # 通知改动
-    if any(k in combined for k in ("通知", "消息", "推送")):
+    if "notification" in change_cats:
         notification_desc = f"根据需求与用户补充：{answer_text or user_request}。"
     else:
         notification_desc = "无。"
@@ -314,12 +481,126 @@ def _derive_system_changes_from_user(user_request: str, answer_text: str) -> tup
     return (overview, frontend_desc, backend_desc, notification_desc)
 
 
+def _fallback_system_current(kb_text: str, image_urls: List[str]) -> Dict[str, Any]:
+    """规则版 system_current（LLM 不可用或该 section 生成失败时使用）。"""
+    fe_cur, be_cur, nt_cur = _derive_system_current_from_kb(kb_text)
+    return {
+        "business_rules": kb_text or "（待从知识库补充当前业务规则）",
+        "frontend_current": {"description": fe_cur},
+        "backend_current": {"description": be_cur},
+        "notification_current": nt_cur,
+        "image_urls": list(image_urls),
+    }
+
+
+def _fallback_system_changes(user_request: str, answer_text: str) -> Dict[str, Any]:
+    """规则版 system_changes（LLM 不可用或该 section 生成失败时使用）。"""
+    ch_overview, ch_fe, ch_be, ch_nt = _derive_system_changes_from_user(user_request, answer_text)
+    return {
+        "change_overview": ch_overview,
+        "frontend_changes": {"description": ch_fe},
+        "backend_changes": {
+            "overview": ch_be,
+            "steps_text": "",
+            "flow_mermaid": "",
+        },
+        "notification_changes": {
+            "description": ch_nt,
+            "table_markdown": "",
+        },
+    }
+
+
+_SECTION_CATEGORIES = frozenset({"frontend", "backend", "notification"})
+
+
+def _truncate_kb(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return text[:limit] + "\n\n（已截断：KB 片段过长）"
+
+
+def _kb_image_section(kb: str) -> str:
+    """KB 输出中的图片段（``=== 图片 (images) ===`` 到下一个 ``=== `` 段之前），含标题行；无则为空串。"""
+    lines = kb.splitlines()
+    for i, ln in enumerate(lines):
+        if ln.strip().startswith(IMAGE_SECTION_MARKER):
+            end = next((j for j in range(i + 1, len(lines)) if lines[j].strip().startswith("=== ")), len(lines))
+            return "\n".join(lines[i:end]).strip()
+    return ""
+
+
+def _kb_slices_for_sections(kb_text: str) -> Dict[str, str]:
+    """分段模式：为每个 section 切出相关的 KB 片段，减少单次调用的输入规模。
+
+    - business_requirement：去掉元数据行后的开头要点；
+    - system_changes：命中前端/后端/通知关键词的行 + 表格聚合视图；
+    - system_current：同 system_changes，再附图片段（与候选图片对应）。
+    无命中时回退到开头要点；各片段均不超过 ``RS_AGENT_DRAFT_SECTION_KB_MAX_CHARS``。
+    """
+    kb = (kb_text or "").strip()
+    limit = max(500, int(getattr(settings, "draft_section_kb_max_chars", 6000)))
+    if not kb:
+        return {section: "" for section in DRAFT_SECTIONS}
+    content_lines = [
+        (ln.strip(), cats)
+        for ln, cats in _KB_LINE_MATCHER.line_categories(kb)
+        if ln.strip() and "source=" not in ln and "distance=" not in ln and not ln.strip().startswith(("---", "==="))
+    ]
+    overview = _truncate_kb("\n".join(ln for ln, _cats in content_lines), limit)
+    category_text = "\n".join(ln for ln, cats in content_lines if cats & _SECTION_CATEGORIES)
+    tables = extract_table_aggregate_markdown(kb)
+    changes_kb = "\n\n".join(part for part in (category_text, tables) if part)
+    current_kb = "\n\n".join(part for part in (changes_kb or overview, _kb_image_section(kb)) if part)
+    return {
+        "business_requirement": overview,
+        "system_current": _truncate_kb(current_kb, limit),
+        "system_changes": _truncate_kb(changes_kb, limit) if changes_kb else overview,
+    }
+
+
+async def _build_draft_sections_parallel(
+    user_request: str,
+    user_answer: str,
+    requirement_structured: Dict[str, Any],
+    kb_text: str,
+    candidate_image_paths: List[str],
+) -> Dict[str, Any]:
+    """并发调用 llm_build_draft_section 生成三个 section，返回成功的部分。
+
+    单个 section 失败只记录日志，不影响其它 section；调用方对缺失的 section 走规则版回退。
+    """
+    slices = await executors.cpu.run(_kb_slices_for_sections, kb_text)
+    results = await asyncio.gather(
+        *(
+            llm_build_draft_section(
+                section,
+                user_request=user_request,
+                user_answer=user_answer,
+                requirement_structured=requirement_structured,
+                kb_markdown=slices[section],
+                candidate_image_paths=(candidate_image_paths or None) if section == "system_current" else None,
+            )
+            for section in DRAFT_SECTIONS
+        ),
+        return_exceptions=True,
+    )
+    sections: Dict[str, Any] = {}
+    for section, result in zip(DRAFT_SECTIONS, results):
+        if isinstance(result, BaseException):
+            logger.warning("LLM llm_build_draft_section(%s) 调用失败，该 section 回退到规则版: %s", section, result)
+            continue
+        sections[section] = result
+    return sections
+
+
 async def answer_questions(session_id: str, answer_text: str) -> Tuple[OrchestratorSession, str]:
     """Consume user's answer and build a draft aligned with demand_analysis_doc_v1."""
-    sess = get_session(session_id)
+    sess = await get_session(session_id)
     if not sess:
         raise KeyError(f"session {session_id} not found")
 
+    await _load_blobs(sess)
     await _ensure_collect(sess)
     sess.user_answers.append(answer_text)
     background = sess.user_answers[-1] if sess.user_answers else sess.user_request
@@ -338,10 +619,9 @@ async def answer_questions(session_id: str, answer_text: str) -> Tuple[Orchestra
                 sess.kb_image_urls.append(url)
 
     # 额外用 KB 返回的 path/page 再抽一版“更像流程图”的候选图，避免 PDF 页第一张图是 logo/装饰导致选图为空
-    extra_refs = extract_image_refs(extra_kb)
-    if extra_refs:
+    if extra_kb:
         images_dir = getattr(settings, "images_output_dir_abs", None) or settings.images_output_dir
-        best_extra = extract_best_images(extra_refs, images_dir, max_images=8)
+        best_extra = await executors.cpu.run(_best_kb_images, extra_kb, images_dir)
         if best_extra:
             seen_basenames = {os.path.basename(u) for u in sess.kb_image_urls}
             for p in best_extra:
@@ -374,28 +654,45 @@ async def answer_questions(session_id: str, answer_text: str) -> Tuple[Orchestra
             url_by_candidate_index.append(url)
 
     # 优先使用 Qwen 生成 business_requirement（产品化表述）+ system_current + system_changes；若有候选图则由 LLM 根据需求选图
-    draft_system_current: Dict[str, any]
-    draft_system_changes: Dict[str, any]
+    # 分段模式下三个 section 并发生成，缺失/失败的 section 单独回退到规则版
     draft_demand_source: str = sess.user_request
     draft_product_statement: str = background
+    sections: Dict[str, Any] = {}
     try:
-        sections = await llm_build_draft_sections(
-            user_request=sess.user_request,
-            user_answer=answer_text,
-            requirement_structured=sess.requirement_structured,
-            kb_markdown=kb_text,
-            candidate_image_paths=candidate_image_paths if candidate_image_paths else None,
-        )
-        draft_system_current = sections.get("system_current") or {}
-        draft_system_changes = sections.get("system_changes") or {}
-        br_llm = sections.get("business_requirement") or {}
-        if isinstance(br_llm, dict):
-            if (ps := (br_llm.get("product_statement") or "").strip()):
-                draft_product_statement = ps
-                sess.requirement_structured["product_statement"] = ps
-            if (ds := (br_llm.get("demand_source") or "").strip()):
-                draft_demand_source = ds
-                sess.requirement_structured["demand_source"] = ds
+        if getattr(settings, "draft_parallel_sections", False):
+            sections = await _build_draft_sections_parallel(
+                user_request=sess.user_request,
+                user_answer=answer_text,
+                requirement_structured=sess.requirement_structured,
+                kb_text=kb_text,
+                candidate_image_paths=candidate_image_paths,
+            )
+        else:
+            sections = await llm_build_draft_sections(
+                user_request=sess.user_request,
+                user_answer=answer_text,
+                requirement_structured=sess.requirement_structured,
+                kb_markdown=kb_text,
+                candidate_image_paths=candidate_image_paths if candidate_image_paths else None,
+            )
+    except Exception as e:
+        logger.warning("LLM llm_build_draft_sections 调用失败，已回退到规则版: %s", e)
+        sections = {}
+    if not isinstance(sections, dict):
+        sections = {}
+
+    br_llm = sections.get("business_requirement") or {}
+    if isinstance(br_llm, dict):
+        if (ps := (br_llm.get("product_statement") or "").strip()):
+            draft_product_statement = ps
+            sess.requirement_structured["product_statement"] = ps
+        if (ds := (br_llm.get("demand_source") or "").strip()):
+            draft_demand_source = ds
+            sess.requirement_structured["demand_source"] = ds
+
+    draft_system_current: Dict[str, Any]
+    if isinstance(sections.get("system_current"), dict):
+        draft_system_current = sections["system_current"]
         # 由 LLM 返回的 selected_image_indices 筛选要展示的图片（序号对应 candidate 顺序）；若无该字段或非法则展示全部
         selected_indices = draft_system_current.get("selected_image_indices")
         if isinstance(selected_indices, list) and url_by_candidate_index:
@@ -408,30 +705,14 @@ async def answer_questions(session_id: str, answer_text: str) -> Tuple[Orchestra
             selected_urls = list(sess.kb_image_urls)
         draft_system_current["image_urls"] = selected_urls
         draft_system_current.pop("selected_image_indices", None)
-    except Exception as e:
-        logger.warning("LLM llm_build_draft_sections 调用失败，已回退到规则版: %s", e)
-        fe_cur, be_cur, nt_cur = _derive_system_current_from_kb(kb_text)
-        ch_overview, ch_fe, ch_be, ch_nt = _derive_system_changes_from_user(sess.user_request, answer_text)
-        draft_system_current = {
-            "business_rules": kb_text or "（待从知识库补充当前业务规则）",
-            "frontend_current": {"description": fe_cur},
-            "backend_current": {"description": be_cur},
-            "notification_current": nt_cur,
-            "image_urls": list(sess.kb_image_urls),
-        }
-        draft_system_changes = {
-            "change_overview": ch_overview,
-            "frontend_changes": {"description": ch_fe},
-            "backend_changes": {
-                "overview": ch_be,
-                "steps_text": "",
-                "flow_mermaid": "",
-            },
-            "notification_changes": {
-                "description": ch_nt,
-                "table_markdown": "",
-            },
-        }
+    else:
+        draft_system_current = await executors.cpu.run(_fallback_system_current, kb_text, sess.kb_image_urls)
+
+    draft_system_changes: Dict[str, Any]
+    if isinstance(sections.get("system_changes"), dict):
+        draft_system_changes = sections["system_changes"]
+    else:
+        draft_system_changes = _fallback_system_changes(sess.user_request, answer_text)
 
     draft = {
         "template_name": "demand_analysis_doc_v1",
@@ -448,7 +729,7 @@ async def answer_questions(session_id: str, answer_text: str) -> Tuple[Orchestra
     sess.draft_struct = draft
     # 生成草稿后进入 CONFIRMING 流程，由调用方决定是直接确认还是带修改意见
     sess.state = "DRAFT_READY"
-    _persist(sess)
+    await _persist(sess)
 
     # 根据结构生成 Markdown 草稿（后续可交给 EditorService 做更丰富排版）
     kb_excerpt = sess.knowledge_markdown[:800] + ("..." if len(sess.knowledge_markdown) > 800 else "")
@@ -495,9 +776,9 @@ async def answer_questions(session_id: str, answer_text: str) -> Tuple[Orchestra
     return sess, draft_md.strip()
 
 
-def confirm_draft(session_id: str, feedback: str) -> Tuple[OrchestratorSession, str]:
+async def confirm_draft(session_id: str, feedback: str) -> Tuple[OrchestratorSession, str]:
     """Handle user feedback on draft: 简单区分 confirmed / revised."""
-    sess = get_session(session_id)
+    sess = await get_session(session_id)
     if not sess:
         raise KeyError(f"session {session_id} not found")
 
@@ -517,13 +798,13 @@ def confirm_draft(session_id: str, feedback: str) -> Tuple[OrchestratorSession,
         status = "revised"
 
     sess.state = "DEFENDING"
-    _persist(sess)
+    await _persist(sess)
     return sess, status
 
 
 async def redo_full(session_id: str) -> OrchestratorSession:
     """P1-6: 整体重做 — 回退到 COLLECT 状态，清空草稿与回答，重新走完整流程。"""
-    sess = get_session(session_id)
+    sess = await get_session(session_id)
     if not sess:
         raise KeyError(f"session {session_id} not found")
 
@@ -537,7 +818,7 @@ async def redo_full(session_id: str) -> OrchestratorSession:
     sess.knowledge_markdown = ""
     sess.kb_image_urls = []
     sess.requirement_structured = {}
-    _persist(sess)
+    await _persist(sess)
     return sess
 
 
@@ -547,7 +828,7 @@ async def redo_partial(session_id: str, scope: str) -> OrchestratorSession:
 
     scope: "business_requirement" | "system_current" | "system_changes"
     """
-    sess = get_session(session_id)
+    sess = await get_session(session_id)
     if not sess:
         raise KeyError(f"session {session_id} not found")
 
@@ -562,13 +843,13 @@ async def redo_partial(session_id: str, scope: str) -> OrchestratorSession:
     # 回退到 WAITING_ANSWERS，下一轮用户回答后重新 build_draft（保留其他 section）
     sess.state = "WAITING_ANSWERS"
     sess.last_defend_questions = []
-    _persist(sess)
+    await _persist(sess)
     return sess
 
 
-def apply_defend_answers(session_id: str, answer_text: str) -> OrchestratorSession:
+async def apply_defend_answers(session_id: str, answer_text: str) -> OrchestratorSession:
     """在 DEFEND 阶段应用用户补充的说明，更新 business_changes，并追加 clarification_log。"""
-    sess = get_session(session_id)
+    sess = await get_session(session_id)
     if not sess:
         raise KeyError(f"session {session_id} not found")
 
@@ -592,6 +873,6 @@ def apply_defend_answers(session_id: str, answer_text: str) -> OrchestratorSessi
             "source": "defend",
         })
     sess.state = "DEFENDING"
-    _persist(sess)
+    await _persist(sess)
     return sess
 
@@ -0,0 +1,165 @@
+"""会话记录保留策略：后台任务按数量 / 时长 / 状态清理 conversations 与 messages。
+
+原先每次 ``create_conversation`` 都在请求路径上同步执行 ``trim_old_conversations(max_count=10)``
+（``NOT IN`` 子查询 + 逐行删除），且写死只保留 10 条。这里改为：
+
+- 策略可配置：``RS_AGENT_RETENTION_MAX_CONVERSATIONS``（总数上限）、``RS_AGENT_RETENTION_MAX_AGE_DAYS``
+  （最后更新时间）、``RS_AGENT_RETENTION_STATUSES``（只清理这些状态，默认不动进行中的 active 会话）；
+- 由 lifespan 中的后台任务每 ``RS_AGENT_RETENTION_INTERVAL`` 秒执行一轮，每批最多
+  ``RS_AGENT_RETENTION_BATCH_SIZE`` 个会话，一批一个事务、在 DB 线程池中执行，批次之间让出事件循环；
+- 可选归档（``RS_AGENT_RETENTION_ARCHIVE``）：``table`` 压缩后写入 ``conversation_archive`` 冷表（与删除同一事务），
+  ``file`` 追加到 ``RS_AGENT_RETENTION_ARCHIVE_DIR`` 下按天滚动的 gzip JSONL；
+- 每轮结束后 ``PRAGMA incremental_vacuum`` 归还空闲页；耗时、删除行数与归还页数经 :meth:`RetentionEngine.stats`
+  暴露给 ``/api/diagnostics/db``。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import logging
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from backend import db
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _cutoff(days: float) -> Optional[str]:
+    """与 ``datetime('now', 'localtime')`` 同格式的截止时间；days <= 0 表示不按时长清理。"""
+    if days <= 0:
+        return None
+    return (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def decode_archived(codec: str, data: bytes) -> Dict[str, Any]:
+    """还原 ``conversation_archive`` 中的一条归档（会话字段 + messages）。"""
+    if codec != "zlib":
+        raise ValueError(f"unknown archive codec: {codec}")
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+class RetentionEngine:
+    """按配置的策略分批清理会话记录。:meth:`run_once` 可在后台任务或测试中直接调用。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._running = False
+        self._stats: Dict[str, Any] = {
+            "runs": 0,
+            "conversations_deleted": 0,
+            "messages_deleted": 0,
+            "archived": 0,
+            "pages_freed": 0,
+            "errors": 0,
+            "last_run": None,
+        }
+
+    # -- one batch（DB 线程中执行）------------------------------------------
+
+    def _archive_file(self, convs: List[Dict[str, Any]]) -> None:
+        folder = Path(settings.retention_archive_dir)
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / f"conversations-{datetime.now():%Y%m%d}.jsonl.gz"
+        lines = "".join(json.dumps(c, ensure_ascii=False) + "\n" for c in convs)
+        with self._file_lock, gzip.open(path, "at", encoding="utf-8") as fh:
+            fh.write(lines)
+
+    def _run_batch(self, older_than: Optional[str]) -> Dict[str, int]:
+        ids = db.retention_candidates(
+            max(1, settings.retention_batch_size),
+            statuses=settings.retention_statuses,
+            older_than=older_than,
+            max_count=settings.retention_max_conversations,
+        )
+        if not ids:
+            return {"conversations": 0, "messages": 0, "archived": 0}
+        archive_rows = []
+        mode = settings.retention_archive
+        if mode != "none":
+            convs = db.export_conversations(ids)
+            if mode == "file":
+                # 先写文件再删除：中途失败最多重复归档，不会丢数据
+                self._archive_file(convs)
+            else:
+                archive_rows = [
+                    (
+                        c["id"],
+                        c["intent"],
+                        c["status"],
+                        c["created_at"],
+                        "zlib",
+                        zlib.compress(json.dumps(c, ensure_ascii=False).encode("utf-8"), 6),
+                    )
+                    for c in convs
+                ]
+            archived = len(convs)
+        else:
+            archived = 0
+        conversations, messages = db.delete_conversations(ids, archive_rows=archive_rows)
+        return {"conversations": conversations, "messages": messages, "archived": archived}
+
+    # -- one run ------------------------------------------------------------
+
+    async def run_once(self) -> Dict[str, Any]:
+        """执行一轮清理（分批直到没有待清理会话），随后归还空闲页；返回本轮统计。"""
+        with self._lock:
+            if self._running:
+                return {"skipped": True}
+            self._running = True
+        t0 = time.perf_counter()
+        result = {"conversations": 0, "messages": 0, "archived": 0, "batches": 0, "pages_freed": 0}
+        try:
+            older_than = _cutoff(settings.retention_max_age_days)
+            while True:
+                batch = await db.run_db(self._run_batch, older_than)
+                if not batch["conversations"]:
+                    break
+                result["batches"] += 1
+                for key in ("conversations", "messages", "archived"):
+                    result[key] += batch[key]
+                await asyncio.sleep(0)  # 批次之间让出事件循环
+            if result["conversations"]:
+                vac = await db.run_db(db.incremental_vacuum, settings.retention_vacuum_pages)
+                result["pages_freed"] = max(0, vac["freelist_before"] - vac["freelist_after"])
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            result["duration_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            with self._lock:
+                self._running = False
+                self._stats["runs"] += 1
+                self._stats["conversations_deleted"] += result["conversations"]
+                self._stats["messages_deleted"] += result["messages"]
+                self._stats["archived"] += result["archived"]
+                self._stats["pages_freed"] += result["pages_freed"]
+                self._stats["last_run"] = {"at": datetime.now().isoformat(timespec="seconds"), **result}
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            "policy": {
+                "max_conversations": settings.retention_max_conversations,
+                "max_age_days": settings.retention_max_age_days,
+                "statuses": list(settings.retention_statuses),
+                "archive": settings.retention_archive,
+                "interval_seconds": settings.retention_interval_seconds,
+                "batch_size": settings.retention_batch_size,
+            },
+            **stats,
+        }
+
+
+retention = RetentionEngine()
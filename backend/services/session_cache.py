@@ -0,0 +1,165 @@
+"""OrchestratorSession 进程内缓存：有界 LRU（跨请求）+ 请求级 identity map（同一请求内同一对象）。
+
+原先一次请求里 ``get_session`` 会被 pipeline 与 ``answer_questions`` / ``redo_*`` / ``apply_defend_answers``
+各调一次，每次都整体 JSON 解析 session_data。这里：
+
+- LRU 缓存保存已解析的会话快照及其 DB 版本号（``sessions.version``，每次保存 +1）；
+  命中前只查一次版本号，版本不一致（其它 worker 写过）即视为过期并重新加载，多 worker 下保持一致；
+- identity map 存在 contextvar 中，由 :func:`session_scope` 为每个请求开启；同一请求内再次
+  ``get_session`` 直接返回同一个对象，一个会话每请求最多加载一次；
+- 写仍然直通 SQLite（write-through），保存后用新版本号刷新缓存；
+- 共享状态后端（``RS_AGENT_STATE_BACKEND`` 为 sqlite / redis）启用时另有一层跨 worker 的共享缓存，
+  条目为增量日志的基准（版本号, 会话 JSON, 距快照增量条数），本地未命中时先查共享层，
+  同样按 DB 版本号校验，省去快照加载与增量重放。
+
+缓存中保存的是快照（深拷贝），请求内对会话对象的修改在保存前不会污染缓存。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from backend.config import settings
+from backend.services import state_store
+
+logger = logging.getLogger(__name__)
+
+_SHARED_NS = "sessions"
+
+_REQUEST_SESSIONS: ContextVar[Optional[Dict[str, Any]]] = ContextVar("rs_agent_request_sessions", default=None)
+
+
+@contextmanager
+def session_scope() -> Iterator[None]:
+    """为当前请求开启 identity map（可嵌套，内层复用外层的 map）。"""
+    if _REQUEST_SESSIONS.get() is not None:
+        yield
+        return
+    token = _REQUEST_SESSIONS.set({})
+    try:
+        yield
+    finally:
+        try:
+            _REQUEST_SESSIONS.reset(token)
+        except ValueError:
+            # 异步生成器在其它 context 中被关闭时无法 reset，直接清空
+            _REQUEST_SESSIONS.set(None)
+
+
+def scoped_get(session_id: str) -> Optional[Any]:
+    scope = _REQUEST_SESSIONS.get()
+    return scope.get(session_id) if scope is not None else None
+
+
+def scoped_put(session_id: str, obj: Any) -> None:
+    scope = _REQUEST_SESSIONS.get()
+    if scope is not None:
+        scope[session_id] = obj
+
+
+class SessionCache:
+    """按 session_id 的有界 LRU，条目为 (version, 会话快照)。容量取 ``RS_AGENT_SESSION_CACHE_SIZE``，0 为关闭。"""
+
+    def __init__(self) -> None:
+        self._entries: "OrderedDict[str, Tuple[int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "evictions": 0,
+            "shared_hits": 0,
+            "shared_misses": 0,
+            "shared_errors": 0,
+        }
+
+    def get(self, session_id: str) -> Optional[Tuple[int, Any]]:
+        """返回 (version, 快照)；调用方需与 DB 版本比对后再 :meth:`record_hit` 或 :meth:`invalidate`。"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(session_id)
+            return entry
+
+    def record_hit(self, shared: bool = False) -> None:
+        with self._lock:
+            self._stats["shared_hits" if shared else "hits"] += 1
+
+    # -- 共享层（阻塞调用，事件循环中经 state_store.run_state 执行）------------
+
+    def get_shared(self, session_id: str) -> Optional[Tuple[int, str, int]]:
+        """返回共享层中的 (version, 会话 JSON, 距快照增量条数)；未启用或后端不可用时返回 None。"""
+        if not state_store.is_shared() or settings.session_cache_size <= 0:
+            return None
+        try:
+            raw = state_store.get_state_backend().get(_SHARED_NS, session_id)
+        except Exception as exc:  # 共享后端故障不影响请求，回退到 DB
+            logger.warning("shared session cache get failed: %s", exc)
+            self._count("shared_errors")
+            return None
+        if raw is None:
+            self._count("shared_misses")
+            return None
+        version, data, since = json.loads(raw)
+        return int(version), data, int(since)
+
+    def put_shared(self, session_id: str, base: Tuple[int, str, int]) -> None:
+        if not state_store.is_shared() or settings.session_cache_size <= 0:
+            return
+        try:
+            state_store.get_state_backend().set(
+                _SHARED_NS, session_id, json.dumps(list(base), ensure_ascii=False), settings.state_session_ttl_seconds
+            )
+        except Exception as exc:
+            logger.warning("shared session cache put failed: %s", exc)
+            self._count("shared_errors")
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def put(self, session_id: str, version: int, snapshot: Any) -> None:
+        maxsize = settings.session_cache_size
+        if maxsize <= 0:
+            return
+        with self._lock:
+            current = self._entries.get(session_id)
+            if current is not None and current[0] > version:
+                return  # 并发保存时不被较旧版本覆盖
+            self._entries[session_id] = (version, snapshot)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, session_id: str, stale: bool = False) -> None:
+        with self._lock:
+            if self._entries.pop(session_id, None) is not None and stale:
+                self._stats["stale"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats = {k: 0 for k in self._stats}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"] + self._stats["stale"]
+            return {
+                "size": len(self._entries),
+                "capacity": settings.session_cache_size,
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "shared_backend": settings.state_backend if state_store.is_shared() else None,
+            }
+
+
+session_cache = SessionCache()
@@ -0,0 +1,259 @@
+"""会话增量持久化：每次保存记一条 JSON patch（RFC 6902 子集），定期压缩为快照，加载时重放。
+
+多数会话更新都很小（改 state、追加一条回答、改一处 ``product_statement``），原先每次 ``_persist``
+都整体重写 session_data。这里：
+
+- 内存中的会话记住上次落库的版本号与 JSON（``OrchestratorSession._journal_base``）；保存时与之做
+  结构化 diff，只向 ``session_journal`` 追加 patch 并把 ``sessions.version`` +1（按版本号 CAS），
+  不重写 session_data；
+- 距上次快照已有 ``RS_AGENT_SESSION_JOURNAL_COMPACT_EVERY`` 条增量、或 patch 不小于整体的一半时，
+  整体写入快照（``snapshot_version`` = 新版本），加载时最多重放这么多条；
+- 库中版本与内存中的基准不一致（其它 worker 写过）时退回整体保存，日志中记一条整体替换；
+- 日志随会话保留（会话删除 / 过期时一并删除），:func:`draft_history` 据此重放出草稿的历史版本。
+
+``RS_AGENT_SESSION_JOURNAL=false`` 时每次整体保存且不记日志（原行为）。
+"""
+
+from __future__ import annotations
+
+import copy
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend import db
+from backend.config import settings
+from backend.services import blob_store
+
+# (版本号, 该版本的会话 JSON, 距上次快照的增量条数)
+JournalBase = Tuple[int, str, int]
+
+_LOCK = threading.Lock()
+_STATS: Dict[str, int] = {
+    "patches": 0,
+    "patch_bytes": 0,
+    "snapshots": 0,
+    "snapshot_bytes": 0,
+    "conflicts": 0,
+    "replays": 0,
+    "replayed_patches": 0,
+}
+
+
+def _count(**deltas: int) -> None:
+    with _LOCK:
+        for key, value in deltas.items():
+            _STATS[key] += value
+
+
+# ---------------------------------------------------------------------------
+# JSON patch
+# ---------------------------------------------------------------------------
+
+def _escape(token: str) -> str:
+    return token.replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def _same(a: Any, b: Any) -> bool:
+    # True == 1 在 Python 中成立，JSON 中不是同一个值
+    return type(a) is type(b) and a == b
+
+
+def diff(old: Any, new: Any, path: str = "") -> List[Dict[str, Any]]:
+    """生成把 ``old`` 变为 ``new`` 的 JSON patch：dict 逐键递归；list 只识别尾部追加，其余整体替换。"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops: List[Dict[str, Any]] = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            sub = f"{path}/{_escape(key)}"
+            if key not in old:
+                ops.append({"op": "add", "path": sub, "value": value})
+            else:
+                ops.extend(diff(old[key], value, sub))
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        n = len(old)
+        if len(new) >= n and all(_same(a, b) for a, b in zip(old, new)):
+            return [{"op": "add", "path": f"{path}/-", "value": v} for v in new[n:]]
+    if _same(old, new):
+        return []
+    return [{"op": "replace", "path": path, "value": new}]
+
+
+def apply(doc: Any, patch: List[Dict[str, Any]]) -> Any:
+    """按顺序应用 patch（就地修改并返回结果；根路径 ``""`` 的 replace 返回新文档）。"""
+    for op in patch:
+        path = op["path"]
+        if path == "":
+            if op["op"] != "replace":
+                raise ValueError(f"unsupported root op: {op['op']}")
+            doc = op["value"]
+            continue
+        tokens = [_unescape(t) for t in path.split("/")[1:]]
+        parent = doc
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        last = tokens[-1]
+        kind = op["op"]
+        if isinstance(parent, list):
+            if kind == "add":
+                if last == "-":
+                    parent.append(op["value"])
+                else:
+                    parent.insert(int(last), op["value"])
+            elif kind == "replace":
+                parent[int(last)] = op["value"]
+            elif kind == "remove":
+                del parent[int(last)]
+            else:
+                raise ValueError(f"unsupported op: {kind}")
+        elif kind in ("add", "replace"):
+            parent[last] = op["value"]
+        elif kind == "remove":
+            del parent[last]
+        else:
+            raise ValueError(f"unsupported op: {kind}")
+    return doc
+
+
+def replay(snapshot: str, patches: List[str]) -> Dict[str, Any]:
+    """在快照 JSON 上依次重放增量（JSON 文本），返回会话 dict。"""
+    doc = json.loads(snapshot)
+    for patch in patches:
+        doc = apply(doc, json.loads(patch))
+    return doc
+
+
+# ---------------------------------------------------------------------------
+# Save / load（在 DB 线程中执行）
+# ---------------------------------------------------------------------------
+
+def _with_blob_retry(
+    write: Callable[[List[Tuple[str, str, int, bytes]]], Any],
+    pending: Dict[str, str],
+    available: Dict[str, str],
+) -> Tuple[Any, List[Tuple[str, str, int, bytes]]]:
+    """执行 ``write(rows)``；库中引用的 blob 已被 GC 掉时用内存中的文本补写后重试一次。"""
+    rows = blob_store.encode_rows(pending)
+    try:
+        return write(rows), rows
+    except db.MissingBlobError as exc:
+        if not all(h in available for h in exc.hashes):
+            raise
+        rows += blob_store.encode_rows({h: available[h] for h in exc.hashes if h not in pending})
+        return write(rows), rows
+
+
+def save_record(
+    session_id: str,
+    state: str,
+    record: Dict[str, Any],
+    refs: List[str],
+    pending: Dict[str, str],
+    available: Dict[str, str],
+    base: Optional[JournalBase] = None,
+) -> JournalBase:
+    """保存 ``OrchestratorSession.to_record()`` 的结果，返回新的 (版本号, 会话 JSON, 距快照增量条数)。
+
+    ``pending`` 为需要写入的 {哈希: 文本}；``available`` 为内存中已有文本的全部 blob 引用。
+    ``RS_AGENT_SESSION_CAS`` 开启（默认）且给出 ``base`` 时，库中版本已不是 ``base`` 的版本即抛出
+    :class:`db.SessionConflictError`，不再由后写者整体覆盖。
+    """
+    session_data = json.dumps(record, ensure_ascii=False)
+    journal = settings.session_journal
+    patch: Optional[str] = None
+    if journal and base is not None:
+        base_version, base_data, since = base
+        patch = json.dumps(diff(json.loads(base_data), json.loads(session_data)), ensure_ascii=False)
+        if since + 1 < settings.session_journal_compact_every and len(patch) * 2 < len(session_data):
+            version, rows = _with_blob_retry(
+                lambda rows: db.append_session_patch(
+                    session_id, base_version, state, patch, blobs=rows, blob_refs=refs
+                ),
+                pending,
+                available,
+            )
+            if version is not None:
+                _count(patches=1, patch_bytes=len(patch.encode("utf-8")))
+                blob_store.record_write(len(patch.encode("utf-8")), rows)
+                return version, session_data, since + 1
+            _count(conflicts=1)
+    version, rows = _with_blob_retry(
+        lambda rows: db.save_session(
+            session_id,
+            state,
+            session_data,
+            blobs=rows,
+            blob_refs=refs,
+            patch=patch,
+            base_version=base[0] if base is not None else None,
+            journal=journal,
+            expected_version=base[0] if base is not None and settings.session_cas else None,
+        ),
+        pending,
+        available,
+    )
+    size = len(session_data.encode("utf-8"))
+    _count(snapshots=1, snapshot_bytes=size)
+    blob_store.record_write(size, rows)
+    return version, session_data, 0
+
+
+def load(session_id: str) -> Optional[Dict[str, Any]]:
+    """读取快照并重放其后的增量。返回 sessions 行加上 ``record``（会话 dict）与 ``base``（该版本的会话 JSON）。"""
+    row = db.load_session(session_id)
+    if row is None:
+        return None
+    patches = row["patches"]
+    if patches:
+        record = replay(row["session_data"], patches)
+        base = json.dumps(record, ensure_ascii=False)
+        _count(replays=1, replayed_patches=len(patches))
+    else:
+        record = json.loads(row["session_data"])
+        base = row["session_data"]
+    return {**row, "record": record, "base": base}
+
+
+async def load_async(session_id: str) -> Optional[Dict[str, Any]]:
+    return await db.run_db(load, session_id)
+
+
+def draft_history(session_id: str) -> List[Dict[str, Any]]:
+    """重放会话的全部增量，返回草稿（draft_struct）每次变化后的版本：version / state / created_at / draft_struct。"""
+    out: List[Dict[str, Any]] = []
+    doc: Any = None
+    last: Any = None
+    for entry in db.list_session_journal(session_id):
+        patch = json.loads(entry["patch"])
+        if doc is None and not (patch and patch[0]["path"] == ""):
+            continue  # 启用日志前的旧会话：从第一条整体替换开始
+        doc = apply(doc, patch)
+        draft = doc.get("draft_struct") or {}
+        if draft and draft != last:
+            last = copy.deepcopy(draft)
+            out.append(
+                {"version": entry["seq"], "state": entry["state"], "created_at": entry["created_at"], "draft_struct": last}
+            )
+    return out
+
+
+async def draft_history_async(session_id: str) -> List[Dict[str, Any]]:
+    return await db.run_db(draft_history, session_id)
+
+
+def stats() -> Dict[str, Any]:
+    with _LOCK:
+        counters = dict(_STATS)
+    return {
+        "enabled": settings.session_journal,
+        "compact_every": settings.session_journal_compact_every,
+        **counters,
+        "avg_patch_bytes": round(counters["patch_bytes"] / counters["patches"], 1) if counters["patches"] else 0.0,
+    }
@@ -0,0 +1,105 @@
+"""按会话的 asyncio 锁：同一进程内同一 sessionId 的请求串行执行，不同会话之间互不阻塞。
+
+重复提交、多个标签页同时对同一会话发请求时，原先两个请求各自 ``get_session`` → 修改 → ``_persist``，
+后写者静默覆盖前者。这里为每个会话维护一把锁（无人持有或等待时即删除，不随会话数增长），
+pipeline 在处理已有会话的一轮时持有它：后到的请求排队等待上一轮结束，再基于最新版本继续；
+等待超过 ``RS_AGENT_SESSION_LOCK_TIMEOUT`` 秒时抛出 :class:`SessionBusyError`（接口返回 409）。
+
+跨进程（多 worker）的并发由 ``sessions.version`` 的 compare-and-swap 保证，见 ``db.SessionConflictError``。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+
+class SessionBusyError(RuntimeError):
+    """等待会话锁超时：同一会话的上一条请求仍在处理。"""
+
+    def __init__(self, session_id: str, waited: float) -> None:
+        super().__init__(f"session {session_id} is busy (waited {waited:.1f}s)")
+        self.session_id = session_id
+
+
+class _Entry:
+    __slots__ = ("lock", "refs")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+
+class SessionLocks:
+    def __init__(self) -> None:
+        self._entries: Dict[str, _Entry] = {}
+        self._stats = {"acquired": 0, "waited": 0, "timeouts": 0, "wait_ms_total": 0.0, "max_queue": 0}
+
+    @asynccontextmanager
+    async def hold(self, session_id: str, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """持有 ``session_id`` 的锁；``timeout`` 为最长等待秒数（None 为一直等待）。"""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            entry = self._entries[session_id] = _Entry()
+        entry.refs += 1
+        try:
+            t0 = time.perf_counter()
+            if entry.lock.locked():
+                self._stats["waited"] += 1
+                self._stats["max_queue"] = max(self._stats["max_queue"], entry.refs - 1)
+            if not await self._acquire(entry.lock, timeout):
+                self._stats["timeouts"] += 1
+                raise SessionBusyError(session_id, time.perf_counter() - t0)
+            self._stats["acquired"] += 1
+            self._stats["wait_ms_total"] += (time.perf_counter() - t0) * 1000
+            try:
+                yield
+            finally:
+                entry.lock.release()
+        finally:
+            entry.refs -= 1
+            if entry.refs == 0 and self._entries.get(session_id) is entry:
+                del self._entries[session_id]
+
+    @staticmethod
+    async def _acquire(lock: asyncio.Lock, timeout: Optional[float]) -> bool:
+        """在 ``timeout`` 秒内取得 ``lock``，返回是否取得。
+
+        不用 ``asyncio.wait_for(lock.acquire(), timeout)``：Python 3.9 下取得锁与超时同时发生时它会抛
+        TimeoutError 而锁已被占住，该会话在本 worker 内从此一直 409。这里等待独立的 acquire 任务，超时或
+        调用方被取消时取消该任务并等它落定，若已取得锁则照常返回（超时）或先释放（取消）。
+        锁空闲时 ``acquire`` 同步返回、不让出事件循环，直接走快路径。
+        """
+        if not lock.locked():
+            return await lock.acquire()
+        acquire = asyncio.ensure_future(lock.acquire())
+        try:
+            await asyncio.wait({acquire}, timeout=timeout)
+        except BaseException:
+            if await SessionLocks._settle(acquire):
+                lock.release()
+            raise
+        return await SessionLocks._settle(acquire)
+
+    @staticmethod
+    async def _settle(acquire: "asyncio.Future[bool]") -> bool:
+        if not acquire.done():
+            acquire.cancel()
+            await asyncio.wait({acquire})
+        return not acquire.cancelled() and acquire.exception() is None
+
+    def stats(self) -> Dict[str, object]:
+        acquired = self._stats["acquired"]
+        return {
+            "active": len(self._entries),
+            "acquired": acquired,
+            "waited": self._stats["waited"],
+            "timeouts": self._stats["timeouts"],
+            "max_queue": self._stats["max_queue"],
+            "avg_wait_ms": round(self._stats["wait_ms_total"] / acquired, 3) if acquired else 0.0,
+        }
+
+
+session_locks = SessionLocks()
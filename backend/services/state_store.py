@@ -0,0 +1,483 @@
+"""多 worker 共享状态后端（roadmap P3-1）：上传登记、会话缓存（共享层）与限流计数。
+
+原先上传登记在 ``routers/agent.py`` 的模块级 dict 中，一个 uvicorn worker 返回的 imageId 在其它 worker
+上无法解析，只能单 worker 运行。这里抽象出按命名空间划分的小型 KV + 计数器接口，由
+``RS_AGENT_STATE_BACKEND`` 选择实现：
+
+- ``memory``（默认）：进程内 dict，行为与之前一致，仅适用于单 worker；
+- ``sqlite``：本机共享的 SQLite 文件（``RS_AGENT_STATE_SQLITE_PATH``，WAL），同一台机器上的多个 worker 共享；
+- ``redis``：最小 RESP2 客户端（无第三方依赖），连接 ``RS_AGENT_STATE_REDIS_URL``，可跨机器共享。
+
+上传登记只保存上传 worker 本机磁盘上的路径（``RS_AGENT_UPLOAD_DIR``），不保存图片内容：跨机器部署时上传目录
+须为各机器相同路径挂载的共享存储，否则其它机器能解析 imageId 但打不开文件。
+
+值统一为 str（调用方自行 JSON 编码），可带 TTL；:meth:`StateBackend.incr` 为原子计数（首次创建时设置 TTL）。
+后端调用是阻塞 IO，事件循环中经 :func:`run_state` 放到线程池执行。
+"""
+
+from __future__ import annotations
+
+import json
+import select
+import socket
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from urllib.parse import unquote, urlparse
+
+from backend import executors
+from backend.config import settings
+
+T = TypeVar("T")
+
+
+class StateBackend:
+    """命名空间 KV + 计数器接口。"""
+
+    name = "base"
+
+    def get(self, ns: str, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, ns: str, key: str, value: str, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, ns: str, key: str) -> None:
+        raise NotImplementedError
+
+    def keys(self, ns: str) -> List[str]:
+        raise NotImplementedError
+
+    def incr(self, ns: str, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """原子加 ``amount`` 并返回新值；键不存在（或已过期）时从 0 开始并设置 ``ttl``。"""
+        raise NotImplementedError
+
+    def clear(self, ns: str) -> None:
+        for key in self.keys(ns):
+            self.delete(ns, key)
+
+    def close(self) -> None:
+        pass
+
+
+# ---------------------------------------------------------------------------
+# memory
+# ---------------------------------------------------------------------------
+
+class InProcessBackend(StateBackend):
+    name = "memory"
+
+    def __init__(self) -> None:
+        self._data: Dict[Tuple[str, str], Tuple[str, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, ns: str, key: str, now: float) -> Optional[str]:
+        entry = self._data.get((ns, key))
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._data[(ns, key)]
+            return None
+        return entry[0]
+
+    def get(self, ns: str, key: str) -> Optional[str]:
+        with self._lock:
+            return self._live(ns, key, time.time())
+
+    def set(self, ns: str, key: str, value: str, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[(ns, key)] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, ns: str, key: str) -> None:
+        with self._lock:
+            self._data.pop((ns, key), None)
+
+    def keys(self, ns: str) -> List[str]:
+        now = time.time()
+        with self._lock:
+            return [k for (n, k) in list(self._data) if n == ns and self._live(n, k, now) is not None]
+
+    def incr(self, ns: str, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        now = time.time()
+        with self._lock:
+            current = self._live(ns, key, now)
+            if current is None:
+                value, expires = amount, (now + ttl if ttl else None)
+            else:
+                value, expires = int(current) + amount, self._data[(ns, key)][1]
+            self._data[(ns, key)] = (str(value), expires)
+            return value
+
+
+# ---------------------------------------------------------------------------
+# sqlite
+# ---------------------------------------------------------------------------
+
+class SQLiteBackend(StateBackend):
+    """本机多 worker 共享：独立的 SQLite 文件，每线程一个 autocommit 连接。"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._conn().execute(
+            """
+            CREATE TABLE IF NOT EXISTS state_kv (
+                ns TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (ns, key)
+            )
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={max(0, settings.db_busy_timeout_ms)}")
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def get(self, ns: str, key: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT value FROM state_kv WHERE ns = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (ns, key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, ns: str, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO state_kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (ns, key, value, time.time() + ttl if ttl else None),
+        )
+
+    def delete(self, ns: str, key: str) -> None:
+        self._conn().execute("DELETE FROM state_kv WHERE ns = ? AND key = ?", (ns, key))
+
+    def keys(self, ns: str) -> List[str]:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("DELETE FROM state_kv WHERE ns = ? AND expires_at IS NOT NULL AND expires_at <= ?", (ns, now))
+        return [r[0] for r in conn.execute("SELECT key FROM state_kv WHERE ns = ?", (ns,))]
+
+    def incr(self, ns: str, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                """
+                INSERT INTO state_kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(ns, key) DO UPDATE SET
+                    value = CASE WHEN expires_at IS NOT NULL AND expires_at <= ? THEN excluded.value
+                                 ELSE CAST(CAST(value AS INTEGER) + ? AS TEXT) END,
+                    expires_at = CASE WHEN expires_at IS NOT NULL AND expires_at <= ? THEN excluded.expires_at
+                                      ELSE expires_at END
+                """,
+                (ns, key, str(amount), now + ttl if ttl else None, now, amount, now),
+            )
+            value = conn.execute("SELECT value FROM state_kv WHERE ns = ? AND key = ?", (ns, key)).fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return int(value)
+
+    def close(self) -> None:
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+# ---------------------------------------------------------------------------
+# redis（RESP2）
+# ---------------------------------------------------------------------------
+
+class RespError(RuntimeError):
+    """服务端返回的 ``-ERR ...`` 错误。"""
+
+
+class RespClient:
+    """最小 RESP2 客户端：每线程一个连接。支持 ``redis://[:password@]host:port/db``。
+
+    只在命令确定没有送达时（复用的连接已被对端关闭、发送失败）换新连接重发一次；命令发出后读回复失败
+    （如超时）不重发，避免重复执行 INCRBY 等非幂等命令。
+    """
+
+    def __init__(self, url: str, timeout: float = 2.0) -> None:
+        parsed = urlparse(url)
+        if parsed.scheme not in ("redis", ""):
+            raise ValueError(f"unsupported state url: {url}")
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> Tuple[socket.socket, Any]:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        self._local.conn = conn
+        if self.password:
+            self._roundtrip(conn, ("AUTH", self.password))
+        if self.db:
+            self._roundtrip(conn, ("SELECT", str(self.db)))
+        return conn
+
+    @staticmethod
+    def _encode(args: Tuple[Any, ...]) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    def _read(self, fh: Any) -> Any:
+        line = fh.readline()
+        if not line:
+            raise ConnectionError("connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise RespError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = fh.read(n + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [self._read(fh) for _ in range(n)]
+        raise ConnectionError(f"unexpected RESP reply: {line!r}")
+
+    def _roundtrip(self, conn: Tuple[socket.socket, Any], args: Tuple[Any, ...]) -> Any:
+        conn[0].sendall(self._encode(args))
+        return self._read(conn[1])
+
+    @staticmethod
+    def _is_stale(sock: socket.socket) -> bool:
+        """空闲连接上不应有可读数据：可读即对端已关闭（EOF）或协议错位，不能再用。"""
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def execute(self, *args: Any) -> Any:
+        payload = self._encode(args)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            try:
+                if self._is_stale(conn[0]):
+                    raise ConnectionError("stale connection")
+                conn[0].sendall(payload)
+            except OSError:
+                # 命令未送达，换新连接重发是安全的
+                self._drop(conn)
+                conn = None
+        if conn is None:
+            conn = self._connect()
+            try:
+                conn[0].sendall(payload)
+            except OSError:
+                self._drop(conn)
+                raise
+        try:
+            return self._read(conn[1])
+        except OSError:
+            # 命令可能已执行，不重发
+            self._drop(conn)
+            raise
+
+    def _drop(self, conn: Tuple[socket.socket, Any]) -> None:
+        self._local.conn = None
+        try:
+            conn[0].close()
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._drop(conn)
+
+
+# KEYS[1] 加 ARGV[1]；键没有过期时间（新建）时设置 ARGV[2] 毫秒过期
+INCR_WITH_TTL_SCRIPT = """
+local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+if redis.call('PTTL', KEYS[1]) < 0 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return value
+"""
+
+
+def _glob_escape(text: str) -> str:
+    return "".join("\\" + ch if ch in "*?[]\\" else ch for ch in text)
+
+
+class RespBackend(StateBackend):
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "rs-agent:") -> None:
+        self.client = RespClient(url)
+        self.prefix = prefix
+
+    def _k(self, ns: str, key: str) -> str:
+        return f"{self.prefix}{ns}:{key}"
+
+    def get(self, ns: str, key: str) -> Optional[str]:
+        return self.client.execute("GET", self._k(ns, key))
+
+    def set(self, ns: str, key: str, value: str, ttl: Optional[float] = None) -> None:
+        if ttl:
+            self.client.execute("SET", self._k(ns, key), value, "PX", max(1, int(ttl * 1000)))
+        else:
+            self.client.execute("SET", self._k(ns, key), value)
+
+    def delete(self, ns: str, key: str) -> None:
+        self.client.execute("DEL", self._k(ns, key))
+
+    def keys(self, ns: str) -> List[str]:
+        head = self._k(ns, "")
+        pattern = _glob_escape(head) + "*"
+        out: List[str] = []
+        cursor = "0"
+        while True:
+            cursor, batch = self.client.execute("SCAN", cursor, "MATCH", pattern, "COUNT", 500)
+            out.extend(k[len(head):] for k in batch)
+            if cursor == "0":
+                return out
+
+    def incr(self, ns: str, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        k = self._k(ns, key)
+        if not ttl:
+            return int(self.client.execute("INCRBY", k, amount))
+        # 加计数与设置过期在同一脚本中原子执行，计数键总会过期（PEXPIRE ... NX 需 Redis 7，脚本不限版本）
+        return int(self.client.execute("EVAL", INCR_WITH_TTL_SCRIPT, 1, k, amount, max(1, int(ttl * 1000))))
+
+    def close(self) -> None:
+        self.client.close()
+
+
+# ---------------------------------------------------------------------------
+# factory
+# ---------------------------------------------------------------------------
+
+_BACKEND: Optional[StateBackend] = None
+_BACKEND_KEY: Optional[Tuple[str, str]] = None
+_BACKEND_LOCK = threading.Lock()
+
+
+def _config_key() -> Tuple[str, str]:
+    kind = settings.state_backend
+    if kind == "sqlite":
+        return kind, str(settings.state_sqlite_path)
+    if kind == "redis":
+        return kind, f"{settings.state_redis_url}|{settings.state_key_prefix}"
+    return "memory", ""
+
+
+def get_state_backend() -> StateBackend:
+    """按当前配置返回共享状态后端（配置变化时重建，便于测试切换）。"""
+    global _BACKEND, _BACKEND_KEY
+    key = _config_key()
+    with _BACKEND_LOCK:
+        if _BACKEND is None or _BACKEND_KEY != key:
+            if _BACKEND is not None:
+                _BACKEND.close()
+            if key[0] == "sqlite":
+                _BACKEND = SQLiteBackend(key[1])
+            elif key[0] == "redis":
+                _BACKEND = RespBackend(settings.state_redis_url, settings.state_key_prefix)
+            else:
+                _BACKEND = InProcessBackend()
+            _BACKEND_KEY = key
+        return _BACKEND
+
+
+def is_shared() -> bool:
+    """当前后端是否在多个 worker 之间共享。"""
+    return settings.state_backend in ("sqlite", "redis")
+
+
+def close_state_backend() -> None:
+    global _BACKEND, _BACKEND_KEY
+    with _BACKEND_LOCK:
+        if _BACKEND is not None:
+            _BACKEND.close()
+        _BACKEND, _BACKEND_KEY = None, None
+
+
+async def run_state(fn: Callable[..., T], *args: Any) -> T:
+    """在 I/O 执行器中执行阻塞的状态后端调用（memory 后端直接调用）。"""
+    if not is_shared():
+        return fn(*args)
+    return await executors.io.run(fn, *args)
+
+
+class StateMapping(MutableMapping):
+    """把某个命名空间包装成 dict 接口（值为可 JSON 序列化的对象；tuple 读回为 list）。"""
+
+    def __init__(self, namespace: str, ttl: Optional[float] = None) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def __getitem__(self, key: str) -> Any:
+        raw = get_state_backend().get(self.namespace, key)
+        if raw is None:
+            raise KeyError(key)
+        return json.loads(raw)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        get_state_backend().set(self.namespace, key, json.dumps(value, ensure_ascii=False), self.ttl)
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        get_state_backend().delete(self.namespace, key)
+
+    def pop(self, key: str, *default: Any) -> Any:
+        """取出并删除；与其它 worker 并发删除同一键时不抛 KeyError（返回 default）。"""
+        backend = get_state_backend()
+        raw = backend.get(self.namespace, key)
+        if raw is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        backend.delete(self.namespace, key)
+        return json.loads(raw)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and get_state_backend().get(self.namespace, key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(get_state_backend().keys(self.namespace))
+
+    def __len__(self) -> int:
+        return len(get_state_backend().keys(self.namespace))
+
+    def clear(self) -> None:
+        get_state_backend().clear(self.namespace)
+
@@ -1,15 +1,18 @@
 """Service wrapper around trading-knowledge-base run_all_sources.py.
 
 P0-3: uses ``asyncio.create_subprocess_exec`` for non-blocking I/O.
+请求被取消（客户端断开 / 超过截止时间，见 ``backend.request_scope``）时杀掉子进程，不再让它跑完。
 """
 
 from __future__ import annotations
 
 import asyncio
 import sys
+import time
 from pathlib import Path
 from typing import List, Optional, Tuple
 
+from backend import request_scope, tracing
 from backend.config import settings
 
 
@@ -17,6 +20,18 @@ class KBQueryError(RuntimeError):
     """Raised when knowledge base query fails."""
 
 
+async def _kill(proc: asyncio.subprocess.Process, started: float) -> None:
+    """取消时终止仍在运行的 KB 子进程并等待其退出。"""
+    if proc.returncode is not None:
+        return
+    try:
+        proc.kill()
+    except ProcessLookupError:
+        return
+    request_scope.note("kb_subprocess", pid=proc.pid, ran_ms=round((time.monotonic() - started) * 1000, 1))
+    await proc.wait()
+
+
 async def query_kb(
     query: str,
     image_paths: Optional[List[str]] = None,
@@ -49,12 +64,19 @@ async def query_kb(
     cmd += ["--output-images-dir", str(images_dir)]
 
     try:
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        stdout_bytes, stderr_bytes = await proc.communicate()
+        with tracing.span("kb.subprocess", "KB", has_query_image=bool(image_paths)) as sp:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            started = time.monotonic()
+            try:
+                stdout_bytes, stderr_bytes = await proc.communicate()
+            except asyncio.CancelledError:
+                await _kill(proc, started)
+                raise
+            sp.set(returncode=proc.returncode, stdout_bytes=len(stdout_bytes or b""))
     except OSError as exc:
         raise KBQueryError(f"failed to start KB script: {exc!r}") from exc
 
@@ -0,0 +1,437 @@
+"""轻量链路追踪：基于 ``contextvars`` 的 span，单调时钟计时，可嵌套，可导出为 Chrome trace。
+
+原先 ``AgentPipeline`` 的 trace 步骤只有秒级时间戳，``duration_ms`` 在各处用 ``time.time()`` 手算，
+看不到单个检索子问题、LLM 重试、抽图、DB 调用等子步骤。这里：
+
+- :func:`trace` 开启一次请求的追踪（pipeline 每轮一个），其内的 :func:`span` 自动以当前 span 为父节点，
+  跨 ``await`` 与 ``asyncio.create_task``（上下文随任务复制）都能保持父子关系；
+- 计时用 ``time.perf_counter_ns``（单调时钟），另记一次墙钟时间仅用于展示；
+- :func:`event` 记录瞬时事件（如 pipeline 的「· 开始」步骤）；SSE trace 事件由 span / event 派生；
+- trace 结束后交给 :data:`exporter`：保留最近 ``RS_AGENT_TRACE_RECENT`` 个在内存中，并按
+  ``RS_AGENT_TRACE_EXPORT`` 写入 SQLite ``spans`` 表（默认）或按天的 JSONL 文件，写入在线程池中完成；
+- :func:`to_chrome_trace` 转为 Chrome Trace Event 格式（``chrome://tracing``、Perfetto、speedscope 均可打开）。
+
+没有进行中的 trace 时 span 仍然计时（调用方可以读 ``duration_ms``），只是不被记录。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, TypeVar
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_ATTR_MAX_CHARS = 300
+
+# span 结束时调用（有无 trace 都会调用），如 backend.metrics 据此记录各阶段耗时
+_listeners: List[Callable[["Span"], None]] = []
+
+
+def _task_name() -> str:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return task.get_name()
+    return threading.current_thread().name
+
+
+def _attr_value(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = str(value)
+    return text if len(text) <= _ATTR_MAX_CHARS else text[:_ATTR_MAX_CHARS] + "…"
+
+
+class Span:
+    """一个计时区间（``kind="span"``）或瞬时事件（``kind="event"``）。"""
+
+    __slots__ = (
+        "trace", "span_id", "parent_id", "name", "phase", "kind",
+        "attrs", "status", "task", "wall", "start_ns", "end_ns",
+    )
+
+    def __init__(
+        self,
+        trace: Optional["Trace"],
+        name: str,
+        phase: str = "",
+        parent_id: Optional[str] = None,
+        attrs: Optional[Dict[str, Any]] = None,
+        kind: str = "span",
+    ) -> None:
+        self.trace = trace
+        self.span_id = trace.next_id() if trace is not None else ""
+        self.parent_id = parent_id
+        self.name = name
+        self.phase = phase
+        self.kind = kind
+        self.attrs: Dict[str, Any] = {}
+        self.status = "ok"
+        self.task = _task_name()
+        self.wall = time.time()
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns: Optional[int] = None
+        if attrs:
+            self.set(**attrs)
+
+    def set(self, **attrs: Any) -> "Span":
+        """附加属性（None 忽略，长字符串截断）。"""
+        for key, value in attrs.items():
+            if value is not None:
+                self.attrs[key] = _attr_value(value)
+        return self
+
+    def fail(self, exc: BaseException) -> None:
+        if isinstance(exc, (asyncio.CancelledError, GeneratorExit)):
+            self.status = "cancelled"
+        else:
+            self.status = "error"
+            self.attrs["error"] = _attr_value(f"{type(exc).__name__}: {exc}")
+
+    def finish(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = self.start_ns if self.kind == "event" else time.perf_counter_ns()
+        if self.trace is not None:
+            self.trace.add(self)
+        for listener in _listeners:
+            try:
+                listener(self)
+            except Exception:
+                logger.exception("Span listener failed")
+
+    @property
+    def duration_ns(self) -> int:
+        end = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+        return end - self.start_ns
+
+    @property
+    def duration_ms(self) -> int:
+        return self.duration_ns // 1_000_000
+
+    @property
+    def end_wall(self) -> float:
+        return self.wall + self.duration_ns / 1e9
+
+    def to_dict(self) -> Dict[str, Any]:
+        origin = self.trace.start_ns if self.trace is not None else self.start_ns
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "phase": self.phase,
+            "kind": self.kind,
+            "start_us": (self.start_ns - origin) // 1000,
+            "duration_us": self.duration_ns // 1000,
+            "status": self.status,
+            "task": self.task,
+            "attrs": dict(self.attrs),
+        }
+
+
+class Trace:
+    """一次请求内的全部 span；span id 在 trace 内唯一。"""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None) -> None:
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.wall = time.time()
+        self.start_ns = time.perf_counter_ns()
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self.finished = False
+        self.root: Optional[Span] = None
+        self._ids = itertools.count(1)
+
+    def next_id(self) -> str:
+        return format(next(self._ids), "x")
+
+    def add(self, span: Span) -> None:
+        if self.finished:
+            return
+        if len(self.spans) >= max(1, settings.trace_max_spans):
+            self.dropped += 1
+            return
+        self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        root = self.root
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": datetime.fromtimestamp(self.wall).isoformat(sep=" ", timespec="milliseconds"),
+            "duration_ms": root.duration_ms if root is not None else 0,
+            "status": root.status if root is not None else "ok",
+            "attrs": dict(root.attrs) if root is not None else {},
+            "dropped": self.dropped,
+            "spans": [s.to_dict() for s in sorted(self.spans, key=lambda s: s.start_ns)],
+        }
+
+
+def add_listener(fn: Callable[[Span], None]) -> None:
+    """注册 span 结束回调（在结束 span 的线程中同步调用，须足够轻量）。"""
+    if fn not in _listeners:
+        _listeners.append(fn)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("rs_agent_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("rs_agent_span", default=None)
+
+
+def _reset(var: ContextVar, token: Token, previous: Any) -> None:
+    try:
+        var.reset(token)
+    except (ValueError, RuntimeError):
+        # 异步生成器可能在另一个上下文中被关闭：退回为直接恢复原值
+        var.set(previous)
+
+
+def current_trace() -> Optional[Trace]:
+    """进行中的 trace（已结束的视为没有）。"""
+    tr = _current_trace.get()
+    return tr if tr is not None and not tr.finished else None
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, phase: str = "", **attrs: Any) -> Span:
+    """创建一个以当前 span 为父节点的 span（不设为当前 span；结束时调用 :meth:`Span.finish`）。"""
+    tr = current_trace()
+    parent = _current_span.get() if tr is not None else None
+    return Span(tr, name, phase or (parent.phase if parent is not None else ""),
+                parent.span_id if parent is not None else None, attrs)
+
+
+@contextmanager
+def span(name: str, phase: str = "", **attrs: Any) -> Iterator[Span]:
+    """计时一段代码；其内创建的 span 以它为父节点。异常时记录状态后原样抛出。
+
+    在异步生成器中使用时，``with`` 块内不要 ``yield``（否则 span 会把消费方的耗时算进去）。
+    """
+    with activate(start_span(name, phase, **attrs)) as sp:
+        yield sp
+
+
+@contextmanager
+def activate(sp: Span) -> Iterator[Span]:
+    """把 :func:`start_span` 创建的 span 设为当前 span，``with`` 块结束时结束它。"""
+    previous = _current_span.get()
+    token = _current_span.set(sp)
+    try:
+        yield sp
+    except BaseException as exc:
+        sp.fail(exc)
+        raise
+    finally:
+        _reset(_current_span, token, previous)
+        sp.finish()
+
+
+def event(name: str, phase: str = "", **attrs: Any) -> Span:
+    """记录一个瞬时事件。"""
+    tr = current_trace()
+    parent = _current_span.get() if tr is not None else None
+    sp = Span(tr, name, phase, parent.span_id if parent is not None else None, attrs, kind="event")
+    sp.finish()
+    return sp
+
+
+def traced(name: Optional[str] = None, phase: str = "") -> Callable[[F], F]:
+    """装饰器：把整个函数调用（同步或 async）记为一个 span。"""
+
+    def decorator(fn: F) -> F:
+        span_name = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(span_name, phase):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper  # type: ignore[return-value]
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(span_name, phase):
+                return fn(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+@contextmanager
+def trace(name: str, trace_id: Optional[str] = None, phase: str = "", **attrs: Any) -> Iterator[Trace]:
+    """开启一次追踪：根 span 覆盖整个 ``with`` 块，结束后导出。"""
+    tr = Trace(name, trace_id)
+    prev_trace, prev_span = _current_trace.get(), _current_span.get()
+    trace_token = _current_trace.set(tr)
+    span_token = _current_span.set(None)
+    try:
+        with span(name, phase, **attrs) as root:
+            tr.root = root
+            yield tr
+    finally:
+        _reset(_current_span, span_token, prev_span)
+        _reset(_current_trace, trace_token, prev_trace)
+        tr.finished = True
+        exporter.export(tr)
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+_JSONL_EXECUTOR: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def _jsonl_executor() -> concurrent.futures.ThreadPoolExecutor:
+    # 单线程：同一文件的追加写入按顺序进行
+    global _JSONL_EXECUTOR
+    if _JSONL_EXECUTOR is None:
+        _JSONL_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="rs-agent-trace")
+    return _JSONL_EXECUTOR
+
+
+class SpanExporter:
+    """保留最近的 trace，并把结束的 trace 异步写入 spans 表或 JSONL 文件。"""
+
+    def __init__(self) -> None:
+        self._recent: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending: Set["concurrent.futures.Future[None]"] = set()
+        self._stats = {"traces": 0, "spans": 0, "dropped": 0, "written": 0, "errors": 0}
+
+    def export(self, tr: Trace) -> None:
+        data = tr.to_dict()
+        with self._lock:
+            self._recent[tr.trace_id] = data
+            while len(self._recent) > max(1, settings.trace_recent):
+                self._recent.popitem(last=False)
+            self._stats["traces"] += 1
+            self._stats["spans"] += len(data["spans"])
+            self._stats["dropped"] += tr.dropped
+        mode = settings.trace_export
+        if mode not in ("table", "jsonl"):
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(mode, data)
+            return
+        # 在事件循环中：交给线程池写入（concurrent Future，可在任意事件循环中等待）
+        if mode == "table":
+            from backend import db
+
+            fut = db._get_executor().submit(self._write, mode, data)
+        else:
+            fut = _jsonl_executor().submit(self._write, mode, data)
+        self._pending.add(fut)
+        fut.add_done_callback(self._pending.discard)
+
+    def _write(self, mode: str, data: Dict[str, Any]) -> None:
+        try:
+            if mode == "table":
+                from backend import db
+
+                db.insert_trace(data)
+            else:
+                directory = settings.trace_dir
+                directory.mkdir(parents=True, exist_ok=True)
+                path = directory / f"spans-{data['started_at'][:10].replace('-', '')}.jsonl"
+                line = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+                with open(path, "a", encoding="utf-8") as fh:
+                    fh.write(line + "\n")
+            with self._lock:
+                self._stats["written"] += 1
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            logger.exception("Failed to export trace %s", data.get("trace_id"))
+
+    async def drain(self) -> None:
+        """等待已提交的导出写入完成（应用退出、测试中使用）。"""
+        pending = list(self._pending)
+        if pending:
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in pending), return_exceptions=True)
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """最近的 trace 摘要（新的在前）。"""
+        with self._lock:
+            items = list(self._recent.values())[-max(1, limit):]
+        return [{k: v for k, v in d.items() if k != "spans"} | {"spans": len(d["spans"])} for d in reversed(items)]
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """按 id 取完整 trace：先查内存，导出到表时再查 spans 表（DB 线程中调用）。"""
+        with self._lock:
+            data = self._recent.get(trace_id)
+        if data is not None:
+            return data
+        if settings.trace_export == "table":
+            from backend import db
+
+            return db.load_trace(trace_id)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"export": settings.trace_export, "recent": len(self._recent), "pending": len(self._pending), **self._stats}
+
+
+exporter = SpanExporter()
+
+
+def to_chrome_trace(data: Dict[str, Any]) -> Dict[str, Any]:
+    """trace（:meth:`Trace.to_dict` 格式）转为 Chrome Trace Event JSON：span 为 ``X`` 事件，瞬时事件为 ``i``。
+
+    时间戳以 trace 开始时的墙钟为原点（微秒）；每个 asyncio 任务 / 线程一条泳道（tid）。
+    """
+    pid = os.getpid()
+    origin_us = int(datetime.fromisoformat(data["started_at"]).timestamp() * 1_000_000)
+    lanes: Dict[str, int] = {}
+    events: List[Dict[str, Any]] = []
+    for s in data["spans"]:
+        tid = lanes.setdefault(s.get("task") or "main", len(lanes) + 1)
+        args = {"span_id": s["span_id"], "parent_id": s["parent_id"], "status": s["status"], **(s.get("attrs") or {})}
+        ev: Dict[str, Any] = {
+            "name": s["name"],
+            "cat": s.get("phase") or "span",
+            "ts": origin_us + int(s["start_us"]),
+            "pid": pid,
+            "tid": tid,
+            "args": args,
+        }
+        if s.get("kind") == "event":
+            ev.update(ph="i", s="t")
+        else:
+            ev.update(ph="X", dur=max(1, int(s["duration_us"])))
+        events.append(ev)
+    for task, tid in lanes.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": task}})
+    events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": f"rs-agent {data['name']}"}})
+    return {
+        "traceEvents": events,
+        "displayTimeUnit": "ms",
+        "otherData": {"trace_id": data["trace_id"], "started_at": data["started_at"], "duration_ms": data["duration_ms"]},
+    }
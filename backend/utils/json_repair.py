@@ -0,0 +1,155 @@
+"""宽松 JSON 解析：尽量从 LLM 输出中抢救出 JSON 对象，避免整次调用因格式瑕疵作废。
+
+处理的常见瑕疵：
+- 被 ```json ... ``` 代码块包裹，或前后带解释文字；
+- // 行注释、/* */ 块注释；
+- 对象/数组末尾多余的逗号；
+- 字符串中夹带未转义的换行（``strict=False``）。
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+def _strip_fences(text: str) -> str:
+    """去掉包裹整段输出的 ```json ... ``` 代码块。
+
+    只处理以 ``` 开头的情况；代码块出现在说明文字中间时交给平衡括号提取处理，
+    避免误截 JSON 字符串内部的 ```mermaid 代码块。
+    """
+    if not text.startswith("```"):
+        return text
+    nl = text.find("\n")
+    body = text[nl + 1:] if nl >= 0 else ""
+    body = body.rstrip()
+    if body.endswith("```"):
+        body = body[:-3]
+    return body
+
+
+def _scan(text: str, handle: Callable[[str, int], Optional[int]]) -> str:
+    """按字符扫描（感知字符串字面量）；字符串外的位置交给 ``handle(text, i)`` 处理。
+
+    ``handle`` 返回下一个扫描位置；返回 None 表示原样保留当前字符。
+    """
+    out: List[str] = []
+    i = 0
+    n = len(text)
+    in_str = False
+    while i < n:
+        ch = text[i]
+        if in_str:
+            out.append(ch)
+            if ch == "\\" and i + 1 < n:
+                out.append(text[i + 1])
+                i += 2
+                continue
+            if ch == '"':
+                in_str = False
+            i += 1
+            continue
+        if ch == '"':
+            in_str = True
+        else:
+            nxt = handle(text, i)
+            if nxt is not None:
+                i = nxt
+                continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def _skip_comment(text: str, i: int) -> Optional[int]:
+    if text.startswith("//", i):
+        nl = text.find("\n", i)
+        return len(text) if nl < 0 else nl
+    if text.startswith("/*", i):
+        end = text.find("*/", i + 2)
+        return len(text) if end < 0 else end + 2
+    return None
+
+
+def _skip_trailing_comma(text: str, i: int) -> Optional[int]:
+    if text[i] != ",":
+        return None
+    j = i + 1
+    while j < len(text) and text[j] in " \t\r\n":
+        j += 1
+    return i + 1 if j < len(text) and text[j] in "}]" else None
+
+
+def _clean(text: str) -> str:
+    """去掉注释，再去掉对象/数组末尾多余的逗号（注释可能夹在逗号与括号之间）。"""
+    return _scan(_scan(text, _skip_comment), _skip_trailing_comma)
+
+
+def _balanced_objects(text: str) -> List[str]:
+    """提取所有顶层平衡的 {...} 片段（感知字符串字面量），按长度降序返回。"""
+    spans: List[Tuple[int, int]] = []
+    depth = 0
+    start = -1
+    in_str = False
+    escape = False
+    for i, ch in enumerate(text):
+        if in_str:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_str = False
+            continue
+        if ch == '"':
+            in_str = True
+        elif ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                spans.append((start, i + 1))
+    return sorted((text[a:b] for a, b in spans), key=len, reverse=True)
+
+
+def _loads_object(text: str) -> Optional[Dict[str, Any]]:
+    try:
+        obj = json.loads(text, strict=False)
+    except ValueError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def repair_json_object(raw: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """解析 LLM 输出中的 JSON 对象。
+
+    Returns:
+        (obj, salvaged)：obj 为解析出的 dict（失败为 None）；
+        salvaged 表示原文不能直接 ``json.loads``、经修复后才解析成功。
+    """
+    text = (raw or "").strip()
+    if not text:
+        return None, False
+    try:
+        obj = json.loads(text)
+        if isinstance(obj, dict):
+            return obj, False
+    except ValueError:
+        pass
+    body = _clean(_strip_fences(text))
+    obj = _loads_object(body.strip())
+    if obj is not None:
+        return obj, True
+    for candidate in _balanced_objects(body):
+        obj = _loads_object(candidate)
+        if obj is not None:
+            return obj, True
+    return None, False
+
+
+def missing_keys(obj: Dict[str, Any], required: Iterable[str]) -> List[str]:
+    """返回 obj 中缺失或为 null 的必填键。"""
+    return [k for k in required if obj.get(k) is None]
@@ -0,0 +1,162 @@
+"""多模式关键词匹配：一次扫描返回文本中所有关键词命中（含重叠命中）及其类别。
+
+意图路由、KB 文本行分类、草稿规则版回退、确认回复关键词回退等处原先对每个关键词各扫描一遍文本
+（``any(k in text for k in keywords)`` 与多条正则）；这里在模块导入时为每组关键词构建一个匹配器，
+文本只扫描一遍即可得到全部命中，多个调用方还可共享同一次扫描结果（:meth:`KeywordMatcher.line_categories` 带缓存）。
+
+实现沿用 Aho-Corasick 的思路（输出函数 + 失败函数），但逐字符推进交给 ``re`` 引擎在 C 层完成——
+纯 Python 逐字符驱动自动机在 CPython 上反而比逐关键词的 C 层子串查找慢 2~3 倍：
+
+- 扫描正则为全部模式按长度降序的分支，每次命中都是最左起点处的最长模式；
+- 输出函数：模式内部完整包含的关键词在构建时预先算好，命中时一并展开；
+- 重叠闭包：若模式的真后缀是某关键词的真前缀（该关键词跨过模式末尾），把二者拼接为合成模式加入分支。
+  闭包完整时，跨过所选模式末尾的命中必然对应一个更长的合成模式，因此不重叠的 ``finditer`` 已覆盖全部重叠命中；
+- 关键词自重叠（如 ``aba``）导致闭包无限生长时，退回逐次 ``search``，按失败函数（最长可延伸后缀）回退续扫。
+
+用法::
+
+    matcher = KeywordMatcher({"frontend": ("页面", "前端"), "backend": ("接口", "后端")})
+    matcher.categories("前端页面调用后端接口")  # {"frontend", "backend"}
+    matcher.line_categories(kb_text)           # ((line, frozenset({...})), ...)
+"""
+
+from __future__ import annotations
+
+import functools
+import re
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Mapping, Set, Tuple
+
+Hit = Tuple[int, int, FrozenSet[str]]
+
+_EMPTY: FrozenSet[str] = frozenset()
+
+
+class KeywordMatcher:
+    """按类别分组的关键词集合上的多模式匹配器（构建后只读，可在线程间共享）。"""
+
+    def __init__(self, categories: Mapping[str, Iterable[str]]) -> None:
+        keyword_cats: Dict[str, Set[str]] = {}
+        for category, keywords in categories.items():
+            for kw in keywords:
+                if kw:
+                    keyword_cats.setdefault(kw, set()).add(category)
+        self.category_names: FrozenSet[str] = frozenset(categories)
+
+        # 重叠闭包：若模式 P 的真后缀是关键词 L 的真前缀（L 跨过 P 的末尾），加入合成模式 P + L 的剩余部分。
+        # 闭包完整时，按长度降序的分支做「不重叠」的 finditer 即可覆盖全部重叠命中：
+        # 任何跨过所选模式末尾的命中都会对应一个更长的合成模式，而最长优先分支必然选中它。
+        patterns: Set[str] = set(keyword_cats)
+        frontier = list(patterns)
+        self._closed = True
+        limit = max(64, 4 * len(patterns))
+        while frontier and self._closed:
+            grown: List[str] = []
+            for pat in frontier:
+                for kw in keyword_cats:
+                    for d in range(1, min(len(pat), len(kw))):
+                        if pat.endswith(kw[:d]):
+                            merged = pat + kw[d:]
+                            if merged not in patterns:
+                                patterns.add(merged)
+                                grown.append(merged)
+            if len(patterns) > limit:
+                # 自重叠关键词（如 "aba"）会无限生长：退回逐次 search + 失败函数回退
+                patterns = set(keyword_cats)
+                self._closed = False
+            frontier = grown
+
+        # 输出函数：模式命中时展开其内部的全部关键词 (offset, length, cats)。
+        # 失败函数（仅非闭包模式使用）：续扫回退长度 = 最长的「同时是某个更长关键词真前缀」的真后缀长度，
+        # 输出只含续扫位置之前起始的关键词，避免重复。
+        proper_prefixes = {k[:i] for k in keyword_cats for i in range(1, len(k))}
+        by_length = sorted(keyword_cats.items(), key=lambda kv: len(kv[0]))
+        self._outputs: Dict[str, Tuple[Tuple[int, int, FrozenSet[str]], ...]] = {}
+        self._backoff: Dict[str, int] = {}
+        self._position_cats: Dict[str, FrozenSet[str]] = {}
+        for pat in patterns:
+            backoff = 0 if self._closed else next(
+                (len(pat) - o for o in range(1, len(pat)) if pat[o:] in proper_prefixes), 0
+            )
+            outs = tuple(
+                (o, len(k), frozenset(cats))
+                for o in range(len(pat) - backoff)
+                for k, cats in by_length
+                if pat.startswith(k, o)
+            )
+            self._outputs[pat] = outs
+            self._backoff[pat] = backoff
+            self._position_cats[pat] = frozenset().union(*(cats for _o, _len, cats in outs))
+
+        # 行级统计用位掩码表示类别集合，避免热路径上反复创建 frozenset
+        bits = {name: 1 << i for i, name in enumerate(sorted(self.category_names))}
+        self._position_masks: Dict[str, int] = {
+            pat: sum(bits[c] for c in cats) for pat, cats in self._position_cats.items()
+        }
+        self._decode_mask = functools.lru_cache(maxsize=None)(
+            lambda mask: frozenset(name for name, bit in bits.items() if mask & bit)
+        )
+
+        alternation = sorted(patterns, key=len, reverse=True)
+        self._regex = re.compile("|".join(re.escape(k) for k in alternation)) if alternation else None
+        # 按实例缓存最近扫描过的文本（同一请求内多个调用方共享一次扫描）
+        self.line_categories = functools.lru_cache(maxsize=8)(self._line_categories)  # type: ignore[method-assign]
+
+    # -- scanning --------------------------------------------------------
+
+    def _scan(self, text: str) -> Iterator[Tuple[int, str]]:
+        """产出 (start, pattern)：被 pattern 覆盖的全部关键词命中由输出函数展开。"""
+        if self._closed:
+            for m in self._regex.finditer(text):  # type: ignore[union-attr]
+                yield m.start(), m.group()
+            return
+        search = self._regex.search  # type: ignore[union-attr]
+        backoff = self._backoff
+        pos = 0
+        while True:
+            m = search(text, pos)
+            if m is None:
+                return
+            pat = m.group()
+            yield m.start(), pat
+            pos = m.end() - backoff[pat]
+
+    def iter_hits(self, text: str) -> Iterator[Hit]:
+        """逐个产出命中 (start, end, categories)，按 start 升序；重叠命中都会产出。"""
+        if not text or self._regex is None:
+            return
+        outputs = self._outputs
+        for start, kw in self._scan(text):
+            for offset, length, cats in outputs[kw]:
+                yield start + offset, start + offset + length, cats
+
+    def categories(self, text: str) -> Set[str]:
+        """返回文本命中的全部类别；所有类别都已命中时提前结束扫描。"""
+        found: Set[str] = set()
+        if not text or self._regex is None:
+            return found
+        total = len(self.category_names)
+        position_cats = self._position_cats
+        for _start, kw in self._scan(text):
+            found |= position_cats[kw]
+            if len(found) == total:
+                break
+        return found
+
+    def _line_categories(self, text: str) -> Tuple[Tuple[str, FrozenSet[str]], ...]:
+        """整段文本只扫描一次，返回每一行（按换行符切分，不含换行符）及其命中的类别。"""
+        if not text:
+            return ()
+        lines = text.split("\n")
+        if self._regex is None:
+            return tuple((ln, _EMPTY) for ln in lines)
+        # 热路径：每行类别用位掩码累积，行号按相邻命中之间的换行数累加（str.count 在 C 层完成）
+        masks = [0] * len(lines)
+        position_masks = self._position_masks
+        count = text.count
+        line = line_pos = 0
+        for start, pat in self._scan(text):
+            line += count("\n", line_pos, start)
+            line_pos = start
+            masks[line] |= position_masks[pat]
+        decode = self._decode_mask
+        return tuple((ln, decode(mask) if mask else _EMPTY) for ln, mask in zip(lines, masks))
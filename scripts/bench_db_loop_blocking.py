@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""事件循环阻塞基准：pipeline 式 SQLite 写入（原实现：每次新建连接、默认 rollback journal、
+在事件循环线程内同步执行） vs 连接池 + WAL + DB 线程池异步接口（backend.db.*_async）
+vs 写后队列（backend.services.message_log，批量落盘）。
+
+场景：N 个并发「请求」各自按 AgentPipeline 的节奏写入（create_conversation → 若干 add_message →
+会话 upsert），同时一个心跳协程每 1ms 醒来一次，记录实际唤醒延迟（事件循环卡顿）。
+同步写入期间事件循环无法调度其它协程（SSE 推送、其它请求的 LLM 等待），卡顿直接体现为心跳延迟。
+另统计每个请求在写入调用上等待的总时间（请求路径写延迟）；写后队列组的总耗时包含最终落盘。
+
+用法（在 RS-Agent 根目录执行）::
+
+    python scripts/bench_db_loop_blocking.py                     # 默认 32 个并发请求 × 8 次写
+    python scripts/bench_db_loop_blocking.py --requests 64 --writes 16 --payload-kb 32
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from backend import db  # noqa: E402
+from backend.config import settings  # noqa: E402
+from backend.services.message_log import message_log  # noqa: E402
+
+
+@contextmanager
+def _legacy_conn():
+    """原 ``get_conn``：每次调用新建连接（默认 DELETE journal、synchronous=FULL）。"""
+    conn = sqlite3.connect(settings.db_path)
+    try:
+        conn.row_factory = sqlite3.Row
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _legacy_add_message(conv_id: str, content: str) -> None:
+    with _legacy_conn() as conn:
+        conn.execute(
+            "INSERT INTO messages (conversation_id, role, payload_type, content, created_at) "
+            "VALUES (?, 'assistant', 'TRACE', ?, datetime('now', 'localtime'))",
+            (conv_id, content),
+        )
+
+
+def _legacy_save_session(session_id: str, data: str) -> None:
+    with _legacy_conn() as conn:
+        conn.execute(
+            "INSERT INTO sessions (id, state, session_data) VALUES (?, 'COLLECT', ?) "
+            "ON CONFLICT(id) DO UPDATE SET session_data = excluded.session_data",
+            (session_id, data),
+        )
+
+
+# 每个请求在写入调用上花费的时间（请求路径上的写延迟）
+_WRITE_PATH: List[float] = []
+
+
+async def _legacy_request(writes: int, payload: str) -> None:
+    conv_id = uuid.uuid4().hex
+    spent = 0.0
+    t0 = time.perf_counter()
+    with _legacy_conn() as conn:
+        conn.execute("INSERT INTO conversations (id, intent, status) VALUES (?, 'ORCH_FLOW', 'active')", (conv_id,))
+    spent += time.perf_counter() - t0
+    for _ in range(writes):
+        t0 = time.perf_counter()
+        _legacy_add_message(conv_id, payload)
+        spent += time.perf_counter() - t0
+        await asyncio.sleep(0)  # 模拟两次写入之间的其它 await（LLM / KB）
+    t0 = time.perf_counter()
+    _legacy_save_session(conv_id, payload)
+    _WRITE_PATH.append(spent + time.perf_counter() - t0)
+
+
+async def _async_request(writes: int, payload: str, write_behind: bool = False) -> None:
+    conv_id = uuid.uuid4().hex
+    spent = 0.0
+    t0 = time.perf_counter()
+    # 与 legacy 相同的单条 INSERT（create_conversation 会额外触发 trim，各组都不计入）
+    await db.run_db(_insert_conversation, conv_id)
+    spent += time.perf_counter() - t0
+    for _ in range(writes):
+        t0 = time.perf_counter()
+        if write_behind:
+            await message_log.add_message(conv_id, "assistant", "TRACE", payload)
+        else:
+            await db.add_message_async(conv_id, "assistant", "TRACE", payload)
+        spent += time.perf_counter() - t0
+        await asyncio.sleep(0)
+    t0 = time.perf_counter()
+    await db.save_session_async(conv_id, "COLLECT", payload)
+    _WRITE_PATH.append(spent + time.perf_counter() - t0)
+
+
+def _insert_conversation(conv_id: str) -> None:
+    with db.get_conn() as conn:
+        conn.execute("INSERT INTO conversations (id, intent, status) VALUES (?, 'ORCH_FLOW', 'active')", (conv_id,))
+
+
+async def _measure(make_request: Callable[[], Awaitable[None]], requests: int) -> Dict[str, float]:
+    lags: List[float] = []
+    stop = asyncio.Event()
+
+    async def heartbeat() -> None:
+        interval = 0.001
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(max(0.0, time.perf_counter() - t0 - interval))
+
+    hb = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0.01)
+    _WRITE_PATH.clear()
+    t0 = time.perf_counter()
+    await asyncio.gather(*(make_request() for _ in range(requests)))
+    await message_log.drain()  # 写后队列：计入落盘完成的时间
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await hb
+    lags.sort()
+    return {
+        "elapsed_ms": elapsed * 1000,
+        "write_path_ms": statistics.mean(_WRITE_PATH) * 1000,
+        "lag_p50_ms": statistics.median(lags) * 1000,
+        "lag_p99_ms": lags[int(len(lags) * 0.99) - 1] * 1000 if len(lags) >= 100 else lags[-1] * 1000,
+        "lag_max_ms": lags[-1] * 1000,
+        "beats": len(lags),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=32, help="并发请求数")
+    parser.add_argument("--writes", type=int, default=8, help="每个请求的 add_message 次数")
+    parser.add_argument("--payload-kb", type=float, default=8.0, help="每条消息大小（KB，模拟 TRACE/DRAFT JSON）")
+    parser.add_argument("--dir", default="", help="数据库所在目录（默认临时目录；放在真实磁盘上更能体现 fsync 开销）")
+    args = parser.parse_args()
+
+    payload = json.dumps({"trace": "x" * int(args.payload_kb * 1024)})
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for name in ("legacy", "pooled", "write_behind"):
+            settings.db_path = str(Path(args.dir or tmp) / f"bench_{name}_{uuid.uuid4().hex[:8]}.db")
+            db.shutdown_db()
+            if name == "legacy":
+                # 原实现的库：默认 rollback journal，不经过连接池
+                _init_schema_legacy()
+                make = lambda: _legacy_request(args.writes, payload)  # noqa: E731
+            else:
+                db.init_db()
+                wb = name == "write_behind"
+                make = lambda: _async_request(args.writes, payload, write_behind=wb)  # noqa: E731
+            results[name] = asyncio.run(_measure(make, args.requests))
+            db.shutdown_db()
+            for suffix in ("", "-wal", "-shm"):
+                Path(settings.db_path + suffix).unlink(missing_ok=True)
+
+    print(
+        f"{args.requests} concurrent requests x {args.writes} writes, payload {args.payload_kb:.0f}KB, "
+        f"pool size {settings.db_pool_size}, synchronous={settings.db_synchronous}"
+    )
+    for name, r in results.items():
+        print(
+            f"  {name:12s} total {r['elapsed_ms']:8.1f} ms | write path/request {r['write_path_ms']:7.2f} ms | loop lag p50 {r['lag_p50_ms']:6.2f} ms "
+            f"p99 {r['lag_p99_ms']:7.2f} ms max {r['lag_max_ms']:7.2f} ms | heartbeats {r['beats']}"
+        )
+    return 0
+
+
+def _init_schema_legacy() -> None:
+    """与 init_db 相同的表结构，但保持原实现的连接方式与 journal 模式。"""
+    with _legacy_conn() as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations (id TEXT PRIMARY KEY, intent TEXT NOT NULL, status TEXT NOT NULL, "
+            "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT NOT NULL, "
+            "role TEXT NOT NULL, payload_type TEXT NOT NULL, content TEXT NOT NULL, "
+            "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state TEXT NOT NULL, session_data TEXT NOT NULL, "
+            "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
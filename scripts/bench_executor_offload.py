@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""并发请求延迟基准：阻塞 / CPU 操作在事件循环线程内执行（原实现） vs 经 backend.executors 移出事件循环。
+
+每个「请求」按 ORCH_FLOW 一轮的节奏执行：等待 KB（asyncio.sleep 模拟子进程）→ KB 文本正则扫描
+（``_derive_open_questions``、``_kb_slices_for_sections``、``_fallback_system_current``）→ 读候选图并 base64
+（``_build_user_content``）→ 等待 LLM → 渲染草稿与终稿（confirmer ``get_display``、``render_final``）。
+同时一个心跳协程每 1ms 醒来一次（代表并发 SSE 流能否及时推送），记录唤醒延迟。
+
+输出两组的请求延迟 p50 / p95 与心跳延迟 p99 / max。CPU 执行器默认线程池（GIL 下总吞吐不变，但长操作
+不再独占事件循环）；``--cpu-kind process`` 对比进程池。
+
+用法（在 RS-Agent 根目录执行）::
+
+    python scripts/bench_executor_offload.py                    # 默认 32 个并发请求，KB 文本 200KB
+    python scripts/bench_executor_offload.py --requests 64 --kb-kb 400 --image-kb 800 --cpu-kind process
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from backend import executors  # noqa: E402
+from backend.config import settings  # noqa: E402
+from backend.services import orchestrator_controller as orch  # noqa: E402
+from backend.services.confirmer_service import get_display  # noqa: E402
+from backend.services.editor_service import render_final  # noqa: E402
+from backend.services.llm_service import _build_user_content  # noqa: E402
+
+_KB_BLOCK = """--- source=清算手册.docx distance=0.12
+【确认调仓】页面展示建议追加金额，用户点击确认后进入调仓流程。
+调仓接口会拆单后生成订单，后端按批次推送到交易系统并落库。
+调仓完成后发送到账通知消息，短信与站内信同时发送。
+=== 表格聚合视图
+| 字段 | 说明 |
+| --- | --- |
+| amount | 追加金额 |
+=== 图片 (images) ===
+path=/data/kb/清算手册.pdf page=12
+"""
+
+
+def _kb_text(size_kb: float) -> str:
+    repeat = max(1, int(size_kb * 1024 / len(_KB_BLOCK.encode("utf-8"))))
+    return _KB_BLOCK * repeat
+
+
+def _cpu_stage_inline(kb: str, images: List[str]) -> dict:
+    orch._derive_open_questions("优化确认调仓页面的追加金额展示", kb)
+    orch._kb_slices_for_sections(kb)
+    current = orch._fallback_system_current(kb, ["/api/kb-images/a.png"])
+    _build_user_content("请根据需求选图", images)
+    return current
+
+
+def _draft(current: dict) -> dict:
+    return {
+        "template_name": "demand_analysis_doc_v1",
+        "business_requirement": {"demand_source": "需求", "product_statement": "表述", "open_questions": [],
+                                 "clarification_log": {"items": []}},
+        "system_current": current,
+        "system_changes": orch._fallback_system_changes("优化确认调仓页面", "只改前端展示，不改后端"),
+    }
+
+
+async def _request_inline(kb: str, images: List[str]) -> None:
+    await asyncio.sleep(0.03)  # KB 子进程
+    current = _cpu_stage_inline(kb, images)
+    await asyncio.sleep(0.05)  # LLM
+    draft = _draft(current)
+    get_display(draft)
+    render_final(draft)
+
+
+async def _request_offloaded(kb: str, images: List[str]) -> None:
+    await asyncio.sleep(0.03)
+    await executors.cpu.run(orch._derive_open_questions, "优化确认调仓页面的追加金额展示", kb)
+    await executors.cpu.run(orch._kb_slices_for_sections, kb)
+    current = await executors.cpu.run(orch._fallback_system_current, kb, ["/api/kb-images/a.png"])
+    await executors.io.run(_build_user_content, "请根据需求选图", images)
+    await asyncio.sleep(0.05)
+    draft = _draft(current)
+    await executors.cpu.run(get_display, draft)
+    await executors.cpu.run(render_final, draft)
+
+
+async def _measure(offload: bool, requests: int, kb: str, images: List[str]) -> Dict[str, float]:
+    lags: List[float] = []
+    latencies: List[float] = []
+    stop = asyncio.Event()
+
+    async def heartbeat() -> None:
+        interval = 0.001
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(max(0.0, time.perf_counter() - t0 - interval))
+
+    async def one() -> None:
+        t0 = time.perf_counter()
+        await (_request_offloaded(kb, images) if offload else _request_inline(kb, images))
+        latencies.append(time.perf_counter() - t0)
+
+    if offload:  # 预热执行器（进程池启动时间不计入）
+        await asyncio.gather(executors.cpu.run(len, ""), executors.io.run(len, ""))
+    hb = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0.01)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await hb
+    lags.sort()
+    latencies.sort()
+    return {
+        "elapsed_ms": elapsed * 1000,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000,
+        "lag_p99_ms": lags[max(0, int(len(lags) * 0.99) - 1)] * 1000,
+        "lag_max_ms": lags[-1] * 1000,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=32, help="并发请求数")
+    parser.add_argument("--kb-kb", type=float, default=200.0, help="KB 文本大小（KB）")
+    parser.add_argument("--image-kb", type=float, default=400.0, help="每张候选图大小（KB），每个请求读 2 张")
+    parser.add_argument("--cpu-kind", choices=("thread", "process"), default=settings.cpu_executor_kind)
+    args = parser.parse_args()
+
+    settings.cpu_executor_kind = args.cpu_kind
+    kb = _kb_text(args.kb_kb)
+    with tempfile.TemporaryDirectory() as tmp:
+        images = []
+        for i in range(2):
+            path = Path(tmp) / f"candidate_{i}.png"
+            path.write_bytes(b"\x89PNG" + bytes(int(args.image_kb * 1024)))
+            images.append(str(path))
+        results = {
+            "inline": asyncio.run(_measure(False, args.requests, kb, images)),
+            "offloaded": asyncio.run(_measure(True, args.requests, kb, images)),
+        }
+        executors.shutdown()
+
+    print(
+        f"{args.requests} concurrent requests, KB {args.kb_kb:.0f}KB, 2 x {args.image_kb:.0f}KB images, "
+        f"cpu executor {args.cpu_kind} x {settings.cpu_executor_workers}, io workers {settings.io_executor_workers}"
+    )
+    for name, r in results.items():
+        print(
+            f"  {name:10s} total {r['elapsed_ms']:8.1f} ms | request p50 {r['p50_ms']:8.1f} ms p95 {r['p95_ms']:8.1f} ms "
+            f"| loop lag p99 {r['lag_p99_ms']:7.2f} ms max {r['lag_max_ms']:7.2f} ms"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
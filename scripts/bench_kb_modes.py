@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""KB_QUERY 模式基准：fast / balanced / thorough 各自的端到端延迟、LLM 调用次数与送给 LLM 的字符数。
+
+整条 ``AgentPipeline`` 执行（意图 → KB → 落库），外部依赖替换为按对数正态分布 sleep 的假实现：
+LLM 意图 + 扩展融合调用 ~0.9s、单次 KB 检索 ~1.2s、LLM 综合 ~2.5s（中位数，可调）。假 KB 每次检索从
+同一片段池中返回 6 个带距离的命中块，不同子问题之间有重复命中（与真实知识库相似）。
+
+问题集为「业务词 + 疑问词」类问题：规则只能弱命中，balanced / thorough 仍需 LLM 兜底判定意图，fast
+直接按规则路由（规则无法判定的问题在 fast 下会回退 ORCH_FLOW，不在此问题集中）。每个模式先清空
+fast 答案缓存，再把问题集跑两遍（第二遍模拟重复提问，fast 可命中缓存）。
+
+用法（在 RS-Agent 根目录执行）::
+
+    python scripts/bench_kb_modes.py                       # 默认 24 个问题 x 2 遍，并发 8
+    python scripts/bench_kb_modes.py --concurrency 16 --retrieve-ms 800 --sigma 0.6
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from backend import db  # noqa: E402
+from backend.config import settings  # noqa: E402
+from backend.services import kb_modes, kb_query_enhanced, llm_service  # noqa: E402
+from backend.services.agent_pipeline import AgentPipeline  # noqa: E402
+from backend.services.intent_router import Intent, detect_intent_local  # noqa: E402
+from backend.services.message_log import message_log  # noqa: E402
+
+_BUSINESS = ("定投", "调仓", "赎回", "申购", "追加", "份额", "组合", "持仓")
+_ASPECTS = ("扣款失败怎么处理", "手续费怎么计算", "有哪些限制", "的规则是什么")
+_POOL = [
+    f"【{_BUSINESS[i % len(_BUSINESS)]}】第 {i} 节：" + "业务规则说明，包含触发条件、处理流程与异常分支。" * 6
+    for i in range(40)
+]
+
+_stats: Dict[str, float] = {}
+
+
+def _install_fakes(rng: random.Random, intent_ms: float, retrieve_ms: float, synth_ms: float, sigma: float) -> None:
+    def draw(median_ms: float) -> float:
+        return median_ms * rng.lognormvariate(0.0, sigma) / 1000
+
+    async def classify_and_expand(text, max_queries=4):
+        _stats["llm_calls"] += 1
+        _stats["llm_chars"] += len(text)
+        await asyncio.sleep(draw(intent_ms))
+        return "KB_QUERY", [f"{text} 子问题{i}" for i in range(1, max_queries)]
+
+    async def expand(q, max_queries=4):
+        _stats["llm_calls"] += 1
+        _stats["llm_chars"] += len(q)
+        await asyncio.sleep(draw(intent_ms))
+        return [f"{q} 子问题{i}" for i in range(1, max_queries)]
+
+    async def query_kb(query, image_paths=None):
+        _stats["kb_calls"] += 1
+        await asyncio.sleep(draw(retrieve_ms))
+        # 同一问题的子问题落在片段池的相邻区间，彼此有重复命中
+        base = zlib.crc32(query.split(" 子问题")[0].encode()) % len(_POOL)
+        offset = int(query.rsplit("子问题", 1)[1]) if "子问题" in query else 0
+        picks = [(base + offset + k) % len(_POOL) for k in range(6)]
+        blocks = [f"--- source=doc{p}.docx distance={0.1 + 0.08 * k:.2f}\n{_POOL[p]}" for k, p in enumerate(picks)]
+        return "\n\n".join(blocks), []
+
+    async def synthesize(q, kb):
+        _stats["llm_calls"] += 1
+        _stats["llm_chars"] += len(kb)
+        await asyncio.sleep(draw(synth_ms))
+        return "综合答案"
+
+    llm_service.llm_classify_and_expand = classify_and_expand
+    kb_query_enhanced.llm_expand_kb_queries = expand
+    kb_query_enhanced.query_kb = query_kb
+    kb_query_enhanced.llm_kb_synthesize = synthesize
+
+
+async def _run_pass(mode: str, questions: List[str], concurrency: int) -> Dict[str, float]:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    cached = 0
+    _stats.update(llm_calls=0, llm_chars=0, kb_calls=0)
+
+    async def one(text: str) -> None:
+        nonlocal cached
+        async with sem:
+            t0 = time.perf_counter()
+            result = await AgentPipeline(mode).run(text)
+            latencies.append(time.perf_counter() - t0)
+            cached += bool(result["content"].get("cached"))
+
+    await asyncio.gather(*(one(q) for q in questions))
+    await message_log.drain()
+    latencies.sort()
+    n = len(latencies)
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[max(0, int(round(0.95 * n)) - 1)] * 1000,
+        "llm_calls": _stats["llm_calls"] / n,
+        "llm_chars": _stats["llm_chars"] / n,
+        "kb_calls": _stats["kb_calls"] / n,
+        "cached": cached / n,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--intent-ms", type=float, default=900.0, help="LLM 意图 / 扩展调用耗时中位数")
+    parser.add_argument("--retrieve-ms", type=float, default=1200.0, help="单次 KB 检索耗时中位数")
+    parser.add_argument("--synth-ms", type=float, default=2500.0, help="LLM 综合耗时中位数")
+    parser.add_argument("--sigma", type=float, default=0.4, help="对数正态分布的 sigma（长尾程度）")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    questions = [f"{b}{a}" for b in _BUSINESS[:6] for a in _ASPECTS]
+    routed = sum(detect_intent_local(q)[0] is Intent.KB_QUERY for q in questions)
+    settings.kb_query_llm_enabled = True
+    settings.llm_api_key = settings.llm_api_key or "sk-bench"
+    settings.llm_base_url = settings.llm_base_url or "http://llm.invalid"
+    settings.intent_clf_path = "/nonexistent"  # 与未训练分类器的部署一致
+    _install_fakes(random.Random(args.seed), args.intent_ms, args.retrieve_ms, args.synth_ms, args.sigma)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.db_path = str(Path(tmp) / "bench.db")
+        db.init_db()
+        for mode in kb_modes.MODES:
+            kb_modes.answer_cache.clear()
+            cfg = kb_modes.resolve(mode)
+            for label in ("cold", "replay"):
+                rows.append((mode, label, cfg, asyncio.run(_run_pass(mode, questions, args.concurrency))))
+        db.shutdown_db()
+
+    print(
+        f"{len(questions)} questions x 2 passes, concurrency {args.concurrency}, medians intent/expand "
+        f"{args.intent_ms:.0f}ms retrieve {args.retrieve_ms:.0f}ms synthesize {args.synth_ms:.0f}ms, sigma {args.sigma}; "
+        f"rule-routed to KB_QUERY {routed}/{len(questions)}"
+    )
+    for mode, label, cfg, r in rows:
+        print(
+            f"  {mode:9s} {label:6s} (subqueries {cfg.max_subqueries}, synth {'y' if cfg.synthesize else 'n'}, "
+            f"rerank {cfg.rerank_top_k}) p50 {r['p50_ms']:7.0f} ms p95 {r['p95_ms']:7.0f} ms | "
+            f"LLM calls/req {r['llm_calls']:4.2f} chars/req {r['llm_chars']:7.0f} | KB calls/req {r['kb_calls']:4.2f} "
+            f"| cached {r['cached']:5.1%}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""关键词匹配微基准：逐关键词扫描（原实现） vs 共享多模式匹配器（backend.utils.keyword_matcher）。
+
+场景：
+1. KB 行分类：同一段多 MB 的 KB 文本依次做 system_current 推导（前端/后端/通知）、
+   分段草稿切片（三类关键词并集）、追问提及提取（另一组关键词）——原实现每个调用方各自逐行、逐关键词扫描；
+   新实现一次扫描得到每行全部类别，三个调用方共享结果。
+2. 意图规则：短文本上 6 组关键词 + 4 条共现正则 vs 一次匹配。
+
+用法（在 RS-Agent 根目录执行）::
+
+    python scripts/bench_keyword_matcher.py                 # 默认 4MB，30% 行含关键词
+    python scripts/bench_keyword_matcher.py --mb 8 --hit-ratio 0.8
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from backend.services import intent_router as ir  # noqa: E402
+from backend.services import orchestrator_controller as oc  # noqa: E402
+
+_HIT_LINES = [
+    "三分法组合的调仓规则说明，用户在确认调仓页面可查看调仓明细。",
+    "后端接口在下单时会拆单，赎回资金到账后触发通知。",
+    "定投扣款失败后次日补扣，补扣结果以消息模板推送。",
+    "追加资金方案：前端展示占比浮层，流程由中台编排。",
+]
+_MISS_LINES = [
+    "本段文字为一般性说明，没有命中任何关键词，仅用于填充长度的普通描述内容。",
+    "| 字段 | 类型 | 说明 |",
+    "source=trading-kb distance=0.231",
+    "以上内容摘自产品文档第三章，更新于上一季度。",
+]
+_INTENT_TEXTS = [
+    "定投扣款规则是什么",
+    "首页新增定投入口",
+    "三分法调仓",
+    "请问赎回到账流程怎么走，需要调整页面吗",
+    "查询知识库：申购费率",
+]
+
+# 原实现的意图弱模式正则（对照组）
+_LEGACY_KB_PATTERNS = [
+    re.compile(r"(?:什么|怎么|如何|哪些|几|多少|是否|有没有|能否).*(?:规则|流程|逻辑|配置|现状|机制|策略|方案)"),
+    re.compile(r"(?:规则|流程|逻辑|配置|现状|机制|策略|方案).*(?:是什么|有哪些|怎么样|如何)"),
+    re.compile(r"(?:定投|调仓|赎回|申购|追加|份额|基金|组合|持仓|下单|拆单).*(?:规则|流程|逻辑|怎么|是什么|有哪些)"),
+    re.compile(r"(?:规则|流程|逻辑).*(?:定投|调仓|赎回|申购|追加|份额|基金|组合|持仓|下单|拆单)"),
+]
+_LEGACY_ORCH_PATTERN = re.compile(r"(?:" + "|".join(ir._ORCH_ACTION_KEYWORDS) + ")")
+
+
+def _make_text(mb: float, hit_ratio: float, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    target = int(mb * 1_000_000)
+    parts: List[str] = []
+    size = 0
+    while size < target:
+        line = rng.choice(_HIT_LINES if rng.random() < hit_ratio else _MISS_LINES)
+        parts.append(line)
+        size += len(line) + 1
+    return "\n".join(parts)
+
+
+def _legacy_kb_consumers(text: str) -> int:
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    n = 0
+    for ln in lines:  # system_current 推导
+        if any(k in ln for k in oc._FRONTEND_KEYWORDS):
+            n += 1
+        elif any(k in ln for k in oc._BACKEND_KEYWORDS):
+            n += 1
+        elif any(k in ln for k in oc._NOTIFICATION_KEYWORDS):
+            n += 1
+    keywords = oc._FRONTEND_KEYWORDS + oc._BACKEND_KEYWORDS + oc._NOTIFICATION_KEYWORDS
+    n += sum(1 for ln in lines if any(k in ln for k in keywords))  # 分段切片
+    n += sum(1 for ln in lines if any(k in ln for k in oc._MENTION_KEYWORDS))  # 提及提取
+    return n
+
+
+def _matcher_kb_consumers(text: str) -> int:
+    oc._KB_LINE_MATCHER.line_categories.cache_clear()  # 计入一次完整扫描
+    n = 0
+    for _ln, cats in oc._KB_LINE_MATCHER.line_categories(text):
+        if cats & oc._SECTION_CATEGORIES:
+            n += 1
+    for _ln, cats in oc._KB_LINE_MATCHER.line_categories(text):
+        if cats & oc._SECTION_CATEGORIES:
+            n += 1
+    for _ln, cats in oc._KB_LINE_MATCHER.line_categories(text):
+        if "mention" in cats:
+            n += 1
+    return n
+
+
+def _legacy_intent(text: str) -> int:
+    score = 0
+    if any(k in text for k in ir._KB_STRONG_KEYWORDS) or any(k in text for k in ir._ORCH_STRONG_KEYWORDS):
+        return 1
+    score += sum(1 for p in _LEGACY_KB_PATTERNS if p.search(text))
+    score += 1 if _LEGACY_ORCH_PATTERN.search(text) else 0
+    return score
+
+
+def _time(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, default=4.0, help="KB 文本大小（百万字符）")
+    parser.add_argument("--hit-ratio", type=float, default=0.3, help="含关键词的行占比")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = _make_text(args.mb, args.hit_ratio)
+    print(f"KB text: {len(text) / 1e6:.1f}M chars, {text.count(chr(10)) + 1} lines, hit ratio {args.hit_ratio:.0%}")
+    assert _legacy_kb_consumers(text) == _matcher_kb_consumers(text)
+    legacy = _time(lambda: _legacy_kb_consumers(text), args.repeat)
+    shared = _time(lambda: _matcher_kb_consumers(text), args.repeat)
+    print(f"  KB line heuristics (3 consumers): legacy {legacy * 1000:8.1f} ms | matcher {shared * 1000:8.1f} ms | x{legacy / shared:.2f}")
+
+    n = 20000
+    legacy = _time(lambda: [_legacy_intent(t) for t in _INTENT_TEXTS * (n // len(_INTENT_TEXTS))], args.repeat)
+    shared = _time(lambda: [ir._rule_based_detect(t) for t in _INTENT_TEXTS * (n // len(_INTENT_TEXTS))], args.repeat)
+    print(f"  intent rules (per call):          legacy {legacy / n * 1e6:8.2f} us | matcher {shared / n * 1e6:8.2f} us | x{legacy / shared:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
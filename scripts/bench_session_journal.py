@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""会话持久化基准：每次整体重写 session_data（RS_AGENT_SESSION_JOURNAL=false，原实现）
+vs 增量日志（JSON patch + 定期快照，backend.services.session_journal）。
+
+场景：N 个会话各带一份草稿（draft_struct，默认约 24KB，模拟 demand_analysis_doc 各章节），
+依次做 M 次小修改（改 state / 追加一条回答 / 改一处 product_statement），每次修改后 ``persist_session``。
+统计每次保存写入的会话字节数（整体 JSON 或 patch）、保存耗时、清空缓存后加载
+（快照 + 重放增量）的耗时，以及库文件大小（增量日志随会话保留，用作草稿历史）。
+
+用法（在 RS-Agent 根目录执行）::
+
+    python scripts/bench_session_journal.py                      # 默认 20 个会话 × 30 次修改
+    python scripts/bench_session_journal.py --sessions 50 --mutations 60 --draft-kb 64 --compact-every 32
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from backend import db  # noqa: E402
+from backend.config import settings  # noqa: E402
+from backend.services import blob_store  # noqa: E402
+from backend.services import orchestrator_controller as orch  # noqa: E402
+from backend.services.session_cache import session_cache  # noqa: E402
+
+
+def _draft(kb: float) -> dict:
+    sections = {f"section_{i}": "需求描述与验收标准。" * int(kb * 1024 / 30 / 12) for i in range(12)}
+    return {"product_statement": "v0", "sections": sections, "clarification_log": {"items": []}}
+
+
+async def _run(sessions: int, mutations: int, draft_kb: float) -> Dict[str, float]:
+    ids: List[str] = []
+    for _ in range(sessions):
+        sess = await orch.create_session("做一个遥感影像分类流程")
+        sess.draft_struct = _draft(draft_kb)
+        sess.state = "DRAFT_READY"
+        await orch.persist_session(sess)
+        ids.append(sess.session_id)
+
+    before = blob_store.stats()
+    save_times: List[float] = []
+    for step in range(mutations):
+        for sid in ids:
+            session_cache.clear()
+            sess = await orch.get_session(sid)
+            kind = step % 3
+            if kind == 0:
+                sess.state = "CONFIRMING" if sess.state != "CONFIRMING" else "DRAFT_READY"
+            elif kind == 1:
+                sess.user_answers.append(f"第 {step} 轮补充：需要支持多光谱波段选择")
+            else:
+                sess.draft_struct["product_statement"] = f"v{step}"
+            t0 = time.perf_counter()
+            await orch.persist_session(sess)
+            save_times.append(time.perf_counter() - t0)
+    after = blob_store.stats()
+
+    load_times: List[float] = []
+    for sid in ids:
+        session_cache.clear()
+        t0 = time.perf_counter()
+        await orch.get_session(sid)
+        load_times.append(time.perf_counter() - t0)
+
+    saves = after["persists"] - before["persists"]
+    load_times.sort()
+    return {
+        "bytes_per_save": (after["session_bytes_written"] - before["session_bytes_written"]) / saves,
+        "save_ms": statistics.mean(save_times) * 1000,
+        "load_ms": statistics.mean(load_times) * 1000,
+        "load_p95_ms": load_times[max(0, int(len(load_times) * 0.95) - 1)] * 1000,
+        "db_kb": _db_kb(),
+    }
+
+
+def _db_kb() -> float:
+    """检查点后的库文件大小（含保留的增量日志）。"""
+    with db.get_conn() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return Path(settings.db_path).stat().st_size / 1024
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20, help="会话数")
+    parser.add_argument("--mutations", type=int, default=30, help="每个会话的修改次数")
+    parser.add_argument("--draft-kb", type=float, default=24.0, help="草稿 JSON 大小（KB）")
+    parser.add_argument("--compact-every", type=int, default=settings.session_journal_compact_every, help="快照间隔")
+    parser.add_argument("--dir", default="", help="数据库所在目录（默认临时目录）")
+    args = parser.parse_args()
+
+    settings.session_journal_compact_every = args.compact_every
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, journal in (("full_rewrite", False), ("journal", True)):
+            settings.session_journal = journal
+            settings.db_path = str(Path(args.dir or tmp) / f"bench_journal_{name}_{uuid.uuid4().hex[:8]}.db")
+            db.shutdown_db()
+            db.init_db()
+            session_cache.clear()
+            results[name] = asyncio.run(_run(args.sessions, args.mutations, args.draft_kb))
+            db.shutdown_db()
+            for suffix in ("", "-wal", "-shm"):
+                Path(settings.db_path + suffix).unlink(missing_ok=True)
+
+    print(
+        f"{args.sessions} sessions x {args.mutations} mutations, draft {args.draft_kb:.0f}KB, "
+        f"compact every {args.compact_every}"
+    )
+    for name, r in results.items():
+        print(
+            f"  {name:12s} written/save {r['bytes_per_save']:9.0f} B | save {r['save_ms']:6.2f} ms | "
+            f"load {r['load_ms']:6.2f} ms (p95 {r['load_p95_ms']:6.2f}) | db file {r['db_kb']:7.0f} KB"
+        )
+    full, journal = results["full_rewrite"], results["journal"]
+    print(f"  write amplification reduced {full['bytes_per_save'] / max(journal['bytes_per_save'], 1):.0f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
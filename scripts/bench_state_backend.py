@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""共享状态后端基准：memory / sqlite / redis（RESP）在 1、4、8 个 worker 进程下的吞吐与跨 worker 可见性。
+
+每个 worker 进程模拟一个 uvicorn worker，按请求路径的访问模式操作 ``backend.services.state_store``：
+
+1. 登记阶段：登记 N 个上传（``uploads`` 命名空间，写 JSON）；
+2. 所有 worker 到齐后进入解析阶段：解析 **下一个 worker** 登记的 imageId（GET），
+   每次解析同时做一次限流计数（``ratelimit`` 命名空间的 INCR + TTL）。
+
+输出总吞吐（ops/s）与跨 worker 解析命中率：memory 后端在多 worker 下命中率为 0（即原先 ``_UPLOAD_STORE``
+只能单 worker 运行的原因），sqlite / redis 应为 100%。未给出 ``--redis-url`` 时使用
+``tests/unit/resp_stub.py`` 中的 Python 替身服务器（单进程，吞吐明显低于真实 Redis，仅作功能对照）。
+
+用法（在 RS-Agent 根目录执行）::
+
+    python scripts/bench_state_backend.py                          # 默认每 worker 2000 次登记 + 2000 次解析
+    python scripts/bench_state_backend.py --ops 5000 --workers 1 4 8 --redis-url redis://127.0.0.1:6379/15
+"""
+
+from __future__ import annotations
+
+import argparse
+import multiprocessing as mp
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from backend.config import settings  # noqa: E402
+from backend.services import state_store  # noqa: E402
+
+
+def _worker(idx: int, workers: int, ops: int, config: Dict[str, str], barrier, results) -> None:
+    settings.state_backend = config["backend"]
+    settings.state_sqlite_path = Path(config["sqlite_path"])
+    settings.state_redis_url = config["redis_url"]
+    settings.state_key_prefix = config["prefix"]
+    uploads = state_store.StateMapping("uploads")
+    backend = state_store.get_state_backend()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for i in range(ops):
+        uploads[f"w{idx}-{i}"] = (f"/data/uploads/w{idx}-{i}.png", time.time())
+    barrier.wait()
+    peer = (idx + 1) % workers
+    hits = 0
+    for i in range(ops):
+        if f"w{peer}-{i}" in uploads:
+            hits += 1
+        backend.incr("ratelimit", f"client-{i % 16}", 1, 120)
+    results.put((idx, time.perf_counter() - t0, hits))
+    state_store.close_state_backend()
+
+
+def _run(workers: int, ops: int, config: Dict[str, str]) -> Dict[str, float]:
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(i, workers, ops, config, barrier, results)) for i in range(workers)]
+    for p in procs:
+        p.start()
+    rows = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    wall = max(r[1] for r in rows)
+    total_ops = workers * ops * 3  # 登记 SET + 解析 GET + 计数 INCR
+    return {"ops_per_s": total_ops / wall, "hit_rate": sum(r[2] for r in rows) / (workers * ops)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=2000, help="每个 worker 的登记 / 解析次数")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help="worker 进程数")
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite", "redis"], help="要测试的后端")
+    parser.add_argument("--redis-url", default="", help="真实 Redis 地址（默认启动内置 RESP 替身）")
+    parser.add_argument("--dir", default="", help="SQLite 状态文件所在目录（默认临时目录）")
+    args = parser.parse_args()
+
+    stub = None
+    redis_url = args.redis_url
+    if "redis" in args.backends and not redis_url:
+        from tests.unit.resp_stub import RespStubServer
+
+        stub = RespStubServer().start()
+        redis_url = stub.url
+
+    print(f"{args.ops} uploads + {args.ops} resolves/rate-limit increments per worker")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in args.backends:
+                for workers in args.workers:
+                    sqlite_path = Path(args.dir or tmp) / f"bench_state_{uuid.uuid4().hex[:8]}.db"
+                    config = {
+                        "backend": name,
+                        "sqlite_path": str(sqlite_path),
+                        "redis_url": redis_url,
+                        "prefix": f"bench-{uuid.uuid4().hex[:8]}:",
+                    }
+                    r = _run(workers, args.ops, config)
+                    label = f"{name}{' (stub)' if name == 'redis' and stub else ''}"
+                    print(
+                        f"  {label:13s} workers={workers}  {r['ops_per_s']:10.0f} ops/s | "
+                        f"cross-worker resolve hit rate {r['hit_rate'] * 100:5.1f}%"
+                    )
+                    for suffix in ("", "-wal", "-shm"):
+                        Path(str(sqlite_path) + suffix).unlink(missing_ok=True)
+    finally:
+        if stub is not None:
+            stub.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
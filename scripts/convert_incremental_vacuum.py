@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""把已有 SQLite 库转换为 auto_vacuum=INCREMENTAL，使会话保留任务删除数据后能归还空闲页。
+
+新库在 ``init_db`` 建库时即为该模式；早于此的旧库启动时只记一条警告，需在维护窗口执行本脚本。
+转换即整库 VACUUM：期间持有独占锁（其它 worker 的读写会等待或报 busy），耗时与临时磁盘占用随库大小增长，
+建议先停服务或摘流量。已是该模式的库不做任何事。
+
+用法（在 RS-Agent 根目录执行）::
+
+    python scripts/convert_incremental_vacuum.py                      # 转换 RS_AGENT_DB_PATH
+    python scripts/convert_incremental_vacuum.py --db /path/rs_agent.db
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from backend import db  # noqa: E402
+from backend.config import settings  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=None, help="库文件路径（默认 RS_AGENT_DB_PATH）")
+    args = parser.parse_args()
+    if args.db:
+        settings.db_path = args.db
+    if not Path(settings.db_path).exists():
+        print(f"{settings.db_path} does not exist", file=sys.stderr)
+        return 1
+
+    try:
+        result = db.convert_incremental_vacuum()
+    finally:
+        db.shutdown_db()
+    if not result["converted"]:
+        print(f"{settings.db_path} is already in incremental auto_vacuum mode ({result['page_count']} pages)")
+        return 0
+    print(
+        f"converted {settings.db_path} in {result['seconds']:.2f}s: auto_vacuum={result['auto_vacuum']}, "
+        f"pages {result['page_count_before']} -> {result['page_count']}"
+    )
+    return 0 if result["auto_vacuum"] == 2 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
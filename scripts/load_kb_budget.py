@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""KB_QUERY 延迟预算压测：无预算 vs 带预算时 ``enhanced_kb_query`` 的端到端延迟分布。
+
+KB 子进程检索、LLM 扩展与综合替换为按对数正态分布 sleep 的假实现（中位数与离散度可调，默认值
+接近线上观测：扩展 ~0.8s、单次检索 ~1.2s、综合 ~2.5s，均带长尾）。先以无预算方式预热，让
+``kb_budget.latency`` 积累各阶段样本；之后分别在无预算与 ``--budget-ms`` 预算下并发执行
+``--requests`` 个请求（每个请求一个 ``RequestScope``，并发度 ``--concurrency``）。
+
+输出两组的 p50 / p95 / p99、超出预算的比例、使用 LLM 综合的比例，以及预算组的决策计数。
+
+用法（在 RS-Agent 根目录执行）::
+
+    python scripts/load_kb_budget.py                              # 默认 200 个请求，并发 20，预算 5000ms
+    python scripts/load_kb_budget.py --budget-ms 3000 --sigma 0.6 --requests 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from backend import request_scope  # noqa: E402
+from backend.config import settings  # noqa: E402
+from backend.services import kb_query_enhanced  # noqa: E402
+from backend.services.kb_budget import latency  # noqa: E402
+
+
+def _install_fakes(rng: random.Random, expand_ms: float, retrieve_ms: float, synth_ms: float, sigma: float) -> None:
+    def draw(median_ms: float) -> float:
+        return median_ms * rng.lognormvariate(0.0, sigma) / 1000
+
+    async def expand(q, max_queries=4):
+        await asyncio.sleep(draw(expand_ms))
+        return [f"{q} 子问题{i}" for i in range(1, 4)]
+
+    async def query_kb(query, image_paths=None):
+        await asyncio.sleep(draw(retrieve_ms))
+        return f"## {query}\n" + "检索内容。" * 50, []
+
+    async def synthesize(q, kb):
+        await asyncio.sleep(draw(synth_ms))
+        return "综合答案"
+
+    kb_query_enhanced.llm_expand_kb_queries = expand
+    kb_query_enhanced.query_kb = query_kb
+    kb_query_enhanced.llm_kb_synthesize = synthesize
+
+
+async def _run(requests: int, concurrency: int, budget_s: Optional[float]) -> Dict[str, object]:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    decisions: Counter = Counter()
+    used_llm = 0
+    failed = 0
+
+    async def one(i: int) -> None:
+        nonlocal used_llm, failed
+        async with sem:
+            scope = request_scope.RequestScope(budget_s=budget_s, label=f"load-{i}")
+            t0 = time.perf_counter()
+            try:
+                result = await scope.run(kb_query_enhanced.enhanced_kb_query(f"清算流程问题 {i}"))
+            except Exception:
+                failed += 1
+                latencies.append(time.perf_counter() - t0)
+                return
+            latencies.append(time.perf_counter() - t0)
+            used_llm += bool(result["used_llm"])
+            decisions.update(r["decision"] for r in result["kb_runs"] if r.get("stage") == "budget")
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        return latencies[max(0, int(round(p / 100 * len(latencies))) - 1)] * 1000
+
+    return {
+        "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99), "max_ms": latencies[-1] * 1000,
+        "over_budget": sum(1 for x in latencies if budget_s is not None and x > budget_s) / len(latencies),
+        "used_llm": used_llm / len(latencies), "failed": failed, "decisions": dict(decisions),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=5000.0)
+    parser.add_argument("--expand-ms", type=float, default=800.0, help="LLM 扩展耗时中位数")
+    parser.add_argument("--retrieve-ms", type=float, default=1200.0, help="单次 KB 检索耗时中位数")
+    parser.add_argument("--synth-ms", type=float, default=2500.0, help="LLM 综合耗时中位数")
+    parser.add_argument("--sigma", type=float, default=0.4, help="对数正态分布的 sigma（长尾程度）")
+    parser.add_argument("--warmup", type=int, default=40, help="预热请求数（积累阶段耗时样本）")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    settings.kb_query_llm_enabled = True
+    settings.llm_api_key = settings.llm_api_key or "sk-load"
+    settings.llm_base_url = settings.llm_base_url or "http://llm.invalid"
+    _install_fakes(random.Random(args.seed), args.expand_ms, args.retrieve_ms, args.synth_ms, args.sigma)
+
+    latency.reset()
+    asyncio.run(_run(args.warmup, args.concurrency, None))
+    results = {
+        "no budget": asyncio.run(_run(args.requests, args.concurrency, None)),
+        f"budget {args.budget_ms:.0f}ms": asyncio.run(_run(args.requests, args.concurrency, args.budget_ms / 1000)),
+    }
+
+    print(
+        f"{args.requests} requests, concurrency {args.concurrency}, medians expand {args.expand_ms:.0f}ms "
+        f"retrieve {args.retrieve_ms:.0f}ms synthesize {args.synth_ms:.0f}ms, sigma {args.sigma}, "
+        f"reserve {settings.kb_budget_reserve_ms}ms"
+    )
+    print(f"  stage estimates: {latency.stats()}")
+    for name, r in results.items():
+        print(
+            f"  {name:14s} p50 {r['p50_ms']:7.0f} ms p95 {r['p95_ms']:7.0f} ms p99 {r['p99_ms']:7.0f} ms "
+            f"max {r['max_ms']:7.0f} ms | over budget {r['over_budget']:5.1%} | synthesized {r['used_llm']:5.1%} "
+            f"| failed {r['failed']}"
+        )
+        if r["decisions"]:
+            print(f"  {'':14s} decisions {r['decisions']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""KB_QUERY 渐进检索回放：同一问题集分别关闭 / 开启提前结束，对比延迟、KB 检索次数与送给 LLM 综合的字符数。
+
+问题集取自本地库中意图为 KB_QUERY 的历史会话首条消息（``RS_AGENT_DB_PATH``），不足时补内置问题。
+``enhanced_kb_query`` 的外部依赖替换为按对数正态分布 sleep 的假实现：LLM 扩展 ~0.9s、单次 KB 检索
+~1.2s、LLM 综合 ~1.5s + 每千字符 0.3s（送入字符数近似 token 数）。假 KB 按问题难度返回命中块：
+
+- easy：每个子问题都有多条近距离、覆盖问题用词的命中（首次检索覆盖度即达标，应在第一个子问题后结束）；
+- redundant：各子问题返回的片段大多相同（新片段占比过低，应在第二个子问题后结束）；
+- hard：命中距离较远、各子问题带来新片段（应检索全部子问题）。
+
+用法（在 RS-Agent 根目录执行）::
+
+    python scripts/replay_kb_early_exit.py                  # 默认 40 个问题，并发 8
+    python scripts/replay_kb_early_exit.py --questions 80 --easy 0.4 --redundant 0.2
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from backend import db  # noqa: E402
+from backend.config import settings  # noqa: E402
+from backend.services import kb_modes, kb_query_enhanced  # noqa: E402
+
+_BUILTIN = [
+    f"{b}{a}"
+    for b in ("定投", "调仓", "赎回", "申购", "追加", "份额", "组合", "持仓")
+    for a in ("扣款失败怎么处理", "手续费怎么计算", "有哪些限制", "的规则是什么", "到账时间是多少")
+]
+_FILLER = "业务规则说明，包含触发条件、处理流程与异常分支。" * 5
+
+_stats: Dict[str, float] = {}
+
+
+def _load_questions(n: int) -> List[str]:
+    seen: List[str] = []
+    try:
+        db.init_db()
+        for text, intent in db.list_intent_samples():
+            if intent == "KB_QUERY" and text not in seen:
+                seen.append(text)
+    except Exception:  # noqa: BLE001 - 没有本地库时只用内置问题
+        pass
+    from_db = len(seen)
+    seen.extend(q for q in _BUILTIN if q not in seen)
+    print(f"questions: {from_db} from {settings.db_path}, {min(n, len(seen)) - min(n, from_db)} built-in")
+    return seen[:n]
+
+
+def _difficulty(question: str, easy: float, redundant: float) -> str:
+    u = (zlib.crc32(question.encode()) % 1000) / 1000
+    return "easy" if u < easy else "redundant" if u < easy + redundant else "hard"
+
+
+def _install_fakes(rng: random.Random, args: argparse.Namespace, difficulty: Dict[str, str]) -> None:
+    def draw(median_ms: float) -> float:
+        return median_ms * rng.lognormvariate(0.0, args.sigma) / 1000
+
+    async def expand(q, max_queries=4):
+        await asyncio.sleep(draw(args.expand_ms))
+        return [f"{q} 子问题{i}" for i in range(1, max_queries)]
+
+    async def query_kb(query, image_paths=None):
+        _stats["kb_calls"] += 1
+        await asyncio.sleep(draw(args.retrieve_ms))
+        question, _, sub = query.partition(" 子问题")
+        idx = int(sub) if sub else 0
+        kind = difficulty.get(question, "hard")
+        if kind == "easy":
+            blocks = [(f"{question}：第 {idx}-{k} 条。{_FILLER}", 0.12 + 0.04 * k) for k in range(4)]
+        elif kind == "redundant":
+            blocks = [(f"{question} 相关片段 {k}。{_FILLER}", 0.35 + 0.05 * k) for k in range(6)]
+            blocks[-1] = (f"{query} 补充片段。{_FILLER}", 0.6)
+        else:
+            blocks = [(f"{question} 片段 {idx}-{k}。{_FILLER}", 0.4 + 0.05 * k) for k in range(5)]
+        md = "\n\n".join(f"--- source=doc{zlib.crc32(t.encode()) % 97}.docx distance={d:.2f}\n{t}" for t, d in blocks)
+        return md, []
+
+    async def synthesize(q, kb):
+        _stats["synth_chars"] += len(kb)
+        await asyncio.sleep(draw(args.synth_ms) + args.synth_ms_per_kchar * len(kb) / 1e6)
+        return "综合答案"
+
+    kb_query_enhanced.llm_expand_kb_queries = expand
+    kb_query_enhanced.query_kb = query_kb
+    kb_query_enhanced.llm_kb_synthesize = synthesize
+
+
+async def _run_pass(questions: List[str], concurrency: int) -> Dict[str, object]:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    reasons: Counter = Counter()
+    _stats.update(kb_calls=0, synth_chars=0)
+
+    async def one(text: str) -> None:
+        async with sem:
+            t0 = time.perf_counter()
+            result = await kb_query_enhanced.enhanced_kb_query(text, mode=kb_modes.BALANCED)
+            latencies.append(time.perf_counter() - t0)
+            for run in result["kb_runs"]:
+                if run.get("stage") == "early_exit":
+                    reasons[run["reason"]] += 1
+                    reasons["skipped"] += len(run["skipped"])
+
+    await asyncio.gather(*(one(q) for q in questions))
+    latencies.sort()
+    n = len(latencies)
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[max(0, int(round(0.95 * n)) - 1)] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "kb_calls": _stats["kb_calls"] / n,
+        "synth_chars": _stats["synth_chars"] / n,
+        "reasons": reasons,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--easy", type=float, default=0.5, help="easy 问题占比")
+    parser.add_argument("--redundant", type=float, default=0.2, help="redundant 问题占比")
+    parser.add_argument("--expand-ms", type=float, default=900.0)
+    parser.add_argument("--retrieve-ms", type=float, default=1200.0)
+    parser.add_argument("--synth-ms", type=float, default=1500.0)
+    parser.add_argument("--synth-ms-per-kchar", type=float, default=300.0)
+    parser.add_argument("--sigma", type=float, default=0.4)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    questions = _load_questions(args.questions)
+    difficulty = {q: _difficulty(q, args.easy, args.redundant) for q in questions}
+    settings.kb_query_llm_enabled = True
+    settings.llm_api_key = settings.llm_api_key or "sk-replay"
+    settings.llm_base_url = settings.llm_base_url or "http://llm.invalid"
+    settings.metrics_enabled = False
+
+    rows = []
+    for enabled in (False, True):
+        settings.kb_early_exit_enabled = enabled
+        kb_modes.answer_cache.clear()
+        _install_fakes(random.Random(args.seed), args, difficulty)
+        rows.append((enabled, asyncio.run(_run_pass(questions, args.concurrency))))
+    db.shutdown_db()
+
+    mix = Counter(difficulty.values())
+    print(
+        f"{len(questions)} questions (easy {mix['easy']}, redundant {mix['redundant']}, hard {mix['hard']}), "
+        f"concurrency {args.concurrency}, {settings.kb_query_max_subqueries} subqueries, coverage >= "
+        f"{settings.kb_early_exit_coverage}, new ratio < {settings.kb_early_exit_min_new_ratio}"
+    )
+    for enabled, r in rows:
+        reasons = r["reasons"]
+        print(
+            f"  early exit {'on ' if enabled else 'off'} p50 {r['p50_ms']:6.0f} ms p95 {r['p95_ms']:6.0f} ms "
+            f"mean {r['mean_ms']:6.0f} ms | KB calls/req {r['kb_calls']:4.2f} | synth chars/req {r['synth_chars']:6.0f} "
+            f"| exits coverage {reasons['coverage']} duplicates {reasons['duplicates']} skipped {reasons['skipped']}"
+        )
+    off, on = rows[0][1], rows[1][1]
+    print(
+        f"  saved: mean latency {1 - on['mean_ms'] / off['mean_ms']:.1%}, KB calls {1 - on['kb_calls'] / off['kb_calls']:.1%}, "
+        f"synth chars {1 - on['synth_chars'] / off['synth_chars']:.1%}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""离线训练本地意图分类器（字符 n-gram 朴素贝叶斯 / 逻辑回归），输出 .npz 权重。
+
+训练数据来自 SQLite 中的 conversations（intent）+ messages（首条用户消息）；
+会话表只保留最近若干条记录时，可用 ``--extra`` 追加 JSONL 标注样本
+（每行 ``{"text": "...", "intent": "KB_QUERY" | "ORCH_FLOW"}``）。
+
+用法（在 RS-Agent 根目录执行）::
+
+    python scripts/train_intent_classifier.py                       # 默认 NB，写入 RS_AGENT_INTENT_CLF_PATH
+    python scripts/train_intent_classifier.py --model lr --holdout 0.2
+    python scripts/train_intent_classifier.py --db /path/rs_agent.db --extra labeled.jsonl --out data/intent_clf.npz
+
+``--holdout`` 会留出一部分样本评估：报告准确率，以及不同阈值下「本地直接判定的覆盖率 / 该部分准确率」，
+便于设置 RS_AGENT_INTENT_CLF_THRESHOLD。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from backend.config import settings  # noqa: E402
+from backend.services import intent_classifier as ic  # noqa: E402
+from backend.services.intent_router import Intent  # noqa: E402
+
+_VALID = {Intent.KB_QUERY.value, Intent.ORCH_FLOW.value}
+
+
+def _load_samples(args: argparse.Namespace) -> List[Tuple[str, str]]:
+    if args.db:
+        settings.db_path = str(Path(args.db).expanduser())
+    from backend.db import list_intent_samples
+
+    samples = [(t, i) for t, i in list_intent_samples() if i in _VALID]
+    for path in args.extra or []:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                row = json.loads(line)
+                if row.get("text") and row.get("intent") in _VALID:
+                    samples.append((row["text"], row["intent"]))
+    return samples
+
+
+def _evaluate(clf: ic.IntentClassifier, test: List[Tuple[str, str]]) -> None:
+    preds = []
+    t0 = time.perf_counter()
+    for text, _ in test:
+        preds.append(clf.predict(text))
+    per_ms = (time.perf_counter() - t0) * 1000 / max(1, len(test))
+    correct = sum(1 for (p, _c), (_t, y) in zip(preds, test) if p.value == y)
+    print(f"holdout: n={len(test)} accuracy={correct / max(1, len(test)):.3f} avg_score={per_ms:.3f}ms")
+    print("threshold  coverage  accuracy_when_local")
+    for th in (0.6, 0.7, 0.8, 0.85, 0.9, 0.95):
+        local = [(p, y) for (p, c), (_t, y) in zip(preds, test) if c >= th]
+        acc = sum(1 for p, y in local if p.value == y) / len(local) if local else float("nan")
+        print(f"{th:>9.2f}  {len(local) / max(1, len(test)):>8.3f}  {acc:>19.3f}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="SQLite 路径（默认 RS_AGENT_DB_PATH）")
+    parser.add_argument("--extra", action="append", help="额外标注样本 JSONL，可重复")
+    parser.add_argument("--out", default=settings.intent_clf_path, help="输出 .npz 路径")
+    parser.add_argument("--model", choices=("nb", "lr"), default="nb")
+    parser.add_argument("--dim", type=int, default=ic.DEFAULT_DIM, help="哈希特征维度")
+    parser.add_argument("--ngram-min", type=int, default=ic.DEFAULT_NGRAM_RANGE[0])
+    parser.add_argument("--ngram-max", type=int, default=ic.DEFAULT_NGRAM_RANGE[1])
+    parser.add_argument("--holdout", type=float, default=0.0, help="留出评估比例（0~0.5）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if ic.np is None:
+        print("需要 numpy：pip install numpy", file=sys.stderr)
+        return 1
+    samples = _load_samples(args)
+    if len(samples) < 2 or len({i for _, i in samples}) < 2:
+        print(f"样本不足（{len(samples)} 条，需同时包含 KB_QUERY 与 ORCH_FLOW）", file=sys.stderr)
+        return 1
+
+    random.Random(args.seed).shuffle(samples)
+    n_test = int(len(samples) * min(max(args.holdout, 0.0), 0.5))
+    test, train = samples[:n_test], samples[n_test:]
+    texts = [t for t, _ in train]
+    intents = [i for _, i in train]
+    ngram_range = (args.ngram_min, args.ngram_max)
+    if args.model == "lr":
+        clf = ic.train_logistic_regression(texts, intents, dim=args.dim, ngram_range=ngram_range, seed=args.seed)
+    else:
+        clf = ic.train_naive_bayes(texts, intents, dim=args.dim, ngram_range=ngram_range)
+    n_kb = sum(1 for i in intents if i == Intent.KB_QUERY.value)
+    print(f"trained {args.model}: n={len(train)} (KB_QUERY={n_kb}, ORCH_FLOW={len(train) - n_kb})")
+    if test:
+        _evaluate(clf, test)
+    clf.save(Path(args.out))
+    print(f"saved → {args.out} ({Path(args.out).stat().st_size / 1024:.1f} KiB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
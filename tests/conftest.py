@@ -4,8 +4,32 @@ from __future__ import annotations
 
 import sys
 from pathlib import Path
+from typing import Any, Dict
+
+import pytest
 
 # 保证从 RS-Agent 根目录运行时能 import backend
 _ROOT = Path(__file__).resolve().parent.parent
 if str(_ROOT) not in sys.path:
     sys.path.insert(0, str(_ROOT))
+
+
+@pytest.fixture
+def db_settings() -> Dict[str, Any]:
+    """``temp_db`` 在建库前额外覆盖的 settings；测试模块按需重写此 fixture。"""
+    return {}
+
+
+@pytest.fixture
+def temp_db(monkeypatch, tmp_path, db_settings):
+    """临时目录中的空库：覆盖 ``db_path`` 与 ``db_settings`` 后重建连接池并建表，结束时关闭。"""
+    from backend import db
+    from backend.config import settings
+
+    monkeypatch.setattr(settings, "db_path", str(tmp_path / "rs_agent.db"))
+    for name, value in db_settings.items():
+        monkeypatch.setattr(settings, name, value, raising=False)
+    db.shutdown_db()
+    db.init_db()
+    yield
+    db.shutdown_db()
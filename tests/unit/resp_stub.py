@@ -0,0 +1,188 @@
+"""测试用 RESP2 替身服务器：实现 RespBackend 用到的 Redis 命令子集（线程化，监听随机端口）。
+
+支持 PING / AUTH / SELECT / GET / SET (PX, NX) / DEL / INCRBY / SCAN (MATCH, COUNT) / FLUSHDB / DBSIZE，
+EVAL 只支持 ``state_store.INCR_WITH_TTL_SCRIPT``（以等价的 Python 实现执行）。
+也供 ``scripts/bench_state_backend.py`` 在没有真实 Redis 时使用。
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import socketserver
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.services.state_store import INCR_WITH_TTL_SCRIPT
+
+
+def _glob(pattern: str, key: str) -> bool:
+    """Redis MATCH 语义：反斜杠转义 * ? [ ]。"""
+    out, i = [], 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\" and i + 1 < len(pattern):
+            out.append("[" + pattern[i + 1] + "]")
+            i += 2
+            continue
+        out.append(ch)
+        i += 1
+    return fnmatch.fnmatchcase(key, "".join(out))
+
+
+class _Store:
+    def __init__(self) -> None:
+        self.data: Dict[str, Tuple[str, Optional[float]]] = {}
+        self.lock = threading.Lock()
+        self.commands = 0
+
+    def live(self, key: str) -> Optional[str]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self.data[key]
+            return None
+        return entry[0]
+
+
+def _encode(value: Any) -> bytes:
+    if isinstance(value, Exception):
+        return b"-ERR %s\r\n" % str(value).encode("utf-8")
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, bool):
+        return b"+OK\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_encode(v) for v in value)
+    data = str(value).encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def _incrby(store: _Store, key: str, amount: str) -> Any:
+    current = store.live(key)
+    try:
+        value = int(current or 0) + int(amount)
+    except ValueError:
+        return ValueError("value is not an integer or out of range")
+    expires = store.data[key][1] if current is not None else None
+    store.data[key] = (str(value), expires)
+    return value
+
+
+def _execute(store: _Store, args: List[str], password: Optional[str], state: Dict[str, bool]) -> Any:
+    cmd = args[0].upper()
+    if cmd == "AUTH":
+        state["authed"] = args[-1] == password
+        return True if state["authed"] else ValueError("invalid password")
+    if password and not state.get("authed"):
+        return ValueError("NOAUTH Authentication required")
+    with store.lock:
+        store.commands += 1
+        if cmd == "PING":
+            return True
+        if cmd == "SELECT" or cmd == "FLUSHDB":
+            if cmd == "FLUSHDB":
+                store.data.clear()
+            return True
+        if cmd == "DBSIZE":
+            return sum(1 for k in list(store.data) if store.live(k) is not None)
+        if cmd == "GET":
+            return store.live(args[1])
+        if cmd == "SET":
+            key, value, opts = args[1], args[2], [a.upper() for a in args[3:]]
+            if "NX" in opts and store.live(key) is not None:
+                return None
+            expires = None
+            if "PX" in opts:
+                expires = time.time() + int(args[3 + opts.index("PX") + 1]) / 1000
+            store.data[key] = (value, expires)
+            return True
+        if cmd == "DEL":
+            return sum(1 for k in args[1:] if store.live(k) is not None and store.data.pop(k, None))
+        if cmd == "INCRBY":
+            return _incrby(store, args[1], args[2])
+        if cmd == "EVAL":
+            if args[1] != INCR_WITH_TTL_SCRIPT:
+                return ValueError("unsupported script")
+            key, amount, ttl_ms = args[3], args[4], int(args[5])
+            value = _incrby(store, key, amount)
+            if not isinstance(value, Exception) and store.data[key][1] is None:
+                store.data[key] = (store.data[key][0], time.time() + ttl_ms / 1000)
+            return value
+        if cmd == "SCAN":
+            opts = [a.upper() for a in args]
+            pattern = args[opts.index("MATCH") + 1] if "MATCH" in opts else "*"
+            keys = [k for k in list(store.data) if store.live(k) is not None and _glob(pattern, k)]
+            return ["0", keys]
+    return ValueError(f"unknown command '{cmd}'")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _read_command(self) -> Optional[List[str]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.decode("utf-8").split()
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2].decode("utf-8"))
+        return args
+
+    def handle(self) -> None:
+        state: Dict[str, bool] = {}
+        while True:
+            try:
+                args = self._read_command()
+            except (OSError, ValueError):
+                return
+            if not args:
+                return
+            reply = _execute(self.server.store, args, self.server.password, state)  # type: ignore[attr-defined]
+            try:
+                self.wfile.write(_encode(reply))
+            except OSError:
+                return
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class RespStubServer:
+    """``with RespStubServer() as srv: srv.url``；``srv.store.commands`` 为已处理命令数。"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, password: Optional[str] = None) -> None:
+        self._server = _Server((host, port), _Handler)
+        self._server.store = _Store()  # type: ignore[attr-defined]
+        self._server.password = password  # type: ignore[attr-defined]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def store(self) -> _Store:
+        return self._server.store  # type: ignore[attr-defined]
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        auth = f":{self._server.password}@" if self._server.password else ""  # type: ignore[attr-defined]
+        return f"redis://{auth}{host}:{port}/0"
+
+    def start(self) -> "RespStubServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "RespStubServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
@@ -0,0 +1,124 @@
+"""单元测试：会话大字段的内容寻址 blob 存储（只写引用、按需加载、去重、GC、兼容旧格式）。"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from backend import db
+from backend.services import blob_store
+from backend.services import orchestrator_controller as orch
+from backend.services.session_cache import session_cache
+
+_KB = "## 检索结果\n" + "遥感影像分类流程与样本说明。" * 2000
+
+
+@pytest.fixture
+def db_settings():
+    return {
+        "blob_min_chars": 4096,
+        "blob_codec": "zlib",
+    }
+
+
+@pytest.fixture
+def temp_db(temp_db):
+    session_cache.clear()
+    blob_store._TEXT_CACHE.clear()
+    yield
+    session_cache.clear()
+
+
+def _session(session_id: str, kb: str = _KB) -> orch.OrchestratorSession:
+    return orch.OrchestratorSession(
+        session_id=session_id, user_request="做一个分类流程", state="COLLECT", knowledge_markdown=kb
+    )
+
+
+def _row(session_id: str) -> dict:
+    with db.get_conn() as conn:
+        return dict(conn.execute("SELECT session_data, version FROM sessions WHERE id = ?", (session_id,)).fetchone())
+
+
+def test_state_only_persist_does_not_rewrite_blob(temp_db) -> None:
+    sess = _session("s1")
+
+    async def scenario():
+        await orch.persist_session(sess)
+        first = dict(blob_store.stats())
+        sess.state = "DRAFT"
+        await orch.persist_session(sess)
+        return first, blob_store.stats()
+
+    first, second = asyncio.run(scenario())
+    assert second["blobs_written"] - first["blobs_written"] == 0
+    assert second["blob_bytes_written"] == first["blob_bytes_written"]
+    row = _row("s1")
+    assert row["version"] == 2
+    assert len(row["session_data"]) < 1024
+    assert json.loads(row["session_data"])["knowledge_markdown"] == {"$blob": blob_store.digest_of(_KB)}
+    assert db.blob_table_stats()["stored_bytes"] < len(_KB.encode("utf-8")) // 10
+
+
+def test_loaded_session_resolves_blob_lazily(temp_db) -> None:
+    async def scenario():
+        await orch.persist_session(_session("s1"))
+        session_cache.clear()
+        blob_store._TEXT_CACHE.clear()
+        loads = blob_store.stats()["loads"]
+        sess = await orch.get_session("s1")
+        assert not sess.blobs_loaded()
+        assert blob_store.stats()["loads"] == loads
+        assert sess.knowledge_markdown == _KB
+        assert blob_store.stats()["loads"] == loads + 1
+        sess.knowledge_markdown += "\n追加"
+        await orch.persist_session(sess)
+
+    asyncio.run(scenario())
+    assert db.blob_table_stats()["count"] == 2
+    session_cache.clear()
+    assert asyncio.run(orch.get_session("s1")).knowledge_markdown == _KB + "\n追加"
+
+
+def test_identical_content_is_stored_once_and_gc_removes_orphans(temp_db) -> None:
+    async def scenario():
+        await orch.persist_session(_session("a"))
+        await orch.persist_session(_session("b"))
+
+    asyncio.run(scenario())
+    assert db.blob_table_stats()["count"] == 1
+    db.delete_session("a")
+    assert blob_store.gc() == 0
+    db.delete_session("b")
+    assert blob_store.gc() == 1
+    assert db.blob_table_stats()["count"] == 0
+
+
+def test_blob_collected_under_a_live_session_is_rewritten(temp_db) -> None:
+    sess = _session("s1")
+
+    async def scenario():
+        await orch.persist_session(sess)
+        db.delete_session("s1")  # 例如被 TTL 清理，随后 GC 删除了 blob
+        assert blob_store.gc() == 1
+        sess.state = "DRAFT"
+        await orch.persist_session(sess)
+
+    asyncio.run(scenario())
+    assert db.get_blob(blob_store.digest_of(_KB)) is not None
+    session_cache.clear()
+    blob_store._TEXT_CACHE.clear()
+    assert asyncio.run(orch.get_session("s1")).knowledge_markdown == _KB
+
+
+def test_small_and_legacy_inline_values_stay_inline(temp_db) -> None:
+    legacy = _session("old").to_dict()
+    db.save_session("old", "COLLECT", json.dumps(legacy, ensure_ascii=False))
+    asyncio.run(orch.persist_session(_session("small", kb="短文本")))
+
+    assert json.loads(_row("small")["session_data"])["knowledge_markdown"] == "短文本"
+    assert db.blob_table_stats()["count"] == 0
+    sess = asyncio.run(orch.get_session("old"))
+    assert sess.blobs_loaded() and sess.knowledge_markdown == _KB
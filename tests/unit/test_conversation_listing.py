@@ -0,0 +1,102 @@
+"""单元测试：会话列表（反规范化的首条用户消息/消息数、keyset 翻页、旧库迁移与索引）。"""
+
+from __future__ import annotations
+
+import sqlite3
+
+from fastapi.testclient import TestClient
+
+from backend import db
+from backend.app import app
+from backend.config import settings
+
+
+def _seed(count: int, created_at: str = "2026-01-01 10:00:00") -> None:
+    """同一秒内创建 count 个会话（created_at 相同，靠 id 决定次序）。"""
+    with db.get_conn() as conn:
+        for i in range(count):
+            conn.execute(
+                "INSERT INTO conversations (id, intent, status, created_at, updated_at) VALUES (?, 'KB_QUERY', 'done', ?, ?)",
+                (f"c{i:03d}", created_at, created_at),
+            )
+
+
+def test_message_insert_maintains_summary_columns(temp_db) -> None:
+    db.write_batch(
+        [
+            ("conversation", ("c1", "ORCH_FLOW", "active")),
+            ("message", ("c1", "assistant", "INFO", "欢迎")),
+            ("message", ("c1", "user", "USER_REQUEST", "第一条需求")),
+            ("message", ("c1", "user", "USER_ANSWER", "补充说明")),
+        ]
+    )
+    db.add_message("c1", "assistant", "TRACE", "[]")
+    (row,) = db.list_conversations(limit=5)
+    assert row["first_user_text"] == "第一条需求"
+    assert row["message_count"] == 4
+    assert db.list_intent_samples() == [("第一条需求", "ORCH_FLOW")]
+
+
+def test_keyset_pages_cover_every_conversation_once(temp_db) -> None:
+    _seed(25)
+    seen, after = [], None
+    while True:
+        page = db.list_conversations(limit=7, after=after)
+        seen.extend(r["id"] for r in page)
+        if len(page) < 7:
+            break
+        after = (page[-1]["created_at"], page[-1]["id"])
+    assert seen == [f"c{i:03d}" for i in range(24, -1, -1)]
+    assert [r["id"] for r in db.list_conversations(limit=7, offset=7)] == seen[7:14]
+
+
+def test_api_returns_list_with_next_cursor_header(temp_db) -> None:
+    _seed(5)
+    client = TestClient(app)
+    first = client.get("/api/conversations", params={"limit": 3})
+    assert first.status_code == 200
+    assert [r["id"] for r in first.json()] == ["c004", "c003", "c002"]
+    cursor = first.headers["X-Next-Cursor"]
+    second = client.get("/api/conversations", params={"limit": 3, "cursor": cursor})
+    assert [r["id"] for r in second.json()] == ["c001", "c000"]
+    assert "X-Next-Cursor" not in second.headers
+    assert client.get("/api/conversations", params={"cursor": "%%%"}).status_code == 400
+
+
+def test_init_db_migrates_existing_database(tmp_path, monkeypatch) -> None:
+    path = tmp_path / "old.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE conversations (id TEXT PRIMARY KEY, intent TEXT NOT NULL, status TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT NOT NULL,
+            role TEXT NOT NULL, payload_type TEXT NOT NULL, content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        INSERT INTO conversations (id, intent, status) VALUES ('old', 'KB_QUERY', 'done');
+        INSERT INTO messages (conversation_id, role, payload_type, content) VALUES ('old', 'user', 'USER_REQUEST', '旧问题');
+        INSERT INTO messages (conversation_id, role, payload_type, content) VALUES ('old', 'assistant', 'KB_ANSWER', '回答');
+        """
+    )
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(settings, "db_path", str(path))
+    db.shutdown_db()
+    try:
+        db.init_db()
+        (row,) = db.list_conversations()
+        assert (row["first_user_text"], row["message_count"]) == ("旧问题", 2)
+        with db.get_conn() as conn:
+            plan = " ".join(
+                r[3]
+                for r in conn.execute(
+                    "EXPLAIN QUERY PLAN SELECT id FROM conversations WHERE (created_at, id) < (?, ?) "
+                    "ORDER BY created_at DESC, id DESC LIMIT 5",
+                    ("2026-01-01", "x"),
+                )
+            )
+            indexes = {r["name"] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert "idx_conversations_created" in plan
+        assert {"idx_messages_conversation", "idx_sessions_updated"} <= indexes
+    finally:
+        db.shutdown_db()
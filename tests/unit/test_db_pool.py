@@ -0,0 +1,80 @@
+"""单元测试：SQLite 连接池（WAL / PRAGMA、连接复用、异常回滚、占满时等待超时）与 DB 线程池上的异步接口。"""
+
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+from backend import db
+from backend.config import settings
+from backend.services import orchestrator_controller as orch
+
+
+@pytest.fixture
+def db_settings():
+    return {"db_pool_size": 2}
+
+
+def test_connections_use_wal_and_tuned_pragmas(temp_db) -> None:
+    with db.get_conn() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == settings.db_busy_timeout_ms
+
+
+def test_connections_are_reused_and_rolled_back_on_error(temp_db) -> None:
+    for i in range(5):
+        db.create_conversation(f"c{i}", intent="KB_QUERY", status="done")
+    with pytest.raises(RuntimeError):
+        with db.get_conn() as conn:
+            conn.execute("UPDATE conversations SET status = 'broken'")
+            raise RuntimeError("boom")
+    assert db.get_conversation("c4")["status"] == "done"
+    stats = db.pool_stats()
+    assert stats["opened"] == 1
+    assert stats["idle"] == stats["open"] == 1
+
+
+def test_exhausted_pool_times_out_instead_of_hanging(temp_db, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "db_busy_timeout_ms", 0, raising=False)  # 等待下限 1 秒
+    pool = db._get_pool()
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(sqlite3.OperationalError, match="SQLite pool"):
+        pool.acquire()
+    assert db.pool_stats()["timeouts"] == 1
+
+    # 等待期间归还的连接会被取走
+    threading.Timer(0.1, pool.release, args=(held.pop(),)).start()
+    held.append(pool.acquire())
+    for conn in held:
+        pool.release(conn)
+    assert db.pool_stats()["timeouts"] == 1
+
+
+def test_async_api_runs_on_db_executor(temp_db, monkeypatch) -> None:
+    threads = set()
+    real_add = db.add_message
+
+    def tracking_add(*args, **kwargs):
+        threads.add(threading.current_thread().name)
+        return real_add(*args, **kwargs)
+
+    monkeypatch.setattr(db, "add_message", tracking_add)
+
+    async def scenario():
+        await db.create_conversation_async("conv", intent="ORCH_FLOW")
+        await asyncio.gather(
+            *(db.add_message_async("conv", "user", "USER_ANSWER", f"m{i}") for i in range(20))
+        )
+        sess = await orch.create_session("首页新增定投入口")
+        loaded = await orch.get_session(sess.session_id)
+        return await db.get_conversation_async("conv"), sess, loaded
+
+    conv, sess, loaded = asyncio.run(scenario())
+    assert len(conv["messages"]) == 20
+    assert loaded is not None and loaded.to_dict() == sess.to_dict()
+    assert threads and all(name.startswith("rs-agent-db") for name in threads)
+    assert db.pool_stats()["open"] <= 2
@@ -0,0 +1,65 @@
+"""单元测试：BUILD_DRAFT 分段并发模式（KB 切片、单 section 失败回退）。"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from backend.services import orchestrator_controller as orch
+
+
+KB_TEXT = """--- source=a.docx distance=0.12
+三分法调仓的确认调仓页面展示建议追加金额。
+调仓接口会拆单后生成订单。
+调仓完成后发送到账通知消息。
+投顾组合的历史说明。"""
+
+
+def test_kb_slices_are_section_scoped(monkeypatch) -> None:
+    """system_current / system_changes 只拿前端/后端/通知相关行（system_current 另带图片段），不含元数据且有长度上限。"""
+    kb = KB_TEXT + "\n=== 图片 (images) ===\npath=/kb/a.pdf page=3\n=== 其它 ===\n无关段落"
+    slices = orch._kb_slices_for_sections(kb)
+    current = slices["system_current"]
+    assert "确认调仓页面" in current and "path=/kb/a.pdf page=3" in current
+    assert "source=" not in current and "历史说明" not in current and "无关段落" not in current
+    monkeypatch.setattr(orch.settings, "draft_section_kb_max_chars", 500, raising=False)
+    long_kb = "\n".join(f"确认调仓页面第 {i} 条说明，展示建议追加金额。" for i in range(200))
+    assert len(orch._kb_slices_for_sections(long_kb)["system_current"]) < 600
+    assert "source=" not in slices["business_requirement"]
+    assert "确认调仓页面" in slices["system_changes"]
+    assert "到账通知" in slices["system_changes"]
+    assert "历史说明" not in slices["system_changes"]
+
+
+def test_parallel_sections_only_current_gets_images(monkeypatch) -> None:
+    """三个 section 并发调用，只有 system_current 携带候选图片；失败的 section 不出现在结果中。"""
+    calls: Dict[str, Optional[List[str]]] = {}
+
+    async def fake_section(section: str, **kwargs: Any) -> Dict[str, Any]:
+        calls[section] = kwargs.get("candidate_image_paths")
+        if section == "system_changes":
+            raise RuntimeError("boom")
+        return {"section": section}
+
+    monkeypatch.setattr(orch, "llm_build_draft_section", fake_section)
+    sections = asyncio.run(
+        orch._build_draft_sections_parallel(
+            user_request="去掉建议追加金额",
+            user_answer="仅前端",
+            requirement_structured={},
+            kb_text=KB_TEXT,
+            candidate_image_paths=["/tmp/a.png"],
+        )
+    )
+    assert set(calls) == {"business_requirement", "system_current", "system_changes"}
+    assert calls["system_current"] == ["/tmp/a.png"]
+    assert calls["business_requirement"] is None
+    assert calls["system_changes"] is None
+    assert set(sections) == {"business_requirement", "system_current"}
+
+
+def test_fallback_system_changes_matches_schema() -> None:
+    """规则版 system_changes 与 draft_struct schema 对齐。"""
+    ch = orch._fallback_system_changes("去掉建议追加金额", "仅前端，不改后端")
+    assert ch["backend_changes"]["overview"].startswith("无")
+    assert set(ch) == {"change_overview", "frontend_changes", "backend_changes", "notification_changes"}
@@ -0,0 +1,87 @@
+"""单元测试：托管执行器（提交上限与背压、contextvars 传递、指标、进程池、上传写盘与 lifespan 关闭）。"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import db, executors, loop_monitor, metrics, tracing
+from backend.config import settings
+
+
+@pytest.fixture
+def fresh_executors(monkeypatch):
+    monkeypatch.setattr(settings, "metrics_enabled", True, raising=False)
+    executors.shutdown()
+    metrics.registry.reset()
+    yield
+    executors.shutdown()
+
+
+def _blocking_io(delay: float) -> float:
+    with tracing.span("test.blocking_io"):
+        time.sleep(delay)
+    return delay
+
+
+def test_bounded_submission_keeps_loop_responsive(fresh_executors, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "io_executor_workers", 1, raising=False)
+    monkeypatch.setattr(settings, "executor_max_queue", 1, raising=False)
+
+    async def scenario():
+        async with loop_monitor.fail_on_block(30):
+            with tracing.trace("test.offload") as tr:
+                results = await asyncio.gather(*(executors.io.run(_blocking_io, 0.04) for _ in range(4)))
+        return results, tr
+
+    results, tr = asyncio.run(scenario())
+    assert results == [0.04] * 4
+    st = executors.io.stats()
+    assert st["started"] and st["workers"] == 1 and st["max_in_flight"] == 2
+    assert st["backpressure_waits"] >= 1 and st["completed"] == 4 and st["in_flight"] == 0
+    # 线程中创建的 span 仍挂在调用方的 trace 上
+    assert sum(1 for sp in tr.spans if sp.name == "test.blocking_io") == 4
+
+    text = metrics.render()
+    assert 'rs_agent_executor_call_duration_seconds_count{pool="io",fn="_blocking_io"} 4' in text
+    assert 'rs_agent_executor_queue_wait_seconds_count{pool="io"} 4' in text
+    assert 'rs_agent_executor_in_flight{pool="io"} 0' in text
+
+
+def test_errors_propagate_and_process_pool(fresh_executors, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "cpu_executor_kind", "process", raising=False)
+    monkeypatch.setattr(settings, "cpu_executor_workers", 1, raising=False)
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await executors.io.run(int, "not a number")
+        return await executors.cpu.run(os.getpid)
+
+    assert asyncio.run(scenario()) != os.getpid()
+    assert executors.cpu.stats()["kind"] == "process"
+    assert executors.io.stats()["errors"] == 1
+
+
+def test_upload_writes_off_loop_and_lifespan_shuts_down(fresh_executors, monkeypatch, tmp_path) -> None:
+    from backend.app import app
+
+    monkeypatch.setattr(settings, "db_path", str(tmp_path / "rs_agent.db"))
+    monkeypatch.setattr(settings, "api_key", "", raising=False)
+    monkeypatch.setattr(settings, "upload_dir", tmp_path / "uploads")
+    db.shutdown_db()
+    with TestClient(app) as client:
+        resp = client.post(
+            "/api/upload",
+            files=[("files", ("a.png", b"\x89PNG-1", "image/png")), ("files", ("b.txt", b"x", "text/plain"))],
+        )
+        assert resp.status_code == 200
+        (image_id,) = resp.json()["imageIds"]
+        assert (tmp_path / "uploads" / f"{image_id}.png").read_bytes() == b"\x89PNG-1"
+        diag = client.get("/api/diagnostics/loop").json()["executors"]
+        assert diag["io"]["completed"] >= 2
+    assert not executors.io.stats()["started"]
+    db.shutdown_db()
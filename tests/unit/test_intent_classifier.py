@@ -0,0 +1,92 @@
+"""单元测试：本地意图分类器（训练/保存/加载、置信度阈值路由、与 LLM 一致率统计）。"""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from backend.config import settings
+from backend.services import intent_classifier as ic
+from backend.services import intent_router, llm_service
+from backend.services.intent_router import Intent
+
+_KB = ["定投扣款日规则是什么", "赎回到账时间怎么算", "调仓的触发条件有哪些", "份额确认规则是什么", "申购费率是多少"]
+_ORCH = ["首页新增定投入口按钮", "赎回页面增加提示弹窗", "调仓通知改成短信推送", "持仓列表隐藏已清仓基金", "下单页面优化按钮文案"]
+
+
+def _train(kind: str = "nb") -> ic.IntentClassifier:
+    texts = _KB + _ORCH
+    intents = ["KB_QUERY"] * len(_KB) + ["ORCH_FLOW"] * len(_ORCH)
+    if kind == "lr":
+        return ic.train_logistic_regression(texts, intents, dim=4096)
+    return ic.train_naive_bayes(texts, intents, dim=4096)
+
+
+@pytest.mark.parametrize("kind", ["nb", "lr"])
+def test_trained_model_separates_classes_and_round_trips(kind, tmp_path) -> None:
+    clf = _train(kind)
+    assert clf.predict("赎回规则是什么")[0] is Intent.KB_QUERY
+    assert clf.predict("新增一个按钮")[0] is Intent.ORCH_FLOW
+
+    path = tmp_path / "clf.npz"
+    clf.save(path)
+    loaded = ic.IntentClassifier.load(path)
+    assert loaded.describe() == clf.describe()
+    assert loaded.prob_kb("定投规则") == pytest.approx(clf.prob_kb("定投规则"), rel=1e-5)
+
+
+@pytest.fixture
+def routed(monkeypatch, tmp_path):
+    path = tmp_path / "clf.npz"
+    _train().save(path)
+    monkeypatch.setattr(settings, "intent_clf_path", str(path), raising=False)
+    monkeypatch.setattr(settings, "intent_clf_shadow_rate", 0.0, raising=False)
+    monkeypatch.setattr(settings, "kb_query_llm_enabled", False, raising=False)
+    ic.agreement.reset()
+    yield
+    ic.agreement.reset()
+
+
+def test_confident_prediction_skips_llm(routed, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "intent_clf_threshold", 0.5, raising=False)
+
+    async def boom(*_a, **_k):
+        raise AssertionError("LLM should not be called")
+
+    monkeypatch.setattr(llm_service, "llm_classify_intent", boom)
+    intent, method = asyncio.run(intent_router.detect_intent_hybrid("三分法定投扣款"))
+    assert method == "classifier"
+    assert intent is Intent.KB_QUERY
+    assert ic.agreement.stats()["decided_locally"] == 1
+
+
+def test_low_confidence_consults_llm_and_tracks_agreement(routed, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "intent_clf_threshold", 1.01, raising=False)
+
+    async def fake_classify(text: str):
+        return "ORCH_FLOW"
+
+    monkeypatch.setattr(llm_service, "llm_classify_intent", fake_classify)
+    intent, method = asyncio.run(intent_router.detect_intent_hybrid("首页定投入口"))
+    assert (intent, method) == (Intent.ORCH_FLOW, "llm")
+    stats = ic.agreement.stats()
+    assert stats["compared_with_llm"] == 1
+    assert stats["agreement_rate"] == 1.0
+
+
+def test_suggested_threshold_uses_high_confidence_buckets() -> None:
+    tracker = ic.AgreementTracker()
+    for _ in range(30):
+        tracker.record(Intent.KB_QUERY, 0.97, Intent.KB_QUERY)
+    for _ in range(10):
+        tracker.record(Intent.KB_QUERY, 0.62, Intent.ORCH_FLOW)
+    assert tracker.suggested_threshold(target=0.95, min_samples=20) == 0.95
+    assert tracker.stats()["buckets"]["0.60"] == {"n": 10, "agree": 0, "rate": 0.0}
+
+
+def test_missing_weights_disable_classifier(monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr(settings, "intent_clf_path", str(tmp_path / "none.npz"), raising=False)
+    assert ic.classify("定投规则") is None
@@ -0,0 +1,59 @@
+"""单元测试：意图路由（规则快速路径、首轮融合调用）。"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import List
+
+import pytest
+
+from backend.config import settings
+from backend.services import intent_router, llm_service
+from backend.services.intent_router import Intent
+
+
+@pytest.fixture
+def llm_on(monkeypatch):
+    monkeypatch.setattr(settings, "llm_api_key", "sk-test", raising=False)
+    monkeypatch.setattr(settings, "llm_base_url", "http://llm.invalid/v1", raising=False)
+    monkeypatch.setattr(settings, "kb_query_llm_enabled", True, raising=False)
+    yield
+
+
+def test_strong_keyword_skips_llm(llm_on, monkeypatch) -> None:
+    """强关键词命中时不调用 LLM，也不返回扩展子问题。"""
+
+    async def boom(*_a, **_k):
+        raise AssertionError("LLM should not be called")
+
+    monkeypatch.setattr(llm_service, "llm_classify_and_expand", boom)
+    intent, method, queries = asyncio.run(intent_router.detect_intent_with_expansion("查询知识库：定投规则"))
+    assert (intent, method, queries) == (Intent.KB_QUERY, "rule", None)
+
+
+def test_fused_call_returns_intent_and_queries(llm_on, monkeypatch) -> None:
+    """规则无法判定时只发一次融合调用，KB_QUERY 同时带回扩展子问题。"""
+    calls: List[str] = []
+
+    async def fake_fused(text: str, max_queries: int = 4):
+        calls.append(text)
+        return "KB_QUERY", ["三分法 调仓 说明", "调仓明细 页面"]
+
+    monkeypatch.setattr(llm_service, "llm_classify_and_expand", fake_fused)
+    intent, method, queries = asyncio.run(intent_router.detect_intent_with_expansion("三分法调仓"))
+    assert intent is Intent.KB_QUERY
+    assert method == "llm_fused"
+    assert queries == ["三分法 调仓 说明", "调仓明细 页面"]
+    assert len(calls) == 1
+
+
+def test_hybrid_returns_enum_from_llm(llm_on, monkeypatch) -> None:
+    """LLM 返回的字符串意图会被转换为 Intent 枚举。"""
+
+    async def fake_classify(text: str):
+        return "ORCH_FLOW"
+
+    monkeypatch.setattr(llm_service, "llm_classify_intent", fake_classify)
+    intent, method = asyncio.run(intent_router.detect_intent_hybrid("三分法调仓"))
+    assert intent is Intent.ORCH_FLOW
+    assert method == "llm"
@@ -0,0 +1,126 @@
+"""单元测试：后台任务模式（事件持久化、断线后按 Last-Event-ID 重放、轮询、启动恢复与关闭中断）。"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import socket
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import db
+from backend.services.agent_pipeline import AgentPipeline
+from backend.services.job_queue import JobManager
+
+
+@pytest.fixture
+def db_settings():
+    return {
+        "api_key": "",
+        "rate_limit_per_minute": 0,
+    }
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    """替换 pipeline：3 条 trace（中间有耗时）+ final。"""
+
+    async def process(self, text, session_id=None, image_paths=None):
+        for i in range(3):
+            await asyncio.sleep(0.02)
+            yield {"type": "trace", "data": {"step": i}}
+        yield {"type": "final", "data": {"sessionId": session_id, "payloadType": "DRAFT", "content": {"text": text}}}
+
+    monkeypatch.setattr(AgentPipeline, "process", process)
+
+
+def test_job_keeps_running_after_subscriber_leaves_and_replays(temp_db, fake_pipeline) -> None:
+    async def scenario():
+        manager = JobManager()
+        job_id = await manager.submit("补充说明", "s1")
+        seen = []
+        async for event in manager.events(job_id):
+            seen.append(event["seq"])
+            if len(seen) == 2:
+                break  # 客户端断开
+        while manager.stats()["active"]:
+            await asyncio.sleep(0.01)
+        rest = [e async for e in manager.events(job_id, after_seq=seen[-1])]
+        return job_id, seen, rest, manager.stats()
+
+    job_id, seen, rest, stats = asyncio.run(scenario())
+    assert seen == [1, 2]
+    assert [e["seq"] for e in rest] == [3, 4] and rest[-1]["type"] == "final"
+    assert rest[-1]["data"]["content"] == {"text": "补充说明"}
+    assert db.get_job(job_id)["status"] == "done" and db.get_job(job_id)["last_seq"] == 4
+    assert stats["done"] == 1 and stats["resumes"] == 1
+
+
+def _sse_events(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields.get("id"), fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_stream_resume_with_last_event_id_and_polling(temp_db, fake_pipeline) -> None:
+    from backend.app import app
+
+    with TestClient(app) as client:
+        first = _sse_events(client.post("/api/agent/stream", json={"text": "需求", "background": True}).text)
+        assert first[0][1] == "job"
+        job_id = first[0][2]["jobId"]
+        assert [e[0] for e in first[1:]] == [f"{job_id}:{i}" for i in range(1, 5)]
+
+        resumed = client.post(
+            "/api/agent/stream", json={"text": "需求"}, headers={"Last-Event-ID": f"{job_id}:2"}
+        )
+        assert [e[0] for e in _sse_events(resumed.text)[1:]] == [f"{job_id}:3", f"{job_id}:4"]
+        replay = client.get(f"/api/jobs/{job_id}/stream", headers={"Last-Event-ID": f"{job_id}:3"})
+        assert [e[1] for e in _sse_events(replay.text)[1:]] == ["final"]
+
+        accepted = client.post("/api/agent", json={"text": "另一个需求", "background": True})
+        assert accepted.status_code == 202
+        poll_id = accepted.json()["jobId"]
+        deadline = time.time() + 5
+        while (status := client.get(f"/api/jobs/{poll_id}").json())["status"] != "done" and time.time() < deadline:
+            time.sleep(0.02)
+        assert status["result"]["type"] == "final" and len(status["events"]) == 4
+        assert client.get(f"/api/jobs/{poll_id}", params={"after": 3}).json()["events"][0]["seq"] == 4
+
+        assert client.get("/api/jobs/missing").status_code == 404
+        bad = client.post("/api/agent/stream", json={"text": "x"}, headers={"Last-Event-ID": "garbage"})
+        assert bad.status_code == 400
+
+
+def test_recover_marks_only_jobs_of_dead_local_processes(temp_db) -> None:
+    host = socket.gethostname()
+    db.create_job("dead", None, "{}", f"{host}:999999999")
+    db.create_job("remote", None, "{}", "another-host:1")
+    db.create_job("done", None, "{}", f"{host}:999999999")
+    db.set_job_status("done", "done")
+    assert JobManager().recover() == 1
+    assert [db.get_job(j)["status"] for j in ("dead", "remote", "done")] == ["interrupted", "queued", "done"]
+
+
+def test_shutdown_interrupts_running_jobs(temp_db, monkeypatch) -> None:
+    async def slow(self, text, session_id=None, image_paths=None):
+        yield {"type": "trace", "data": {}}
+        await asyncio.sleep(60)
+        yield {"type": "final", "data": {}}
+
+    monkeypatch.setattr(AgentPipeline, "process", slow)
+
+    async def scenario():
+        manager = JobManager()
+        job_id = await manager.submit("需求", None)
+        await asyncio.sleep(0.05)
+        await manager.shutdown()
+        return job_id, [e async for e in manager.events(job_id)]
+
+    job_id, events = asyncio.run(scenario())
+    assert db.get_job(job_id)["status"] == "interrupted"
+    assert [e["type"] for e in events] == ["trace"]
@@ -0,0 +1,168 @@
+"""单元测试：LLM JSON 输出的宽松修复解析、缺失字段定向补问与 JSON 模式退化。"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any, Dict, List
+
+import httpx
+import pytest
+
+from backend.services import llm_service
+from backend.utils.json_repair import missing_keys, repair_json_object
+
+
+def test_clean_json_is_not_marked_salvaged() -> None:
+    obj, salvaged = repair_json_object('{"status": "confirmed"}')
+    assert obj == {"status": "confirmed"}
+    assert salvaged is False
+
+
+def test_repairs_fences_comments_and_trailing_commas() -> None:
+    raw = """```json
+{
+  // 需求来源
+  "demand_source": "运营",
+  "open_questions": ["a", "b",], /* 待确认 */
+}
+```"""
+    obj, salvaged = repair_json_object(raw)
+    assert obj == {"demand_source": "运营", "open_questions": ["a", "b"]}
+    assert salvaged is True
+
+
+def test_extracts_object_from_surrounding_prose() -> None:
+    raw = '好的，结果如下：\n{"status": "need_more", "note": "含 // 与 , } 的字符串"}\n以上。'
+    obj, salvaged = repair_json_object(raw)
+    assert obj == {"status": "need_more", "note": "含 // 与 , } 的字符串"}
+    assert salvaged is True
+
+
+def test_keeps_code_fences_inside_string_values() -> None:
+    raw = '说明\n{"backend_changes": "```mermaid\\nflowchart TD\\n```"}'
+    obj, _ = repair_json_object(raw)
+    assert obj == {"backend_changes": "```mermaid\nflowchart TD\n```"}
+
+
+def test_unparseable_returns_none() -> None:
+    assert repair_json_object("not json at all") == (None, False)
+    assert repair_json_object("[1, 2]") == (None, False)
+
+
+def test_missing_keys_treats_null_as_missing() -> None:
+    assert missing_keys({"a": 1, "b": None}, ("a", "b", "c")) == ["b", "c"]
+
+
+@pytest.fixture
+def fake_chat(monkeypatch):
+    """替换 _chat：按顺序返回预置回复，并记录每次调用的 messages。"""
+    calls: List[Dict[str, Any]] = []
+    replies: List[str] = []
+
+    async def _chat(messages, temperature=0.2, max_tokens=2048, stage="default", json_mode=False):
+        calls.append({"messages": messages, "stage": stage, "json_mode": json_mode})
+        return replies.pop(0)
+
+    monkeypatch.setattr(llm_service, "_chat", _chat)
+    monkeypatch.setattr(llm_service, "_JSON_STATS", {})
+    return calls, replies
+
+
+def test_chat_json_reasks_only_missing_fields(fake_chat) -> None:
+    calls, replies = fake_chat
+    replies += [
+        '{"demand_source": "运营", "product_statement": "新增提醒",}',
+        '{"open_questions": ["是否需要短信？"]}',
+    ]
+    messages = [
+        {"role": "system", "content": "sys"},
+        {"role": "user", "content": [{"type": "text", "text": "需求"}, {"type": "image_url", "image_url": {}}]},
+    ]
+    data = asyncio.run(
+        llm_service._chat_json(messages, stage="collect", required=llm_service._COLLECT_REQUIRED)
+    )
+    assert data["open_questions"] == ["是否需要短信？"]
+    assert data["demand_source"] == "运营"
+    assert len(calls) == 2 and all(c["json_mode"] for c in calls)
+    reask = calls[1]["messages"]
+    assert "open_questions" in reask[-1]["content"]
+    assert "demand_source" not in reask[-1]["content"]
+    # 补问不重复上传图片
+    assert reask[1]["content"] == "需求"
+    stats = llm_service.json_parse_stats()["collect"]
+    assert stats["salvaged"] == 1 and stats["reasked"] == 1 and stats["reask_filled"] == 1
+    assert stats["salvage_rate"] == 1.0
+
+
+def test_chat_json_unwraps_section_and_raises_on_garbage(fake_chat) -> None:
+    _, replies = fake_chat
+    replies += [json.dumps({"system_current": {"business_rules": "r", "frontend_current": "f",
+                                               "backend_current": "b", "notification_current": "n"}})]
+    data = asyncio.run(
+        llm_service._chat_json(
+            [{"role": "user", "content": "x"}],
+            stage="draft_section",
+            required=llm_service._DRAFT_SECTION_REQUIRED["system_current"],
+            unwrap="system_current",
+        )
+    )
+    assert data["business_rules"] == "r"
+
+    replies.append("抱歉，无法生成。")
+    with pytest.raises(ValueError):
+        asyncio.run(llm_service._chat_json([{"role": "user", "content": "x"}], stage="confirmer", required=("status",)))
+    assert llm_service.json_parse_stats()["confirmer"]["failed"] == 1
+
+
+def test_json_mode_falls_back_when_model_rejects_response_format(monkeypatch) -> None:
+    payloads: List[Dict[str, Any]] = []
+
+    async def _http_post(url, headers, payload):
+        payloads.append(dict(payload))
+        if "response_format" in payload:
+            req = httpx.Request("POST", url)
+            body = {"error": {"message": "'response_format.type' json_object is not supported by this model"}}
+            raise httpx.HTTPStatusError("bad", request=req, response=httpx.Response(400, json=body, request=req))
+        return {"choices": [{"message": {"content": '{"status": "confirmed"}'}}]}
+
+    monkeypatch.setattr(llm_service, "_http_post", _http_post)
+    monkeypatch.setattr(llm_service.settings, "llm_api_key", "k", raising=False)
+    monkeypatch.setattr(llm_service.settings, "llm_json_mode", True, raising=False)
+    monkeypatch.setattr(llm_service, "_JSON_MODE_UNSUPPORTED", set())
+
+    out = asyncio.run(llm_service._chat([{"role": "user", "content": "x"}], stage="confirmer", json_mode=True))
+    assert out == '{"status": "confirmed"}'
+    assert "response_format" in payloads[0] and "response_format" not in payloads[1]
+
+    # 已记住该模型不支持 JSON 模式，后续不再发送
+    asyncio.run(llm_service._chat([{"role": "user", "content": "x"}], stage="confirmer", json_mode=True))
+    assert "response_format" not in payloads[2]
+
+
+def test_unrelated_400_keeps_json_mode(monkeypatch) -> None:
+    payloads = []
+
+    async def _http_post(url, headers, payload):
+        payloads.append(dict(payload))
+        req = httpx.Request("POST", url)
+        body = {"error": {"message": "This model's maximum context length is 8192 tokens"}}
+        raise httpx.HTTPStatusError("bad", request=req, response=httpx.Response(400, json=body, request=req))
+
+    monkeypatch.setattr(llm_service, "_http_post", _http_post)
+    monkeypatch.setattr(llm_service.settings, "llm_api_key", "k", raising=False)
+    monkeypatch.setattr(llm_service.settings, "llm_json_mode", True, raising=False)
+    monkeypatch.setattr(llm_service, "_JSON_MODE_UNSUPPORTED", set())
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(llm_service._chat([{"role": "user", "content": "x"}], stage="confirmer", json_mode=True))
+    # 不重发、也不记住该模型不支持 JSON 模式
+    assert len(payloads) == 1 and not llm_service._JSON_MODE_UNSUPPORTED
+
+
+def test_client_errors_are_not_retried() -> None:
+    req = httpx.Request("POST", "http://x")
+    assert not llm_service._is_retryable(httpx.HTTPStatusError("", request=req, response=httpx.Response(400)))
+    assert llm_service._is_retryable(httpx.HTTPStatusError("", request=req, response=httpx.Response(429)))
+    assert llm_service._is_retryable(httpx.HTTPStatusError("", request=req, response=httpx.Response(503)))
+    assert llm_service._is_retryable(httpx.ConnectError("boom"))
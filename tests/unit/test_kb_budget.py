@@ -0,0 +1,133 @@
+"""单元测试：KB_QUERY 延迟预算（跳过扩展 / 减少子问题 / 不做综合、超时回退、按 API Key 与请求的预算）。"""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from fastapi.security import HTTPAuthorizationCredentials
+from fastapi.testclient import TestClient
+
+from backend import db, request_scope
+from backend.config import settings
+from backend.routers.agent import _latency_budget_s
+from backend.services import agent_pipeline, kb_query_enhanced
+from backend.services.intent_router import Intent
+from backend.services.kb_budget import latency
+from backend.services.trading_kb_service import KBQueryError
+
+
+@pytest.fixture
+def llm_on(monkeypatch):
+    monkeypatch.setattr(settings, "kb_query_llm_enabled", True, raising=False)
+    monkeypatch.setattr(settings, "llm_api_key", "sk-test", raising=False)
+    monkeypatch.setattr(settings, "llm_base_url", "http://llm", raising=False)
+    monkeypatch.setattr(settings, "kb_budget_reserve_ms", 0, raising=False)
+    latency.reset()
+    yield
+    latency.reset()
+
+
+def _fake_services(monkeypatch, retrieve_s: float, synth_s: float = 0.0) -> dict:
+    calls = {"expand": 0, "retrieve": [], "synthesize": 0, "cancelled": 0}
+
+    async def expand(q, max_queries=4):
+        calls["expand"] += 1
+        await asyncio.sleep(0.05)
+        return ["子问题一", "子问题二", "子问题三"]
+
+    async def query_kb(query, image_paths=None):
+        calls["retrieve"].append(query)
+        try:
+            await asyncio.sleep(retrieve_s)
+        except asyncio.CancelledError:
+            calls["cancelled"] += 1
+            raise
+        return f"## {query}\n内容", []
+
+    async def synthesize(q, kb):
+        calls["synthesize"] += 1
+        await asyncio.sleep(synth_s)
+        return "综合答案"
+
+    monkeypatch.setattr(kb_query_enhanced, "llm_expand_kb_queries", expand)
+    monkeypatch.setattr(kb_query_enhanced, "query_kb", query_kb)
+    monkeypatch.setattr(kb_query_enhanced, "llm_kb_synthesize", synthesize)
+    return calls
+
+
+def _decisions(result: dict) -> list:
+    return [r["decision"] for r in result["kb_runs"] if r["stage"] == "budget"]
+
+
+def test_budget_drops_subqueries_and_synthesis(llm_on, monkeypatch) -> None:
+    calls = _fake_services(monkeypatch, retrieve_s=0.2)
+    for _ in range(5):
+        latency.record("expand", 50)
+        latency.record("retrieve", 200)
+        latency.record("synthesize", 500)
+
+    scope = request_scope.RequestScope(budget_s=0.55)
+    result = asyncio.run(scope.run(kb_query_enhanced.enhanced_kb_query("清算流程是什么")))
+
+    assert _decisions(result) == ["start", "drop_subqueries", "skip_synthesize"]
+    drop = next(r for r in result["kb_runs"] if r.get("decision") == "drop_subqueries")
+    assert drop["dropped"] == ["子问题二", "子问题三"] and drop["estimate_ms"] >= 200
+    assert calls["expand"] == 1 and calls["retrieve"] == ["清算流程是什么", "子问题一"] and calls["synthesize"] == 0
+    assert result["used_llm"] is False and result["final_markdown"] == result["raw_markdown"]
+
+    # 没有预算：行为不变
+    result = asyncio.run(kb_query_enhanced.enhanced_kb_query("清算流程是什么", expanded_queries=[]))
+    assert _decisions(result) == [] and result["used_llm"] is True
+
+
+def test_budget_skips_expansion_and_times_out_retrieval(llm_on, monkeypatch) -> None:
+    calls = _fake_services(monkeypatch, retrieve_s=2.0)
+    scope = request_scope.RequestScope(budget_s=0.3)
+
+    with pytest.raises(KBQueryError, match="延迟预算"):
+        asyncio.run(scope.run(kb_query_enhanced.enhanced_kb_query("清算流程是什么")))
+    # 先验估计放不下扩展 + 检索；唯一的检索在预算用尽时被取消
+    assert calls["expand"] == 0 and calls["retrieve"] == ["清算流程是什么"] and calls["cancelled"] == 1
+
+
+def test_budget_from_request_and_api_key(llm_on, monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr(settings, "api_key", "main-key,widget-key", raising=False)
+    monkeypatch.setattr(settings, "kb_budget_ms", 0, raising=False)
+    monkeypatch.setattr(settings, "kb_budget_ms_by_key", {"widget-key": 300.0}, raising=False)
+    widget = HTTPAuthorizationCredentials(scheme="Bearer", credentials="widget-key")
+    main = HTTPAuthorizationCredentials(scheme="Bearer", credentials="main-key")
+    assert _latency_budget_s(None, widget) == 0.3
+    assert _latency_budget_s(100, widget) == 0.1
+    assert _latency_budget_s(9000, widget) == 0.3
+    assert _latency_budget_s(None, main) is None and _latency_budget_s(None, None) is None
+    assert _latency_budget_s(5000, main) == 5.0
+
+    from backend.app import app
+
+    monkeypatch.setattr(settings, "db_path", str(tmp_path / "rs_agent.db"))
+    monkeypatch.setattr(settings, "rate_limit_per_minute", 0, raising=False)
+    calls = _fake_services(monkeypatch, retrieve_s=0.01)
+
+    async def detect(text, max_queries=None):
+        return Intent.KB_QUERY, "llm_fused", []
+
+    monkeypatch.setattr(agent_pipeline, "detect_intent_with_expansion", detect)
+    db.shutdown_db()
+    with TestClient(app) as client:
+        assert client.post("/api/agent", json={"text": "清算流程是什么"}).status_code == 401
+        resp = client.post(
+            "/api/agent", json={"text": "清算流程是什么"}, headers={"Authorization": "Bearer widget-key"}
+        )
+        assert resp.status_code == 200
+        runs = resp.json()["content"]["kbRuns"]
+        start = next(r for r in runs if r.get("decision") == "start")
+        assert start["budget_ms"] == 300.0
+        assert [r["decision"] for r in runs if r["stage"] == "budget"] == ["start", "skip_synthesize"]
+        assert calls["synthesize"] == 0
+
+        resp = client.post(
+            "/api/agent", json={"text": "清算流程是什么"}, headers={"Authorization": "Bearer main-key"}
+        )
+        assert resp.json()["content"]["usedLLM"] is True and calls["synthesize"] == 1
+    db.shutdown_db()
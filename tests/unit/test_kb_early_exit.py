@@ -0,0 +1,110 @@
+"""单元测试：KB_QUERY 渐进检索（覆盖度达标 / 新片段过少时提前结束，跳过的子问题记入 kb_runs）。"""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from backend import executors
+from backend.config import settings
+from backend.services import kb_hits, kb_modes, kb_query_enhanced
+
+
+@pytest.fixture
+def kb_env(monkeypatch):
+    monkeypatch.setattr(settings, "kb_query_llm_enabled", True, raising=False)
+    monkeypatch.setattr(settings, "llm_api_key", "sk-test", raising=False)
+    monkeypatch.setattr(settings, "llm_base_url", "http://llm", raising=False)
+    monkeypatch.setattr(settings, "kb_query_max_subqueries", 4, raising=False)
+    monkeypatch.setattr(settings, "kb_early_exit_enabled", True, raising=False)
+    monkeypatch.setattr(settings, "kb_early_exit_coverage", 0.8, raising=False)
+    monkeypatch.setattr(settings, "kb_early_exit_max_distance", 0.3, raising=False)
+    monkeypatch.setattr(settings, "kb_early_exit_min_hits", 2, raising=False)
+    monkeypatch.setattr(settings, "kb_early_exit_min_new_ratio", 0.2, raising=False)
+    kb_modes.answer_cache.clear()
+    calls = {"retrieve": [], "synthesize": []}
+    answers = {}
+
+    async def expand(q, max_queries=4):
+        return [f"子问题{i}" for i in range(1, max_queries)]
+
+    async def query_kb(query, image_paths=None):
+        calls["retrieve"].append(query)
+        return answers.get(query, answers.get("*", "")), []
+
+    async def synthesize(q, kb):
+        calls["synthesize"].append(kb)
+        return "综合答案"
+
+    monkeypatch.setattr(kb_query_enhanced, "llm_expand_kb_queries", expand)
+    monkeypatch.setattr(kb_query_enhanced, "query_kb", query_kb)
+    monkeypatch.setattr(kb_query_enhanced, "llm_kb_synthesize", synthesize)
+    yield calls, answers
+    kb_modes.answer_cache.clear()
+
+
+def test_coverage_tracker() -> None:
+    tracker = kb_hits.CoverageTracker("清算流程", max_distance=0.3, min_hits=2)
+    first = tracker.add("--- source=a.docx distance=0.10\n清算流程的步骤\n--- source=b.docx distance=0.90\n无关内容")
+    assert first == {"hits": 2, "new_hits": 2, "new_ratio": 1.0, "coverage": 0.75}
+    # 重复片段不计新命中；第二个高置信命中使命中数达标
+    second = tracker.add("--- source=a.docx distance=0.05\n清算流程的步骤\n--- source=c.docx distance=0.20\n清算时间")
+    assert second == {"hits": 2, "new_hits": 1, "new_ratio": 0.5, "coverage": 1.0}
+    assert tracker.add("没有命中块的文本")["new_ratio"] is None
+
+
+def test_early_exit_on_coverage(kb_env) -> None:
+    calls, answers = kb_env
+    answers["*"] = (
+        "--- source=a.docx distance=0.10\n清算流程的步骤\n\n"
+        "--- source=b.docx distance=0.20\n清算流程与时间\n=== 图片 (images) ===\npath=/data/kb/a.png"
+    )
+    result = asyncio.run(kb_query_enhanced.enhanced_kb_query("清算流程"))
+    assert calls["retrieve"] == ["清算流程"]
+    runs = {run["stage"]: run for run in result["kb_runs"]}
+    assert runs["early_exit"]["reason"] == "coverage"
+    assert runs["early_exit"]["skipped"] == ["子问题1", "子问题2", "子问题3"]
+    assert runs["kb_retrieve"]["coverage"] == 1.0
+    assert result["final_markdown"] == "综合答案" and calls["synthesize"] == [answers["*"]]
+
+
+def test_early_exit_on_duplicates(kb_env) -> None:
+    calls, answers = kb_env
+    answers["清算流程"] = "--- source=a.docx distance=0.50\n总览\n--- source=b.docx distance=0.60\n附录"
+    answers["子问题1"] = answers["清算流程"]
+    answers["子问题2"] = "--- source=c.docx distance=0.50\n细则"
+    asyncio.run(kb_query_enhanced.enhanced_kb_query("清算流程"))
+    assert calls["retrieve"] == ["清算流程", "子问题1"]
+
+
+def test_early_exit_with_process_cpu_executor(kb_env, monkeypatch) -> None:
+    # 覆盖度状态跨子问题累积，不能随 CPU 执行器进程池的副本丢失
+    calls, answers = kb_env
+    monkeypatch.setattr(settings, "cpu_executor_kind", "process", raising=False)
+    monkeypatch.setattr(settings, "cpu_executor_workers", 1, raising=False)
+    executors.shutdown()
+    answers["*"] = "--- source=a.docx distance=0.50\n总览\n--- source=b.docx distance=0.60\n附录"
+    try:
+        result = asyncio.run(kb_query_enhanced.enhanced_kb_query("清算流程"))
+    finally:
+        executors.shutdown()
+    assert calls["retrieve"] == ["清算流程", "子问题1"]
+    retrieved = [run for run in result["kb_runs"] if run["stage"] == "kb_retrieve"]
+    assert [run["new_hits"] for run in retrieved] == [2, 0]
+    assert [run["reason"] for run in result["kb_runs"] if run["stage"] == "early_exit"] == ["duplicates"]
+
+
+def test_no_early_exit_when_disabled_or_unparsed(kb_env, monkeypatch) -> None:
+    calls, answers = kb_env
+    answers["*"] = "检索结果没有命中块格式"
+    result = asyncio.run(kb_query_enhanced.enhanced_kb_query("清算流程"))
+    assert len(calls["retrieve"]) == 4
+    assert all(run["stage"] != "early_exit" for run in result["kb_runs"])
+
+    calls["retrieve"].clear()
+    kb_modes.answer_cache.clear()
+    answers["*"] = "--- source=a.docx distance=0.10\n清算流程\n--- source=b.docx distance=0.10\n清算流程步骤"
+    monkeypatch.setattr(settings, "kb_early_exit_enabled", False, raising=False)
+    asyncio.run(kb_query_enhanced.enhanced_kb_query("清算流程"))
+    assert len(calls["retrieve"]) == 4
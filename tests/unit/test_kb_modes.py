@@ -0,0 +1,142 @@
+"""单元测试：KB_QUERY 模式（fast / balanced / thorough）、命中片段重排与 fast 答案缓存。"""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import db
+from backend.config import settings
+from backend.services import agent_pipeline, kb_hits, kb_modes, kb_query_enhanced
+from backend.services.intent_router import Intent, detect_intent_local
+
+
+@pytest.fixture
+def kb_env(monkeypatch):
+    monkeypatch.setattr(settings, "kb_query_llm_enabled", True, raising=False)
+    monkeypatch.setattr(settings, "llm_api_key", "sk-test", raising=False)
+    monkeypatch.setattr(settings, "llm_base_url", "http://llm", raising=False)
+    monkeypatch.setattr(settings, "kb_query_default_mode", "balanced", raising=False)
+    monkeypatch.setattr(settings, "kb_query_max_subqueries", 4, raising=False)
+    monkeypatch.setattr(settings, "kb_thorough_max_subqueries", 8, raising=False)
+    monkeypatch.setattr(settings, "kb_thorough_rerank_top_k", 3, raising=False)
+    monkeypatch.setattr(settings, "kb_fast_cache_ttl_seconds", 600, raising=False)
+    monkeypatch.setattr(settings, "kb_early_exit_enabled", False, raising=False)  # 渐进检索另见 test_kb_early_exit
+    kb_modes.answer_cache.clear()
+    calls = {"expand": [], "retrieve": [], "synthesize": 0}
+
+    async def expand(q, max_queries=4):
+        calls["expand"].append(max_queries)
+        return [f"子问题{i}" for i in range(1, max_queries)]
+
+    async def query_kb(query, image_paths=None):
+        calls["retrieve"].append(query)
+        n = len(calls["retrieve"])
+        md = (
+            "--- source=总览.docx distance=0.30\n清算流程总览。\n\n"
+            f"--- source=细则.docx distance={0.10 + 0.05 * n:.2f}\n{query} 的清算细则。\n"
+            "=== 图片 (images) ===\npath=/data/kb/a.png"
+        )
+        return md, []
+
+    async def synthesize(q, kb):
+        calls["synthesize"] += 1
+        return "综合答案"
+
+    monkeypatch.setattr(kb_query_enhanced, "llm_expand_kb_queries", expand)
+    monkeypatch.setattr(kb_query_enhanced, "query_kb", query_kb)
+    monkeypatch.setattr(kb_query_enhanced, "llm_kb_synthesize", synthesize)
+    yield calls
+    kb_modes.answer_cache.clear()
+
+
+def test_rerank_dedups_and_orders_hits() -> None:
+    results = [
+        ("q1", "前言\n--- source=a.docx distance=0.40\n无关内容\n--- source=b.docx distance=0.10\n清算流程的步骤\n=== 表格聚合视图\n| a |"),
+        ("q2", "--- source=b.docx distance=0.05\n清算流程的步骤\n--- source=c.docx distance=0.20\n清算时间\n=== 表格聚合视图\n| a |"),
+    ]
+    hits, extras = kb_hits.split_blocks(results[0][1])
+    assert [(h.source, h.distance) for h in hits] == [("a.docx", 0.4), ("b.docx", 0.1)]
+    assert extras == ["前言", "=== 表格聚合视图\n| a |"]
+
+    md, stats = kb_hits.rerank_markdown("清算流程是什么", results, top_k=2)
+    assert stats["hits"] == 4 and stats["unique"] == 3 and stats["kept"] == 2
+    # 重复命中取较小距离；无关片段被挤出
+    assert md.startswith("--- source=b.docx distance=0.05\n清算流程的步骤")
+    assert "清算时间" in md and "无关内容" not in md
+    assert md.endswith("清算时间\n\n前言\n\n=== 表格聚合视图\n| a |")
+    assert kb_hits.rerank_markdown("q", [("q", "没有命中块的文本")], 3) == ("", {"hits": 0, "unique": 0, "kept": 0})
+
+
+def test_modes_change_depth(kb_env) -> None:
+    calls = kb_env
+
+    result = asyncio.run(kb_query_enhanced.enhanced_kb_query("清算流程是什么", mode="balanced"))
+    assert result["mode"] == "balanced" and result["used_llm"] is True and not result["cached"]
+    assert calls["expand"] == [4] and len(calls["retrieve"]) == 4 and calls["synthesize"] == 1
+    assert not any(r["stage"] == "rerank" for r in result["kb_runs"])
+
+    calls["retrieve"].clear()
+    result = asyncio.run(kb_query_enhanced.enhanced_kb_query("划款规则", mode="thorough"))
+    assert calls["expand"][-1] == 8 and len(calls["retrieve"]) == 8 and calls["synthesize"] == 2
+    rerank = next(r for r in result["kb_runs"] if r["stage"] == "rerank")
+    assert rerank["hits"] == 16 and rerank["unique"] == 9 and rerank["kept"] == 3
+    assert result["raw_markdown"].count("--- source=") == 3 and "distance=0.15" in result["raw_markdown"]
+
+    calls["retrieve"].clear()
+    result = asyncio.run(kb_query_enhanced.enhanced_kb_query("申购确认", mode="fast"))
+    assert calls["expand"] == [4, 8] and calls["retrieve"] == ["申购确认"] and calls["synthesize"] == 2
+    assert result["used_llm"] is False and result["final_markdown"] == result["raw_markdown"]
+    synth = next(r for r in result["kb_runs"] if r["stage"] == "synthesize")
+    assert synth["used_llm"] is False
+
+
+def test_fast_mode_serves_cached_answers(kb_env, monkeypatch) -> None:
+    calls = kb_env
+    asyncio.run(kb_query_enhanced.enhanced_kb_query("清算流程是什么", mode="fast"))
+    # balanced 的综合答案覆盖 fast 的原文答案，之后 fast 直接返回它
+    asyncio.run(kb_query_enhanced.enhanced_kb_query("清算流程是什么", mode="balanced"))
+    asyncio.run(kb_query_enhanced.enhanced_kb_query("清算流程是什么", mode="fast"))
+    retrieved = len(calls["retrieve"])
+
+    result = asyncio.run(kb_query_enhanced.enhanced_kb_query("  清算流程是什么 ", mode="fast"))
+    assert len(calls["retrieve"]) == retrieved
+    assert result["cached"] is True and result["mode"] == "fast" and result["final_markdown"] == "综合答案"
+    (run,) = result["kb_runs"]
+    assert run["stage"] == "cache" and run["source_mode"] == "balanced"
+
+    # balanced / thorough 不读缓存；带查询图片与过期条目不命中
+    asyncio.run(kb_query_enhanced.enhanced_kb_query("清算流程是什么", mode="balanced"))
+    asyncio.run(kb_query_enhanced.enhanced_kb_query("清算流程是什么", ["/tmp/q.png"], mode="fast"))
+    assert len(calls["retrieve"]) == retrieved + 5
+    monkeypatch.setattr(settings, "kb_fast_cache_ttl_seconds", 0.0001, raising=False)
+    assert kb_modes.answer_cache.get("清算流程是什么") is None
+
+
+def test_request_mode_routes_intent_locally(kb_env, monkeypatch, tmp_path) -> None:
+    from backend.app import app
+
+    assert detect_intent_local("查询知识库：定投规则") == (Intent.KB_QUERY, "rule")
+    monkeypatch.setattr(settings, "db_path", str(tmp_path / "rs_agent.db"))
+    monkeypatch.setattr(settings, "api_key", "", raising=False)
+    monkeypatch.setattr(settings, "rate_limit_per_minute", 0, raising=False)
+
+    async def no_llm_intent(text, max_queries=None):
+        raise AssertionError("fast 模式不应调用 LLM 意图路由")
+
+    monkeypatch.setattr(agent_pipeline, "detect_intent_with_expansion", no_llm_intent)
+    db.shutdown_db()
+    with TestClient(app) as client:
+        assert client.post("/api/agent", json={"text": "x", "mode": "quick"}).status_code == 422
+        resp = client.post("/api/agent", json={"text": "查询知识库：定投规则", "mode": "fast"})
+        assert resp.status_code == 200
+        content = resp.json()["content"]
+        assert content["mode"] == "fast" and content["cached"] is False and content["usedLLM"] is False
+        assert kb_env["retrieve"] == ["查询知识库：定投规则"]
+
+        resp = client.post("/api/agent", json={"text": "查询知识库：定投规则", "mode": "fast"})
+        assert resp.json()["content"]["cached"] is True and len(kb_env["retrieve"]) == 1
+        assert client.get("/api/diagnostics/db").json()["kb_answer_cache"]["hits"] == 1
+    db.shutdown_db()
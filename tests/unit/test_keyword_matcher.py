@@ -0,0 +1,100 @@
+"""单元测试：多模式关键词匹配器（重叠命中、行分类）及其在意图规则中的等价性。"""
+
+from __future__ import annotations
+
+import random
+import re
+
+import pytest
+
+from backend.services import intent_router
+from backend.utils.keyword_matcher import KeywordMatcher
+
+
+def _naive_hits(text, categories):
+    out = set()
+    for cat, kws in categories.items():
+        for kw in kws:
+            start = text.find(kw)
+            while start >= 0:
+                out.add((start, start + len(kw), cat))
+                start = text.find(kw, start + 1)
+    return out
+
+
+def _flatten(hits):
+    return {(s, e, c) for s, e, cats in hits for c in cats}
+
+
+def test_overlapping_hits_across_categories() -> None:
+    m = KeywordMatcher({"fe": ("确认调仓", "调仓明细"), "biz": ("调仓",), "q": ("明细",)})
+    hits = _flatten(m.iter_hits("请打开确认调仓明细页"))
+    assert hits == {(3, 7, "fe"), (5, 9, "fe"), (5, 7, "biz"), (7, 9, "q")}
+    assert m.categories("调仓") == {"biz"}
+
+
+@pytest.mark.parametrize(
+    "categories",
+    [
+        {"a": ("页面", "前端", "调仓明细"), "b": ("调仓", "确认调仓", "明细"), "c": ("仓明",)},
+        # 自重叠关键词：闭包无法收敛，走失败函数回退路径
+        {"a": ("aba", "ab"), "b": ("bab", "b")},
+    ],
+)
+def test_matches_naive_scan_on_random_text(categories) -> None:
+    m = KeywordMatcher(categories)
+    alphabet = sorted({ch for kws in categories.values() for kw in kws for ch in kw}) + ["x", "\n"]
+    rng = random.Random(0)
+    for _ in range(500):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        assert _flatten(m.iter_hits(text)) == _naive_hits(text, categories)
+        assert m.categories(text) == {c for _s, _e, c in _naive_hits(text, categories)}
+        for line, cats in m.line_categories(text):
+            assert cats == {c for _s, _e, c in _naive_hits(line, categories)}
+
+
+def test_line_categories_are_cached_per_text() -> None:
+    m = KeywordMatcher({"fe": ("页面",), "be": ("接口",)})
+    text = "页面说明\n无关内容\n接口与页面"
+    first = m.line_categories(text)
+    assert first == (("页面说明", frozenset({"fe"})), ("无关内容", frozenset()), ("接口与页面", frozenset({"fe", "be"})))
+    assert m.line_categories(text) is first
+
+
+# 原先的弱 KB_QUERY 正则与动作词正则，用于验证改写后规则结果不变
+_LEGACY_KB = [
+    re.compile(r"(?:什么|怎么|如何|哪些|几|多少|是否|有没有|能否).*(?:规则|流程|逻辑|配置|现状|机制|策略|方案)"),
+    re.compile(r"(?:规则|流程|逻辑|配置|现状|机制|策略|方案).*(?:是什么|有哪些|怎么样|如何)"),
+    re.compile(r"(?:定投|调仓|赎回|申购|追加|份额|基金|组合|持仓|下单|拆单).*(?:规则|流程|逻辑|怎么|是什么|有哪些)"),
+    re.compile(r"(?:规则|流程|逻辑).*(?:定投|调仓|赎回|申购|追加|份额|基金|组合|持仓|下单|拆单)"),
+]
+_LEGACY_ORCH = re.compile(r"(?:新增|增加|添加|修改|调整|优化|去掉|移除|删除|隐藏|改为|改成|替换|升级|重构|上线|需要)")
+
+
+def _legacy_rule_detect(text):
+    normalized = (text or "").strip()
+    if not normalized:
+        return intent_router.Intent.ORCH_FLOW, 1.0
+    if any(k in normalized for k in intent_router._KB_STRONG_KEYWORDS):
+        return intent_router.Intent.KB_QUERY, 1.0
+    if any(k in normalized for k in intent_router._ORCH_STRONG_KEYWORDS):
+        return intent_router.Intent.ORCH_FLOW, 1.0
+    kb_score = sum(1 for p in _LEGACY_KB if p.search(normalized))
+    orch_score = 1 if _LEGACY_ORCH.search(normalized) else 0
+    if kb_score > 0 and orch_score == 0:
+        return intent_router.Intent.KB_QUERY, 0.7
+    if orch_score > 0 and kb_score == 0:
+        return intent_router.Intent.ORCH_FLOW, 0.7
+    return None, 0.0
+
+
+def test_rule_based_detect_matches_legacy_regexes() -> None:
+    vocab = [
+        "什么", "怎么", "是什么", "有哪些", "怎么样", "如何", "几", "规则", "流程", "逻辑", "现状", "方案",
+        "定投", "调仓", "赎回", "基金", "新增", "需要", "优化", "交易规则", "改动点", "查知识库",
+        "的", "页面", "。", "\n", " ",
+    ]
+    rng = random.Random(1)
+    for _ in range(2000):
+        text = "".join(rng.choice(vocab) for _ in range(rng.randint(0, 12)))
+        assert intent_router._rule_based_detect(text) == _legacy_rule_detect(text), text
@@ -0,0 +1,94 @@
+"""单元测试：LLM 请求对冲（阈值学习、备份胜出、预算上限）。"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import List
+
+import pytest
+
+from backend.config import settings
+from backend.services.llm_hedging import HedgeController
+
+
+@pytest.fixture
+def hedge_settings(monkeypatch):
+    monkeypatch.setattr(settings, "llm_hedge_stages", frozenset({"intent"}), raising=False)
+    monkeypatch.setattr(settings, "llm_hedge_min_samples", 5, raising=False)
+    monkeypatch.setattr(settings, "llm_hedge_percentile", 95.0, raising=False)
+    monkeypatch.setattr(settings, "llm_hedge_budget_ratio", 0.5, raising=False)
+    yield
+
+
+def _warm(ctl: HedgeController, stage: str, seconds: float = 0.01, n: int = 5) -> None:
+    for _ in range(n):
+        ctl.record(stage, seconds)
+
+
+def test_threshold_requires_min_samples(hedge_settings) -> None:
+    """样本不足时不对冲（阈值为 None）。"""
+    ctl = HedgeController()
+    _warm(ctl, "intent", n=4)
+    assert ctl.threshold("intent") is None
+    ctl.record("intent", 0.01)
+    assert ctl.threshold("intent") == pytest.approx(0.01)
+
+
+def test_backup_wins_when_primary_stalls(hedge_settings) -> None:
+    """首个请求卡住超过阈值 → 发出备份请求，备份先返回并取消首个请求。"""
+    ctl = HedgeController()
+    _warm(ctl, "intent")
+    ctl._calls = 10  # 预留预算
+    cancelled: List[int] = []
+    attempt = {"n": 0}
+
+    async def call() -> str:
+        attempt["n"] += 1
+        n = attempt["n"]
+        try:
+            await asyncio.sleep(5 if n == 1 else 0.001)
+        except asyncio.CancelledError:
+            cancelled.append(n)
+            raise
+        return f"r{n}"
+
+    async def main() -> str:
+        result = await ctl.run("intent", call)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == "r2"
+    assert cancelled == [1]
+    st = ctl.stats()["stages"]["intent"]
+    assert st["hedged"] == 1 and st["hedge_wins"] == 1
+    assert st["hedge_win_rate"] == 1.0
+
+
+def test_budget_limits_hedges(hedge_settings, monkeypatch) -> None:
+    """预算耗尽时不再发备份请求，仅等待首个请求。"""
+    monkeypatch.setattr(settings, "llm_hedge_budget_ratio", 0.0, raising=False)
+    ctl = HedgeController()
+    _warm(ctl, "intent")
+    attempt = {"n": 0}
+
+    async def call() -> str:
+        attempt["n"] += 1
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    assert asyncio.run(ctl.run("intent", call)) == "ok"
+    assert attempt["n"] == 1
+    assert ctl.stats()["stages"]["intent"]["budget_denied"] == 1
+
+
+def test_disabled_stage_never_hedges(hedge_settings) -> None:
+    """未启用的 stage 直接调用。"""
+    ctl = HedgeController()
+    _warm(ctl, "collect")
+
+    async def call() -> str:
+        await asyncio.sleep(0.03)
+        return "ok"
+
+    assert asyncio.run(ctl.run("collect", call)) == "ok"
+    assert ctl.stats()["stages"]["collect"]["hedged"] == 0
@@ -0,0 +1,100 @@
+"""单元测试：事件循环延迟监控（阻塞检测与调用点聚合、诊断端点与指标、测试用 fail_on_block）。"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import loop_monitor, metrics
+from backend.config import settings
+from backend.services import agent_pipeline, kb_query_enhanced
+from backend.services.agent_pipeline import AgentPipeline
+from backend.services.intent_router import Intent
+
+
+@pytest.fixture
+def db_settings():
+    return {
+        "api_key": "",
+        "rate_limit_per_minute": 0,
+        "kb_query_llm_enabled": False,
+    }
+
+
+def _fake_kb(monkeypatch, block_s: float = 0.0) -> None:
+    async def detect(text, max_queries=None):
+        return Intent.KB_QUERY, "rule", None
+
+    async def query_kb(query, image_paths=None):
+        await asyncio.sleep(0.01)
+        if block_s:
+            time.sleep(block_s)  # 模拟在 async 函数里做同步 I/O
+        return f"## {query}\n内容", []
+
+    monkeypatch.setattr(agent_pipeline, "detect_intent_with_expansion", detect)
+    monkeypatch.setattr(kb_query_enhanced, "query_kb", query_kb)
+
+
+def test_fail_on_block_reports_call_site() -> None:
+    async def scenario():
+        async with loop_monitor.fail_on_block(40):
+            for _ in range(5):
+                await asyncio.sleep(0.005)
+
+        with pytest.raises(loop_monitor.LoopBlockedError) as info:
+            async with loop_monitor.fail_on_block(40) as guard:
+                await asyncio.sleep(0.01)
+                time.sleep(0.12)
+        return guard, str(info.value)
+
+    guard, message = asyncio.run(scenario())
+    (site,) = guard.sites()
+    assert site["site"].startswith("tests/unit/test_loop_monitor.py:") and site["site"].endswith("in scenario")
+    assert site["count"] == 1 and site["max_ms"] >= 80
+    assert site["last_stack"][-1] == site["site"]
+    assert "test_loop_monitor.py" in message
+
+
+def test_pipeline_does_not_block_loop(temp_db, monkeypatch) -> None:
+    """测试模式：pipeline 阻塞事件循环超过 RS_AGENT_LOOP_BLOCK_FAIL_MS 即失败。"""
+    _fake_kb(monkeypatch)
+
+    async def run(guard_ms):
+        async with loop_monitor.fail_on_block(guard_ms):
+            return await AgentPipeline().run("清算流程是什么", None, None)
+
+    assert asyncio.run(run(None))["payloadType"]
+
+    _fake_kb(monkeypatch, block_s=0.15)
+    with pytest.raises(loop_monitor.LoopBlockedError, match="query_kb"):
+        asyncio.run(run(100))
+
+
+def test_diagnostics_and_metrics_aggregate_blocks(temp_db, monkeypatch) -> None:
+    from backend.app import app
+
+    monkeypatch.setattr(settings, "loop_monitor_enabled", True, raising=False)
+    monkeypatch.setattr(settings, "loop_monitor_interval_ms", 5, raising=False)
+    monkeypatch.setattr(settings, "loop_block_threshold_ms", 50, raising=False)
+    monkeypatch.setattr(settings, "metrics_enabled", True, raising=False)
+    monkeypatch.setattr(settings, "metrics_dir", None, raising=False)
+    metrics.registry.reset()
+    loop_monitor.monitor.reset()
+    _fake_kb(monkeypatch, block_s=0.12)
+
+    with TestClient(app) as client:
+        for _ in range(2):
+            assert client.post("/api/agent", json={"text": "清算流程是什么"}).status_code == 200
+        time.sleep(0.05)
+        stats = client.get("/api/diagnostics/loop").json()
+        text = client.get("/metrics").text
+
+    assert stats["running"] and stats["threshold_ms"] == 50 and stats["lag_ms"]["samples"] > 0
+    top = stats["sites"][0]
+    assert "in query_kb" in top["site"] and top["count"] == 2 and top["max_ms"] >= 60
+    assert any("agent_pipeline.py" in frame for frame in top["last_stack"])
+    assert f'rs_agent_event_loop_blocks_total{{site="{top["site"]}"}} 2' in text
+    assert "rs_agent_event_loop_block_seconds_count" in text
@@ -0,0 +1,92 @@
+"""单元测试：写后消息日志（批量落盘、读己之写、退出时排空、失败写入隔离）。"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from backend import db
+from backend.config import settings
+from backend.services.message_log import MessageLog
+
+
+@pytest.fixture
+def db_settings():
+    return {
+        "db_write_behind": True,
+        "db_write_batch_size": 100,
+        "db_write_flush_ms": 10_000,
+    }
+
+
+def test_writes_are_batched_and_ordered_per_conversation(temp_db) -> None:
+    log = MessageLog()
+
+    async def scenario():
+        for conv in ("a", "b"):
+            await log.create_conversation(conv, intent="ORCH_FLOW")
+        for i in range(30):
+            await log.add_message("a" if i % 2 else "b", "user", "USER_ANSWER", f"m{i}")
+        assert log.stats()["depth"] == 32  # 未到批大小与时间阈值：尚未落盘
+        assert db.get_conversation("a") is None
+        await log.barrier("a")
+        return log.stats()
+
+    stats = asyncio.run(scenario())
+    assert [m["content"] for m in db.get_conversation("a")["messages"]] == [f"m{i}" for i in range(1, 30, 2)]
+    assert stats["depth"] == 0 and stats["written"] == 32 and stats["batches"] == 1
+
+
+def test_batch_size_triggers_flush_and_drain_writes_the_rest(temp_db, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "db_write_batch_size", 5, raising=False)
+    log = MessageLog()
+
+    async def scenario():
+        await log.create_conversation("c", intent="KB_QUERY", status="done")
+        for i in range(3):
+            await log.add_message("c", "assistant", "TRACE", [{"phase": "KB", "i": i}])
+        await asyncio.sleep(0.05)
+        before = db.get_conversation("c")
+        await log.add_message("c", "assistant", "TRACE", [{"phase": "KB", "i": 3}])  # 第 5 条：攒够一批
+        await asyncio.sleep(0.05)
+        flushed = len(db.get_conversation("c")["messages"])
+        for i in range(4, 6):
+            await log.add_message("c", "assistant", "TRACE", [{"phase": "KB", "i": i}])
+        await log.drain()
+        return before, flushed
+
+    before, flushed = asyncio.run(scenario())
+    assert before is None and flushed == 4
+    messages = db.get_conversation("c")["messages"]
+    assert len(messages) == 6
+    assert json.loads(messages[-1]["content"]) == [{"phase": "KB", "i": 5}]
+
+
+def test_failed_op_is_dropped_without_blocking_others(temp_db) -> None:
+    log = MessageLog()
+
+    async def scenario():
+        await log.create_conversation("c", intent="ORCH_FLOW")
+        await log.add_message("c", "user", "USER_ANSWER", "ok-1")
+        await log.add_message("c", "user", None, "bad")  # payload_type NOT NULL
+        await log.add_message("c", "user", "USER_ANSWER", "ok-2")
+        await log.barrier("c")
+
+    asyncio.run(scenario())
+    assert [m["content"] for m in db.get_conversation("c")["messages"]] == ["ok-1", "ok-2"]
+    assert log.stats()["dropped"] == 1
+
+
+def test_disabled_write_behind_writes_through(temp_db, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "db_write_behind", False, raising=False)
+    log = MessageLog()
+
+    async def scenario():
+        await log.create_conversation("c", intent="ORCH_FLOW")
+        await log.add_message("c", "user", "USER_REQUEST", "hello")
+
+    asyncio.run(scenario())
+    assert db.get_conversation("c")["messages"][0]["content"] == "hello"
+    assert log.stats()["enqueued"] == 0
@@ -0,0 +1,116 @@
+"""单元测试：Prometheus 指标（文本格式、多 worker 文件合并、由 span / DB 调用 / SSE 产生的指标）。"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+import socket
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import metrics, tracing
+from backend.config import settings
+from backend.services import agent_pipeline, kb_query_enhanced
+from backend.services.intent_router import Intent
+
+
+@pytest.fixture
+def db_settings():
+    return {
+        "api_key": "",
+        "rate_limit_per_minute": 0,
+        "metrics_enabled": True,
+        "metrics_dir": None,
+    }
+
+
+@pytest.fixture
+def temp_db(temp_db):
+    metrics.registry.reset()
+    yield
+
+
+def _value(text: str, sample: str) -> float:
+    match = re.search(rf"^{re.escape(sample)} (\S+)$", text, re.M)
+    assert match, f"{sample} not in output"
+    return float(match.group(1))
+
+
+def test_histogram_text_format_and_multiworker_merge(temp_db, monkeypatch, tmp_path) -> None:
+    reg = metrics.Registry()
+    hist = reg.histogram("t_seconds", "Test latency.", ("stage",), buckets=(0.1, 1.0))
+    lag = reg.gauge("t_lag", "Lag.", mode="max")
+    inflight = reg.gauge("t_inflight", "In flight.")
+    for v in (0.05, 0.5, 5.0):
+        hist.observe(v, 'a"b')
+    lag.set(0.2)
+    inflight.set(3)
+
+    other = metrics.Registry()
+    other.histogram("t_seconds", "Test latency.", ("stage",), buckets=(0.1, 1.0)).observe(0.05, 'a"b')
+    other.gauge("t_lag", "Lag.", mode="max").set(0.7)
+    other.gauge("t_inflight", "In flight.").set(2)
+    text = reg.render([reg.dump(), other.dump()])
+
+    assert "# TYPE t_seconds histogram" in text
+    assert _value(text, 't_seconds_bucket{stage="a\\"b",le="0.1"}') == 2
+    assert _value(text, 't_seconds_bucket{stage="a\\"b",le="1"}') == 3
+    assert _value(text, 't_seconds_bucket{stage="a\\"b",le="+Inf"}') == 4
+    assert _value(text, 't_seconds_count{stage="a\\"b"}') == 4
+    assert _value(text, "t_lag") == 0.7 and _value(text, "t_inflight") == 5
+
+    # 多 worker：其它进程的文件被合并；已退出进程只保留计数器 / 直方图
+    monkeypatch.setattr(settings, "metrics_dir", tmp_path / "metrics")
+    metrics.SSE_IN_FLIGHT.set(1)
+    metrics.DB_WAIT_SECONDS.observe(0.001)
+    assert metrics.flush() is not None
+    own = json.loads(next((tmp_path / "metrics").glob("metrics-*.json")).read_text())
+    for pid, name in ((os.getpid(), "live"), (999999999, "dead")):
+        payload = dict(own, pid=pid)
+        (tmp_path / "metrics" / f"metrics-{socket.gethostname()}-{name}.json").write_text(json.dumps(payload))
+    text = metrics.render()
+    assert _value(text, "rs_agent_db_pool_wait_seconds_count") == 3  # 本进程 + live + dead
+    assert _value(text, "rs_agent_sse_streams_in_flight") == 2  # 本进程 + live
+
+
+@pytest.fixture
+def fake_kb(monkeypatch):
+    async def detect(text, max_queries=None):
+        return Intent.KB_QUERY, "rule", None
+
+    async def query_kb(query, image_paths=None):
+        await asyncio.sleep(0.005)
+        return f"## {query}\n内容", []
+
+    monkeypatch.setattr(agent_pipeline, "detect_intent_with_expansion", detect)
+    monkeypatch.setattr(kb_query_enhanced, "query_kb", query_kb)
+    monkeypatch.setattr(settings, "kb_query_llm_enabled", False, raising=False)
+
+
+def test_metrics_endpoint_reports_pipeline_db_llm_and_sse(temp_db, fake_kb) -> None:
+    from backend.app import app
+
+    # LLM / KB 子进程 span 由 span 结束回调计入
+    with tracing.span("llm._chat", stage="collect", model="qwen-plus") as sp:
+        sp.set(prompt_tokens=120, completion_tokens=30)
+    with tracing.span("kb.subprocess", returncode=1):
+        pass
+
+    with TestClient(app) as client:
+        stream = client.post("/api/agent/stream", json={"text": "清算流程是什么"})
+        assert stream.status_code == 200 and "event: final" in stream.text
+        text = client.get("/metrics").text
+
+    assert _value(text, 'rs_agent_phase_duration_seconds_count{phase="INTENT"}') == 1
+    assert _value(text, 'rs_agent_phase_duration_seconds_count{phase="KB"}') == 1
+    assert _value(text, 'rs_agent_pipeline_duration_seconds_count{status="ok"}') == 1
+    assert _value(text, 'rs_agent_llm_tokens_total{stage="collect",model="qwen-plus",kind="prompt"}') == 120
+    assert _value(text, 'rs_agent_llm_request_duration_seconds_count{stage="collect",model="qwen-plus",status="ok"}') == 1
+    assert _value(text, 'rs_agent_kb_subprocess_duration_seconds_count{status="error"}') == 1
+    assert _value(text, 'rs_agent_db_call_duration_seconds_count{fn="recover"}') == 1  # lifespan 启动恢复
+    assert _value(text, "rs_agent_db_pool_wait_seconds_count") >= 1
+    assert _value(text, "rs_agent_sse_streams_in_flight") == 0
+    assert 'rs_agent_cache_hit_ratio{cache="session"}' in text
@@ -0,0 +1,108 @@
+"""单元测试：按需请求剖析（授权、cProfile / 采样两种模式、任务耗时与 tracemalloc、pstats / speedscope 下载）。"""
+
+from __future__ import annotations
+
+import asyncio
+import io
+import marshal
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import db, profiling
+from backend.config import settings
+from backend.services import agent_pipeline, kb_query_enhanced
+from backend.services.intent_router import Intent
+
+ADMIN = {"X-Profile-Key": "admin-secret"}
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "db_path", str(tmp_path / "rs_agent.db"))
+    monkeypatch.setattr(settings, "api_key", "", raising=False)
+    monkeypatch.setattr(settings, "rate_limit_per_minute", 0, raising=False)
+    monkeypatch.setattr(settings, "kb_query_llm_enabled", False, raising=False)
+    monkeypatch.setattr(settings, "profile_key", "admin-secret", raising=False)
+    monkeypatch.setattr(settings, "profile_dir", tmp_path / "profiles", raising=False)
+    monkeypatch.setattr(settings, "profile_keep", 20, raising=False)
+    monkeypatch.setattr(settings, "profile_sample_interval_ms", 1, raising=False)
+    monkeypatch.setattr(settings, "profile_tracemalloc_top", 5, raising=False)
+    monkeypatch.setattr(settings, "profile_tracemalloc_frames", 1, raising=False)
+
+    async def detect(text, max_queries=None):
+        return Intent.KB_QUERY, "rule", None
+
+    async def query_kb(query, image_paths=None):
+        time.sleep(0.03)  # 模拟阻塞事件循环的同步代码
+        await asyncio.sleep(0.01)
+        return f"## {query}\n" + "内容" * 2000, []
+
+    monkeypatch.setattr(agent_pipeline, "detect_intent_with_expansion", detect)
+    monkeypatch.setattr(kb_query_enhanced, "query_kb", query_kb)
+    db.shutdown_db()
+    db.init_db()
+    from backend.app import app
+
+    with TestClient(app) as c:
+        yield c
+    db.shutdown_db()
+
+
+def test_profile_requires_admin_key_and_valid_mode(client, monkeypatch) -> None:
+    assert client.post("/api/agent", json={"text": "清算流程"}, headers={"X-Profile": "cprofile"}).status_code == 403
+    assert client.post("/api/agent?profile=cprofile", json={"text": "清算流程"}).status_code == 403
+    assert client.post("/api/agent", json={"text": "清算流程"}, headers={"X-Profile": "perf", **ADMIN}).status_code == 400
+    assert client.get("/api/profiles").status_code == 403
+
+    plain = client.post("/api/agent", json={"text": "清算流程"})
+    assert plain.status_code == 200 and "X-Profile-Id" not in plain.headers
+
+    monkeypatch.setattr(settings, "profile_key", "")  # 未配置密钥时不允许剖析
+    assert client.post("/api/agent", json={"text": "清算流程"}, headers={"X-Profile": "cprofile", "X-Profile-Key": ""}).status_code == 403
+
+
+def test_cprofile_run_records_tasks_allocations_and_downloads(client) -> None:
+    resp = client.post("/api/agent", json={"text": "清算流程是什么"}, headers={"X-Profile": "cprofile", **ADMIN})
+    assert resp.status_code == 200
+    profile_id = resp.headers["X-Profile-Id"]
+
+    summary = client.get(f"/api/profiles/{profile_id}", headers=ADMIN).json()
+    assert summary["mode"] == "cprofile" and summary["status"] == "ok"
+    run = next(t for t in summary["tasks"] if t["name"] == "AgentPipeline.run")
+    assert run["max_step_ms"] >= 25  # 阻塞事件循环的那一步
+    assert summary["loop"]["busy_ms"] >= run["busy_ms"] and summary["loop"]["idle_ms"] >= 0
+    assert summary["tracemalloc"] and len(summary["tracemalloc"]) <= 5
+    assert summary["downloads"] == {"pstats": True, "speedscope": True}
+    assert [p["id"] for p in client.get("/api/profiles", headers=ADMIN).json()] == [profile_id]
+
+    raw = client.get(f"/api/profiles/{profile_id}/pstats", headers=ADMIN)
+    assert raw.status_code == 200
+    stats = marshal.load(io.BytesIO(raw.content))
+    assert any(fn == "query_kb" for (_, _, fn) in stats)
+
+    doc = client.get(f"/api/profiles/{profile_id}/speedscope", headers=ADMIN).json()
+    frames = doc["shared"]["frames"]
+    profile = doc["profiles"][0]
+    assert profile["type"] == "sampled" and len(profile["samples"]) == len(profile["weights"])
+    assert any(frames[i]["name"] == "query_kb" for s in profile["samples"] for i in s)
+
+    assert client.get("/api/profiles/../../etc/passwd", headers=ADMIN).status_code == 404
+    assert client.get(f"/api/profiles/{'0' * 32}/pstats", headers=ADMIN).status_code == 404
+
+
+def test_sampling_profile_on_stream(client) -> None:
+    resp = client.post("/api/agent/stream", json={"text": "清算流程是什么"}, headers={"X-Profile": "sample", **ADMIN})
+    assert resp.status_code == 200 and "event: final" in resp.text
+    profile_id = resp.headers["X-Profile-Id"]
+
+    summary = client.get(f"/api/profiles/{profile_id}", headers=ADMIN).json()
+    assert summary["mode"] == "sample" and summary["samples"] > 0
+    assert summary["downloads"]["pstats"] is False
+    assert client.get(f"/api/profiles/{profile_id}/pstats", headers=ADMIN).status_code == 404
+
+    doc = client.get(f"/api/profiles/{profile_id}/speedscope", headers=ADMIN).json()
+    names = {f["name"] for f in doc["shared"]["frames"]}
+    assert "query_kb" in names
+    assert not profiling.busy()
@@ -0,0 +1,191 @@
+"""单元测试：请求截止时间与取消范围（KB 子进程终止、LLM 重试 / 文生图停止、SSE 客户端断开、504）。"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import metrics, request_scope
+from backend.config import settings
+from backend.services import agent_pipeline, image_gen_service, kb_query_enhanced, llm_service
+from backend.services.intent_router import Intent
+from backend.services.trading_kb_service import query_kb
+
+
+@pytest.fixture
+def db_settings():
+    return {
+        "api_key": "",
+        "rate_limit_per_minute": 0,
+        "kb_query_llm_enabled": False,
+        "metrics_enabled": True,
+        "disconnect_poll_ms": 20,
+    }
+
+
+@pytest.fixture
+def temp_db(temp_db):
+    metrics.registry.reset()
+    yield
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def test_deadline_kills_kb_subprocess(monkeypatch, tmp_path) -> None:
+    pid_file = tmp_path / "pid"
+    script = tmp_path / "run_all_sources.py"
+    script.write_text(
+        f"import os, time\nopen({str(pid_file)!r}, 'w').write(str(os.getpid()))\ntime.sleep(30)\n", encoding="utf-8"
+    )
+    monkeypatch.setattr(settings, "run_all_sources_path", script)
+    scope = request_scope.RequestScope(0.5, label="test")
+
+    t0 = time.monotonic()
+    with pytest.raises(request_scope.DeadlineExceeded):
+        asyncio.run(scope.run(query_kb("清算流程")))
+    assert time.monotonic() - t0 < 5
+
+    (saved,) = scope.saved
+    pid = int(pid_file.read_text())
+    assert saved["kind"] == "kb_subprocess" and saved["pid"] == pid and saved["ran_ms"] > 0
+    for _ in range(100):
+        if not _pid_alive(pid):
+            break
+        time.sleep(0.02)
+    assert not _pid_alive(pid)
+    assert scope.summary()["reason"] == request_scope.DEADLINE
+
+
+def test_llm_retries_and_image_gen_honor_scope(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "llm_max_retries", 3, raising=False)
+    monkeypatch.setattr(settings, "llm_retry_min_wait", 1.0, raising=False)
+    monkeypatch.setattr(settings, "llm_api_key", "sk-test", raising=False)
+    monkeypatch.setattr(settings, "image_gen_enabled", True, raising=False)
+    calls = []
+
+    async def failing_post(self, url, **kwargs):
+        calls.append(self.timeout.read)
+        raise httpx.ConnectError("down")
+
+    async def slow_post(self, url, **kwargs):
+        calls.append(self.timeout.read)
+        await asyncio.sleep(30)
+
+    # 剩余时间不够等待下一次重试：只尝试一次，直接抛出上一次的错误
+    monkeypatch.setattr(httpx.AsyncClient, "post", failing_post)
+    scope = request_scope.RequestScope(0.5)
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(scope.run(llm_service._http_post("http://llm/chat", {}, {})))
+    assert len(calls) == 1 and calls[0] <= 0.5
+    assert scope.saved == [{"kind": "llm_retry", "retries_skipped": 2}] and scope.reason is None
+
+    # 请求被取消：中止进行中的 HTTP 调用，记下放弃的重试
+    calls.clear()
+    monkeypatch.setattr(httpx.AsyncClient, "post", slow_post)
+
+    async def disconnected_later():
+        return bool(calls)
+
+    scope = request_scope.RequestScope(None)
+    with pytest.raises(request_scope.RequestCancelled) as info:
+        asyncio.run(scope.run(llm_service._http_post("http://llm/chat", {}, {}), disconnected_later))
+    assert info.value.reason == request_scope.DISCONNECTED
+    (saved,) = scope.saved
+    assert saved["kind"] == "llm_request" and saved["retries_skipped"] == 2 and saved["wait_saved_s"] > 100
+
+    # 文生图：超时收紧到剩余时间，截止时停止等待
+    calls.clear()
+    scope = request_scope.RequestScope(0.3)
+    with pytest.raises(request_scope.DeadlineExceeded):
+        asyncio.run(scope.run(image_gen_service.generate_flowchart_image("流程：A -> B")))
+    assert calls[0] <= 0.3
+    (saved,) = scope.saved
+    assert saved["kind"] == "image_gen" and saved["wait_saved_s"] > 80
+    assert scope.summary()["work"] == {"image_gen": 1}
+
+
+def _slow_kb(monkeypatch) -> dict:
+    state = {"started": 0, "cancelled": 0}
+
+    async def detect(text, max_queries=None):
+        return Intent.KB_QUERY, "rule", None
+
+    async def query_kb(query, image_paths=None):
+        state["started"] += 1
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            state["cancelled"] += 1
+            raise
+        return "内容", []
+
+    monkeypatch.setattr(agent_pipeline, "detect_intent_with_expansion", detect)
+    monkeypatch.setattr(kb_query_enhanced, "query_kb", query_kb)
+    return state
+
+
+def test_sse_disconnect_cancels_pipeline(temp_db, monkeypatch) -> None:
+    from backend.app import app
+
+    state = _slow_kb(monkeypatch)
+    sent = []
+
+    async def scenario():
+        gone = asyncio.Event()
+        body = json.dumps({"text": "清算流程是什么"}).encode()
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await gone.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+            if message["type"] == "http.response.body" and b"event: trace" in message.get("body", b""):
+                gone.set()  # 收到第一个事件后关闭页面
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+            "method": "POST", "scheme": "http", "path": "/api/agent/stream", "raw_path": b"/api/agent/stream",
+            "query_string": b"", "root_path": "", "headers": [(b"content-type", b"application/json")],
+            "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+        }
+        t0 = time.monotonic()
+        await app(scope, receive, send)
+        await asyncio.sleep(0.05)
+        return time.monotonic() - t0
+
+    elapsed = asyncio.run(scenario())
+    assert elapsed < 2
+    assert state == {"started": 1, "cancelled": 1}
+    assert not any(b"event: final" in m.get("body", b"") for m in sent)
+    text = metrics.render()
+    assert 'rs_agent_requests_cancelled_total{reason="client_disconnected"} 1' in text
+
+
+def test_deadline_returns_504(temp_db, monkeypatch) -> None:
+    from backend.app import app
+
+    monkeypatch.setattr(settings, "request_deadline_seconds", 0.2, raising=False)
+    state = _slow_kb(monkeypatch)
+    with TestClient(app) as client:
+        resp = client.post("/api/agent", json={"text": "清算流程是什么"})
+        assert resp.status_code == 504 and "截止时间" in resp.json()["detail"]
+        stream = client.post("/api/agent/stream", json={"text": "清算流程是什么"})
+        assert 'event: error\ndata: {"message": "请求超过截止时间（0.2 秒）", "status_code": 504}' in stream.text
+    assert state == {"started": 2, "cancelled": 2}
+    assert 'rs_agent_requests_cancelled_total{reason="deadline"} 2' in metrics.render()
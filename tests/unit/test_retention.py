@@ -0,0 +1,136 @@
+"""单元测试：会话记录保留策略（按数量 / 时长 / 状态分批清理、归档、incremental_vacuum）。"""
+
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import sqlite3
+
+import pytest
+
+from backend import db
+from backend.config import settings
+from backend.services.retention import RetentionEngine, decode_archived
+
+
+@pytest.fixture
+def db_settings(tmp_path):
+    return {
+        "retention_max_conversations": 0,
+        "retention_max_age_days": 0,
+        "retention_statuses": ["done", "expired"],
+        "retention_batch_size": 3,
+        "retention_archive": "none",
+        "retention_archive_dir": tmp_path / "archive",
+        "retention_vacuum_pages": 0,
+    }
+
+
+def _seed(n: int, status: str = "done", prefix: str = "c", payload: str = "回答") -> None:
+    for i in range(n):
+        conv_id = f"{prefix}{i:02d}"
+        day = f"2026-01-{i + 1:02d} 10:00:00"
+        with db.get_conn() as conn:
+            conn.execute(
+                "INSERT INTO conversations (id, intent, status, created_at, updated_at) VALUES (?, 'KB_QUERY', ?, ?, ?)",
+                (conv_id, status, day, day),
+            )
+        db.add_message(conv_id, "user", "USER_REQUEST", f"问题 {conv_id}")
+        db.add_message(conv_id, "assistant", "KB_ANSWER", payload)
+
+
+def _ids() -> list:
+    with db.get_conn() as conn:
+        return [r["id"] for r in conn.execute("SELECT id FROM conversations ORDER BY created_at, id")]
+
+
+def test_inserts_no_longer_trim_history(temp_db) -> None:
+    for i in range(15):
+        db.create_conversation(f"x{i}", "KB_QUERY", "done")
+    db.write_batch([("conversation", ("y", "KB_QUERY", "done"))])
+    assert len(_ids()) == 16
+
+
+def test_count_policy_deletes_oldest_eligible_in_batches(temp_db, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "retention_max_conversations", 5, raising=False)
+    _seed(12)
+    _seed(2, status="active", prefix="a")  # 最早创建，但进行中不清理
+
+    result = asyncio.run(RetentionEngine().run_once())
+    assert result["conversations"] == 9 and result["messages"] == 18 and result["batches"] == 3
+    assert _ids() == ["a00", "a01", "c09", "c10", "c11"]
+    with db.get_conn() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 10
+
+
+def test_age_policy_and_status_filter(temp_db, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "retention_max_age_days", 30, raising=False)
+    _seed(4)
+    _seed(2, status="expired", prefix="e")
+    _seed(2, status="active", prefix="a")
+    db.create_conversation("fresh", "KB_QUERY", "done")
+
+    engine = RetentionEngine()
+    result = asyncio.run(engine.run_once())
+    assert result["conversations"] == 6
+    assert sorted(_ids()) == ["a00", "a01", "fresh"]
+    assert asyncio.run(engine.run_once())["conversations"] == 0
+    assert engine.stats()["conversations_deleted"] == 6 and engine.stats()["runs"] == 2
+
+
+def test_archive_to_table_and_file(temp_db, monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr(settings, "retention_max_conversations", 2, raising=False)
+    monkeypatch.setattr(settings, "retention_archive", "table", raising=False)
+    _seed(4)
+    assert asyncio.run(RetentionEngine().run_once())["archived"] == 2
+    archived = decode_archived(*db.get_archived_conversation("c00"))
+    assert [m["content"] for m in archived["messages"]] == ["问题 c00", "回答"]
+
+    monkeypatch.setattr(settings, "retention_archive", "file", raising=False)
+    monkeypatch.setattr(settings, "retention_max_conversations", 1, raising=False)
+    asyncio.run(RetentionEngine().run_once())
+    (path,) = list((tmp_path / "archive").glob("conversations-*.jsonl.gz"))
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        assert [json.loads(line)["id"] for line in fh] == ["c02"]
+    assert _ids() == ["c03"]
+
+
+def test_incremental_vacuum_reclaims_freed_pages(temp_db, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "retention_max_conversations", 1, raising=False)
+    monkeypatch.setattr(settings, "retention_batch_size", 50, raising=False)
+    _seed(20, payload="x" * 20_000)
+    with db.get_conn() as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+
+    result = asyncio.run(RetentionEngine().run_once())
+    assert result["conversations"] == 19 and result["pages_freed"] > 0
+    with db.get_conn() as conn:
+        assert conn.execute("PRAGMA page_count").fetchone()[0] < pages_before
+        assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+
+def test_legacy_db_is_not_vacuumed_at_startup(monkeypatch, tmp_path, caplog) -> None:
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(str(path))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE legacy (x TEXT)")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(settings, "db_path", str(path))
+    db.shutdown_db()
+    try:
+        with caplog.at_level("WARNING", logger="backend.db"):
+            db.init_db()
+        # 启动时只提示，不整库 VACUUM；转换由 scripts/convert_incremental_vacuum.py 显式执行
+        with db.get_conn() as c:
+            assert c.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+        assert "convert_incremental_vacuum" in caplog.text
+        assert db.incremental_vacuum()["auto_vacuum"] == 0
+
+        result = db.convert_incremental_vacuum()
+        assert result["converted"] and result["auto_vacuum"] == 2
+        assert db.convert_incremental_vacuum()["converted"] is False
+    finally:
+        db.shutdown_db()
@@ -0,0 +1,161 @@
+"""单元测试：会话 LRU 缓存（版本校验、淘汰）、请求级 identity map 与 user_version 迁移。"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+
+import pytest
+
+from backend import db
+from backend.config import settings
+from backend.services import orchestrator_controller as orch
+from backend.services.session_cache import session_cache
+
+
+@pytest.fixture
+def db_settings():
+    return {"session_cache_size": 2}
+
+
+@pytest.fixture
+def temp_db(temp_db):
+    session_cache.clear()
+    yield
+    session_cache.clear()
+
+
+@pytest.fixture
+def load_counter(monkeypatch):
+    calls = []
+    real_load = orch._db_load
+
+    async def counting_load(session_id):
+        calls.append(session_id)
+        return await real_load(session_id)
+
+    monkeypatch.setattr(orch, "_db_load", counting_load)
+    return calls
+
+
+def test_identity_map_loads_each_session_once_per_request(temp_db, load_counter) -> None:
+    async def scenario():
+        sess = await orch.create_session("首页新增定投入口")
+        session_cache.clear()
+        with orch.session_scope():
+            first = await orch.get_session(sess.session_id)
+            first.user_answers.append("仅前端")
+            again = await orch.get_session(sess.session_id)
+        return first, again
+
+    first, again = asyncio.run(scenario())
+    assert first is again
+    assert len(load_counter) == 1
+
+
+def test_cache_serves_snapshot_until_another_writer_bumps_version(temp_db, load_counter) -> None:
+    async def scenario():
+        sess = await orch.create_session("赎回页面增加提示")
+        with orch.session_scope():
+            cached = await orch.get_session(sess.session_id)
+            cached.user_answers.append("未保存的修改")  # 未 persist，不应进入缓存
+        with orch.session_scope():
+            clean = await orch.get_session(sess.session_id)
+        # 模拟另一个 worker 直接写库
+        data = sess.to_dict()
+        data["state"] = "WAITING_ANSWERS"
+        await db.save_session_async(sess.session_id, "WAITING_ANSWERS", json.dumps(data))
+        with orch.session_scope():
+            reloaded = await orch.get_session(sess.session_id)
+        return clean, reloaded
+
+    clean, reloaded = asyncio.run(scenario())
+    assert clean.user_answers == [] and clean.state == "COLLECT"
+    assert reloaded.state == "WAITING_ANSWERS"
+    assert len(load_counter) == 1  # 前两次请求都命中缓存，版本变化后才重新加载
+    stats = session_cache.stats()
+    assert stats["hits"] == 2 and stats["stale"] == 1
+
+
+def test_lru_evicts_least_recently_used(temp_db) -> None:
+    async def scenario():
+        return [await orch.create_session(f"需求{i}") for i in range(3)]
+
+    sessions = asyncio.run(scenario())
+    assert session_cache.get(sessions[0].session_id) is None
+    assert session_cache.get(sessions[2].session_id)[0] == 1
+    assert session_cache.stats()["evictions"] == 1
+
+
+def test_init_db_migrates_legacy_sessions_table(monkeypatch, tmp_path) -> None:
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE sessions (id TEXT PRIMARY KEY, state TEXT NOT NULL, session_data TEXT NOT NULL, "
+                 "created_at TIMESTAMP, updated_at TIMESTAMP)")
+    conn.execute("INSERT INTO sessions (id, state, session_data) VALUES ('s1', 'COLLECT', '{}')")
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(settings, "db_path", str(path))
+    db.shutdown_db()
+    try:
+        db.init_db()
+        db.init_db()  # 幂等
+        assert db.get_session_version("s1") == 0
+        assert db.save_session("s1", "DONE", "{}") == 1
+        with db.get_conn() as c:
+            assert c.execute("PRAGMA user_version").fetchone()[0] == db._MIGRATIONS[-1][0]
+    finally:
+        db.shutdown_db()
+
+
+def test_failed_migration_step_rolls_back_whole_step(temp_db, monkeypatch) -> None:
+    latest = db._MIGRATIONS[-1][0]
+    step = (latest + 1, ("ALTER TABLE sessions ADD COLUMN extra TEXT", "SELECT no_such_column FROM sessions"))
+    monkeypatch.setattr(db, "_MIGRATIONS", [*db._MIGRATIONS, step])
+    with pytest.raises(sqlite3.OperationalError, match="no_such_column"):
+        db.init_db()
+    with db.get_conn() as c:
+        assert c.execute("PRAGMA user_version").fetchone()[0] == latest
+        assert "extra" not in {row[1] for row in c.execute("PRAGMA table_info(sessions)")}
+
+    # 修正后重新执行同一步，不会因已加的列报 duplicate column name
+    monkeypatch.setattr(db, "_MIGRATIONS", [*db._MIGRATIONS[:-1], (latest + 1, step[1][:1])])
+    db.init_db()
+    with db.get_conn() as c:
+        assert c.execute("PRAGMA user_version").fetchone()[0] == latest + 1
+
+
+def test_concurrent_workers_migrate_once(monkeypatch, tmp_path) -> None:
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE sessions (id TEXT PRIMARY KEY, state TEXT NOT NULL, session_data TEXT NOT NULL, "
+                 "created_at TIMESTAMP, updated_at TIMESTAMP)")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(db, "_MIGRATIONS", [(1, ("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0",))])
+
+    barrier = threading.Barrier(4)
+    errors = []
+
+    def worker() -> None:
+        c = sqlite3.connect(path, timeout=10)
+        try:
+            barrier.wait()
+            db._migrate(c)
+        except Exception as exc:  # noqa: BLE001
+            errors.append(exc)
+        finally:
+            c.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    c = sqlite3.connect(path)
+    assert c.execute("PRAGMA user_version").fetchone()[0] == 1
+    c.close()
@@ -0,0 +1,165 @@
+"""单元测试：会话并发控制（进程内按会话加锁、跨进程版本号 CAS、409 映射）与并发压力。"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import time
+
+import pytest
+
+from backend import db
+from backend.config import settings
+from backend.services import orchestrator_controller as orch
+from backend.services.agent_pipeline import AgentPipeline, PipelineError
+from backend.services.session_cache import session_cache
+from backend.services.session_locks import SessionBusyError, SessionLocks, session_locks
+
+
+@pytest.fixture
+def db_settings():
+    return {"session_cas": True}
+
+
+@pytest.fixture
+def temp_db(temp_db):
+    session_cache.clear()
+    yield
+    session_cache.clear()
+
+
+async def _turn(locks: SessionLocks, session_id: str, answer: str, work: float) -> None:
+    """模拟 pipeline 的一轮：加锁 → 加载 → 修改（期间有 LLM 等耗时）→ 保存。"""
+    with orch.session_scope():
+        async with locks.hold(session_id):
+            sess = await orch.get_session(session_id)
+            await asyncio.sleep(work)
+            sess.user_answers.append(answer)
+            await orch.persist_session(sess)
+
+
+def test_concurrent_turns_lose_no_updates_and_scale_across_sessions(temp_db) -> None:
+    work = 0.01
+
+    async def scenario():
+        locks = SessionLocks()
+        sessions = [await orch.create_session(f"需求 {i}") for i in range(16)]
+
+        # 同一会话 16 个并发请求：串行执行，不丢更新
+        hot = sessions[0].session_id
+        t0 = time.perf_counter()
+        await asyncio.gather(*(_turn(locks, hot, f"a{i}", work) for i in range(16)))
+        same_session = time.perf_counter() - t0
+
+        # 16 个独立会话各 1 个请求：并行执行
+        t0 = time.perf_counter()
+        await asyncio.gather(*(_turn(locks, s.session_id, "b", work) for s in sessions[1:]))
+        independent = time.perf_counter() - t0
+
+        session_cache.clear()
+        loaded = [await orch.get_session(s.session_id) for s in sessions]
+        return locks.stats(), same_session, independent, loaded
+
+    stats, same_session, independent, loaded = asyncio.run(scenario())
+    assert sorted(loaded[0].user_answers) == sorted(f"a{i}" for i in range(16))
+    assert all(s.user_answers == ["b"] for s in loaded[1:])
+    assert same_session >= 16 * work
+    assert independent < same_session / 3
+    assert stats["waited"] == 15 and stats["active"] == 0
+
+
+def test_cas_rejects_write_from_stale_copy(temp_db) -> None:
+    """另一个 worker 基于旧版本保存时冲突，不覆盖已保存的修改。"""
+
+    async def scenario():
+        sess = await orch.create_session("需求")
+        other = copy.deepcopy(sess)  # 另一个 worker 读到的同一版本
+        sess.user_answers.append("先到的回答")
+        await orch.persist_session(sess)
+        other.user_answers.append("后到的回答")
+        with pytest.raises(db.SessionConflictError) as info:
+            await orch.persist_session(other)
+        session_cache.clear()
+        return info.value, await orch.get_session(sess.session_id)
+
+    err, loaded = asyncio.run(scenario())
+    assert (err.expected, err.actual) == (1, 2)
+    assert loaded.user_answers == ["先到的回答"]
+
+
+def test_busy_session_and_conflict_map_to_409(temp_db, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "session_lock_timeout_seconds", 0.05, raising=False)
+
+    async def answer_after_other_worker(self, sess, text):
+        db.save_session(sess.session_id, sess.state, "{}")  # 另一个 worker 抢先保存
+        sess.user_answers.append(text)
+        await orch.persist_session(sess)
+        yield self._emit("COLLECT", "unreachable")
+
+    monkeypatch.setattr(AgentPipeline, "_handle_answer", answer_after_other_worker)
+
+    async def scenario():
+        sess = await orch.create_session("需求")
+        async with session_locks.hold(sess.session_id):
+            with pytest.raises(PipelineError) as busy:
+                await AgentPipeline().run("补充", sess.session_id)
+        with pytest.raises(PipelineError) as conflict:
+            await AgentPipeline().run("补充", sess.session_id)
+        return busy.value, conflict.value
+
+    busy, conflict = asyncio.run(scenario())
+    assert busy.status_code == 409 and "正在处理" in str(busy)
+    assert conflict.status_code == 409 and "其它请求" in str(conflict)
+    assert session_locks.stats()["active"] == 0
+
+
+def test_lock_wait_timeout_raises_busy() -> None:
+    async def scenario():
+        locks = SessionLocks()
+        async with locks.hold("s"):
+            with pytest.raises(SessionBusyError):
+                async with locks.hold("s", timeout=0.01):
+                    pass
+            async with locks.hold("other", timeout=0.01):  # 其它会话不受影响
+                pass
+        return locks.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["timeouts"] == 1 and stats["active"] == 0
+
+
+def test_lock_not_leaked_when_release_races_timeout_or_cancel() -> None:
+    # 上一轮释放与本轮等待超时/被取消落在同一轮事件循环时，锁要么交给本轮，要么归还，不能悬空
+    async def scenario():
+        locks = SessionLocks()
+        loop = asyncio.get_running_loop()
+        outcomes = set()
+        for _ in range(20):
+            async with locks.hold("s"):
+                holder = locks._entries["s"].lock
+                loop.call_later(0.01, holder.release)
+                try:
+                    async with locks.hold("s", timeout=0.01):
+                        outcomes.add("acquired")
+                except SessionBusyError:
+                    outcomes.add("busy")
+                # 锁若悬空这里会超时；取回后由外层 hold 退出时释放
+                await asyncio.wait_for(holder.acquire(), 1)
+            async with locks.hold("s", timeout=0.01):
+                pass
+
+        async with locks.hold("s"):
+            waiter = asyncio.ensure_future(locks.hold("s").__aenter__())
+            await asyncio.sleep(0)
+            locks._entries["s"].lock.release()
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            assert not locks._entries["s"].lock.locked()
+            await locks._entries["s"].lock.acquire()
+        async with locks.hold("s", timeout=0.01):
+            pass
+        return outcomes, locks.stats()
+
+    outcomes, stats = asyncio.run(scenario())
+    assert outcomes and stats["active"] == 0
@@ -0,0 +1,174 @@
+"""单元测试：会话增量日志（JSON patch 往返、只追加增量、快照压缩、并发回退、草稿历史）。"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import json
+import random
+
+import pytest
+
+from backend import db
+from backend.config import settings
+from backend.services import orchestrator_controller as orch
+from backend.services import session_journal
+from backend.services.session_cache import session_cache
+
+
+@pytest.fixture
+def db_settings():
+    return {
+        "session_journal": True,
+        "session_journal_compact_every": 16,
+    }
+
+
+@pytest.fixture
+def temp_db(temp_db):
+    session_cache.clear()
+    yield
+    session_cache.clear()
+
+
+def _row(session_id: str) -> dict:
+    with db.get_conn() as conn:
+        return dict(
+            conn.execute(
+                "SELECT session_data, version, snapshot_version FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        )
+
+
+async def _reload(session_id: str) -> orch.OrchestratorSession:
+    session_cache.clear()
+    return await orch.get_session(session_id)
+
+
+def _mutate(rng: random.Random, value, depth: int = 0):
+    if isinstance(value, dict) and depth < 3:
+        out = dict(value)
+        for key in list(out):
+            roll = rng.random()
+            if roll < 0.15:
+                del out[key]
+            elif roll < 0.5:
+                out[key] = _mutate(rng, out[key], depth + 1)
+        if rng.random() < 0.3:
+            out[rng.choice(["new", "a/b", "t~x", "1"])] = rng.choice([1, True, "s", [1], {"k": None}])
+        return out
+    if isinstance(value, list):
+        roll = rng.random()
+        if roll < 0.4:
+            return value + [rng.randint(0, 3) for _ in range(rng.randint(1, 3))]
+        if roll < 0.6 and value:
+            return value[1:]
+        return value
+    return rng.choice([value, 0, 1, True, False, None, "x", 1.5])
+
+
+def test_diff_apply_roundtrip() -> None:
+    rng = random.Random(7)
+    doc = {"state": "COLLECT", "answers": ["a"], "draft": {"p": "x", "n": {"k": 1, "l": [1, 2]}}, "flag": 1}
+    for _ in range(300):
+        new = _mutate(rng, doc)
+        patch = session_journal.diff(doc, new)
+        assert session_journal.apply(json.loads(json.dumps(doc)), json.loads(json.dumps(patch))) == new
+        doc = new
+    assert session_journal.diff({"a": 1}, {"a": True}) == [{"op": "replace", "path": "/a", "value": True}]
+    assert session_journal.diff({"l": [1]}, {"l": [1, 2]}) == [{"op": "add", "path": "/l/-", "value": 2}]
+
+
+def test_small_mutations_append_patches_without_rewriting_snapshot(temp_db) -> None:
+    async def scenario():
+        sess = await orch.create_session("做一个分类流程")
+        sess.state = "WAITING_ANSWERS"
+        await orch.persist_session(sess)
+        sess.user_answers.append("用户补充：需要支持多光谱")
+        await orch.persist_session(sess)
+        return sess, await _reload(sess.session_id)
+
+    sess, loaded = asyncio.run(scenario())
+    row = _row(sess.session_id)
+    assert row["version"] == 3 and row["snapshot_version"] == 1
+    assert json.loads(row["session_data"])["state"] == "COLLECT"
+    assert loaded.to_dict() == sess.to_dict()
+    patches = [e["patch"] for e in db.list_session_journal(sess.session_id)[1:]]
+    assert json.loads(patches[1]) == [{"op": "add", "path": "/user_answers/-", "value": "用户补充：需要支持多光谱"}]
+
+
+def test_compaction_writes_snapshot_and_bounds_replay(temp_db, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "session_journal_compact_every", 3, raising=False)
+
+    async def scenario():
+        sess = await orch.create_session("需求")
+        snapshots = []
+        for i in range(7):
+            sess.user_answers.append(f"a{i}")
+            await orch.persist_session(sess)
+            snapshots.append(_row(sess.session_id)["snapshot_version"])
+        return sess, snapshots, await _reload(sess.session_id)
+
+    sess, snapshots, loaded = asyncio.run(scenario())
+    assert snapshots == [1, 1, 4, 4, 4, 7, 7]
+    assert len(db.load_session(sess.session_id)["patches"]) == 1
+    assert loaded.user_answers == [f"a{i}" for i in range(7)]
+    assert len(db.list_session_journal(sess.session_id)) == 8  # 历史保留
+
+
+def test_concurrent_writer_falls_back_to_full_save_without_cas(temp_db, monkeypatch) -> None:
+    """RS_AGENT_SESSION_CAS=false 时沿用后写者整体覆盖（开启时的冲突见 test_session_concurrency.py）。"""
+    monkeypatch.setattr(settings, "session_cas", False, raising=False)
+
+    async def scenario():
+        sess = await orch.create_session("需求")
+        other = copy.deepcopy(sess)
+        sess.state = "WAITING_ANSWERS"
+        await orch.persist_session(sess)
+        conflicts = session_journal.stats()["conflicts"]
+        other.user_answers.append("另一个 worker 的回答")
+        await orch.persist_session(other)
+        return other, conflicts, await _reload(sess.session_id)
+
+    other, conflicts, loaded = asyncio.run(scenario())
+    assert session_journal.stats()["conflicts"] == conflicts + 1
+    assert loaded.to_dict() == other.to_dict()
+    assert _row(other.session_id)["snapshot_version"] == 3
+    assert json.loads(db.list_session_journal(other.session_id)[-1]["patch"])[0]["path"] == ""
+
+
+def test_draft_history_replays_every_draft_version(temp_db) -> None:
+    async def scenario():
+        sess = await orch.create_session("需求")
+        sess.draft_struct = {"product_statement": "v1", "sections": ["背景"]}
+        sess.state = "DRAFT_READY"
+        await orch.persist_session(sess)
+        sess.state = "CONFIRMING"
+        await orch.persist_session(sess)
+        sess.draft_struct["product_statement"] = "v2"
+        await orch.persist_session(sess)
+        return sess.session_id
+
+    history = session_journal.draft_history(asyncio.run(scenario()))
+    assert [h["draft_struct"]["product_statement"] for h in history] == ["v1", "v2"]
+    assert [h["version"] for h in history] == [2, 4]
+
+
+def test_session_saved_before_journal_starts_history_on_next_save(temp_db) -> None:
+    record = orch.OrchestratorSession(session_id="old", user_request="需求", state="COLLECT").to_dict()
+    db.save_session("old", "COLLECT", json.dumps(record, ensure_ascii=False), journal=False)
+    with db.get_conn() as conn:
+        conn.execute("UPDATE sessions SET snapshot_version = 0 WHERE id = 'old'")  # 迁移前写入的会话
+
+    async def scenario():
+        sess = await _reload("old")
+        sess.draft_struct = {"product_statement": "v1"}
+        await orch.persist_session(sess)
+        sess.state = "DONE"
+        await orch.persist_session(sess)
+        return await _reload("old")
+
+    loaded = asyncio.run(scenario())
+    assert loaded.state == "DONE" and loaded.draft_struct == {"product_statement": "v1"}
+    assert _row("old")["snapshot_version"] == 2
+    assert [h["version"] for h in session_journal.draft_history("old")] == [2]
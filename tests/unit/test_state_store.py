@@ -0,0 +1,233 @@
+"""单元测试：共享状态后端（memory / sqlite / RESP）、上传登记跨 worker 可见、限流计数与会话缓存共享层。"""
+
+from __future__ import annotations
+
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import db
+from backend.config import settings
+from backend.services import state_store
+from backend.services import orchestrator_controller as orch
+from backend.services.session_cache import session_cache
+from tests.unit.resp_stub import RespStubServer
+
+
+@pytest.fixture
+def resp_server():
+    with RespStubServer() as server:
+        yield server
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, monkeypatch, tmp_path):
+    kind = request.param
+    monkeypatch.setattr(settings, "state_backend", kind, raising=False)
+    monkeypatch.setattr(settings, "state_sqlite_path", tmp_path / "state.db", raising=False)
+    server = None
+    if kind == "redis":
+        server = RespStubServer().start()
+        monkeypatch.setattr(settings, "state_redis_url", server.url, raising=False)
+    state_store.close_state_backend()
+    yield state_store.get_state_backend()
+    state_store.close_state_backend()
+    if server is not None:
+        server.stop()
+
+
+def test_kv_ttl_namespaces_and_counters(backend) -> None:
+    backend.set("a", "k1", "v1")
+    backend.set("a", "k2", "v2", ttl=0.05)
+    backend.set("b", "k1", "other")
+    assert backend.get("a", "k1") == "v1" and backend.get("b", "k1") == "other"
+    assert sorted(backend.keys("a")) == ["k1", "k2"]
+    time.sleep(0.1)
+    assert backend.get("a", "k2") is None and backend.keys("a") == ["k1"]
+
+    assert [backend.incr("c", "n", 1, ttl=0.05) for _ in range(3)] == [1, 2, 3]
+    time.sleep(0.1)
+    assert backend.incr("c", "n", 5, ttl=10) == 5  # 过期后重新计数
+
+    backend.delete("a", "k1")
+    backend.clear("b")
+    assert backend.get("a", "k1") is None and backend.keys("b") == []
+
+
+def test_incr_is_atomic_across_threads(backend) -> None:
+    def worker():
+        for _ in range(50):
+            backend.incr("c", "shared", 1, ttl=60)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert backend.incr("c", "shared", 0) == 400
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "redis"])
+def test_uploads_visible_to_other_workers(kind, monkeypatch, tmp_path, resp_server) -> None:
+    """另一个 worker（独立的后端实例 / 连接）能解析本 worker 登记的 imageId。"""
+    from backend.routers import agent as agent_router
+
+    monkeypatch.setattr(settings, "state_backend", kind, raising=False)
+    monkeypatch.setattr(settings, "state_sqlite_path", tmp_path / "state.db", raising=False)
+    monkeypatch.setattr(settings, "state_redis_url", resp_server.url, raising=False)
+    state_store.close_state_backend()
+    try:
+        agent_router._UPLOAD_STORE["img-1"] = ("/data/uploads/img-1.png", time.time())
+        other = (
+            state_store.SQLiteBackend(str(tmp_path / "state.db"))
+            if kind == "sqlite"
+            else state_store.RespBackend(resp_server.url, settings.state_key_prefix)
+        )
+        assert other.keys("uploads") == ["img-1"]
+        state_store.close_state_backend()  # 模拟本 worker 重启
+        assert agent_router._resolve_image_paths(["img-1", "missing"]) == ["/data/uploads/img-1.png"]
+        other.close()
+    finally:
+        agent_router._UPLOAD_STORE.clear()
+        state_store.close_state_backend()
+
+
+def test_resp_client_auth_and_reconnect() -> None:
+    with RespStubServer(password="s3cret") as server:
+        backend = state_store.RespBackend(server.url, "t:")
+        backend.set("ns", "k", "v")
+        backend.client._local.conn[0].close()  # 连接被对端断开后自动重连
+        assert backend.get("ns", "k") == "v"
+        with pytest.raises(state_store.RespError):
+            state_store.RespBackend(server.url.replace("s3cret", "wrong"), "t:").get("ns", "k")
+        backend.close()
+
+
+def test_resp_incr_sets_ttl_atomically(resp_server) -> None:
+    backend = state_store.RespBackend(resp_server.url, "t:")
+    backend.set("c", "legacy", "3")  # 早先版本留下的无过期计数键
+    assert backend.incr("c", "legacy", 1, ttl=60) == 4
+    assert backend.incr("c", "fresh", 2, ttl=60) == 2
+    assert all(resp_server.store.data[f"t:c:{k}"][1] is not None for k in ("legacy", "fresh"))
+    backend.close()
+
+
+class _RawServer:
+    """每个连接只回复第一条命令（+OK）；close_after_reply 时随后关闭连接，否则之后的命令收下但不回复。"""
+
+    def __init__(self, close_after_reply: bool) -> None:
+        self.close_after_reply = close_after_reply
+        self.received: list = []
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(8)
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.listener.getsockname()[1]}/0"
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket) -> None:
+        replied = False
+        while True:
+            data = conn.recv(1024)
+            if not data:
+                return
+            self.received.append(data)
+            if not replied:
+                conn.sendall(b"+OK\r\n")
+                replied = True
+                if self.close_after_reply:
+                    conn.close()
+                    return
+
+
+def test_resp_client_retries_only_unsent_commands() -> None:
+    # 服务端关闭了空闲连接：发送前发现连接已失效，换新连接发送
+    server = _RawServer(close_after_reply=True)
+    client = state_store.RespClient(server.url, timeout=0.5)
+    assert client.execute("PING") == "OK"
+    time.sleep(0.05)
+    assert client.execute("INCRBY", "k", 1) == "OK"
+    assert [b"INCRBY" in d for d in server.received] == [False, True]
+    client.close()
+    server.listener.close()
+
+    # 命令已发出、读回复超时：不重发（INCRBY 等非幂等命令不能执行两次）
+    server = _RawServer(close_after_reply=False)
+    client = state_store.RespClient(server.url, timeout=0.2)
+    assert client.execute("PING") == "OK"
+    with pytest.raises(socket.timeout):
+        client.execute("INCRBY", "k", 1)
+    time.sleep(0.05)
+    assert sum(b"INCRBY" in d for d in server.received) == 1
+    client.close()
+    server.listener.close()
+
+
+def test_rate_limit_returns_429_after_limit(monkeypatch) -> None:
+    from backend.app import app
+
+    monkeypatch.setattr(settings, "state_backend", "memory", raising=False)
+    monkeypatch.setattr(settings, "rate_limit_per_minute", 2, raising=False)
+    monkeypatch.setattr(settings, "api_key", "", raising=False)
+    state_store.close_state_backend()
+    client = TestClient(app)
+    # text 为空返回 400，但仍计入次数（不会进入 pipeline）
+    codes = [client.post("/api/agent", json={"text": ""}).status_code for _ in range(3)]
+    assert codes == [400, 400, 429]
+    resp = client.post("/api/agent/stream", json={"text": ""})
+    assert resp.status_code == 429 and int(resp.headers["Retry-After"]) >= 1
+    monkeypatch.setattr(settings, "rate_limit_per_minute", 0, raising=False)
+    assert client.post("/api/agent", json={"text": ""}).status_code == 400
+    state_store.close_state_backend()
+
+
+def test_session_cache_shared_layer(monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr(settings, "db_path", str(tmp_path / "rs_agent.db"))
+    monkeypatch.setattr(settings, "state_backend", "sqlite", raising=False)
+    monkeypatch.setattr(settings, "state_sqlite_path", tmp_path / "state.db", raising=False)
+    db.shutdown_db()
+    db.init_db()
+    state_store.close_state_backend()
+    session_cache.clear()
+    try:
+
+        async def run():
+            sess = await orch.create_session("做一个遥感影像分类流程")
+            sess.user_answers.append("需要多光谱")
+            await orch.persist_session(sess)
+            session_cache.clear()  # 模拟另一个 worker：本地 LRU 为空
+            loaded = await orch.get_session(sess.session_id)
+            assert loaded.user_answers == ["需要多光谱"]
+            assert session_cache.stats()["shared_hits"] == 1
+
+            # 共享层条目落后于 DB 时不使用
+            loaded.state = "DRAFT_READY"
+            await orch.persist_session(loaded)
+            stale = state_store.get_state_backend().get("sessions", sess.session_id)
+            loaded.state = "CONFIRMING"
+            await orch.persist_session(loaded)
+            state_store.get_state_backend().set("sessions", sess.session_id, stale)
+            session_cache.clear()
+            again = await orch.get_session(sess.session_id)
+            assert again.state == "CONFIRMING"
+            assert session_cache.stats()["shared_hits"] == 0
+
+        asyncio.run(run())
+    finally:
+        session_cache.clear()
+        state_store.close_state_backend()
+        db.shutdown_db()
@@ -0,0 +1,115 @@
+"""单元测试：span 追踪（嵌套与跨任务传播、异常状态、spans 表导出、Chrome trace）及 pipeline trace 事件派生。"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import db, tracing
+from backend.config import settings
+from backend.services import agent_pipeline, kb_query_enhanced
+from backend.services.agent_pipeline import AgentPipeline
+from backend.services.intent_router import Intent
+
+
+@pytest.fixture
+def db_settings():
+    return {
+        "trace_export": "table",
+        "api_key": "",
+    }
+
+
+def test_spans_nest_across_tasks_and_record_errors(temp_db) -> None:
+    async def child(i: int) -> None:
+        with tracing.span("child", index=i):
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        with tracing.trace("root", phase="TEST") as tr:
+            with tracing.span("gather") as outer:
+                await asyncio.gather(*(asyncio.create_task(child(i)) for i in range(3)))
+            tracing.event("marker", note="x")
+            with pytest.raises(ValueError):
+                with tracing.span("boom"):
+                    raise ValueError("bad")
+            await db.run_db(db.get_job, "missing")
+        await tracing.exporter.drain()
+        return tr, outer
+
+    tr, outer = asyncio.run(scenario())
+    by_name = {}
+    for s in tr.spans:
+        by_name.setdefault(s.name, []).append(s)
+    root = tr.root
+    assert [s.parent_id for s in by_name["child"]] == [outer.span_id] * 3
+    assert len({s.task for s in by_name["child"]}) == 3  # 每个任务一条泳道
+    assert outer.duration_ms >= 10 and outer.phase == "TEST"
+    assert by_name["marker"][0].kind == "event" and by_name["marker"][0].parent_id == root.span_id
+    assert by_name["boom"][0].status == "error" and "ValueError: bad" in by_name["boom"][0].attrs["error"]
+    assert by_name["db.get_job"][0].phase == "DB" and "wait_ms" in by_name["db.get_job"][0].attrs
+    assert tracing.current_trace() is None
+
+    stored = db.load_trace(tr.trace_id)
+    assert stored is not None and len(stored["spans"]) == len(tr.spans)
+    assert stored["name"] == "root" and [t["trace_id"] for t in db.list_traces(5)] == [tr.trace_id]
+
+    chrome = tracing.to_chrome_trace(stored)
+    complete = [e for e in chrome["traceEvents"] if e["ph"] == "X"]
+    assert {e["name"] for e in complete} >= {"root", "gather", "child", "boom", "db.get_job"}
+    assert all(e["dur"] >= 1 and e["ts"] > 0 for e in complete)
+    assert [e["ph"] for e in chrome["traceEvents"] if e["name"] == "marker"] == ["i"]
+
+
+def test_span_without_trace_times_but_is_not_recorded() -> None:
+    with tracing.span("orphan") as sp:
+        pass
+    assert sp.trace is None and sp.end_ns is not None and sp.duration_ms == 0
+
+
+@pytest.fixture
+def fake_kb(monkeypatch):
+    async def detect(text, max_queries=None):
+        return Intent.KB_QUERY, "rule", None
+
+    async def query_kb(query, image_paths=None):
+        await asyncio.sleep(0.01)
+        return f"## {query}\n内容", []
+
+    monkeypatch.setattr(agent_pipeline, "detect_intent_with_expansion", detect)
+    monkeypatch.setattr(kb_query_enhanced, "query_kb", query_kb)
+    monkeypatch.setattr(settings, "kb_query_llm_enabled", False, raising=False)
+
+
+def test_pipeline_trace_events_are_derived_from_spans(temp_db, fake_kb) -> None:
+    async def scenario():
+        events = [e async for e in AgentPipeline().process("清算流程是什么")]
+        await tracing.exporter.drain()
+        return events
+
+    events = asyncio.run(scenario())
+    steps = [e["data"] for e in events if e["type"] == "trace"]
+    trace_id = steps[0]["trace_id"]
+    assert trace_id and all(s["trace_id"] == trace_id and s["span_id"] for s in steps)
+    done = next(s for s in steps if s["title"] == "services.kb_query_enhanced.enhanced_kb_query · 完成")
+    assert done["duration_ms"] >= 10 and f"duration_ms={done['duration_ms']}" in done["detail"]
+    assert len(steps[0]["ts"]) == len("2024-01-01T00:00:00.000")
+
+    stored = db.load_trace(trace_id)
+    spans = {s["span_id"]: s for s in stored["spans"]}
+    retrieve = [s for s in stored["spans"] if s["name"] == "kb_query.retrieve"]
+    assert len(retrieve) == 1 and spans[retrieve[0]["parent_id"]]["span_id"] == done["span_id"]
+    assert stored["attrs"]["payload_type"] == "KB_ANSWER" and stored["status"] == "ok"
+
+    from backend.app import app
+
+    with TestClient(app) as client:
+        assert client.get("/api/traces").json()[0]["trace_id"] == trace_id
+        chrome = client.get(f"/api/traces/{trace_id}/chrome")
+        assert chrome.status_code == 200 and "attachment" in chrome.headers["content-disposition"]
+        names = {e["name"] for e in json.loads(chrome.text)["traceEvents"]}
+        assert {"agent.pipeline", "kb_query.retrieve", "kb_query.synthesize"} <= names
+        assert client.get("/api/traces/missing").status_code == 404
@@ -1,12 +1,15 @@
-"""单元测试：上传存储 _UPLOAD_STORE 按时间清理逻辑。"""
+"""单元测试：上传登记 _UPLOAD_STORE 的 TTL 与上传目录按时间清理逻辑。"""
 
 from __future__ import annotations
 
+import os
 import time
 from pathlib import Path
 import pytest
 
+from backend.config import settings
 from backend.routers import agent as agent_router
+from backend.services import state_store
 
 
 # 暴露模块级 store 与清理函数便于测试
@@ -16,54 +19,66 @@ UPLOAD_MAX_AGE_SECONDS = agent_router.UPLOAD_MAX_AGE_SECONDS
 
 
 @pytest.fixture(autouse=True)
-def reset_upload_store():
-    """每个测试前清空 store，避免跨用例污染。"""
+def reset_upload_store(monkeypatch, tmp_path):
+    """每个测试前清空 store 并使用临时上传目录，避免跨用例污染。"""
+    monkeypatch.setattr(settings, "upload_dir", tmp_path / "uploads")
+    settings.upload_dir.mkdir()
     _UPLOAD_STORE.clear()
     yield
     _UPLOAD_STORE.clear()
 
 
-def test_cleanup_removes_old_entries(tmp_path: Path) -> None:
-    """超过最大年龄的条目应被删除，且对应文件被删除。"""
-    old_path = tmp_path / "old.png"
-    old_path.write_bytes(b"x")
-    _UPLOAD_STORE["old-uid"] = (str(old_path.resolve()), time.time() - UPLOAD_MAX_AGE_SECONDS - 1)
+def _upload(uid: str, age: float = 0.0) -> Path:
+    path = settings.upload_dir / f"{uid}.png"
+    path.write_bytes(b"x")
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    _UPLOAD_STORE[uid] = (str(path.resolve()), mtime)
+    return path
 
-    _cleanup_old_uploads()
+
+def test_cleanup_removes_old_files() -> None:
+    """超过最大年龄的文件应被删除，登记条目一并移除。"""
+    old_path = _upload("old-uid", age=UPLOAD_MAX_AGE_SECONDS + 1)
+
+    assert _cleanup_old_uploads() == 1
 
     assert "old-uid" not in _UPLOAD_STORE
     assert not old_path.exists()
 
 
-def test_cleanup_keeps_recent_entries(tmp_path: Path) -> None:
-    """未超过最大年龄的条目保留。"""
-    recent_path = tmp_path / "recent.png"
-    recent_path.write_bytes(b"y")
-    _UPLOAD_STORE["recent-uid"] = (str(recent_path.resolve()), time.time())
+def test_cleanup_keeps_recent_files() -> None:
+    """未超过最大年龄的文件与条目保留。"""
+    recent_path = _upload("recent-uid")
 
-    _cleanup_old_uploads()
+    assert _cleanup_old_uploads() == 0
 
-    assert "recent-uid" in _UPLOAD_STORE
     assert _UPLOAD_STORE["recent-uid"][0] == str(recent_path.resolve())
     assert recent_path.exists()
 
 
-def test_cleanup_handles_missing_file(tmp_path: Path) -> None:
-    """磁盘文件已被删除时，仍能从 store 移除条目，不抛异常。"""
-    missing_path = tmp_path / "missing.png"
-    assert not missing_path.exists()
-    _UPLOAD_STORE["missing-uid"] = (str(missing_path.resolve()), time.time() - UPLOAD_MAX_AGE_SECONDS - 1)
+def test_cleanup_tolerates_missing_entries_and_dir(monkeypatch, tmp_path) -> None:
+    """条目已过期或被其它 worker 删除时仍能删文件；上传目录不存在时直接返回。"""
+    old_path = _upload("gone-uid", age=UPLOAD_MAX_AGE_SECONDS + 1)
+    del _UPLOAD_STORE["gone-uid"]
+    assert _cleanup_old_uploads() == 1 and not old_path.exists()
+
+    monkeypatch.setattr(settings, "upload_dir", tmp_path / "missing")
+    assert _cleanup_old_uploads() == 0
 
-    _cleanup_old_uploads()
 
-    assert "missing-uid" not in _UPLOAD_STORE
+def test_upload_entries_expire_with_ttl(monkeypatch) -> None:
+    """登记条目带 TTL 写入状态后端，过期后解析不到。"""
+    assert _UPLOAD_STORE.ttl == UPLOAD_MAX_AGE_SECONDS
+    _upload("a")
+    now = time.time()
+    monkeypatch.setattr(state_store.time, "time", lambda: now + UPLOAD_MAX_AGE_SECONDS + 1)
+    assert agent_router._resolve_image_paths(["a"]) == []
 
 
 def test_resolve_image_paths_returns_path_strings() -> None:
-    """_resolve_image_paths 返回路径字符串列表，且会触发清理。"""
-    _UPLOAD_STORE["a"] = ("/fake/path/a.png", time.time())
-    result = agent_router._resolve_image_paths(["a"])
-    assert result == ["/fake/path/a.png"]
-    # 清理后若 a 已过期会被删，这里未过期故仍在
-    result2 = agent_router._resolve_image_paths(["a"])
-    assert result2 == ["/fake/path/a.png"]
+    """_resolve_image_paths 返回路径字符串列表，忽略不存在的 id，且不触发清理。"""
+    path = _upload("a", age=UPLOAD_MAX_AGE_SECONDS + 1)
+    assert agent_router._resolve_image_paths(["a", "missing"]) == [str(path.resolve())]
+    assert path.exists()
+    assert agent_router._resolve_image_paths(None) == []